@@ -0,0 +1,46 @@
+from airflow import DAG
+from airflow.operators.python import PythonOperator
+from datetime import datetime, timedelta
+
+default_args = {
+    'owner': 'nimbus_bill',
+    'depends_on_past': False,
+    'email_on_failure': True,
+    'retries': 1,
+    'retry_delay': timedelta(minutes=5),
+}
+
+dag = DAG(
+    'clustering_health_report',
+    default_args=default_args,
+    description='Record clustering depth of the Gold facts on their declared keys',
+    schedule_interval='0 7 * * 1',
+    start_date=datetime(2023, 1, 1),
+    catchup=False,
+    tags=['ops', 'physical_design'],
+)
+
+
+def record_clustering_depth(run_id, **kwargs):
+    """SYSTEM$CLUSTERING_INFORMATION per Gold fact into OPS.CLUSTERING_DEPTH_REPORT."""
+    from airflow.providers.snowflake.hooks.snowflake import SnowflakeHook
+    from billing.physical_design import clustering_report
+
+    hook = SnowflakeHook(snowflake_conn_id='snowflake_default')
+    conn = hook.get_conn()
+    cursor = conn.cursor()
+    try:
+        report = clustering_report(cursor, run_id)
+    finally:
+        cursor.close()
+        conn.close()
+    for h in report:
+        print(f"{h.spec.table}: depth {h.average_depth:.2f}, overlaps {h.average_overlaps:.2f}, "
+              f"{h.total_partitions} partitions -> {h.status}")
+
+
+clustering_depth = PythonOperator(
+    task_id='record_clustering_depth',
+    python_callable=record_clustering_depth,
+    dag=dag,
+)
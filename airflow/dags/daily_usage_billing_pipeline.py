@@ -27,14 +27,39 @@ dag = DAG(
 PROCESS_DATE = "{{ ds }}"
 BATCH_ID = "run_{{ run_id }}"
 
+def prefilter_events(cursor, run_id, file_path, ds):
+    """Probe the batch against the event-ID filter so Silver can append definitely-new rows.
+
+    The window ends at the run date `ds`, not at any date found in the file.
+    Best effort: if the filter is unavailable, every row goes through the MERGE.
+    """
+    import tempfile
+    from datetime import date
+    from billing.dedup import prefilter_batch
+    from billing.landing import read_events
+
+    try:
+        events = read_events(file_path, columns=["event_id", "event_timestamp"])
+        with tempfile.TemporaryDirectory() as workdir:
+            result = prefilter_batch(cursor, run_id, events, workdir, date.fromisoformat(ds))
+        if result is None:
+            print("Batch already consumed by Silver; all rows will be merged.")
+        else:
+            print(f"Prefilter: {result.new_rows} of {len(events)} rows definitely new "
+                  f"({result.filter_hits} filter hits, est. FPR {result.estimated_fpr:.4%}).")
+    except Exception as e:
+        print(f"Duplicate prefilter skipped ({e}); all rows will be merged.")
+
 def load_bronze_data(ds, **kwargs):
+    """Load the day's landing file: Parquet into the typed Bronze table, else JSONL into RAW."""
     from airflow.providers.snowflake.hooks.snowflake import SnowflakeHook
+    from billing.landing import landing_file, load_statements
     import os
-    
-    file_path = f"/opt/airflow/datagen/data/usage_events_{ds}.jsonl"
-    
-    if not os.path.exists(file_path):
-        print(f"File {file_path} not found. Skipping ingestion.")
+
+    file_path = landing_file("/opt/airflow/datagen/data", ds)
+
+    if file_path is None:
+        print(f"No usage_events_{ds}.parquet or .jsonl found. Skipping ingestion.")
         return
 
     hook = SnowflakeHook(snowflake_conn_id='snowflake_default')
@@ -42,25 +67,12 @@ def load_bronze_data(ds, **kwargs):
     cursor = conn.cursor()
     
     try:
-        cursor.execute(f"PUT file://{file_path} @NIMBUSBILL.BRONZE.%USAGE_EVENTS_RAW AUTO_COMPRESS=TRUE")
-        
         run_id = kwargs.get('run_id')
-        cursor.execute(f"""
-            COPY INTO NIMBUSBILL.BRONZE.USAGE_EVENTS_RAW (INGEST_TS, SOURCE, DT, BATCH_ID, FILE_NAME, RAW)
-            FROM (
-                SELECT 
-                    CURRENT_TIMESTAMP(), 
-                    'API', 
-                    '{ds}', 
-                    '{run_id}', 
-                    METADATA$FILENAME, 
-                    $1 
-                FROM @NIMBUSBILL.BRONZE.%USAGE_EVENTS_RAW
-            )
-            FILE_FORMAT = (TYPE = 'JSON' STRIP_OUTER_ARRAY = FALSE)
-            PURGE = TRUE
-        """)
-        print("Ingestion complete.")
+        prefilter_events(cursor, run_id, file_path, ds)
+
+        for statement in load_statements(file_path, ds, run_id, source='API'):
+            cursor.execute(statement)
+        print(f"Ingestion of {os.path.basename(file_path)} complete.")
     finally:
         cursor.close()
         conn.close()
@@ -71,14 +83,50 @@ ingest_bronze = PythonOperator(
     dag=dag,
 )
 
+# Bronze is read once: a multi-table insert validates every row against the
+# data contract and routes it. Rows the duplicate pre-filter proved new go
+# straight into Silver; other valid rows go to this session's batch table and
+# through the EVENT_ID MERGE; violations go to quarantine with ERROR_REASON.
+# Rows already quarantined (same RAW_HASH) are not re-quarantined on retries.
 silver_clean_merge = SnowflakeOperator(
     task_id='silver_clean_merge',
     sql="""
+    CREATE OR REPLACE TEMPORARY TABLE NIMBUSBILL.SILVER.USAGE_EVENTS_BATCH LIKE NIMBUSBILL.SILVER.USAGE_EVENTS_CLEAN;
+
+    BEGIN;
+
+    INSERT FIRST
+        WHEN ERROR_REASON IS NULL AND IS_NEW THEN
+            INTO NIMBUSBILL.SILVER.USAGE_EVENTS_CLEAN (EVENT_ID, EVENT_TS, EVENT_DATE, CUSTOMER_ID, PRODUCT_ID, PLAN_ID, REGION, UNIT, QUANTITY, SOURCE, LOAD_TS, BATCH_ID, RAW_HASH)
+            VALUES (EVENT_ID, EVENT_TS, EVENT_DATE, CUSTOMER_ID, PRODUCT_ID, PLAN_ID, REGION, UNIT, QUANTITY, SOURCE, CURRENT_TIMESTAMP(), '{{ run_id }}', RAW_HASH)
+        WHEN ERROR_REASON IS NULL THEN
+            INTO NIMBUSBILL.SILVER.USAGE_EVENTS_BATCH (EVENT_ID, EVENT_TS, EVENT_DATE, CUSTOMER_ID, PRODUCT_ID, PLAN_ID, REGION, UNIT, QUANTITY, SOURCE, BATCH_ID, RAW_HASH)
+            VALUES (EVENT_ID, EVENT_TS, EVENT_DATE, CUSTOMER_ID, PRODUCT_ID, PLAN_ID, REGION, UNIT, QUANTITY, SOURCE, '{{ run_id }}', RAW_HASH)
+        WHEN NOT ALREADY_QUARANTINED THEN
+            INTO NIMBUSBILL.SILVER.USAGE_EVENTS_QUARANTINE (INGEST_TS, DT, SOURCE, ERROR_REASON, RAW, BATCH_ID, EVENT_ID, RAW_HASH)
+            VALUES (CURRENT_TIMESTAMP(), DT, SOURCE, ERROR_REASON, RAW, '{{ run_id }}', EVENT_ID, RAW_HASH)
+    SELECT
+        v.*,
+        q.RAW_HASH IS NOT NULL AS ALREADY_QUARANTINED,
+        (pf.BATCH_ID IS NOT NULL AND dc.EVENT_ID IS NULL
+         AND COUNT(*) OVER (PARTITION BY v.EVENT_ID) = 1) AS IS_NEW
+    FROM NIMBUSBILL.SILVER.V_USAGE_EVENTS_VALIDATED v
+    LEFT JOIN (SELECT DISTINCT RAW_HASH FROM NIMBUSBILL.SILVER.USAGE_EVENTS_QUARANTINE) q
+        ON q.RAW_HASH = v.RAW_HASH
+    LEFT JOIN NIMBUSBILL.OPS.DEDUP_BATCHES pf
+        ON pf.BATCH_ID = v.BATCH_ID AND pf.BATCH_ID = '{{ run_id }}' AND pf.CONSUMED_TS IS NULL
+    LEFT JOIN NIMBUSBILL.OPS.DEDUP_CANDIDATES dc
+        ON dc.BATCH_ID = v.BATCH_ID AND dc.EVENT_ID = v.EVENT_ID
+    WHERE v.ORIGIN = 'BRONZE'
+      AND (v.EVENT_DATE = '{{ ds }}' OR (v.EVENT_DATE IS NULL AND v.DT = '{{ ds }}'));
+
+    UPDATE NIMBUSBILL.OPS.DEDUP_BATCHES SET CONSUMED_TS = CURRENT_TIMESTAMP()
+    WHERE BATCH_ID = '{{ run_id }}' AND CONSUMED_TS IS NULL;
+
     MERGE INTO NIMBUSBILL.SILVER.USAGE_EVENTS_CLEAN T
     USING (
-        SELECT * 
-        FROM NIMBUSBILL.SILVER.V_USAGE_EVENTS_PARSED 
-        WHERE EVENT_DATE = '{{ ds }}'
+        SELECT *
+        FROM NIMBUSBILL.SILVER.USAGE_EVENTS_BATCH
         QUALIFY ROW_NUMBER() OVER (PARTITION BY EVENT_ID ORDER BY EVENT_TS DESC) = 1
     ) S
     ON T.EVENT_ID = S.EVENT_ID
@@ -87,40 +135,69 @@ silver_clean_merge = SnowflakeOperator(
     WHEN NOT MATCHED THEN
         INSERT (EVENT_ID, EVENT_TS, EVENT_DATE, CUSTOMER_ID, PRODUCT_ID, PLAN_ID, REGION, UNIT, QUANTITY, SOURCE, LOAD_TS, BATCH_ID, RAW_HASH)
         VALUES (S.EVENT_ID, S.EVENT_TS, S.EVENT_DATE, S.CUSTOMER_ID, S.PRODUCT_ID, S.PLAN_ID, S.REGION, S.UNIT, S.QUANTITY, S.SOURCE, CURRENT_TIMESTAMP(), '{{ run_id }}', S.RAW_HASH);
+
+    UPDATE NIMBUSBILL.OPS.DEDUP_BATCHES b
+    SET MERGE_MATCHED = r."number of rows updated", MERGE_INSERTED = r."number of rows inserted"
+    FROM TABLE(RESULT_SCAN(LAST_QUERY_ID(-1))) r
+    WHERE b.BATCH_ID = '{{ run_id }}';
+
+    COMMIT;
     """,
     snowflake_conn_id='snowflake_default',
     dag=dag,
 )
 
+# Silver is scanned once per day: events roll up to hours, and the daily
+# aggregate is rolled up from the hours.
 silver_daily_agg = SnowflakeOperator(
     task_id='silver_daily_agg_rebuild',
     sql="""
-    DELETE FROM NIMBUSBILL.SILVER.USAGE_DAILY_AGG WHERE EVENT_DATE = '{{ ds }}';
+    DELETE FROM NIMBUSBILL.SILVER.USAGE_HOURLY_AGG WHERE EVENT_DATE = '{{ ds }}';
 
-    INSERT INTO NIMBUSBILL.SILVER.USAGE_DAILY_AGG (EVENT_DATE, CUSTOMER_ID, PRODUCT_ID, UNIT, TOTAL_QUANTITY, EVENT_COUNT, LAST_EVENT_TS, LOAD_TS, BATCH_ID)
+    INSERT INTO NIMBUSBILL.SILVER.USAGE_HOURLY_AGG (EVENT_DATE, EVENT_HOUR, CUSTOMER_ID, PRODUCT_ID, UNIT, REGION, PLAN_ID, TOTAL_QUANTITY, EVENT_COUNT, LAST_EVENT_TS, LOAD_TS, BATCH_ID)
     SELECT
-        EVENT_DATE, CUSTOMER_ID, PRODUCT_ID, UNIT, SUM(QUANTITY), COUNT(*), MAX(EVENT_TS), CURRENT_TIMESTAMP(), '{{ run_id }}'
+        EVENT_DATE, DATE_TRUNC('HOUR', EVENT_TS), CUSTOMER_ID, PRODUCT_ID, UNIT, COALESCE(REGION, 'unknown'), COALESCE(PLAN_ID, 'unknown'),
+        SUM(QUANTITY), COUNT(*), MAX(EVENT_TS), CURRENT_TIMESTAMP(), '{{ run_id }}'
     FROM NIMBUSBILL.SILVER.USAGE_EVENTS_CLEAN
     WHERE EVENT_DATE = '{{ ds }}'
-    GROUP BY 1, 2, 3, 4;
+    GROUP BY 1, 2, 3, 4, 5, 6, 7;
+
+    DELETE FROM NIMBUSBILL.SILVER.USAGE_DAILY_AGG WHERE EVENT_DATE = '{{ ds }}';
+
+    INSERT INTO NIMBUSBILL.SILVER.USAGE_DAILY_AGG (EVENT_DATE, CUSTOMER_ID, PRODUCT_ID, UNIT, REGION, PLAN_ID, TOTAL_QUANTITY, EVENT_COUNT, LAST_EVENT_TS, LOAD_TS, BATCH_ID)
+    SELECT
+        EVENT_DATE, CUSTOMER_ID, PRODUCT_ID, UNIT, REGION, PLAN_ID, SUM(TOTAL_QUANTITY), SUM(EVENT_COUNT), MAX(LAST_EVENT_TS), CURRENT_TIMESTAMP(), '{{ run_id }}'
+    FROM NIMBUSBILL.SILVER.USAGE_HOURLY_AGG
+    WHERE EVENT_DATE = '{{ ds }}'
+    GROUP BY 1, 2, 3, 4, 5, 6;
     """,
     snowflake_conn_id='snowflake_default',
     dag=dag,
 )
 
+# Hours are priced with the customer version and rate in effect on their
+# date; the daily fact re-applies that same rate to the summed hours and
+# converts the cost with the day's DIM_FX_RATE into the reporting currency
+# (USD, billing/fx.py REPORTING_CURRENCY), kept next to the original. The
+# product-daily and monthly rollups /usage reads and the region x plan x
+# product revenue cube are refreshed from the day (the month is re-summed
+# whole, at most 31 daily partitions).
 gold_daily_costs = SnowflakeOperator(
     task_id='gold_compute_daily_costs',
     sql="""
-    DELETE FROM NIMBUSBILL.GOLD.FACT_CUSTOMER_DAILY_USAGE WHERE DATE_ID = '{{ ds }}';
+    DELETE FROM NIMBUSBILL.GOLD.FACT_CUSTOMER_HOURLY_USAGE WHERE DATE_ID = '{{ ds }}';
 
-    INSERT INTO NIMBUSBILL.GOLD.FACT_CUSTOMER_DAILY_USAGE (
-        DATE_ID, CUSTOMER_SK, PRODUCT_ID, UNIT, TOTAL_QUANTITY, BILLABLE_QUANTITY, COST_AMOUNT, CURRENCY, RATE_SK, LOAD_TS, BATCH_ID
+    INSERT INTO NIMBUSBILL.GOLD.FACT_CUSTOMER_HOURLY_USAGE (
+        DATE_ID, HOUR_TS, CUSTOMER_SK, PRODUCT_ID, UNIT, REGION, EVENT_PLAN_ID, TOTAL_QUANTITY, BILLABLE_QUANTITY, COST_AMOUNT, CURRENCY, RATE_SK, LOAD_TS, BATCH_ID
     )
     SELECT
         agg.EVENT_DATE,
+        agg.EVENT_HOUR,
         c.CUSTOMER_SK,
         agg.PRODUCT_ID,
         agg.UNIT,
+        agg.REGION,
+        agg.PLAN_ID,
         agg.TOTAL_QUANTITY,
         agg.TOTAL_QUANTITY,
         (agg.TOTAL_QUANTITY * p.UNIT_PRICE),
@@ -128,26 +205,199 @@ gold_daily_costs = SnowflakeOperator(
         p.RATE_SK,
         CURRENT_TIMESTAMP(),
         '{{ run_id }}'
-    FROM NIMBUSBILL.SILVER.USAGE_DAILY_AGG agg
-    JOIN NIMBUSBILL.GOLD.DIM_CUSTOMER c ON agg.CUSTOMER_ID = c.CUSTOMER_ID AND c.IS_CURRENT = TRUE
-    JOIN NIMBUSBILL.GOLD.DIM_PRICING_RATE p ON agg.PRODUCT_ID = p.PRODUCT_ID AND agg.UNIT = p.UNIT 
+    FROM NIMBUSBILL.SILVER.USAGE_HOURLY_AGG agg
+    JOIN NIMBUSBILL.GOLD.DIM_CUSTOMER c ON agg.CUSTOMER_ID = c.CUSTOMER_ID
+        AND agg.EVENT_DATE >= c.EFFECTIVE_START::DATE
+        AND agg.EVENT_DATE < COALESCE(c.EFFECTIVE_END::DATE, '9999-12-31')
+    JOIN NIMBUSBILL.GOLD.DIM_PRICING_RATE p ON agg.PRODUCT_ID = p.PRODUCT_ID AND agg.UNIT = p.UNIT
+        AND p.PLAN_ID = c.PLAN_ID
         AND (agg.EVENT_DATE BETWEEN p.EFFECTIVE_FROM AND COALESCE(p.EFFECTIVE_TO, '9999-12-31'))
     WHERE agg.EVENT_DATE = '{{ ds }}';
+
+    DELETE FROM NIMBUSBILL.GOLD.FACT_CUSTOMER_DAILY_USAGE WHERE DATE_ID = '{{ ds }}';
+
+    INSERT INTO NIMBUSBILL.GOLD.FACT_CUSTOMER_DAILY_USAGE (
+        DATE_ID, CUSTOMER_SK, PRODUCT_ID, UNIT, REGION, EVENT_PLAN_ID, TOTAL_QUANTITY, BILLABLE_QUANTITY, COST_AMOUNT, CURRENCY,
+        FX_RATE, REPORTING_COST_AMOUNT, RATE_SK, LOAD_TS, BATCH_ID
+    )
+    SELECT
+        h.DATE_ID,
+        h.CUSTOMER_SK,
+        h.PRODUCT_ID,
+        h.UNIT,
+        h.REGION,
+        h.EVENT_PLAN_ID,
+        SUM(h.TOTAL_QUANTITY),
+        SUM(h.BILLABLE_QUANTITY),
+        (SUM(h.BILLABLE_QUANTITY) * p.UNIT_PRICE),
+        p.CURRENCY,
+        IFF(p.CURRENCY = 'USD', 1, fx.RATE),
+        (SUM(h.BILLABLE_QUANTITY) * p.UNIT_PRICE) * IFF(p.CURRENCY = 'USD', 1, fx.RATE),
+        p.RATE_SK,
+        CURRENT_TIMESTAMP(),
+        '{{ run_id }}'
+    FROM NIMBUSBILL.GOLD.FACT_CUSTOMER_HOURLY_USAGE h
+    JOIN NIMBUSBILL.GOLD.DIM_PRICING_RATE p ON p.RATE_SK = h.RATE_SK
+    LEFT JOIN NIMBUSBILL.GOLD.DIM_FX_RATE fx ON fx.CURRENCY = p.CURRENCY AND fx.REPORTING_CURRENCY = 'USD'
+        AND h.DATE_ID BETWEEN fx.EFFECTIVE_FROM AND COALESCE(fx.EFFECTIVE_TO, '9999-12-31')
+    WHERE h.DATE_ID = '{{ ds }}'
+    GROUP BY h.DATE_ID, h.CUSTOMER_SK, h.PRODUCT_ID, h.UNIT, h.REGION, h.EVENT_PLAN_ID, p.UNIT_PRICE, p.CURRENCY, p.RATE_SK, fx.RATE;
+
+    DELETE FROM NIMBUSBILL.GOLD.FACT_PRODUCT_DAILY_USAGE WHERE DATE_ID = '{{ ds }}';
+
+    INSERT INTO NIMBUSBILL.GOLD.FACT_PRODUCT_DAILY_USAGE (
+        DATE_ID, PRODUCT_ID, UNIT, CURRENCY, TOTAL_QUANTITY, BILLABLE_QUANTITY, COST_AMOUNT, REPORTING_COST_AMOUNT, LOAD_TS, BATCH_ID
+    )
+    SELECT DATE_ID, PRODUCT_ID, UNIT, CURRENCY,
+           SUM(TOTAL_QUANTITY), SUM(BILLABLE_QUANTITY), SUM(COST_AMOUNT), SUM(REPORTING_COST_AMOUNT),
+           CURRENT_TIMESTAMP(), '{{ run_id }}'
+    FROM NIMBUSBILL.GOLD.FACT_CUSTOMER_DAILY_USAGE
+    WHERE DATE_ID = '{{ ds }}'
+    GROUP BY DATE_ID, PRODUCT_ID, UNIT, CURRENCY;
+
+    DELETE FROM NIMBUSBILL.GOLD.FACT_CUSTOMER_MONTHLY_USAGE WHERE MONTH_ID = DATE_TRUNC('MONTH', '{{ ds }}'::DATE);
+
+    INSERT INTO NIMBUSBILL.GOLD.FACT_CUSTOMER_MONTHLY_USAGE (
+        MONTH_ID, CUSTOMER_SK, PRODUCT_ID, UNIT, CURRENCY, TOTAL_QUANTITY, BILLABLE_QUANTITY, COST_AMOUNT, REPORTING_COST_AMOUNT, LOAD_TS, BATCH_ID
+    )
+    SELECT DATE_TRUNC('MONTH', DATE_ID), CUSTOMER_SK, PRODUCT_ID, UNIT, CURRENCY,
+           SUM(TOTAL_QUANTITY), SUM(BILLABLE_QUANTITY), SUM(COST_AMOUNT), SUM(REPORTING_COST_AMOUNT),
+           CURRENT_TIMESTAMP(), '{{ run_id }}'
+    FROM NIMBUSBILL.GOLD.FACT_CUSTOMER_DAILY_USAGE
+    WHERE DATE_ID BETWEEN DATE_TRUNC('MONTH', '{{ ds }}'::DATE) AND LAST_DAY('{{ ds }}'::DATE)
+    GROUP BY 1, CUSTOMER_SK, PRODUCT_ID, UNIT, CURRENCY;
+
+    DELETE FROM NIMBUSBILL.GOLD.FACT_REVENUE_CUBE WHERE DATE_ID = '{{ ds }}';
+
+    INSERT INTO NIMBUSBILL.GOLD.FACT_REVENUE_CUBE (
+        DATE_ID, REGION, EVENT_PLAN_ID, PRODUCT_ID, UNIT, CURRENCY, TOTAL_QUANTITY, BILLABLE_QUANTITY, COST_AMOUNT, REPORTING_COST_AMOUNT, LOAD_TS, BATCH_ID
+    )
+    SELECT DATE_ID, REGION, EVENT_PLAN_ID, PRODUCT_ID, UNIT, CURRENCY,
+           SUM(TOTAL_QUANTITY), SUM(BILLABLE_QUANTITY), SUM(COST_AMOUNT), SUM(REPORTING_COST_AMOUNT),
+           CURRENT_TIMESTAMP(), '{{ run_id }}'
+    FROM NIMBUSBILL.GOLD.FACT_CUSTOMER_DAILY_USAGE
+    WHERE DATE_ID = '{{ ds }}'
+    GROUP BY DATE_ID, REGION, EVENT_PLAN_ID, PRODUCT_ID, UNIT, CURRENCY;
     """,
     snowflake_conn_id='snowflake_default',
     dag=dag,
 )
 
-dq_check_duplicates = SnowflakeOperator(
-    task_id='dq_check_duplicates',
+# Pricing must never fan out: at most one Gold row per Silver aggregate row,
+# hourly and daily.
+dq_check_gold_cardinality = SnowflakeOperator(
+    task_id='dq_check_gold_cardinality',
     sql="""
-    SELECT 1 / IFF(COUNT(*) > 0, 0, 1)
-    FROM (SELECT EVENT_ID FROM NIMBUSBILL.SILVER.USAGE_EVENTS_CLEAN GROUP BY EVENT_ID HAVING COUNT(*) > 1);
+    SELECT 1 / IFF(
+        (SELECT COUNT(*) FROM NIMBUSBILL.GOLD.FACT_CUSTOMER_DAILY_USAGE WHERE DATE_ID = '{{ ds }}')
+            > (SELECT COUNT(*) FROM NIMBUSBILL.SILVER.USAGE_DAILY_AGG WHERE EVENT_DATE = '{{ ds }}')
+        OR (SELECT COUNT(*) FROM NIMBUSBILL.GOLD.FACT_CUSTOMER_HOURLY_USAGE WHERE DATE_ID = '{{ ds }}')
+            > (SELECT COUNT(*) FROM NIMBUSBILL.SILVER.USAGE_HOURLY_AGG WHERE EVENT_DATE = '{{ ds }}')
+        OR EXISTS (
+            SELECT 1 FROM NIMBUSBILL.GOLD.FACT_CUSTOMER_DAILY_USAGE
+            WHERE DATE_ID = '{{ ds }}'
+            GROUP BY CUSTOMER_SK, PRODUCT_ID, UNIT, REGION, EVENT_PLAN_ID
+            HAVING COUNT(*) > 1
+        ),
+        0,
+        1
+    );
     """,
     snowflake_conn_id='snowflake_default',
     dag=dag,
 )
 
+def detect_usage_anomalies(ds, run_id, **kwargs):
+    """Fold the day's Gold usage into the EWMA baselines and flag spikes/drops."""
+    from airflow.providers.snowflake.hooks.snowflake import SnowflakeHook
+    from billing.anomalies import detect
+
+    hook = SnowflakeHook(snowflake_conn_id='snowflake_default')
+    conn = hook.get_conn()
+    cursor = conn.cursor()
+    try:
+        result = detect(cursor, datetime.strptime(ds, "%Y-%m-%d").date(), run_id)
+    finally:
+        cursor.close()
+        conn.close()
+    print(f"Anomalies {ds}: {result.flagged} flagged over {result.active_keys} active keys "
+          f"({result.baselines_inserted} new baselines) in {result.duration_ms} ms.")
+
+usage_anomalies = PythonOperator(
+    task_id='detect_usage_anomalies',
+    python_callable=detect_usage_anomalies,
+    dag=dag,
+)
+
+def run_dq_checks(ds, run_id, **kwargs):
+    """Single-pass DQ over the partitions this run touched; error-severity failures fail the task."""
+    from airflow.providers.snowflake.hooks.snowflake import SnowflakeHook
+    from billing.dq import gate, run_checks
+
+    hook = SnowflakeHook(snowflake_conn_id='snowflake_default')
+    conn = hook.get_conn()
+    cursor = conn.cursor()
+    try:
+        day = datetime.strptime(ds, "%Y-%m-%d").date()
+        results = run_checks(cursor, run_id, [day], sources=["silver_events", "silver_daily_agg", "gold_daily_usage"])
+    finally:
+        cursor.close()
+        conn.close()
+    gate(results)
+
+dq_checks = PythonOperator(
+    task_id='dq_checks',
+    python_callable=run_dq_checks,
+    dag=dag,
+)
+
+def apply_credit_drawdown(ds, run_id, **kwargs):
+    """Draw the day's Gold usage cost from prepaid credits and update the balances."""
+    from airflow.providers.snowflake.hooks.snowflake import SnowflakeHook
+    from billing.credits import apply_drawdown
+
+    hook = SnowflakeHook(snowflake_conn_id='snowflake_default')
+    conn = hook.get_conn()
+    cursor = conn.cursor()
+    try:
+        result = apply_drawdown(cursor, datetime.strptime(ds, "%Y-%m-%d").date(), run_id)
+    finally:
+        cursor.close()
+        conn.close()
+    print(f"Credits {ds}: {result.drawdowns} drawdowns ({result.reversals} reversed) for "
+          f"{result.amount_drawn:.2f} over {result.customers} customers, {result.grants_posted} grants "
+          f"posted, {result.grants_expired} expired in {result.duration_ms} ms.")
+
+credit_drawdown = PythonOperator(
+    task_id='apply_credit_drawdown',
+    python_callable=apply_credit_drawdown,
+    dag=dag,
+)
+
+def publish_usage_store(ds, **kwargs):
+    """Snapshot the trailing usage window into the file the API memory-maps."""
+    import os
+    from airflow.providers.snowflake.hooks.snowflake import SnowflakeHook
+    from billing.usage_store import publish
+
+    path = os.getenv("USAGE_STORE_PATH", "/opt/airflow/serving/usage_series.nbus")
+    hook = SnowflakeHook(snowflake_conn_id='snowflake_default')
+    conn = hook.get_conn()
+    cursor = conn.cursor()
+    try:
+        summary = publish(cursor, path, datetime.strptime(ds, "%Y-%m-%d").date())
+    finally:
+        cursor.close()
+        conn.close()
+    print(f"Published {path}: {summary.customers} customers, {summary.series} series, "
+          f"{summary.points} points, {summary.bytes} bytes.")
+
+publish_usage_series = PythonOperator(
+    task_id='publish_usage_store',
+    python_callable=publish_usage_store,
+    dag=dag,
+)
+
 audit_log = SnowflakeOperator(
     task_id='write_pipeline_audit',
     sql="""
@@ -158,4 +408,11 @@ audit_log = SnowflakeOperator(
     dag=dag,
 )
 
-ingest_bronze >> silver_clean_merge >> silver_daily_agg >> gold_daily_costs >> dq_check_duplicates >> audit_log
+ingest_bronze >> silver_clean_merge >> silver_daily_agg >> gold_daily_costs >> dq_check_gold_cardinality >> dq_checks >> audit_log
+# Baselines only see Gold that passed the fan-out check.
+dq_check_gold_cardinality >> usage_anomalies >> audit_log
+# The serving store only reflects Gold that passed DQ; the API falls back to
+# the warehouse if it is missing or stale, so it doesn't gate the audit.
+dq_checks >> publish_usage_series
+# Credits are only drawn for Gold that passed DQ.
+dq_checks >> credit_drawdown >> audit_log
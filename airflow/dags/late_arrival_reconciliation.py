@@ -36,13 +36,19 @@ detect_late_events = SnowflakeOperator(
         (e.QUANTITY * p.UNIT_PRICE) as ADJUSTMENT_AMOUNT,
         p.RATE_SK
     FROM NIMBUSBILL.SILVER.USAGE_EVENTS_CLEAN e
-    JOIN NIMBUSBILL.GOLD.DIM_CUSTOMER c ON e.CUSTOMER_ID = c.CUSTOMER_ID AND c.IS_CURRENT = TRUE
-    JOIN NIMBUSBILL.GOLD.FACT_INVOICES i ON c.CUSTOMER_SK = i.CUSTOMER_SK
-    JOIN NIMBUSBILL.GOLD.DIM_PRICING_RATE p ON e.PRODUCT_ID = p.PRODUCT_ID AND e.UNIT = p.UNIT 
+    -- Price with the customer version in effect on the event date, not today's plan
+    JOIN NIMBUSBILL.GOLD.DIM_CUSTOMER c ON e.CUSTOMER_ID = c.CUSTOMER_ID
+        AND e.EVENT_DATE >= c.EFFECTIVE_START::DATE
+        AND e.EVENT_DATE < COALESCE(c.EFFECTIVE_END::DATE, '9999-12-31')
+    JOIN NIMBUSBILL.GOLD.DIM_CUSTOMER ic ON ic.CUSTOMER_ID = e.CUSTOMER_ID
+    JOIN NIMBUSBILL.GOLD.FACT_INVOICES i ON i.CUSTOMER_SK = ic.CUSTOMER_SK
+    JOIN NIMBUSBILL.GOLD.DIM_PRICING_RATE p ON e.PRODUCT_ID = p.PRODUCT_ID AND e.UNIT = p.UNIT
+        AND p.PLAN_ID = c.PLAN_ID
         AND e.EVENT_DATE BETWEEN p.EFFECTIVE_FROM AND COALESCE(p.EFFECTIVE_TO, '9999-12-31')
     WHERE 
         e.EVENT_DATE BETWEEN i.BILLING_PERIOD_START AND i.BILLING_PERIOD_END
         AND i.STATUS = 'issued'
+        AND i.CURRENCY = p.CURRENCY -- the invoice for the rate's currency
         AND e.LOAD_TS > i.ISSUED_TS
         AND e.EVENT_ID NOT IN (SELECT LINE_ITEM_ID FROM NIMBUSBILL.GOLD.FACT_INVOICE_LINE_ITEMS WHERE LINE_TYPE='adjustment_ref'); 
     """,
@@ -76,22 +82,78 @@ create_adjustments = SnowflakeOperator(
     dag=dag,
 )
 
+tax_adjustments = SnowflakeOperator(
+    task_id='tax_adjustment_lines',
+    sql="""
+    -- Adjustments are taxed like the invoice they amend: with the rules its
+    -- close run snapshotted (OPS.INVOICE_TAX_RATES for the invoice's BATCH_ID),
+    -- one tax line per invoice and rule over this run's adjustment lines.
+    -- Invoices closed before tax rates were snapshotted stay untaxed.
+    INSERT INTO NIMBUSBILL.GOLD.FACT_INVOICE_LINE_ITEMS (
+        INVOICE_ID, LINE_ITEM_ID, LINE_TYPE, PRODUCT_ID, UNIT, QUANTITY, UNIT_PRICE, AMOUNT, RATE_SK, USAGE_WINDOW_START, USAGE_WINDOW_END, CALC_BATCH_ID, LOAD_TS, TAX_RULE_ID
+    )
+    SELECT
+        t.INVOICE_ID,
+        UUID_STRING(),
+        'tax',
+        NULL,
+        NULL,
+        t.TAXABLE_AMOUNT,
+        t.TAX_RATE,
+        ROUND(t.TAXABLE_AMOUNT * t.TAX_RATE, 2),
+        NULL,
+        t.BILLING_PERIOD_START,
+        t.BILLING_PERIOD_END,
+        '{{ run_id }}',
+        CURRENT_TIMESTAMP(),
+        t.RULE_ID
+    FROM (
+        SELECT
+            inv.INVOICE_ID,
+            inv.BILLING_PERIOD_START,
+            inv.BILLING_PERIOD_END,
+            COALESCE(own.RULE_ID, dflt.RULE_ID) AS RULE_ID,
+            COALESCE(own.TAX_RATE, dflt.TAX_RATE) AS TAX_RATE,
+            SUM(li.AMOUNT) AS TAXABLE_AMOUNT
+        FROM NIMBUSBILL.GOLD.FACT_INVOICE_LINE_ITEMS li
+        JOIN NIMBUSBILL.GOLD.FACT_INVOICES inv ON inv.INVOICE_ID = li.INVOICE_ID
+        JOIN NIMBUSBILL.GOLD.DIM_CUSTOMER c ON c.CUSTOMER_SK = inv.CUSTOMER_SK
+        LEFT JOIN NIMBUSBILL.GOLD.DIM_PRODUCT p ON p.PRODUCT_ID = li.PRODUCT_ID
+        LEFT JOIN NIMBUSBILL.OPS.INVOICE_TAX_RATES own
+            ON own.BATCH_ID = inv.BATCH_ID AND own.COUNTRY = c.COUNTRY AND own.PRODUCT_CATEGORY = p.CATEGORY
+        LEFT JOIN NIMBUSBILL.OPS.INVOICE_TAX_RATES dflt
+            ON dflt.BATCH_ID = inv.BATCH_ID AND dflt.COUNTRY = c.COUNTRY AND dflt.PRODUCT_CATEGORY IS NULL
+        WHERE li.CALC_BATCH_ID = '{{ run_id }}'
+          AND li.LINE_TYPE = 'adjustment'
+          AND COALESCE(own.RULE_ID, dflt.RULE_ID) IS NOT NULL
+        GROUP BY inv.INVOICE_ID, inv.BILLING_PERIOD_START, inv.BILLING_PERIOD_END,
+                 COALESCE(own.RULE_ID, dflt.RULE_ID), COALESCE(own.TAX_RATE, dflt.TAX_RATE)
+    ) t;
+    """,
+    snowflake_conn_id='snowflake_default',
+    dag=dag,
+)
+
 update_invoice_headers = SnowflakeOperator(
     task_id='update_invoice_totals',
     sql="""
+    -- Adjustments raise SUBTOTAL, their tax lines raise TAX; TOTAL takes both
     MERGE INTO NIMBUSBILL.GOLD.FACT_INVOICES T
     USING (
-        SELECT INVOICE_ID, SUM(AMOUNT) as ADJ_TOTAL
+        SELECT INVOICE_ID,
+               SUM(IFF(LINE_TYPE = 'adjustment', AMOUNT, 0)) as ADJ_TOTAL,
+               SUM(IFF(LINE_TYPE = 'tax', AMOUNT, 0)) as ADJ_TAX
         FROM NIMBUSBILL.GOLD.FACT_INVOICE_LINE_ITEMS
-        WHERE CALC_BATCH_ID = '{{ run_id }}' AND LINE_TYPE = 'adjustment'
+        WHERE CALC_BATCH_ID = '{{ run_id }}' AND LINE_TYPE IN ('adjustment', 'tax')
         GROUP BY INVOICE_ID
     ) S
     ON T.INVOICE_ID = S.INVOICE_ID
     WHEN MATCHED THEN
-        UPDATE SET T.TOTAL = T.TOTAL + S.ADJ_TOTAL, T.SUBTOTAL = T.SUBTOTAL + S.ADJ_TOTAL;
+        UPDATE SET T.TOTAL = T.TOTAL + S.ADJ_TOTAL + S.ADJ_TAX, T.SUBTOTAL = T.SUBTOTAL + S.ADJ_TOTAL,
+                   T.TAX = COALESCE(T.TAX, 0) + S.ADJ_TAX;
     """,
     snowflake_conn_id='snowflake_default',
     dag=dag,
 )
 
-detect_late_events >> create_adjustments >> update_invoice_headers
+detect_late_events >> create_adjustments >> tax_adjustments >> update_invoice_headers
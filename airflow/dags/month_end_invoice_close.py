@@ -26,6 +26,77 @@ BILLING_START = "{{ data_interval_start.replace(day=1).subtract(months=1).date()
 BILLING_END = "{{ data_interval_start.replace(day=1).subtract(days=1).date() }}"
 BATCH_ID = "inv_close_{{ run_id }}"
 
+snapshot_tax_rates = SnowflakeOperator(
+    task_id='snapshot_tax_rates',
+    sql="""
+    -- Resolve the tax rules once per close: the rules in force on the period's
+    -- last day (the tax point). Every invoice of the run is taxed from here.
+    DELETE FROM NIMBUSBILL.OPS.INVOICE_TAX_RATES WHERE BATCH_ID = '{{ run_id }}';
+    INSERT INTO NIMBUSBILL.OPS.INVOICE_TAX_RATES (BATCH_ID, TAX_DATE, RULE_ID, COUNTRY, PRODUCT_CATEGORY, TAX_RATE)
+    SELECT '{{ run_id }}', '{{ prev_ds_month_end }}'::DATE, RULE_ID, COUNTRY, PRODUCT_CATEGORY, TAX_RATE
+    FROM NIMBUSBILL.GOLD.DIM_TAX_RULE
+    WHERE '{{ prev_ds_month_end }}'::DATE BETWEEN EFFECTIVE_FROM AND COALESCE(EFFECTIVE_TO, '9999-12-31'::DATE);
+    """,
+    snowflake_conn_id='snowflake_default',
+    dag=dag,
+)
+
+prorate_base_fees = SnowflakeOperator(
+    task_id='prorate_base_fees',
+    sql="""
+    -- One set-based pass over DIM_CUSTOMER: every version in force on a day of
+    -- the period, clipped to it (a version covers EFFECTIVE_START's day up to,
+    -- not including, EFFECTIVE_END's, as in the usage as-of join). Consecutive
+    -- versions on the same plan and billing state (e.g. a rename) form one
+    -- segment; a plan change mid-period splits it. Each billable segment owes
+    -- BASE_FEE prorated by its days. Cancelled versions owe nothing.
+    DELETE FROM NIMBUSBILL.OPS.INVOICE_BASE_FEES WHERE BATCH_ID = '{{ run_id }}';
+    INSERT INTO NIMBUSBILL.OPS.INVOICE_BASE_FEES (
+        BATCH_ID, CUSTOMER_ID, CUSTOMER_SK, PLAN_ID, SEGMENT_START, SEGMENT_END, DAYS_ON_PLAN, DAYS_IN_PERIOD, BASE_FEE, AMOUNT, CURRENCY
+    )
+    SELECT
+        '{{ run_id }}',
+        s.CUSTOMER_ID,
+        MAX(s.CUSTOMER_SK),
+        s.PLAN_ID,
+        MIN(s.FIRST_DAY),
+        MAX(s.LAST_DAY),
+        SUM(DATEDIFF('day', s.FIRST_DAY, s.LAST_DAY) + 1),
+        DATEDIFF('day', '{{ prev_ds_month_start }}'::DATE, '{{ prev_ds_month_end }}'::DATE) + 1,
+        p.BASE_FEE,
+        ROUND(p.BASE_FEE * SUM(DATEDIFF('day', s.FIRST_DAY, s.LAST_DAY) + 1)
+              / (DATEDIFF('day', '{{ prev_ds_month_start }}'::DATE, '{{ prev_ds_month_end }}'::DATE) + 1), 2),
+        p.CURRENCY
+    FROM (
+        SELECT
+            v.*,
+            ROW_NUMBER() OVER (PARTITION BY v.CUSTOMER_ID ORDER BY v.EFFECTIVE_START)
+              - ROW_NUMBER() OVER (PARTITION BY v.CUSTOMER_ID, v.PLAN_ID, v.BILLABLE ORDER BY v.EFFECTIVE_START)
+              AS SEGMENT
+        FROM (
+            SELECT
+                c.CUSTOMER_ID,
+                c.CUSTOMER_SK,
+                c.PLAN_ID,
+                c.EFFECTIVE_START,
+                COALESCE(c.STATUS, '') <> 'cancelled' AS BILLABLE,
+                GREATEST(c.EFFECTIVE_START::DATE, '{{ prev_ds_month_start }}'::DATE) AS FIRST_DAY,
+                LEAST(DATEADD('day', -1, COALESCE(c.EFFECTIVE_END::DATE, '9999-12-31'::DATE)),
+                      '{{ prev_ds_month_end }}'::DATE) AS LAST_DAY
+            FROM NIMBUSBILL.GOLD.DIM_CUSTOMER c
+            WHERE c.EFFECTIVE_START::DATE <= '{{ prev_ds_month_end }}'::DATE
+              AND COALESCE(c.EFFECTIVE_END::DATE, '9999-12-31'::DATE) > '{{ prev_ds_month_start }}'::DATE
+              AND COALESCE(c.EFFECTIVE_END::DATE, '9999-12-31'::DATE) > c.EFFECTIVE_START::DATE
+        ) v
+    ) s
+    JOIN NIMBUSBILL.GOLD.DIM_PLAN p ON p.PLAN_ID = s.PLAN_ID
+    WHERE s.BILLABLE AND p.BASE_FEE > 0
+    GROUP BY s.CUSTOMER_ID, s.PLAN_ID, s.SEGMENT, p.BASE_FEE, p.CURRENCY;
+    """,
+    snowflake_conn_id='snowflake_default',
+    dag=dag,
+)
+
 generate_invoices = SnowflakeOperator(
     task_id='generate_invoice_headers',
     sql="""
@@ -34,20 +105,31 @@ generate_invoices = SnowflakeOperator(
     )
     SELECT
         UUID_STRING(),
-        CUSTOMER_SK,
+        MAX(b.CUSTOMER_SK), -- latest SCD2 version of the customer billed in the period
         '{{ prev_ds_month_start }}'::DATE,
         '{{ prev_ds_month_end }}'::DATE,
         CURRENT_TIMESTAMP(),
         'issued',
-        SUM(COST_AMOUNT),
-        0,
-        SUM(COST_AMOUNT),
-        MAX(CURRENCY),
+        SUM(b.AMOUNT),
+        0, -- filled from the tax lines by apply_invoice_tax
+        SUM(b.AMOUNT),
+        b.CURRENCY,
         CURRENT_TIMESTAMP(),
         '{{ run_id }}'
-    FROM NIMBUSBILL.GOLD.FACT_CUSTOMER_DAILY_USAGE
-    WHERE DATE_ID BETWEEN '{{ prev_ds_month_start }}'::DATE AND '{{ prev_ds_month_end }}'::DATE
-    GROUP BY CUSTOMER_SK;
+    FROM (
+        SELECT v.CUSTOMER_ID, u.CUSTOMER_SK, u.CURRENCY, u.COST_AMOUNT AS AMOUNT
+        FROM NIMBUSBILL.GOLD.FACT_CUSTOMER_DAILY_USAGE u
+        JOIN NIMBUSBILL.GOLD.DIM_CUSTOMER v ON u.CUSTOMER_SK = v.CUSTOMER_SK
+        WHERE u.DATE_ID BETWEEN '{{ prev_ds_month_start }}'::DATE AND '{{ prev_ds_month_end }}'::DATE
+        UNION ALL
+        -- Customers with a base fee are invoiced even without usage; cast so
+        -- the union keeps the usage amounts' scale
+        SELECT CUSTOMER_ID, CUSTOMER_SK, CURRENCY, CAST(AMOUNT AS DECIMAL(38,10))
+        FROM NIMBUSBILL.OPS.INVOICE_BASE_FEES
+        WHERE BATCH_ID = '{{ run_id }}'
+    ) b
+    -- One invoice per currency billed: amounts are never summed across currencies
+    GROUP BY b.CUSTOMER_ID, b.CURRENCY;
     """,
     snowflake_conn_id='snowflake_default',
     dag=dag,
@@ -74,9 +156,12 @@ generate_line_items = SnowflakeOperator(
         '{{ run_id }}',
         CURRENT_TIMESTAMP()
     FROM NIMBUSBILL.GOLD.FACT_CUSTOMER_DAILY_USAGE u
-    JOIN NIMBUSBILL.GOLD.FACT_INVOICES inv 
-        ON u.CUSTOMER_SK = inv.CUSTOMER_SK 
-        AND u.DATE_ID BETWEEN inv.BILLING_PERIOD_START AND inv.BILLING_PERIOD_END
+    JOIN NIMBUSBILL.GOLD.DIM_CUSTOMER v ON u.CUSTOMER_SK = v.CUSTOMER_SK
+    JOIN NIMBUSBILL.GOLD.FACT_INVOICES inv
+        ON u.DATE_ID BETWEEN inv.BILLING_PERIOD_START AND inv.BILLING_PERIOD_END
+    JOIN NIMBUSBILL.GOLD.DIM_CUSTOMER iv
+        ON inv.CUSTOMER_SK = iv.CUSTOMER_SK AND iv.CUSTOMER_ID = v.CUSTOMER_ID
+        AND inv.CURRENCY = u.CURRENCY
     LEFT JOIN NIMBUSBILL.GOLD.DIM_PRICING_RATE r ON u.RATE_SK = r.RATE_SK
     WHERE inv.BATCH_ID = '{{ run_id }}'
     GROUP BY inv.INVOICE_ID, u.PRODUCT_ID, u.UNIT, u.RATE_SK;
@@ -85,20 +170,129 @@ generate_line_items = SnowflakeOperator(
     dag=dag,
 )
 
+generate_base_fee_lines = SnowflakeOperator(
+    task_id='generate_base_fee_lines',
+    sql="""
+    -- One line per prorated segment: QUANTITY days on the plan at the plan's daily rate
+    INSERT INTO NIMBUSBILL.GOLD.FACT_INVOICE_LINE_ITEMS (
+        INVOICE_ID, LINE_ITEM_ID, LINE_TYPE, PRODUCT_ID, UNIT, QUANTITY, UNIT_PRICE, AMOUNT, RATE_SK, USAGE_WINDOW_START, USAGE_WINDOW_END, CALC_BATCH_ID, LOAD_TS, PLAN_ID
+    )
+    SELECT
+        inv.INVOICE_ID,
+        UUID_STRING(),
+        'base_fee',
+        NULL,
+        'days',
+        f.DAYS_ON_PLAN,
+        f.BASE_FEE / f.DAYS_IN_PERIOD,
+        f.AMOUNT,
+        NULL,
+        f.SEGMENT_START,
+        f.SEGMENT_END,
+        '{{ run_id }}',
+        CURRENT_TIMESTAMP(),
+        f.PLAN_ID
+    FROM NIMBUSBILL.OPS.INVOICE_BASE_FEES f
+    JOIN NIMBUSBILL.GOLD.FACT_INVOICES inv
+        ON inv.BATCH_ID = '{{ run_id }}' AND inv.CURRENCY = f.CURRENCY
+    JOIN NIMBUSBILL.GOLD.DIM_CUSTOMER iv
+        ON inv.CUSTOMER_SK = iv.CUSTOMER_SK AND iv.CUSTOMER_ID = f.CUSTOMER_ID
+    WHERE f.BATCH_ID = '{{ run_id }}';
+    """,
+    snowflake_conn_id='snowflake_default',
+    dag=dag,
+)
+
+generate_tax_lines = SnowflakeOperator(
+    task_id='generate_tax_lines',
+    sql="""
+    -- One tax line per invoice and rule: the invoice's lines in the rule's
+    -- categories, taxed at the snapshotted rate and rounded to cents. A
+    -- category's own rule wins over the country default.
+    INSERT INTO NIMBUSBILL.GOLD.FACT_INVOICE_LINE_ITEMS (
+        INVOICE_ID, LINE_ITEM_ID, LINE_TYPE, PRODUCT_ID, UNIT, QUANTITY, UNIT_PRICE, AMOUNT, RATE_SK, USAGE_WINDOW_START, USAGE_WINDOW_END, CALC_BATCH_ID, LOAD_TS, TAX_RULE_ID
+    )
+    SELECT
+        t.INVOICE_ID,
+        UUID_STRING(),
+        'tax',
+        NULL,
+        NULL,
+        t.TAXABLE_AMOUNT,
+        t.TAX_RATE,
+        ROUND(t.TAXABLE_AMOUNT * t.TAX_RATE, 2),
+        NULL,
+        t.BILLING_PERIOD_START,
+        t.BILLING_PERIOD_END,
+        '{{ run_id }}',
+        CURRENT_TIMESTAMP(),
+        t.RULE_ID
+    FROM (
+        SELECT
+            inv.INVOICE_ID,
+            inv.BILLING_PERIOD_START,
+            inv.BILLING_PERIOD_END,
+            COALESCE(own.RULE_ID, dflt.RULE_ID) AS RULE_ID,
+            COALESCE(own.TAX_RATE, dflt.TAX_RATE) AS TAX_RATE,
+            SUM(li.AMOUNT) AS TAXABLE_AMOUNT
+        FROM NIMBUSBILL.GOLD.FACT_INVOICES inv
+        JOIN NIMBUSBILL.GOLD.FACT_INVOICE_LINE_ITEMS li ON li.INVOICE_ID = inv.INVOICE_ID
+        JOIN NIMBUSBILL.GOLD.DIM_CUSTOMER c ON c.CUSTOMER_SK = inv.CUSTOMER_SK
+        LEFT JOIN NIMBUSBILL.GOLD.DIM_PRODUCT p ON p.PRODUCT_ID = li.PRODUCT_ID
+        LEFT JOIN NIMBUSBILL.OPS.INVOICE_TAX_RATES own
+            ON own.BATCH_ID = '{{ run_id }}' AND own.COUNTRY = c.COUNTRY AND own.PRODUCT_CATEGORY = p.CATEGORY
+        LEFT JOIN NIMBUSBILL.OPS.INVOICE_TAX_RATES dflt
+            ON dflt.BATCH_ID = '{{ run_id }}' AND dflt.COUNTRY = c.COUNTRY AND dflt.PRODUCT_CATEGORY IS NULL
+        WHERE inv.BATCH_ID = '{{ run_id }}'
+          AND li.LINE_TYPE <> 'tax'
+          AND COALESCE(own.RULE_ID, dflt.RULE_ID) IS NOT NULL
+        GROUP BY inv.INVOICE_ID, inv.BILLING_PERIOD_START, inv.BILLING_PERIOD_END,
+                 COALESCE(own.RULE_ID, dflt.RULE_ID), COALESCE(own.TAX_RATE, dflt.TAX_RATE)
+    ) t;
+    """,
+    snowflake_conn_id='snowflake_default',
+    dag=dag,
+)
+
+apply_invoice_tax = SnowflakeOperator(
+    task_id='apply_invoice_tax',
+    sql="""
+    -- Header TAX is the sum of its tax lines, so TOTAL still equals the sum of all lines
+    MERGE INTO NIMBUSBILL.GOLD.FACT_INVOICES T
+    USING (
+        SELECT INVOICE_ID, SUM(AMOUNT) AS TAX
+        FROM NIMBUSBILL.GOLD.FACT_INVOICE_LINE_ITEMS
+        WHERE CALC_BATCH_ID = '{{ run_id }}' AND LINE_TYPE = 'tax'
+        GROUP BY INVOICE_ID
+    ) S
+    ON T.INVOICE_ID = S.INVOICE_ID AND T.BATCH_ID = '{{ run_id }}'
+    WHEN MATCHED THEN
+        UPDATE SET T.TAX = S.TAX, T.TOTAL = T.SUBTOTAL + S.TAX;
+    """,
+    snowflake_conn_id='snowflake_default',
+    dag=dag,
+)
+
 check_integrity = SnowflakeOperator(
     task_id='check_invoice_integrity',
     sql="""
+    -- Sum each side separately: joining first repeats a header's TOTAL per line
+    -- (the lines include the tax lines, so header TAX is covered too)
     SELECT 1 / IFF(
-        ABS(COALESCE(SUM(i.TOTAL), 0) - COALESCE(SUM(li.AMOUNT), 0)) > 0.01,
+        ABS(
+            COALESCE((SELECT SUM(TOTAL) FROM NIMBUSBILL.GOLD.FACT_INVOICES
+                      WHERE BATCH_ID = '{{ run_id }}'), 0)
+            - COALESCE((SELECT SUM(li.AMOUNT) FROM NIMBUSBILL.GOLD.FACT_INVOICE_LINE_ITEMS li
+                        JOIN NIMBUSBILL.GOLD.FACT_INVOICES i ON i.INVOICE_ID = li.INVOICE_ID
+                        WHERE i.BATCH_ID = '{{ run_id }}'), 0)
+        ) > 0.01,
         0,
         1
-    )
-    FROM NIMBUSBILL.GOLD.FACT_INVOICES i
-    LEFT JOIN NIMBUSBILL.GOLD.FACT_INVOICE_LINE_ITEMS li ON i.INVOICE_ID = li.INVOICE_ID
-    WHERE i.BATCH_ID = '{{ run_id }}';
+    );
     """,
     snowflake_conn_id='snowflake_default',
     dag=dag,
 )
 
-generate_invoices >> generate_line_items >> check_integrity
+[snapshot_tax_rates, prorate_base_fees] >> generate_invoices
+generate_invoices >> generate_line_items >> generate_base_fee_lines >> generate_tax_lines >> apply_invoice_tax >> check_integrity
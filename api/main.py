@@ -1,15 +1,36 @@
-from fastapi import FastAPI, HTTPException, Query
+from fastapi import BackgroundTasks, Body, FastAPI, HTTPException, Query, Request
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import StreamingResponse
+from fastapi.responses import FileResponse, StreamingResponse
 from contextlib import asynccontextmanager
-from typing import List, Optional
+from typing import List, Literal, Optional
 from pydantic import BaseModel
-from datetime import date, datetime
+from datetime import date, datetime, timedelta
 from io import BytesIO
 import snowflake.connector
+import csv
+import json
+import logging
+import math
 import os
+import sys
+import tempfile
 from dotenv import load_dotenv
 
+# `uvicorn main:app` runs from api/; make the shared billing package importable.
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from billing.customer_keys import CustomerKeyMap
+from billing.ingest import BufferFull, EventBuffer, LocalSink, SnowflakeSink, parse_batch, validate_event
+from billing.exports import EXPORT_SQL, FINGERPRINT_SQL, FORMATS, ExportCache, fingerprint, parse_period
+from billing.fx import REPORTING_CURRENCY, FxRateCache
+from billing.rating import RateIndex
+from billing.repricing import default_range, segment_starts, simulate, usage_segments_sql
+from billing.singleflight import SingleFlight, flight_key, is_read
+from billing.unload import ExportJobs, LocalStage, SnowflakeStage, UsageExport
+from billing.usage_planner import UsagePlanner
+from billing.usage_store import UsageSeriesStore
+
 load_dotenv()
 
 SNOWFLAKE_CONFIG = {
@@ -27,8 +48,22 @@ def get_connection():
     return snowflake.connector.connect(**SNOWFLAKE_CONFIG)
 
 
+# Identical reads issued concurrently (dashboard tabs loading at once) share
+# one warehouse execution; writes always run on their own.
+QUERY_COALESCING = os.getenv("QUERY_COALESCING", "true").lower() in ("1", "true", "yes")
+query_flights = SingleFlight(max_waiters=int(os.getenv("QUERY_COALESCE_MAX_WAITERS", "64")))
+
+
 def query(sql: str, params: dict | None = None) -> list[dict]:
     """Execute a SQL query and return rows as list of dicts."""
+    if not QUERY_COALESCING or not is_read(sql):
+        return _execute(sql, params)
+    rows, shared = query_flights.do(flight_key(sql, params), lambda: _execute(sql, params))
+    # Waiters get their own row dicts so one handler can't mutate another's result.
+    return [dict(r) for r in rows] if shared else rows
+
+
+def _execute(sql: str, params: dict | None = None) -> list[dict]:
     conn = get_connection()
     try:
         cur = conn.cursor(snowflake.connector.DictCursor)
@@ -39,6 +74,79 @@ def query(sql: str, params: dict | None = None) -> list[dict]:
         conn.close()
 
 
+def query_chunks(sql: str, params: dict | None = None, chunk_size: int = 50_000):
+    """Execute a SQL query and yield rows in bounded lists of dicts."""
+    conn = get_connection()
+    try:
+        cur = conn.cursor(snowflake.connector.DictCursor)
+        cur.execute(sql, params or {})
+        while True:
+            rows = cur.fetchmany(chunk_size)
+            if not rows:
+                break
+            yield [{k.lower(): v for k, v in row.items()} for row in rows]
+    finally:
+        conn.close()
+
+
+# CUSTOMER_ID -> CUSTOMER_SKs, so fact queries filter on the surrogate key
+# instead of joining DIM_CUSTOMER per request.
+customer_keys = CustomerKeyMap(
+    query,
+    capacity=int(os.getenv("CUSTOMER_KEY_CACHE_SIZE", "100000")),
+    refresh_seconds=float(os.getenv("CUSTOMER_KEY_REFRESH_SECONDS", "60")),
+)
+
+# Period exports are built once per version of the period's invoices and
+# served from disk, so downloads can resume with HTTP range requests.
+export_cache = ExportCache(os.getenv("EXPORT_CACHE_DIR", os.path.join(tempfile.gettempdir(), "nimbusbill_exports")))
+EXPORT_CHUNK_ROWS = int(os.getenv("EXPORT_CHUNK_ROWS", "50000"))
+
+# Large usage extracts are unloaded warehouse-side (COPY INTO @stage); the
+# local stage writes the same layout to disk for development.
+if os.getenv("EXPORT_STAGE_BACKEND", "snowflake") == "local":
+    export_stage = LocalStage(
+        os.getenv("EXPORT_LOCAL_STAGE_DIR", os.path.join(tempfile.gettempdir(), "nimbusbill_stage")),
+        lambda sql, params: query_chunks(sql, params, chunk_size=EXPORT_CHUNK_ROWS),
+    )
+else:
+    export_stage = SnowflakeStage(query)
+export_jobs = ExportJobs(query, export_stage)
+
+# Per-customer usage series published by the daily pipeline and memory-mapped
+# here; /customers/{id}/usage reads it when the requested range is covered.
+usage_store = UsageSeriesStore(
+    os.getenv("USAGE_STORE_PATH", os.path.join(tempfile.gettempdir(), "nimbusbill_serving", "usage_series.nbus")),
+    max_age_hours=float(os.getenv("USAGE_STORE_MAX_AGE_HOURS", "36")),
+)
+
+# POST /events: validated events are written to a local WAL, buffered and
+# flushed to Bronze as gzip chunks (PUT + COPY) by size or age.
+if os.getenv("EVENT_SINK_BACKEND", "snowflake") == "local":
+    event_sink = LocalSink(os.getenv("EVENT_LOCAL_SINK_DIR", os.path.join(tempfile.gettempdir(), "nimbusbill_events")))
+else:
+    event_sink = SnowflakeSink(lambda: get_connection())
+event_buffer = EventBuffer(
+    os.getenv("EVENT_WAL_DIR", os.path.join(tempfile.gettempdir(), "nimbusbill_wal")),
+    event_sink,
+    max_events=int(os.getenv("EVENT_BUFFER_MAX_EVENTS", "1000000")),
+    flush_events=int(os.getenv("EVENT_FLUSH_EVENTS", "200000")),
+    flush_seconds=float(os.getenv("EVENT_FLUSH_SECONDS", "10")),
+    fsync=os.getenv("EVENT_WAL_FSYNC", "true").lower() in ("1", "true", "yes"),
+)
+EVENT_MAX_BATCH = int(os.getenv("EVENT_MAX_BATCH", "10000"))
+
+# /usage is answered from the smallest Gold rollup that can serve it exactly;
+# the table chosen is logged per request and counted in /health.
+usage_planner = UsagePlanner()
+
+# Effective-dated FX rates into the reporting currency Gold converts to, for
+# amounts it doesn't pre-convert (invoice totals); one dict hit per row.
+fx_rates = FxRateCache(query, REPORTING_CURRENCY,
+                       refresh_seconds=float(os.getenv("FX_RATE_REFRESH_SECONDS", "3600")))
+log = logging.getLogger(__name__)
+
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     try:
@@ -46,9 +154,13 @@ async def lifespan(app: FastAPI):
         conn.cursor().execute("SELECT 1")
         conn.close()
         print("Snowflake connection verified")
+        print(f"Customer key map warmed with {customer_keys.warm()} customers")
+        print(f"FX rate cache loaded {fx_rates.load()} windows")
     except Exception as e:
         print(f"Snowflake connection failed: {e}")
+    print(f"Event buffer recovered {event_buffer.start()} events from the WAL")
     yield
+    event_buffer.close()
 
 
 
@@ -81,6 +193,8 @@ class Invoice(BaseModel):
     tax: float
     total: float
     currency: str
+    reporting_currency: Optional[str] = None
+    total_reporting: Optional[float] = None  # None when no FX rate covers the period end
 
 class LineItem(BaseModel):
     line_item_id: str
@@ -103,6 +217,13 @@ class Customer(BaseModel):
     plan_id: Optional[str] = None
     is_current: bool = True
 
+class CreditBalance(BaseModel):
+    customer_id: str
+    currency: str
+    balance: float
+    last_entry_date: Optional[date] = None  # day of the latest ledger entry applied
+    updated_ts: Optional[datetime] = None
+
 class DailyUsage(BaseModel):
     date_id: date
     product_id: str
@@ -111,12 +232,82 @@ class DailyUsage(BaseModel):
     cost_amount: float
     currency: Optional[str] = None
 
+class UsageBucket(DailyUsage):
+    hour_ts: Optional[datetime] = None  # set for grain=hour
+
+class RevenueSlice(BaseModel):
+    # Dimensions not in `by` are None; plan_id is the plan reported on the events
+    region: Optional[str] = None
+    plan_id: Optional[str] = None
+    product_id: Optional[str] = None
+    unit: Optional[str] = None
+    total_quantity: Optional[float] = None  # per product only
+    currency: Optional[str] = None
+    revenue: float
+    reporting_revenue: Optional[float] = None
+
 class DashboardSummary(BaseModel):
+    # Revenue figures are in the reporting currency
     total_revenue_mtd: float
     total_customers: int
     active_invoices: int
     total_events_today: int
     avg_daily_revenue: float
+    reporting_currency: str = REPORTING_CURRENCY
+
+class RepricingDelta(BaseModel):
+    baseline: float
+    candidate: float
+    delta: float
+
+class CustomerRepricingDelta(RepricingDelta):
+    customer_id: str
+
+class ProductRepricingDelta(RepricingDelta):
+    product_id: str
+
+class RepricingSimulation(BaseModel):
+    date_from: date
+    date_to: date
+    rows_rated: int
+    unpriced_baseline: int
+    unpriced_candidate: int
+    baseline_total: float
+    candidate_total: float
+    delta_total: float
+    by_product: List[ProductRepricingDelta] = []
+    by_customer: List[CustomerRepricingDelta] = []
+
+class ExportFile(BaseModel):
+    path: str
+    size: int
+    url: Optional[str] = None
+
+class ExportJob(BaseModel):
+    job_id: str
+    kind: str
+    status: str
+    params: Optional[dict] = None
+    stage_path: Optional[str] = None
+    rows_unloaded: Optional[int] = None
+    file_count: Optional[int] = None
+    bytes_unloaded: Optional[int] = None
+    duration_ms: Optional[int] = None
+    error_message: Optional[str] = None
+    created_ts: Optional[datetime] = None
+    started_ts: Optional[datetime] = None
+    finished_ts: Optional[datetime] = None
+    files: List[ExportFile] = []
+
+class EventRejection(BaseModel):
+    index: int
+    errors: List[str]
+
+
+class EventIngestResult(BaseModel):
+    accepted: int
+    rejected: List[EventRejection]
+
 
 class PipelineStatus(BaseModel):
     run_id: Optional[str] = None
@@ -124,6 +315,21 @@ class PipelineStatus(BaseModel):
     status: Optional[str] = None
     created_ts: Optional[datetime] = None
 
+class UsageAnomaly(BaseModel):
+    date_id: date
+    customer_id: str
+    product_id: str
+    unit: str
+    kind: str
+    quantity: float
+    cost_amount: Optional[float] = None
+    currency: Optional[str] = None
+    baseline_mean: float
+    baseline_stddev: float
+    z_score: Optional[float] = None
+    relative_change: Optional[float] = None
+    observations: int
+
 
 # Endpoints
 
@@ -131,32 +337,36 @@ class PipelineStatus(BaseModel):
 @app.get("/health")
 def health_check():
     """Health check with Snowflake connectivity test."""
+    serving = {"query_coalescing": query_flights.stats.to_dict(), "usage_store": usage_store.info(),
+               "event_buffer": event_buffer.info(), "usage_planner": usage_planner.info(),
+               "fx_rates": fx_rates.info()}
     try:
         conn = get_connection()
         conn.cursor().execute("SELECT 1")
         conn.close()
-        return {"status": "ok", "snowflake": "connected"}
+        return {"status": "ok", "snowflake": "connected", **serving}
     except Exception as e:
-        return {"status": "degraded", "snowflake": str(e)}
+        return {"status": "degraded", "snowflake": str(e), **serving}
 
 
 
 @app.get("/dashboard/summary", response_model=DashboardSummary)
 def get_dashboard_summary():
     """Aggregated KPIs for the dashboard overview."""
+    # Sums REPORTING_COST_AMOUNT (converted once by the daily Gold step) so
+    # currencies are never added together; the product rollup is a few rows a day.
     rows = query("""
         SELECT
-            COALESCE(SUM(f.COST_AMOUNT), 0) AS total_revenue_mtd,
+            COALESCE(SUM(f.REPORTING_COST_AMOUNT), 0) AS total_revenue_mtd,
             (SELECT COUNT(DISTINCT CUSTOMER_ID) FROM NIMBUSBILL.GOLD.DIM_CUSTOMER WHERE IS_CURRENT = TRUE) AS total_customers,
             (SELECT COUNT(*) FROM NIMBUSBILL.GOLD.FACT_INVOICES WHERE STATUS = 'issued') AS active_invoices,
             (SELECT COUNT(*) FROM NIMBUSBILL.SILVER.USAGE_EVENTS_CLEAN WHERE EVENT_DATE = CURRENT_DATE()) AS total_events_today,
-            COALESCE(AVG(daily_total), 0) AS avg_daily_revenue
-        FROM NIMBUSBILL.GOLD.FACT_CUSTOMER_DAILY_USAGE f
-        LEFT JOIN (
-            SELECT DATE_ID, SUM(COST_AMOUNT) AS daily_total
-            FROM NIMBUSBILL.GOLD.FACT_CUSTOMER_DAILY_USAGE
-            GROUP BY DATE_ID
-        ) d ON 1=1
+            (SELECT COALESCE(AVG(daily_total), 0) FROM (
+                SELECT DATE_ID, SUM(REPORTING_COST_AMOUNT) AS daily_total
+                FROM NIMBUSBILL.GOLD.FACT_PRODUCT_DAILY_USAGE
+                GROUP BY DATE_ID
+            )) AS avg_daily_revenue
+        FROM NIMBUSBILL.GOLD.FACT_PRODUCT_DAILY_USAGE f
         WHERE f.DATE_ID >= DATE_TRUNC('MONTH', CURRENT_DATE())
     """)
     if rows:
@@ -189,23 +399,55 @@ def get_customer_usage(
     date_to: Optional[date] = None,
 ):
     """Daily usage breakdown for a specific customer."""
+    sks = customer_keys.sks(customer_id)
+    if not sks:
+        return []
+    rows = usage_store.lookup(sks, date_from, date_to)
+    if rows is not None:
+        return rows  # validated once by the response model
     sql = """
-        SELECT f.DATE_ID, f.PRODUCT_ID, f.UNIT, f.TOTAL_QUANTITY, f.COST_AMOUNT, f.CURRENCY
+        SELECT f.DATE_ID, f.PRODUCT_ID, f.UNIT,
+               SUM(f.TOTAL_QUANTITY) AS TOTAL_QUANTITY, SUM(f.COST_AMOUNT) AS COST_AMOUNT, f.CURRENCY
         FROM NIMBUSBILL.GOLD.FACT_CUSTOMER_DAILY_USAGE f
-        JOIN NIMBUSBILL.GOLD.DIM_CUSTOMER c ON f.CUSTOMER_SK = c.CUSTOMER_SK
-        WHERE c.CUSTOMER_ID = %(cid)s AND c.IS_CURRENT = TRUE
+        WHERE f.CUSTOMER_SK IN (%(sks)s)
     """
-    params = {"cid": customer_id}
+    params = {"sks": sks}
     if date_from:
         sql += " AND f.DATE_ID >= %(df)s"
         params["df"] = str(date_from)
     if date_to:
         sql += " AND f.DATE_ID <= %(dt)s"
         params["dt"] = str(date_to)
-    sql += " ORDER BY f.DATE_ID DESC, f.PRODUCT_ID"
+    sql += " GROUP BY f.DATE_ID, f.PRODUCT_ID, f.UNIT, f.CURRENCY ORDER BY f.DATE_ID DESC, f.PRODUCT_ID"
     return [DailyUsage(**r) for r in query(sql, params)]
 
 
+@app.get("/customers/{customer_id}/balance", response_model=List[CreditBalance])
+def get_customer_balance(customer_id: str):
+    """Prepaid credit balance per currency, read by key from the materialized balance table."""
+    return [CreditBalance(**r) for r in query("""
+        SELECT CUSTOMER_ID, CURRENCY, BALANCE, LAST_ENTRY_DATE, UPDATED_TS
+        FROM NIMBUSBILL.GOLD.FACT_CREDIT_BALANCES
+        WHERE CUSTOMER_ID = %(cid)s
+        ORDER BY CURRENCY
+    """, {"cid": customer_id})]
+
+
+
+def _refresh_fx_rates():
+    # Stale rates beat failing the invoice read; the next request probes again.
+    try:
+        fx_rates.maybe_refresh()
+    except Exception as e:
+        log.warning("FX rate refresh failed, serving cached rates: %s", e)
+
+
+def _with_reporting_total(row: dict) -> dict:
+    """Add the invoice total in the reporting currency, at the rate on the period's last day."""
+    row["reporting_currency"] = fx_rates.reporting_currency
+    row["total_reporting"] = fx_rates.convert(row.get("total"), row.get("currency"), row["billing_period_end"])
+    return row
+
 
 @app.get("/invoices", response_model=List[Invoice])
 def list_invoices(customer_id: Optional[str] = None, status: Optional[str] = None):
@@ -217,15 +459,22 @@ def list_invoices(customer_id: Optional[str] = None, status: Optional[str] = Non
             i.BILLING_PERIOD_START, i.BILLING_PERIOD_END,
             i.ISSUED_TS, i.STATUS, i.SUBTOTAL, i.TAX, i.TOTAL, i.CURRENCY
         FROM NIMBUSBILL.GOLD.FACT_INVOICES i
-        LEFT JOIN NIMBUSBILL.GOLD.DIM_CUSTOMER c ON i.CUSTOMER_SK = c.CUSTOMER_SK AND c.IS_CURRENT = TRUE
+        LEFT JOIN NIMBUSBILL.GOLD.DIM_CUSTOMER c ON i.CUSTOMER_SK = c.CUSTOMER_SK
         WHERE 1=1
     """
+    params: dict = {}
     if customer_id:
-        sql += f" AND c.CUSTOMER_ID = '{customer_id}'"
+        sks = customer_keys.sks(customer_id)
+        if not sks:
+            return []
+        sql += " AND i.CUSTOMER_SK IN (%(sks)s)"
+        params["sks"] = sks
     if status:
-        sql += f" AND i.STATUS = '{status}'"
+        sql += " AND i.STATUS = %(status)s"
+        params["status"] = status
     sql += " ORDER BY i.ISSUED_TS DESC"
-    return [Invoice(**r) for r in query(sql)]
+    _refresh_fx_rates()
+    return [Invoice(**_with_reporting_total(r)) for r in query(sql, params)]
 
 
 @app.get("/invoices/{invoice_id}", response_model=InvoiceDetail)
@@ -238,7 +487,7 @@ def get_invoice_detail(invoice_id: str):
             i.BILLING_PERIOD_START, i.BILLING_PERIOD_END,
             i.ISSUED_TS, i.STATUS, i.SUBTOTAL, i.TAX, i.TOTAL, i.CURRENCY
         FROM NIMBUSBILL.GOLD.FACT_INVOICES i
-        LEFT JOIN NIMBUSBILL.GOLD.DIM_CUSTOMER c ON i.CUSTOMER_SK = c.CUSTOMER_SK AND c.IS_CURRENT = TRUE
+        LEFT JOIN NIMBUSBILL.GOLD.DIM_CUSTOMER c ON i.CUSTOMER_SK = c.CUSTOMER_SK
         WHERE i.INVOICE_ID = %(iid)s
     """, {"iid": invoice_id})
 
@@ -252,8 +501,9 @@ def get_invoice_detail(invoice_id: str):
         ORDER BY LOAD_TS
     """, {"iid": invoice_id})
 
+    _refresh_fx_rates()
     return InvoiceDetail(
-        **inv_rows[0],
+        **_with_reporting_total(inv_rows[0]),
         line_items=[LineItem(**li) for li in li_rows],
     )
 
@@ -275,7 +525,7 @@ def download_invoice_pdf(invoice_id: str):
             i.BILLING_PERIOD_START, i.BILLING_PERIOD_END,
             i.ISSUED_TS, i.STATUS, i.SUBTOTAL, i.TAX, i.TOTAL, i.CURRENCY
         FROM NIMBUSBILL.GOLD.FACT_INVOICES i
-        LEFT JOIN NIMBUSBILL.GOLD.DIM_CUSTOMER c ON i.CUSTOMER_SK = c.CUSTOMER_SK AND c.IS_CURRENT = TRUE
+        LEFT JOIN NIMBUSBILL.GOLD.DIM_CUSTOMER c ON i.CUSTOMER_SK = c.CUSTOMER_SK
         WHERE i.INVOICE_ID = %(iid)s
     """, {"iid": invoice_id})
     if not inv_rows:
@@ -348,12 +598,15 @@ def download_invoice_pdf(invoice_id: str):
             pdf.set_fill_color(248, 250, 252)
         else:
             pdf.set_fill_color(255, 255, 255)
-        product_name = li['product_id'].replace('prod_', '').replace('_', ' ').title()
+        # Tax and fee lines carry no product; they are labelled by type
+        product_name = (li['product_id'] or li['line_type']).replace('prod_', '').replace('_', ' ').title()
         pdf.cell(col_widths[0], 7, product_name, border=1, fill=True)
         pdf.cell(col_widths[1], 7, str(li.get('line_type', 'usage')), border=1, fill=True, align="C")
         pdf.cell(col_widths[2], 7, f"{li['quantity']:.2f}", border=1, fill=True, align="R")
-        pdf.cell(col_widths[3], 7, str(li.get('unit', '')), border=1, fill=True, align="C")
-        pdf.cell(col_widths[4], 7, f"${li['unit_price']:.4f}", border=1, fill=True, align="R")
+        pdf.cell(col_widths[3], 7, str(li.get('unit') or ''), border=1, fill=True, align="C")
+        # A tax line's quantity is the taxable amount and its unit price the rate
+        unit_price = f"{li['unit_price'] * 100:.2f}%" if li['line_type'] == 'tax' else f"${li['unit_price']:.4f}"
+        pdf.cell(col_widths[4], 7, unit_price, border=1, fill=True, align="R")
         pdf.cell(col_widths[5], 7, f"${li['amount']:.2f}", border=1, fill=True, align="R")
         pdf.ln()
         fill = not fill
@@ -394,40 +647,208 @@ def download_invoice_pdf(invoice_id: str):
 
 
 
-@app.get("/usage", response_model=List[DailyUsage])
+@app.get("/exports/invoices")
+def export_invoices(period: str, format: Literal["csv", "parquet"] = "csv"):
+    """All invoice headers and line items for a billing period (YYYY-MM) as gzip CSV or Parquet.
+
+    Supports Range / If-Range against the ETag; the ETag changes whenever the
+    period's invoices or line items do.
+    """
+    try:
+        period_start = parse_period(period)
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    if format == "parquet":
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError:
+            raise HTTPException(status_code=500, detail="pyarrow not installed")
+
+    params = {"ps": str(period_start)}
+    rows = query(FINGERPRINT_SQL, params)
+    version = fingerprint(rows[0] if rows else None)
+    if version is None:
+        raise HTTPException(status_code=404, detail=f"No invoices for period {period}")
+
+    path = export_cache.get_or_build(
+        period, format, version,
+        lambda: query_chunks(EXPORT_SQL, params, chunk_size=EXPORT_CHUNK_ROWS),
+    )
+    extension, media_type = FORMATS[format]
+    return FileResponse(
+        path,
+        media_type=media_type,
+        filename=f"invoices_{period}{extension}",
+        headers={"ETag": f'"{version}"', "Cache-Control": "private, max-age=0, must-revalidate"},
+    )
+
+
+
+@app.post("/exports/usage", response_model=ExportJob, status_code=202)
+def create_usage_export(
+    background_tasks: BackgroundTasks,
+    date_from: date,
+    date_to: date,
+    customer_id: Optional[str] = None,
+):
+    """Start a warehouse-side Parquet unload of daily usage, partitioned by date and customer."""
+    sks: tuple = ()
+    if customer_id:
+        sks = customer_keys.sks(customer_id)
+        if not sks:
+            raise HTTPException(status_code=404, detail="Customer not found")
+    try:
+        export = UsageExport(date_from, date_to, sks)
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    job_id = export_jobs.create(export)
+    background_tasks.add_task(export_jobs.run, job_id, export)
+    return ExportJob(job_id=job_id, kind="usage", status="queued", params=json.loads(export.to_json()))
+
+
+@app.get("/exports/jobs/{job_id}", response_model=ExportJob)
+def get_export_job(job_id: str, expiry_seconds: int = Query(3600, ge=60, le=7 * 24 * 3600)):
+    """Job status; once succeeded, lists the files with presigned URLs (or local paths)."""
+    job = export_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Export job not found")
+    if job["status"] == "succeeded":
+        job["files"] = export_jobs.files(job_id, expiry_seconds)
+    return ExportJob(**job)
+
+
+
+def _ingest(body: bytes, ndjson: bool) -> EventIngestResult:
+    try:
+        events, raw = parse_batch(body, ndjson)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Malformed JSON: {e}")
+    if len(events) > EVENT_MAX_BATCH:
+        raise HTTPException(status_code=413, detail=f"At most {EVENT_MAX_BATCH} events per request")
+
+    lines, rejected = [], []
+    for i, event in enumerate(events):
+        errors = validate_event(event)
+        if errors:
+            rejected.append({"index": i, "errors": errors})
+        else:
+            lines.append(raw[i])
+    if not lines:
+        raise HTTPException(status_code=422, detail=rejected or "No events")
+    try:
+        event_buffer.append(lines)
+    except BufferFull as e:
+        raise HTTPException(status_code=429, detail=str(e),
+                            headers={"Retry-After": str(int(math.ceil(e.retry_after)))})
+    return EventIngestResult(accepted=len(lines), rejected=rejected)
+
+
+@app.post("/events", response_model=EventIngestResult, status_code=202)
+async def ingest_events(request: Request):
+    """Accept one usage event (JSON object), a batch (JSON array) or NDJSON.
+
+    Valid events are acknowledged once written to the local WAL and reach Bronze
+    within EVENT_FLUSH_SECONDS; invalid ones are listed by index and dropped.
+    429 with Retry-After when the buffer is full.
+    """
+    body = await request.body()
+    ndjson = request.headers.get("content-type", "").startswith("application/x-ndjson")
+    return await run_in_threadpool(_ingest, body, ndjson)
+
+
+
+@app.get("/usage", response_model=List[UsageBucket])
 def get_usage(
     customer_id: Optional[str] = None,
     date_from: Optional[date] = None,
     date_to: Optional[date] = None,
     product_id: Optional[str] = None,
+    region: Optional[str] = None,
+    grain: Literal["hour", "day", "month"] = "day",
 ):
-    """Flexible usage query across all customers or filtered."""
-    sql = """
-        SELECT
-            f.DATE_ID, f.PRODUCT_ID, f.UNIT,
-            SUM(f.TOTAL_QUANTITY) AS TOTAL_QUANTITY,
-            SUM(f.COST_AMOUNT) AS COST_AMOUNT,
-            MAX(f.CURRENCY) AS CURRENCY
-        FROM NIMBUSBILL.GOLD.FACT_CUSTOMER_DAILY_USAGE f
-        JOIN NIMBUSBILL.GOLD.DIM_CUSTOMER c ON f.CUSTOMER_SK = c.CUSTOMER_SK AND c.IS_CURRENT = TRUE
-        WHERE f.DATE_ID >= DATEADD('day', -90, CURRENT_DATE())
-    """
-    params: dict = {}
+    """Flexible usage query across all customers or filtered, per hour, day or month."""
+    sks = None
     if customer_id:
-        sql += " AND c.CUSTOMER_ID = %(cid)s"
-        params["cid"] = customer_id
-    if date_from:
-        sql += " AND f.DATE_ID >= %(df)s"
-        params["df"] = str(date_from)
+        sks = customer_keys.sks(customer_id)
+        if not sks:
+            return []
+    plan = usage_planner.plan(grain, date_from=date_from, date_to=date_to, sks=sks,
+                              product_id=product_id, region=region)
+    log.info("/usage grain=%s from %s to %s served by %s", grain, plan.date_from, plan.date_to or "now",
+             plan.source.name)
+    return [UsageBucket(**r) for r in query(plan.sql, plan.params)]
+
+
+# /revenue/breakdown dimension -> FACT_REVENUE_CUBE columns
+REVENUE_DIMENSIONS = {
+    "region": ("REGION",),
+    "plan": ("EVENT_PLAN_ID AS PLAN_ID",),
+    "product": ("PRODUCT_ID", "UNIT"),
+}
+
+
+@app.get("/revenue/breakdown", response_model=List[RevenueSlice])
+def get_revenue_breakdown(
+    by: List[Literal["region", "plan", "product"]] = Query(["region", "plan", "product"]),
+    date_from: Optional[date] = None,
+    date_to: Optional[date] = None,
+    region: Optional[str] = None,
+    plan_id: Optional[str] = None,
+    product_id: Optional[str] = None,
+):
+    """Revenue per region, event plan and/or product (month to date by default), largest first.
+
+    Rows are per currency; `reporting_revenue` is comparable across them.
+    """
+    columns = [c for dim in dict.fromkeys(by) for c in REVENUE_DIMENSIONS[dim]]
+    keys = [c.split(" AS ")[0] for c in columns]
+    measures = "SUM(COST_AMOUNT) AS REVENUE, SUM(REPORTING_COST_AMOUNT) AS REPORTING_REVENUE"
+    if "product" in by:
+        measures += ", SUM(TOTAL_QUANTITY) AS TOTAL_QUANTITY"
+    sql = f"""
+        SELECT {", ".join(columns + ["CURRENCY", measures])}
+        FROM NIMBUSBILL.GOLD.FACT_REVENUE_CUBE
+        WHERE DATE_ID >= %(df)s
+    """
+    params: dict = {"df": str(date_from or date.today().replace(day=1))}
     if date_to:
-        sql += " AND f.DATE_ID <= %(dt)s"
+        sql += " AND DATE_ID <= %(dt)s"
         params["dt"] = str(date_to)
-    if product_id:
-        sql += " AND f.PRODUCT_ID = %(pid)s"
-        params["pid"] = product_id
-    sql += " GROUP BY f.DATE_ID, f.PRODUCT_ID, f.UNIT ORDER BY f.DATE_ID DESC LIMIT 5000"
-    return [DailyUsage(**r) for r in query(sql, params)]
+    for column, value in (("REGION", region), ("EVENT_PLAN_ID", plan_id), ("PRODUCT_ID", product_id)):
+        if value:
+            sql += f" AND {column} = %({column.lower()})s"
+            params[column.lower()] = value
+    sql += f" GROUP BY {', '.join(keys + ['CURRENCY'])} ORDER BY REPORTING_REVENUE DESC"
+    return [RevenueSlice(**r) for r in query(sql, params)]
+
 
+@app.get("/anomalies", response_model=List[UsageAnomaly])
+def list_anomalies(
+    date_from: Optional[date] = None,
+    date_to: Optional[date] = None,
+    customer_id: Optional[str] = None,
+    kind: Optional[Literal["spike", "drop"]] = None,
+    limit: int = Query(200, ge=1, le=5000),
+):
+    """Usage spikes and drops flagged by the daily pipeline, largest deviations first per day."""
+    sql = """
+        SELECT DATE_ID, CUSTOMER_ID, PRODUCT_ID, UNIT, KIND, QUANTITY, COST_AMOUNT, CURRENCY,
+               BASELINE_MEAN, BASELINE_STDDEV, Z_SCORE, RELATIVE_CHANGE, OBSERVATIONS
+        FROM NIMBUSBILL.OPS.USAGE_ANOMALIES
+        WHERE DATE_ID >= %(df)s
+    """
+    params: dict = {"df": str(date_from or date.today() - timedelta(days=30)), "limit": limit}
+    if date_to:
+        sql += " AND DATE_ID <= %(dt)s"
+        params["dt"] = str(date_to)
+    if customer_id:
+        sql += " AND CUSTOMER_ID = %(cid)s"
+        params["cid"] = customer_id
+    if kind:
+        sql += " AND KIND = %(kind)s"
+        params["kind"] = kind
+    sql += " ORDER BY DATE_ID DESC, ABS(RELATIVE_CHANGE) DESC NULLS FIRST LIMIT %(limit)s"
+    return [UsageAnomaly(**r) for r in query(sql, params)]
 
 
 @app.get("/pipeline/status", response_model=List[PipelineStatus])
@@ -452,3 +873,41 @@ def get_pricing():
         WHERE IS_CURRENT = TRUE
         ORDER BY PRODUCT_ID, PLAN_ID
     """)
+
+
+@app.post("/pricing/simulate", response_model=RepricingSimulation)
+def simulate_repricing(
+    catalog: str = Body(..., media_type="text/csv"),
+    date_from: Optional[date] = None,
+    date_to: Optional[date] = None,
+    top: int = Query(100, ge=0, le=10000),
+):
+    """Re-rate historical usage under a candidate catalog CSV without touching Gold."""
+    default_from, default_to = default_range()
+    date_from, date_to = date_from or default_from, date_to or default_to
+    if date_from > date_to:
+        raise HTTPException(status_code=422, detail="date_from must not be after date_to")
+    try:
+        candidate = RateIndex(list(csv.DictReader(catalog.splitlines())))
+    except (KeyError, ValueError) as e:
+        raise HTTPException(status_code=422, detail=f"Invalid candidate catalog: {e}")
+    baseline = RateIndex.from_warehouse(query)
+
+    starts = segment_starts(date_from, date_to, baseline, candidate)
+    result = simulate(
+        query_chunks(usage_segments_sql(starts), {"df": str(date_from), "dt": str(date_to)}),
+        baseline,
+        candidate,
+    )
+    return RepricingSimulation(
+        date_from=date_from,
+        date_to=date_to,
+        rows_rated=result.rows_rated,
+        unpriced_baseline=result.unpriced_baseline,
+        unpriced_candidate=result.unpriced_candidate,
+        baseline_total=result.baseline_total,
+        candidate_total=result.candidate_total,
+        delta_total=result.candidate_total - result.baseline_total,
+        by_product=result.product_deltas(),
+        by_customer=result.customer_deltas(top),
+    )
@@ -0,0 +1,205 @@
+"""
+anomalies.py
+
+Usage spike and drop detection for the daily pipeline.
+
+Each (customer, product, unit) keeps an exponentially weighted mean and
+variance of its daily quantity in OPS.USAGE_BASELINES. A run touches only the
+keys with usage on the processed day, plus the keys that had usage the day
+before and none today (read as quantity 0, so usage that stops entirely is
+caught as a drop). It folds that day's quantity into the baseline and flags
+the day when it deviates from the baseline as it stood before the day, so
+cost grows with the active keys, not with history. A key that stays at zero
+is left alone after its first zero day until usage resumes.
+
+A day is flagged when all of these hold (thresholds per product in
+OPS.USAGE_ANOMALY_THRESHOLDS, '*' row as the default, DEFAULT_THRESHOLDS if
+neither exists):
+
+  - the baseline has at least `min_observations` days,
+  - |x - mean| >= z_threshold * stddev,
+  - |x - mean| >= min_relative_change * mean.
+
+The state row also keeps the previous baseline, so re-running a day
+recomputes from it instead of folding the same day in twice. Days older
+than a key's last update (out-of-order backfills) leave its state alone.
+
+`Baseline` is the same arithmetic in Python, for tests and previews.
+"""
+from __future__ import annotations
+
+import math
+import time
+from dataclasses import dataclass
+from datetime import date
+
+BASELINES_TABLE = "NIMBUSBILL.OPS.USAGE_BASELINES"
+THRESHOLDS_TABLE = "NIMBUSBILL.OPS.USAGE_ANOMALY_THRESHOLDS"
+ANOMALIES_TABLE = "NIMBUSBILL.OPS.USAGE_ANOMALIES"
+_BATCH = "NIMBUSBILL.OPS.USAGE_ANOMALY_BATCH"
+
+
+@dataclass(frozen=True)
+class Thresholds:
+    alpha: float = 0.1                 # weight of the newest day in the EWMA
+    z_threshold: float = 4.0
+    min_observations: int = 7
+    min_relative_change: float = 0.5
+
+
+DEFAULT_THRESHOLDS = Thresholds()
+
+
+@dataclass
+class Baseline:
+    mean: float = 0.0
+    var: float = 0.0
+    observations: int = 0
+
+    @property
+    def stddev(self) -> float:
+        return math.sqrt(self.var)
+
+    def check(self, x: float, t: Thresholds = DEFAULT_THRESHOLDS) -> tuple[str, float | None] | None:
+        """('spike' | 'drop', z-score) if x is anomalous against this baseline."""
+        if self.observations < t.min_observations:
+            return None
+        delta = x - self.mean
+        if delta == 0 or abs(delta) < t.z_threshold * self.stddev or abs(delta) < t.min_relative_change * self.mean:
+            return None
+        z = delta / self.stddev if self.var > 0 else None
+        return ("spike" if delta > 0 else "drop"), z
+
+    def update(self, x: float, alpha: float = DEFAULT_THRESHOLDS.alpha) -> "Baseline":
+        if not self.observations:
+            return Baseline(x, 0.0, 1)
+        delta = x - self.mean
+        return Baseline(
+            self.mean + alpha * delta,
+            (1 - alpha) * (self.var + alpha * delta * delta),
+            self.observations + 1,
+        )
+
+
+@dataclass
+class AnomalyRun:
+    day: date
+    active_keys: int
+    baselines_inserted: int
+    baselines_updated: int
+    flagged: int
+    duration_ms: int
+
+
+# The day's quantity per key with its resolved thresholds; read by both the
+# state MERGE and the flag INSERT. Keys that had usage the day before but
+# none today come in at zero; on a re-run of the day they are recognised by
+# the zero they were folded in with.
+BATCH_SQL = f"""
+    CREATE OR REPLACE TEMPORARY TABLE {_BATCH} AS
+    WITH active AS (
+        SELECT c.CUSTOMER_ID, f.PRODUCT_ID, f.UNIT,
+               SUM(f.TOTAL_QUANTITY)::FLOAT AS QUANTITY,
+               SUM(f.COST_AMOUNT) AS COST_AMOUNT,
+               ANY_VALUE(f.CURRENCY) AS CURRENCY
+        FROM NIMBUSBILL.GOLD.FACT_CUSTOMER_DAILY_USAGE f
+        JOIN NIMBUSBILL.GOLD.DIM_CUSTOMER c ON f.CUSTOMER_SK = c.CUSTOMER_SK
+        WHERE f.DATE_ID = %(day)s
+        GROUP BY 1, 2, 3
+    ),
+    usage_day AS (
+        SELECT * FROM active
+        UNION ALL
+        SELECT b.CUSTOMER_ID, b.PRODUCT_ID, b.UNIT, 0::FLOAT, 0, NULL
+        FROM {BASELINES_TABLE} b
+        WHERE ((b.LAST_DATE = %(day)s::DATE - 1 AND b.LAST_QUANTITY > 0)
+               OR (b.LAST_DATE = %(day)s::DATE AND b.PREV_DATE = %(day)s::DATE - 1 AND b.LAST_QUANTITY = 0))
+          AND NOT EXISTS (
+              SELECT 1 FROM active a
+              WHERE a.CUSTOMER_ID = b.CUSTOMER_ID AND a.PRODUCT_ID = b.PRODUCT_ID AND a.UNIT = b.UNIT
+          )
+    )
+    SELECT u.*, %(day)s::DATE AS DATE_ID,
+           COALESCE(p.ALPHA, d.ALPHA, %(alpha)s) AS ALPHA,
+           COALESCE(p.Z_THRESHOLD, d.Z_THRESHOLD, %(z)s) AS Z_THRESHOLD,
+           COALESCE(p.MIN_OBSERVATIONS, d.MIN_OBSERVATIONS, %(min_obs)s) AS MIN_OBSERVATIONS,
+           COALESCE(p.MIN_RELATIVE_CHANGE, d.MIN_RELATIVE_CHANGE, %(min_rel)s) AS MIN_RELATIVE_CHANGE
+    FROM usage_day u
+    LEFT JOIN {THRESHOLDS_TABLE} p ON p.PRODUCT_ID = u.PRODUCT_ID
+    LEFT JOIN {THRESHOLDS_TABLE} d ON d.PRODUCT_ID = '*'
+"""
+
+UPDATE_SQL = f"""
+    MERGE INTO {BASELINES_TABLE} b
+    USING {_BATCH} s
+    ON b.CUSTOMER_ID = s.CUSTOMER_ID AND b.PRODUCT_ID = s.PRODUCT_ID AND b.UNIT = s.UNIT
+    WHEN MATCHED AND b.LAST_DATE < s.DATE_ID THEN UPDATE SET
+        PREV_MEAN = b.EWMA_MEAN,
+        PREV_VAR = b.EWMA_VAR,
+        PREV_OBSERVATIONS = b.OBSERVATIONS,
+        PREV_DATE = b.LAST_DATE,
+        EWMA_MEAN = b.EWMA_MEAN + s.ALPHA * (s.QUANTITY - b.EWMA_MEAN),
+        EWMA_VAR = (1 - s.ALPHA) * (b.EWMA_VAR + s.ALPHA * SQUARE(s.QUANTITY - b.EWMA_MEAN)),
+        OBSERVATIONS = b.OBSERVATIONS + 1,
+        LAST_DATE = s.DATE_ID,
+        LAST_QUANTITY = s.QUANTITY,
+        UPDATED_TS = CURRENT_TIMESTAMP()
+    -- Re-run of the same day: fold it into the previous baseline again
+    WHEN MATCHED AND b.LAST_DATE = s.DATE_ID THEN UPDATE SET
+        EWMA_MEAN = IFF(b.PREV_OBSERVATIONS IS NULL, s.QUANTITY,
+                        b.PREV_MEAN + s.ALPHA * (s.QUANTITY - b.PREV_MEAN)),
+        EWMA_VAR = IFF(b.PREV_OBSERVATIONS IS NULL, 0,
+                       (1 - s.ALPHA) * (b.PREV_VAR + s.ALPHA * SQUARE(s.QUANTITY - b.PREV_MEAN))),
+        LAST_QUANTITY = s.QUANTITY,
+        UPDATED_TS = CURRENT_TIMESTAMP()
+    WHEN NOT MATCHED THEN INSERT
+        (CUSTOMER_ID, PRODUCT_ID, UNIT, EWMA_MEAN, EWMA_VAR, OBSERVATIONS, LAST_DATE, LAST_QUANTITY, UPDATED_TS)
+    VALUES
+        (s.CUSTOMER_ID, s.PRODUCT_ID, s.UNIT, s.QUANTITY, 0, 1, s.DATE_ID, s.QUANTITY, CURRENT_TIMESTAMP())
+"""
+
+FLAG_SQL = f"""
+    INSERT INTO {ANOMALIES_TABLE}
+        (DATE_ID, CUSTOMER_ID, PRODUCT_ID, UNIT, KIND, QUANTITY, COST_AMOUNT, CURRENCY,
+         BASELINE_MEAN, BASELINE_STDDEV, Z_SCORE, RELATIVE_CHANGE, OBSERVATIONS, RUN_ID, CREATED_TS)
+    SELECT s.DATE_ID, s.CUSTOMER_ID, s.PRODUCT_ID, s.UNIT,
+           IFF(s.QUANTITY > b.PREV_MEAN, 'spike', 'drop'),
+           s.QUANTITY, s.COST_AMOUNT, s.CURRENCY,
+           b.PREV_MEAN, SQRT(b.PREV_VAR),
+           (s.QUANTITY - b.PREV_MEAN) / NULLIF(SQRT(b.PREV_VAR), 0),
+           (s.QUANTITY - b.PREV_MEAN) / NULLIF(b.PREV_MEAN, 0),
+           b.PREV_OBSERVATIONS, %(run_id)s, CURRENT_TIMESTAMP()
+    FROM {_BATCH} s
+    JOIN {BASELINES_TABLE} b
+        ON b.CUSTOMER_ID = s.CUSTOMER_ID AND b.PRODUCT_ID = s.PRODUCT_ID AND b.UNIT = s.UNIT
+    WHERE b.LAST_DATE = s.DATE_ID
+      AND b.PREV_OBSERVATIONS >= s.MIN_OBSERVATIONS
+      AND s.QUANTITY <> b.PREV_MEAN
+      AND ABS(s.QUANTITY - b.PREV_MEAN) >= s.Z_THRESHOLD * SQRT(b.PREV_VAR)
+      AND ABS(s.QUANTITY - b.PREV_MEAN) >= s.MIN_RELATIVE_CHANGE * b.PREV_MEAN
+"""
+
+
+def detect(cursor, day: date, run_id: str, defaults: Thresholds = DEFAULT_THRESHOLDS) -> AnomalyRun:
+    """Update baselines with `day`'s Gold usage and (re)write that day's flags."""
+    t0 = time.perf_counter()
+    params = {
+        "day": str(day), "alpha": defaults.alpha, "z": defaults.z_threshold,
+        "min_obs": defaults.min_observations, "min_rel": defaults.min_relative_change,
+    }
+    cursor.execute(BATCH_SQL, params)
+    cursor.execute(f"SELECT COUNT(*) FROM {_BATCH}")
+    active = int(cursor.fetchone()[0])
+
+    cursor.execute("BEGIN")
+    try:
+        cursor.execute(UPDATE_SQL)
+        inserted, updated = (int(v) for v in cursor.fetchone()[:2])
+        cursor.execute(f"DELETE FROM {ANOMALIES_TABLE} WHERE DATE_ID = %(day)s", {"day": str(day)})
+        cursor.execute(FLAG_SQL, {"run_id": run_id})
+        flagged = int(cursor.fetchone()[0])
+        cursor.execute("COMMIT")
+    except Exception:
+        cursor.execute("ROLLBACK")
+        raise
+    return AnomalyRun(day, active, inserted, updated, flagged, int((time.perf_counter() - t0) * 1000))
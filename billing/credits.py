@@ -0,0 +1,259 @@
+"""
+credits.py
+
+Prepaid commit credits drawn down by daily usage.
+
+GOLD.FACT_CREDIT_GRANTS holds one row per grant (customer, currency, amount,
+first and last usable day) and its REMAINING_AMOUNT. Every change to a grant
+is an entry in GOLD.FACT_CREDIT_LEDGER, signed from the customer's side:
+
+  - 'grant'       +AMOUNT, posted by the first run on or after GRANTED_DATE,
+  - 'expiration'  -what is left, posted by the first run after EXPIRES_DATE,
+  - 'drawdown'    -the share of the day's FACT_CUSTOMER_DAILY_USAGE cost taken
+                  from the grant,
+  - 'reversal'    undoes a day's drawdowns when the day is re-run.
+
+so REMAINING_AMOUNT is always the sum of its grant's entries. A run applies
+the day's cost per (customer, currency) against the open grants in expiry
+order (then grant date, then id): each grant takes min(its remaining, cost
+not covered by the grants ahead of it), a running sum over the customer's
+open grants instead of a loop. The drawdown only tracks how much of the
+commit the usage has consumed; invoices are not netted against it, and the
+month-end close bills the full usage cost either way.
+
+GOLD.FACT_CREDIT_BALANCES is the materialized balance per (customer,
+currency): the run adds the net of the entries it wrote, so the API reads
+one row per currency and never sums the ledger. Like the anomaly baselines,
+a run only touches the customers it writes entries for, re-running a day
+reverses that day's drawdowns before drawing again, and days older than a
+customer's LAST_ENTRY_DATE (out-of-order backfills) are not drawn.
+
+`allocate` is the same drawdown order in Python, for tests and previews.
+"""
+from __future__ import annotations
+
+import csv
+import time
+from dataclasses import dataclass
+from datetime import date
+from decimal import Decimal
+
+from billing.fx import to_date
+
+GRANTS_TABLE = "NIMBUSBILL.GOLD.FACT_CREDIT_GRANTS"
+LEDGER_TABLE = "NIMBUSBILL.GOLD.FACT_CREDIT_LEDGER"
+BALANCES_TABLE = "NIMBUSBILL.GOLD.FACT_CREDIT_BALANCES"
+_ENTRIES = "CREDIT_LEDGER_BATCH"
+
+# Entries are staged in phases; each phase is applied to the grants before the
+# next one reads them.
+_POST, _EXPIRE, _DRAW = 1, 2, 3
+
+
+@dataclass(frozen=True)
+class CreditGrant:
+    grant_id: str
+    customer_id: str
+    amount: float
+    currency: str
+    granted_date: date          # first day the credits can be drawn
+    expires_date: date          # last day the credits can be drawn
+
+    @classmethod
+    def from_row(cls, row: dict) -> "CreditGrant":
+        return cls(row["grant_id"], row["customer_id"], float(row["amount"]), row["currency"].upper(),
+                   to_date(row["granted_date"]), to_date(row["expires_date"]))
+
+    def order(self) -> tuple:
+        """Drawdown order: soonest expiry first."""
+        return self.expires_date, self.granted_date, self.grant_id
+
+
+def check_grants(grants: list[CreditGrant]) -> None:
+    """Reject duplicate ids, non-positive amounts and grants expiring before they start."""
+    ids: set[str] = set()
+    for g in grants:
+        if g.grant_id in ids:
+            raise ValueError(f"Duplicate credit grant id {g.grant_id}")
+        ids.add(g.grant_id)
+        if g.amount <= 0:
+            raise ValueError(f"Credit grant {g.grant_id} must be positive, got {g.amount}")
+        if g.expires_date < g.granted_date:
+            raise ValueError(f"Credit grant {g.grant_id} expires before it starts: "
+                             f"{g.granted_date} > {g.expires_date}")
+
+
+def read_grants_csv(path: str) -> list[CreditGrant]:
+    """Read a credit_grants CSV (grant_id, customer_id, amount, currency, granted_date, expires_date)."""
+    with open(path, newline="") as f:
+        grants = [CreditGrant.from_row(row) for row in csv.DictReader(f)]
+    check_grants(grants)
+    return grants
+
+
+def allocate(remaining: dict[CreditGrant, float], cost: float, day) -> dict[str, float]:
+    """Amount drawn from each grant open on `day` to cover `cost`, in drawdown order."""
+    day = to_date(day)
+    left = Decimal(str(cost))
+    drawn: dict[str, float] = {}
+    for g in sorted(remaining, key=CreditGrant.order):
+        if left <= 0:
+            break
+        if not g.granted_date <= day <= g.expires_date or remaining[g] <= 0:
+            continue
+        take = min(Decimal(str(remaining[g])), left)
+        drawn[g.grant_id] = float(take)
+        left -= take
+    return drawn
+
+
+@dataclass
+class DrawdownRun:
+    day: date
+    grants_posted: int
+    grants_expired: int
+    drawdowns: int
+    reversals: int
+    amount_drawn: float         # net of this run's reversals, summed over currencies
+    customers: int
+    duration_ms: int
+
+
+ENTRIES_DDL = f"""
+    CREATE OR REPLACE TEMPORARY TABLE {_ENTRIES} (
+        PHASE NUMBER, GRANT_ID STRING, CUSTOMER_ID STRING, CURRENCY STRING,
+        ENTRY_TYPE STRING, AMOUNT NUMBER(38,10)
+    )
+"""
+
+# Re-run of a day: undo its net drawdowns per grant. A customer whose ledger
+# has moved past the day is left alone.
+REVERSE_SQL = f"""
+    INSERT INTO {_ENTRIES} (PHASE, GRANT_ID, CUSTOMER_ID, CURRENCY, ENTRY_TYPE, AMOUNT)
+    SELECT {_POST}, l.GRANT_ID, l.CUSTOMER_ID, l.CURRENCY, 'reversal', -SUM(l.AMOUNT)
+    FROM {LEDGER_TABLE} l
+    JOIN {BALANCES_TABLE} b ON b.CUSTOMER_ID = l.CUSTOMER_ID AND b.CURRENCY = l.CURRENCY
+    WHERE l.DATE_ID = %(day)s
+      AND l.ENTRY_TYPE IN ('drawdown', 'reversal')
+      AND b.LAST_ENTRY_DATE <= %(day)s
+    GROUP BY l.GRANT_ID, l.CUSTOMER_ID, l.CURRENCY
+    HAVING SUM(l.AMOUNT) <> 0
+"""
+
+POST_SQL = f"""
+    INSERT INTO {_ENTRIES} (PHASE, GRANT_ID, CUSTOMER_ID, CURRENCY, ENTRY_TYPE, AMOUNT)
+    SELECT {_POST}, GRANT_ID, CUSTOMER_ID, CURRENCY, 'grant', AMOUNT
+    FROM {GRANTS_TABLE}
+    WHERE POSTED_DATE IS NULL AND GRANTED_DATE <= %(day)s
+"""
+
+EXPIRE_SQL = f"""
+    INSERT INTO {_ENTRIES} (PHASE, GRANT_ID, CUSTOMER_ID, CURRENCY, ENTRY_TYPE, AMOUNT)
+    SELECT {_EXPIRE}, GRANT_ID, CUSTOMER_ID, CURRENCY, 'expiration', -REMAINING_AMOUNT
+    FROM {GRANTS_TABLE}
+    WHERE POSTED_DATE IS NOT NULL AND EXPIRES_DATE < %(day)s AND REMAINING_AMOUNT > 0
+"""
+
+# AHEAD = what the grants expiring sooner can still cover; a grant is drawn
+# only for the cost they leave over.
+DRAW_SQL = f"""
+    INSERT INTO {_ENTRIES} (PHASE, GRANT_ID, CUSTOMER_ID, CURRENCY, ENTRY_TYPE, AMOUNT)
+    WITH open_grants AS (
+        SELECT g.GRANT_ID, g.CUSTOMER_ID, g.CURRENCY, g.REMAINING_AMOUNT,
+               COALESCE(SUM(g.REMAINING_AMOUNT) OVER (
+                   PARTITION BY g.CUSTOMER_ID, g.CURRENCY
+                   ORDER BY g.EXPIRES_DATE, g.GRANTED_DATE, g.GRANT_ID
+                   ROWS BETWEEN UNBOUNDED PRECEDING AND 1 PRECEDING), 0) AS AHEAD
+        FROM {GRANTS_TABLE} g
+        LEFT JOIN {BALANCES_TABLE} b ON b.CUSTOMER_ID = g.CUSTOMER_ID AND b.CURRENCY = g.CURRENCY
+        WHERE g.POSTED_DATE IS NOT NULL AND g.EXPIRES_DATE >= %(day)s AND g.REMAINING_AMOUNT > 0
+          AND COALESCE(b.LAST_ENTRY_DATE, %(day)s) <= %(day)s
+    ),
+    day_cost AS (
+        SELECT c.CUSTOMER_ID, f.CURRENCY, SUM(f.COST_AMOUNT) AS COST
+        FROM NIMBUSBILL.GOLD.FACT_CUSTOMER_DAILY_USAGE f
+        JOIN NIMBUSBILL.GOLD.DIM_CUSTOMER c ON c.CUSTOMER_SK = f.CUSTOMER_SK
+        WHERE f.DATE_ID = %(day)s
+          AND c.CUSTOMER_ID IN (SELECT CUSTOMER_ID FROM open_grants)
+        GROUP BY c.CUSTOMER_ID, f.CURRENCY
+    )
+    SELECT {_DRAW}, g.GRANT_ID, g.CUSTOMER_ID, g.CURRENCY, 'drawdown', -LEAST(g.REMAINING_AMOUNT, k.COST - g.AHEAD)
+    FROM open_grants g
+    JOIN day_cost k ON k.CUSTOMER_ID = g.CUSTOMER_ID AND k.CURRENCY = g.CURRENCY
+    WHERE k.COST > g.AHEAD
+"""
+
+APPLY_SQL = f"""
+    MERGE INTO {GRANTS_TABLE} g
+    USING (
+        SELECT GRANT_ID, SUM(AMOUNT) AS DELTA, MAX(IFF(ENTRY_TYPE = 'grant', 1, 0)) AS POSTED
+        FROM {_ENTRIES}
+        WHERE PHASE = %(phase)s
+        GROUP BY GRANT_ID
+    ) e
+    ON g.GRANT_ID = e.GRANT_ID
+    WHEN MATCHED THEN UPDATE SET
+        g.REMAINING_AMOUNT = g.REMAINING_AMOUNT + e.DELTA,
+        g.POSTED_DATE = IFF(e.POSTED = 1, %(day)s::DATE, g.POSTED_DATE),
+        g.UPDATED_TS = CURRENT_TIMESTAMP()
+"""
+
+LEDGER_SQL = f"""
+    INSERT INTO {LEDGER_TABLE}
+        (ENTRY_ID, DATE_ID, CUSTOMER_ID, CURRENCY, GRANT_ID, ENTRY_TYPE, AMOUNT, BATCH_ID, CREATED_TS)
+    SELECT UUID_STRING(), %(day)s::DATE, CUSTOMER_ID, CURRENCY, GRANT_ID, ENTRY_TYPE, AMOUNT,
+           %(run_id)s, CURRENT_TIMESTAMP()
+    FROM {_ENTRIES}
+"""
+
+BALANCE_SQL = f"""
+    MERGE INTO {BALANCES_TABLE} b
+    USING (
+        SELECT CUSTOMER_ID, CURRENCY, SUM(AMOUNT) AS DELTA
+        FROM {_ENTRIES}
+        GROUP BY CUSTOMER_ID, CURRENCY
+    ) e
+    ON b.CUSTOMER_ID = e.CUSTOMER_ID AND b.CURRENCY = e.CURRENCY
+    WHEN MATCHED THEN UPDATE SET
+        b.BALANCE = b.BALANCE + e.DELTA,
+        b.LAST_ENTRY_DATE = GREATEST(b.LAST_ENTRY_DATE, %(day)s::DATE),
+        b.UPDATED_TS = CURRENT_TIMESTAMP()
+    WHEN NOT MATCHED THEN INSERT (CUSTOMER_ID, CURRENCY, BALANCE, LAST_ENTRY_DATE, UPDATED_TS)
+        VALUES (e.CUSTOMER_ID, e.CURRENCY, e.DELTA, %(day)s::DATE, CURRENT_TIMESTAMP())
+"""
+
+SUMMARY_SQL = f"""
+    SELECT COUNT_IF(ENTRY_TYPE = 'grant'), COUNT_IF(ENTRY_TYPE = 'expiration'),
+           COUNT_IF(ENTRY_TYPE = 'drawdown'), COUNT_IF(ENTRY_TYPE = 'reversal'),
+           COALESCE(-SUM(IFF(ENTRY_TYPE IN ('drawdown', 'reversal'), AMOUNT, 0)), 0),
+           COUNT(DISTINCT CUSTOMER_ID)
+    FROM {_ENTRIES}
+"""
+
+
+def apply_drawdown(cursor, day: date, run_id: str) -> DrawdownRun:
+    """Post due grants and expirations, then draw `day`'s Gold cost from the open grants."""
+    t0 = time.perf_counter()
+    params = {"day": str(day)}
+    cursor.execute(ENTRIES_DDL)
+
+    cursor.execute("BEGIN")
+    try:
+        cursor.execute(REVERSE_SQL, params)
+        cursor.execute(POST_SQL, params)
+        cursor.execute(APPLY_SQL, {**params, "phase": _POST})
+        cursor.execute(EXPIRE_SQL, params)
+        cursor.execute(APPLY_SQL, {**params, "phase": _EXPIRE})
+        cursor.execute(DRAW_SQL, params)
+        cursor.execute(APPLY_SQL, {**params, "phase": _DRAW})
+        cursor.execute(LEDGER_SQL, {**params, "run_id": run_id})
+        cursor.execute(BALANCE_SQL, params)
+        cursor.execute("COMMIT")
+    except Exception:
+        cursor.execute("ROLLBACK")
+        raise
+
+    cursor.execute(SUMMARY_SQL)
+    posted, expired, drawdowns, reversals, drawn, customers = (v or 0 for v in cursor.fetchone())
+    return DrawdownRun(day, int(posted), int(expired), int(drawdowns), int(reversals), float(drawn),
+                       int(customers), int((time.perf_counter() - t0) * 1000))
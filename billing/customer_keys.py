@@ -0,0 +1,192 @@
+"""
+customer_keys.py
+
+In-process CUSTOMER_ID <-> CUSTOMER_SK map for the API.
+
+DIM_CUSTOMER is SCD2, so one public ID owns every surrogate key it has ever
+had and facts reference the version in effect on their date. Resolving the
+full key set once lets fact queries filter on CUSTOMER_SK directly (and prune
+on the clustering key) instead of joining DIM_CUSTOMER on every request.
+
+The map is a bounded LRU, warmed with the most recently changed customers.
+New versions always get new autoincrement keys, so (row count, max key) of
+DIM_CUSTOMER changes whenever any ID's key set does; that pair is probed at
+most every `refresh_seconds`. When it moves, only the rows above the last
+max key are read and appended to the cached key sets, so a request never
+waits on a full rebuild. If rows disappeared instead (the count fell short),
+the map is emptied and refills from misses.
+"""
+from __future__ import annotations
+
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Callable
+
+DIM_CUSTOMER = "NIMBUSBILL.GOLD.DIM_CUSTOMER"
+
+_VERSION_SQL = f"SELECT COUNT(*) AS ROW_COUNT, MAX(CUSTOMER_SK) AS MAX_SK FROM {DIM_CUSTOMER}"
+
+_WARM_SQL = f"""
+    SELECT CUSTOMER_ID, LISTAGG(CUSTOMER_SK, ',') WITHIN GROUP (ORDER BY CUSTOMER_SK) AS SKS
+    FROM {DIM_CUSTOMER}
+    GROUP BY CUSTOMER_ID
+    ORDER BY MAX(CUSTOMER_SK) DESC
+    LIMIT %(n)s
+"""
+
+_NEW_KEYS_SQL = f"""
+    SELECT CUSTOMER_ID, CUSTOMER_SK
+    FROM {DIM_CUSTOMER}
+    WHERE CUSTOMER_SK > %(sk)s
+    ORDER BY CUSTOMER_SK
+"""
+
+_BY_ID_SQL = f"SELECT CUSTOMER_SK FROM {DIM_CUSTOMER} WHERE CUSTOMER_ID = %(cid)s ORDER BY CUSTOMER_SK"
+
+_BY_SK_SQL = f"SELECT CUSTOMER_ID FROM {DIM_CUSTOMER} WHERE CUSTOMER_SK = %(sk)s"
+
+
+@dataclass
+class KeyMapStats:
+    hits: int = 0
+    misses: int = 0
+    evictions: int = 0
+    refreshes: int = 0
+
+
+class CustomerKeyMap:
+    """Bounded LRU of customer ID -> all of its surrogate keys, plus the reverse.
+
+    `fetch` is the API's `query(sql, params) -> list[dict]` (lower-cased keys).
+    Unknown IDs are cached as an empty tuple until the next dimension change.
+    """
+
+    def __init__(self, fetch: Callable[..., list[dict]], capacity: int = 100_000,
+                 refresh_seconds: float = 60.0, clock: Callable[[], float] = time.monotonic):
+        if capacity < 1:
+            raise ValueError("capacity must be positive")
+        self.fetch = fetch
+        self.capacity = capacity
+        self.refresh_seconds = refresh_seconds
+        self.clock = clock
+        self.stats = KeyMapStats()
+        self._by_id: OrderedDict[str, tuple[int, ...]] = OrderedDict()
+        self._by_sk: dict[int, str] = {}
+        self._version: tuple | None = None
+        self._checked_at: float | None = None
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._by_id)
+
+    # ── Loading ────────────────────────────────────────────────────────────
+
+    def _probe_version(self) -> tuple:
+        rows = self.fetch(_VERSION_SQL)
+        row = rows[0] if rows else {}
+        return (row.get("row_count"), row.get("max_sk"))
+
+    def warm(self) -> int:
+        """Reload the map with the `capacity` most recently changed customers."""
+        version = self._probe_version()
+        rows = self.fetch(_WARM_SQL, {"n": self.capacity})
+        with self._lock:
+            self._by_id.clear()
+            self._by_sk.clear()
+            # Most recent first in the result; insert oldest first so they evict first.
+            for row in reversed(rows):
+                sks = tuple(int(s) for s in str(row["sks"]).split(",") if s)
+                self._put(row["customer_id"], sks)
+            self._version = version
+            self._checked_at = self.clock()
+            self.stats.refreshes += 1
+            return len(self._by_id)
+
+    def maybe_refresh(self) -> bool:
+        """Catch up with DIM_CUSTOMER if it changed; probes at most every refresh_seconds."""
+        now = self.clock()
+        with self._lock:
+            if self._checked_at is not None and now - self._checked_at < self.refresh_seconds:
+                return False
+            self._checked_at = now
+        version = self._probe_version()
+        if version == self._version:
+            return False
+        if self._version is None:
+            self.warm()
+        else:
+            self._top_up(version)
+        return True
+
+    def _top_up(self, version: tuple):
+        """Append keys added since the last version to the IDs already cached."""
+        count, max_sk = self._version
+        rows = self.fetch(_NEW_KEYS_SQL, {"sk": max_sk or 0})
+        added: dict[str, list[int]] = {}
+        for row in rows:
+            added.setdefault(row["customer_id"], []).append(int(row["customer_sk"]))
+        with self._lock:
+            if (count or 0) + len(rows) != version[0]:
+                # Rows were removed, not just added: start over lazily.
+                self._by_id.clear()
+                self._by_sk.clear()
+            else:
+                for customer_id, sks in added.items():
+                    # Uncached IDs may have older keys too; they load in full on a miss.
+                    cached = self._by_id.get(customer_id)
+                    if cached is not None:
+                        self._put(customer_id, tuple(sorted(set(cached).union(sks))))
+            self._version = version
+            self.stats.refreshes += 1
+
+    # ── Lookups ────────────────────────────────────────────────────────────
+
+    def _put(self, customer_id: str, sks: tuple[int, ...]):
+        # Caller holds the lock.
+        if customer_id in self._by_id:
+            self._by_id.move_to_end(customer_id)
+        self._by_id[customer_id] = sks
+        for sk in sks:
+            self._by_sk[sk] = customer_id
+        while len(self._by_id) > self.capacity:
+            _, evicted = self._by_id.popitem(last=False)
+            for sk in evicted:
+                self._by_sk.pop(sk, None)
+            self.stats.evictions += 1
+
+    def sks(self, customer_id: str) -> tuple[int, ...]:
+        """Every CUSTOMER_SK the customer has had; empty if the ID is unknown."""
+        self.maybe_refresh()
+        with self._lock:
+            cached = self._by_id.get(customer_id)
+            if cached is not None:
+                self._by_id.move_to_end(customer_id)
+                self.stats.hits += 1
+                return cached
+            self.stats.misses += 1
+        return self._load(customer_id)
+
+    def _load(self, customer_id: str) -> tuple[int, ...]:
+        sks = tuple(int(r["customer_sk"]) for r in self.fetch(_BY_ID_SQL, {"cid": customer_id}))
+        with self._lock:
+            self._put(customer_id, sks)
+        return sks
+
+    def customer_id(self, sk: int) -> str | None:
+        """The public ID that owns `sk`, or None if no such key exists."""
+        self.maybe_refresh()
+        with self._lock:
+            cached = self._by_sk.get(sk)
+            if cached is not None:
+                self._by_id.move_to_end(cached)
+                self.stats.hits += 1
+                return cached
+            self.stats.misses += 1
+        rows = self.fetch(_BY_SK_SQL, {"sk": sk})
+        if not rows:
+            return None
+        customer_id = rows[0]["customer_id"]
+        self._load(customer_id)
+        return customer_id
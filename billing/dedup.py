@@ -0,0 +1,491 @@
+"""
+dedup.py
+
+Rolling-window duplicate pre-filter for usage-event ingestion.
+
+Recently seen EVENT_IDs are kept in one register-blocked Bloom filter per
+event date (all k probe bits of a key live in one 64-bit word, so an insert
+or lookup touches a single word and vectorizes in numpy). Before Silver, each
+row of a batch is probed against every shard in the window, not just its own
+date's: a redelivered event may carry a different event date than its
+original, and the EVENT_ID MERGE it would skip matches across all dates.
+Rows no shard knows, that are unique within the batch, and whose date is
+inside the rolling window are definitely new and are appended to
+USAGE_EVENTS_CLEAN directly. Only the remaining candidates go through the
+EVENT_ID MERGE.
+
+The window ends at the run date the caller passes in, never at a date read
+from the batch: a single event stamped years ahead must not expire every
+shard. Rows dated after the run date are always candidates.
+
+Shards are files on an OPS stage with metadata in OPS.EVENT_ID_FILTER_SHARDS.
+The filter is synced from USAGE_EVENTS_CLEAN by LOAD_TS watermark (recorded
+in OPS.PIPELINE_CHECKPOINTS) right before every probe, so IDs written by any
+path (pipeline, backfill, quarantine replay) are covered. Until the first
+sync exists, nothing is treated as new.
+"""
+from __future__ import annotations
+
+import hashlib
+import math
+import os
+import struct
+import time
+from dataclasses import dataclass, field
+from datetime import date, timedelta
+from typing import Callable
+
+import numpy as np
+
+STAGE = "@NIMBUSBILL.OPS.EVENT_ID_FILTER_STAGE"
+SHARDS_TABLE = "NIMBUSBILL.OPS.EVENT_ID_FILTER_SHARDS"
+BATCHES_TABLE = "NIMBUSBILL.OPS.DEDUP_BATCHES"
+CANDIDATES_TABLE = "NIMBUSBILL.OPS.DEDUP_CANDIDATES"
+CHECKPOINT_NAME = "event_id_filter"
+
+DEFAULT_WINDOW_DAYS = 35
+DEFAULT_FPR = 0.01
+DEFAULT_MIN_CAPACITY = 100_000
+
+# Re-read a little before the watermark so writes that committed late with
+# an earlier LOAD_TS are not missed; re-adding a key leaves the bits unchanged.
+_WATERMARK_OVERLAP = timedelta(hours=1)
+
+_MAGIC = b"NBBF1"
+_HEADER = struct.Struct("<5sBQQ")  # magic, num_hashes, num_words, item_count
+_ONE = np.uint64(1)
+_SIX = np.uint64(6)
+_LOW6 = np.uint64(63)
+
+
+def blocked_fpr(bits_per_key: float, num_hashes: int) -> float:
+    """Expected false-positive rate of a 64-bit register-blocked Bloom filter."""
+    lam = 64.0 / bits_per_key  # keys per word ~ Poisson(lam)
+    j = np.arange(int(lam + 12 * math.sqrt(lam) + 20))
+    log_p = -lam + j * math.log(lam) - np.array([math.lgamma(x + 1) for x in j])
+    return float((np.exp(log_p) * (1 - (1 - 1 / 64) ** (num_hashes * j)) ** num_hashes).sum())
+
+
+def size_for(capacity: int, fpr: float) -> tuple[int, int]:
+    """(num_words, num_hashes) for `capacity` keys at or below the target FPR."""
+    for tenths in range(40, 641):
+        bpk = tenths / 10
+        k = min(range(1, 11), key=lambda k: blocked_fpr(bpk, k))
+        if blocked_fpr(bpk, k) <= fpr:
+            return max(1, math.ceil(capacity * bpk / 64)), k
+    raise ValueError(f"Target FPR {fpr} is below what a 64-bit blocked filter can reach")
+
+
+def hash_ids(event_ids) -> tuple[np.ndarray, np.ndarray]:
+    """Two independent 64-bit hashes per ID: one picks the word, one the bits."""
+    digest = b"".join(hashlib.blake2b(str(e).encode(), digest_size=16).digest() for e in event_ids)
+    h = np.frombuffer(digest, dtype=np.uint64).reshape(-1, 2)
+    return h[:, 0], h[:, 1]
+
+
+def _popcount(words: np.ndarray) -> np.ndarray:
+    if hasattr(np, "bitwise_count"):
+        return np.bitwise_count(words)
+    return np.unpackbits(words.view(np.uint8)).reshape(-1, 64).sum(axis=1)
+
+
+class BlockedBloomFilter:
+    """Bloom filter whose k bits per key all fall in one 64-bit word."""
+
+    def __init__(self, words: np.ndarray, num_hashes: int, item_count: int = 0):
+        if not 1 <= num_hashes <= 10:
+            raise ValueError("num_hashes must be between 1 and 10")
+        self.words = words
+        self.num_hashes = num_hashes
+        self.item_count = item_count
+
+    @classmethod
+    def for_capacity(cls, capacity: int, fpr: float = DEFAULT_FPR) -> "BlockedBloomFilter":
+        num_words, k = size_for(capacity, fpr)
+        return cls(np.zeros(num_words, dtype=np.uint64), k)
+
+    @property
+    def nbytes(self) -> int:
+        return self.words.nbytes
+
+    def _locate(self, h1: np.ndarray, h2: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        idx = (h1 % np.uint64(len(self.words))).astype(np.int64)
+        mask = np.zeros(h2.shape, dtype=np.uint64)
+        for i in range(self.num_hashes):
+            mask |= _ONE << ((h2 >> (_SIX * np.uint64(i))) & _LOW6)
+        return idx, mask
+
+    def add(self, h1: np.ndarray, h2: np.ndarray):
+        if not len(h1):
+            return
+        idx, mask = self._locate(h1, h2)
+        np.bitwise_or.at(self.words, idx, mask)
+        self.item_count += len(h1)
+
+    def contains(self, h1: np.ndarray, h2: np.ndarray) -> np.ndarray:
+        idx, mask = self._locate(h1, h2)
+        return (self.words[idx] & mask) == mask
+
+    def estimated_fpr(self) -> float:
+        """Probability that an unseen key hits, given the bits actually set."""
+        if not len(self.words):
+            return 1.0
+        return float(((_popcount(self.words) / 64.0) ** self.num_hashes).mean())
+
+    def to_bytes(self) -> bytes:
+        return _HEADER.pack(_MAGIC, self.num_hashes, len(self.words), self.item_count) + self.words.tobytes()
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> "BlockedBloomFilter":
+        magic, k, num_words, items = _HEADER.unpack_from(data)
+        if magic != _MAGIC:
+            raise ValueError("Not an event-id filter shard")
+        words = np.frombuffer(data, dtype=np.uint64, count=num_words, offset=_HEADER.size).copy()
+        return cls(words, k, items)
+
+
+@dataclass
+class PrefilterResult:
+    """Per-row routing decision for one ingestion batch."""
+    candidates: np.ndarray          # True = possibly duplicate, route through MERGE
+    filter_hits: int = 0
+    in_batch_duplicates: int = 0
+    out_of_window: int = 0
+    shards_probed: int = 0
+    estimated_fpr: float = 0.0
+    probe_ms: int = 0
+
+    @property
+    def new_rows(self) -> int:
+        return int((~self.candidates).sum())
+
+
+@dataclass
+class EventIdFilter:
+    """Rolling window of per-event-date Bloom shards.
+
+    A row is probed against every shard from the window start on, so an ID
+    stored under any date in the window is found whatever date the row
+    carries. Shards are sized so that the combined false-positive rate over
+    those `window_days + 1` probes stays at `fpr`.
+
+    `loader(day)` fetches a persisted shard on first use, so only the dates a
+    batch touches are ever read. `persisted` lists the dates stored so far,
+    so shards dated after the window end are still probed.
+    """
+    window_days: int = DEFAULT_WINDOW_DAYS
+    fpr: float = DEFAULT_FPR
+    min_capacity: int = DEFAULT_MIN_CAPACITY
+    shards: dict[date, BlockedBloomFilter] = field(default_factory=dict)
+    loader: Callable[[date], BlockedBloomFilter | None] | None = None
+    persisted: set[date] = field(default_factory=set)
+    _missing: set[date] = field(default_factory=set, repr=False)
+
+    @property
+    def shard_fpr(self) -> float:
+        return 1.0 - (1.0 - self.fpr) ** (1.0 / (self.window_days + 1))
+
+    def window_start(self, as_of: date) -> date:
+        return as_of - timedelta(days=self.window_days)
+
+    def shard_dates(self, start: date, last: date) -> list[date]:
+        """Dates from `start` through `last`, plus any later shard held or persisted."""
+        days = [start + timedelta(days=i) for i in range((last - start).days + 1)]
+        return days + sorted(d for d in set(self.shards) | self.persisted if d > last)
+
+    def shard(self, day: date) -> BlockedBloomFilter | None:
+        if day not in self.shards and day not in self._missing and self.loader is not None:
+            loaded = self.loader(day)
+            if loaded is None:
+                self._missing.add(day)
+            else:
+                self.shards[day] = loaded
+        return self.shards.get(day)
+
+    def _new_shard(self, items: int) -> BlockedBloomFilter:
+        return BlockedBloomFilter.for_capacity(max(self.min_capacity, 2 * items), self.shard_fpr)
+
+    def add(self, event_ids, event_dates) -> set[date]:
+        """Record IDs under their event dates; returns dates whose shard is overfilled."""
+        overfilled = set()
+        for day, ids in _group_by_date(event_ids, event_dates).items():
+            shard = self.shard(day)
+            if shard is None:
+                shard = self.shards[day] = self._new_shard(len(ids))
+                self._missing.discard(day)
+            shard.add(*hash_ids(ids))
+            if shard.estimated_fpr() > 2 * self.shard_fpr:
+                overfilled.add(day)
+        return overfilled
+
+    def presize(self, counts: dict[date, int]):
+        """Create empty shards sized for known per-date counts (first build)."""
+        for day, items in counts.items():
+            if self.shard(day) is None:
+                self.shards[day] = self._new_shard(items)
+                self._missing.discard(day)
+
+    def rebuild(self, day: date, event_ids):
+        """Replace one shard with a fresh one sized for `event_ids`."""
+        shard = self._new_shard(len(event_ids))
+        shard.add(*hash_ids(event_ids))
+        self.shards[day] = shard
+
+    def expire(self, as_of: date) -> list[date]:
+        start = self.window_start(as_of)
+        old = [d for d in self.shards if d < start]
+        for d in old:
+            del self.shards[d]
+        return old
+
+    def probe(self, event_ids: list, event_dates: list, as_of: date) -> PrefilterResult:
+        """Flag rows that may already exist; everything else is definitely new.
+
+        A row is a candidate if any shard in the window may hold its ID, if
+        its ID repeats within the batch, or if its date (None = unparseable)
+        is outside the window: older, since its original could sit in an
+        expired shard, or after `as_of`, which the filter does not cover.
+        """
+        t0 = time.perf_counter()
+        n = len(event_ids)
+        start = self.window_start(as_of)
+        h1, h2 = hash_ids(event_ids)
+        day_num = np.fromiter((d.toordinal() if d is not None else -1 for d in event_dates),
+                              dtype=np.int64, count=n)
+        stale = (day_num < start.toordinal()) | (day_num > as_of.toordinal())
+
+        hits = np.zeros(n, dtype=bool)
+        miss = 1.0
+        probed = set()
+        rows = np.flatnonzero(~stale)
+        if len(rows):
+            for day in self.shard_dates(start, as_of):
+                shard = self.shard(day)
+                if shard is None:
+                    continue
+                hits[rows] |= shard.contains(h1[rows], h2[rows])
+                miss *= 1.0 - shard.estimated_fpr()
+                probed.add(day)
+
+        _, inverse, counts = np.unique(np.asarray(event_ids, dtype=object).astype(str),
+                                       return_inverse=True, return_counts=True)
+        repeated = counts[inverse] > 1
+
+        return PrefilterResult(
+            candidates=hits | repeated | stale,
+            filter_hits=int(hits.sum()),
+            in_batch_duplicates=int(repeated.sum()),
+            out_of_window=int(stale.sum()),
+            shards_probed=len(probed),
+            estimated_fpr=float(1.0 - miss) if len(rows) else 0.0,
+            probe_ms=int((time.perf_counter() - t0) * 1000),
+        )
+
+    @property
+    def nbytes(self) -> int:
+        return sum(s.nbytes for s in self.shards.values())
+
+
+def _group_by_date(event_ids, event_dates) -> dict[date, list]:
+    groups: dict[date, list] = {}
+    for eid, day in zip(event_ids, event_dates):
+        if day is not None:
+            groups.setdefault(day, []).append(eid)
+    return groups
+
+
+def event_date(event: dict) -> date | None:
+    """EVENT_DATE as Silver derives it, or None if the timestamp won't parse."""
+    try:
+        return date.fromisoformat(str(event.get("event_timestamp"))[:10])
+    except ValueError:
+        return None
+
+
+# ── Warehouse persistence ────────────────────────────────────────────────
+
+def _shard_file(day: date) -> str:
+    return f"shard_{day.isoformat()}.bloom"
+
+
+def open_filter(cursor, workdir: str, **kwargs) -> tuple[EventIdFilter, object]:
+    """Filter backed by the OPS stage; returns (filter, LOAD_TS watermark or None).
+
+    A None watermark means the filter has never been built.
+    """
+    cursor.execute(
+        "SELECT LAST_INGEST_TS FROM NIMBUSBILL.OPS.PIPELINE_CHECKPOINTS WHERE PIPELINE_NAME = %(name)s",
+        {"name": CHECKPOINT_NAME},
+    )
+    row = cursor.fetchone()
+    watermark = row[0] if row else None
+    cursor.execute(f"SELECT SHARD_DATE FROM {SHARDS_TABLE}")
+    stored = {r[0] for r in cursor.fetchall()}
+
+    def load(day: date) -> BlockedBloomFilter | None:
+        if day not in stored:
+            return None
+        cursor.execute(f"GET {STAGE}/{_shard_file(day)} file://{workdir}/")
+        with open(os.path.join(workdir, _shard_file(day)), "rb") as f:
+            return BlockedBloomFilter.from_bytes(f.read())
+
+    return EventIdFilter(loader=load, persisted=stored, **kwargs), watermark
+
+
+def sync_filter(cursor, flt: EventIdFilter, watermark, as_of: date, chunk_size: int = 500_000):
+    """Add IDs loaded into USAGE_EVENTS_CLEAN since `watermark`; returns (watermark, changed dates)."""
+    start = flt.window_start(as_of)
+    where = "EVENT_DATE >= %(start)s"
+    params = {"start": start}
+    if watermark is not None:
+        where += " AND LOAD_TS > %(since)s"
+        params["since"] = watermark - _WATERMARK_OVERLAP
+    else:
+        cursor.execute(
+            f"SELECT EVENT_DATE, COUNT(*) FROM NIMBUSBILL.SILVER.USAGE_EVENTS_CLEAN WHERE {where} GROUP BY 1",
+            params,
+        )
+        flt.presize(dict(cursor.fetchall()))
+    cursor.execute(
+        f"SELECT EVENT_ID, EVENT_DATE, LOAD_TS FROM NIMBUSBILL.SILVER.USAGE_EVENTS_CLEAN WHERE {where}",
+        params,
+    )
+    changed: set[date] = set()
+    overfilled: set[date] = set()
+    latest = None
+    while True:
+        rows = cursor.fetchmany(chunk_size)
+        if not rows:
+            break
+        overfilled |= flt.add([r[0] for r in rows], [r[1] for r in rows])
+        changed.update(r[1] for r in rows)
+        batch_max = max(r[2] for r in rows)
+        latest = batch_max if latest is None else max(latest, batch_max)
+
+    # Every row probes every shard, so a shard persisted under a looser
+    # per-shard target than the current one is rebuilt too.
+    for day in flt.shard_dates(start, as_of):
+        shard = flt.shard(day)
+        if shard is not None and shard.estimated_fpr() > 2 * flt.shard_fpr:
+            overfilled.add(day)
+    for day in sorted(overfilled):
+        cursor.execute(
+            "SELECT EVENT_ID FROM NIMBUSBILL.SILVER.USAGE_EVENTS_CLEAN WHERE EVENT_DATE = %(day)s",
+            {"day": day},
+        )
+        flt.rebuild(day, [r[0] for r in cursor.fetchall()])
+    changed |= overfilled
+
+    if latest is not None:
+        watermark = latest if watermark is None else max(watermark, latest)
+    elif watermark is None:
+        # Nothing in the window yet: still mark the filter as built.
+        cursor.execute("SELECT COALESCE(MAX(LOAD_TS), '1970-01-01'::TIMESTAMP_NTZ) "
+                       "FROM NIMBUSBILL.SILVER.USAGE_EVENTS_CLEAN")
+        watermark = cursor.fetchone()[0]
+    return watermark, changed
+
+
+def save_filter(cursor, flt: EventIdFilter, changed: set[date], as_of: date, watermark, workdir: str):
+    """Upload changed shards, drop shards older than the window and advance the watermark."""
+    for day in sorted(changed):
+        shard = flt.shards.get(day)
+        if shard is None:
+            continue
+        path = os.path.join(workdir, _shard_file(day))
+        with open(path, "wb") as f:
+            f.write(shard.to_bytes())
+        cursor.execute(f"PUT file://{path} {STAGE}/ AUTO_COMPRESS=FALSE OVERWRITE=TRUE")
+        cursor.execute(
+            f"""
+            MERGE INTO {SHARDS_TABLE} t
+            USING (SELECT %(day)s::DATE AS SHARD_DATE) s ON t.SHARD_DATE = s.SHARD_DATE
+            WHEN MATCHED THEN UPDATE SET
+                FILE_NAME = %(file)s, NUM_WORDS = %(words)s, NUM_HASHES = %(k)s,
+                ITEM_COUNT = %(items)s, EST_FPR = %(fpr)s, UPDATED_TS = CURRENT_TIMESTAMP()
+            WHEN NOT MATCHED THEN INSERT
+                (SHARD_DATE, FILE_NAME, NUM_WORDS, NUM_HASHES, ITEM_COUNT, EST_FPR, UPDATED_TS)
+                VALUES (s.SHARD_DATE, %(file)s, %(words)s, %(k)s, %(items)s, %(fpr)s, CURRENT_TIMESTAMP())
+            """,
+            {"day": day, "file": _shard_file(day), "words": len(shard.words), "k": shard.num_hashes,
+             "items": shard.item_count, "fpr": shard.estimated_fpr()},
+        )
+
+    start = flt.window_start(as_of)
+    cursor.execute(f"SELECT SHARD_DATE FROM {SHARDS_TABLE} WHERE SHARD_DATE < %(start)s", {"start": start})
+    for (day,) in cursor.fetchall():
+        cursor.execute(f"REMOVE {STAGE}/{_shard_file(day)}")
+    cursor.execute(f"DELETE FROM {SHARDS_TABLE} WHERE SHARD_DATE < %(start)s", {"start": start})
+    flt.expire(as_of)
+
+    cursor.execute(
+        """
+        MERGE INTO NIMBUSBILL.OPS.PIPELINE_CHECKPOINTS t
+        USING (SELECT %(name)s AS PIPELINE_NAME) s ON t.PIPELINE_NAME = s.PIPELINE_NAME
+        WHEN MATCHED THEN UPDATE SET LAST_INGEST_TS = %(wm)s, UPDATED_TS = CURRENT_TIMESTAMP()
+        WHEN NOT MATCHED THEN INSERT (PIPELINE_NAME, LAST_INGEST_TS, UPDATED_TS)
+            VALUES (s.PIPELINE_NAME, %(wm)s, CURRENT_TIMESTAMP())
+        """,
+        {"name": CHECKPOINT_NAME, "wm": watermark},
+    )
+
+
+def register_batch(cursor, batch_id: str, event_ids: list, result: PrefilterResult,
+                   sync_ms: int, filter_bytes: int, chunk_size: int = 10_000) -> bool:
+    """Record the routing decision the Silver stage will apply.
+
+    Returns False (and records nothing) if Silver already consumed this
+    batch: a re-ingested batch must then go entirely through the MERGE.
+    """
+    cursor.execute(f"SELECT CONSUMED_TS FROM {BATCHES_TABLE} WHERE BATCH_ID = %(b)s", {"b": batch_id})
+    row = cursor.fetchone()
+    if row and row[0] is not None:
+        return False
+
+    # The batch row is written last: its presence implies a complete candidate list.
+    cursor.execute(f"DELETE FROM {BATCHES_TABLE} WHERE BATCH_ID = %(b)s", {"b": batch_id})
+    cursor.execute(f"DELETE FROM {CANDIDATES_TABLE} WHERE BATCH_ID = %(b)s", {"b": batch_id})
+    candidates = sorted({str(e) for e, c in zip(event_ids, result.candidates) if c and e is not None})
+    for i in range(0, len(candidates), chunk_size):
+        chunk = candidates[i:i + chunk_size]
+        values = ", ".join(f"(%(b)s, %(e{j})s)" for j in range(len(chunk)))
+        params = {"b": batch_id, **{f"e{j}": e for j, e in enumerate(chunk)}}
+        cursor.execute(f"INSERT INTO {CANDIDATES_TABLE} (BATCH_ID, EVENT_ID) VALUES {values}", params)
+
+    cursor.execute(
+        f"""
+        INSERT INTO {BATCHES_TABLE}
+            (BATCH_ID, EVENTS_PROBED, FILTER_HITS, IN_BATCH_DUPLICATES, OUT_OF_WINDOW, CANDIDATES,
+             SHARDS_PROBED, FILTER_BYTES, EST_FPR, PROBE_MS, SYNC_MS, CREATED_TS)
+        VALUES (%(b)s, %(n)s, %(hits)s, %(dups)s, %(stale)s, %(cand)s,
+                %(shards)s, %(bytes)s, %(fpr)s, %(probe)s, %(sync)s, CURRENT_TIMESTAMP())
+        """,
+        {"b": batch_id, "n": len(event_ids), "hits": result.filter_hits,
+         "dups": result.in_batch_duplicates, "stale": result.out_of_window,
+         "cand": len(candidates), "shards": result.shards_probed, "bytes": filter_bytes,
+         "fpr": result.estimated_fpr, "probe": result.probe_ms, "sync": sync_ms},
+    )
+    return True
+
+
+def prefilter_batch(cursor, batch_id: str, events: list[dict], workdir: str,
+                    as_of: date, **kwargs) -> PrefilterResult | None:
+    """Sync the filter, probe a batch of raw events and record its routing.
+
+    `as_of` is the run date; it ends the window and drives shard expiry.
+    Returns None when the batch cannot be prefiltered (already consumed).
+    """
+    ids = [e.get("event_id") for e in events]
+    days = [event_date(e) for e in events]
+
+    t0 = time.perf_counter()
+    flt, watermark = open_filter(cursor, workdir, **kwargs)
+    watermark, changed = sync_filter(cursor, flt, watermark, as_of)
+    save_filter(cursor, flt, changed, as_of, watermark, workdir)
+    sync_ms = int((time.perf_counter() - t0) * 1000)
+
+    result = flt.probe(["" if e is None else e for e in ids], days, as_of)
+    result.candidates |= np.fromiter((e is None for e in ids), dtype=bool, count=len(ids))
+    if not register_batch(cursor, batch_id, ids, result, sync_ms, flt.nbytes):
+        return None
+    return result
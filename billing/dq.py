@@ -0,0 +1,286 @@
+"""
+dq.py
+
+Single-pass data-quality engine.
+
+Checks are declared as row-level predicates (TRUE = failing row) against a
+named source relation. All checks on a source are fused into one query that
+scans only the partitions touched by the current batch (lookups such as the
+cross-date EVENT_ID probe read one column beyond them), counts failures per
+check and keeps a few failing rows as samples. Results, timings and samples
+go to OPS.DQ_CHECK_RESULTS; `gate` fails the run on error-severity failures
+so downstream tasks never see bad data.
+"""
+from __future__ import annotations
+
+import json
+import time
+from dataclasses import dataclass, field
+from datetime import date
+
+SEVERITIES = ("error", "warn")
+
+
+class DQGateError(RuntimeError):
+    """Raised when an error-severity check fails."""
+
+
+@dataclass(frozen=True)
+class Source:
+    """A relation checked in one scan.
+
+    `relation` is a FROM clause (joins and scope filter included) with
+    `{dates}` / `{months}` placeholders for the batch's touched partitions.
+    """
+    name: str
+    relation: str
+
+
+@dataclass(frozen=True)
+class Check:
+    name: str
+    source: str
+    condition: str               # TRUE when the row fails; may use window functions
+    severity: str = "error"
+    sample: tuple[str, ...] = ()  # columns captured for failing-row samples
+    description: str = ""
+
+
+@dataclass
+class CheckResult:
+    check: Check
+    rows_scanned: int
+    failed_rows: int
+    duration_ms: int
+    samples: list = field(default_factory=list)
+
+    @property
+    def status(self) -> str:
+        if not self.failed_rows:
+            return "pass"
+        return "fail" if self.check.severity == "error" else "warn"
+
+
+SOURCES = {
+    s.name: s for s in [
+        Source(
+            "silver_events",
+            """
+            FROM NIMBUSBILL.SILVER.USAGE_EVENTS_CLEAN e
+            -- Touched IDs that Silver also holds under another EVENT_DATE
+            LEFT JOIN (
+                SELECT o.EVENT_ID
+                FROM NIMBUSBILL.SILVER.USAGE_EVENTS_CLEAN o
+                WHERE o.EVENT_DATE NOT IN ({dates})
+                  AND o.EVENT_ID IN (
+                      SELECT t.EVENT_ID FROM NIMBUSBILL.SILVER.USAGE_EVENTS_CLEAN t
+                      WHERE t.EVENT_DATE IN ({dates})
+                  )
+                GROUP BY o.EVENT_ID
+            ) elsewhere ON elsewhere.EVENT_ID = e.EVENT_ID
+            WHERE e.EVENT_DATE IN ({dates})
+            """,
+        ),
+        Source(
+            "silver_daily_agg",
+            """
+            FROM NIMBUSBILL.SILVER.USAGE_DAILY_AGG agg
+            LEFT JOIN NIMBUSBILL.GOLD.DIM_CUSTOMER c
+                ON agg.CUSTOMER_ID = c.CUSTOMER_ID
+                AND agg.EVENT_DATE >= c.EFFECTIVE_START::DATE
+                AND agg.EVENT_DATE < COALESCE(c.EFFECTIVE_END::DATE, '9999-12-31')
+            LEFT JOIN NIMBUSBILL.GOLD.DIM_PRICING_RATE p
+                ON agg.PRODUCT_ID = p.PRODUCT_ID
+                AND agg.UNIT = p.UNIT
+                AND p.PLAN_ID = c.PLAN_ID
+                AND agg.EVENT_DATE BETWEEN p.EFFECTIVE_FROM AND COALESCE(p.EFFECTIVE_TO, '9999-12-31')
+            WHERE agg.EVENT_DATE IN ({dates})
+            """,
+        ),
+        Source(
+            "gold_daily_usage",
+            """
+            FROM NIMBUSBILL.GOLD.FACT_CUSTOMER_DAILY_USAGE f
+            WHERE f.DATE_ID IN ({dates})
+            """,
+        ),
+        Source(
+            "gold_invoices",
+            """
+            FROM NIMBUSBILL.GOLD.FACT_INVOICES i
+            LEFT JOIN (
+                SELECT li.INVOICE_ID,
+                       SUM(IFF(li.LINE_TYPE = 'tax', 0, li.AMOUNT)) AS LINE_TOTAL,
+                       SUM(IFF(li.LINE_TYPE = 'tax', li.AMOUNT, 0)) AS TAX_TOTAL
+                FROM NIMBUSBILL.GOLD.FACT_INVOICE_LINE_ITEMS li
+                JOIN NIMBUSBILL.GOLD.FACT_INVOICES si
+                    ON si.INVOICE_ID = li.INVOICE_ID AND si.BILLING_PERIOD_START IN ({months})
+                GROUP BY li.INVOICE_ID
+            ) l ON l.INVOICE_ID = i.INVOICE_ID
+            WHERE i.BILLING_PERIOD_START IN ({months})
+            """,
+        ),
+    ]
+}
+
+CHECKS = [
+    # Rows the dedup pre-filter judged definitely new are appended without the
+    # EVENT_ID MERGE, so a filter miss can duplicate an ID from any earlier
+    # batch and date: compare against all of Silver, not just the touched dates.
+    Check("duplicate_event_id", "silver_events",
+          "COUNT(*) OVER (PARTITION BY e.EVENT_ID) > 1 OR elsewhere.EVENT_ID IS NOT NULL",
+          sample=("e.EVENT_ID", "e.EVENT_DATE", "e.BATCH_ID"),
+          description="EVENT_ID appears more than once in Silver"),
+    Check("negative_quantity", "silver_events",
+          "e.QUANTITY < 0",
+          sample=("e.EVENT_ID", "e.CUSTOMER_ID", "e.QUANTITY"),
+          description="Usage quantity below zero"),
+    Check("missing_required_field", "silver_events",
+          "e.EVENT_TS IS NULL OR e.CUSTOMER_ID IS NULL OR e.PRODUCT_ID IS NULL OR e.UNIT IS NULL",
+          sample=("e.EVENT_ID", "e.CUSTOMER_ID", "e.PRODUCT_ID", "e.UNIT"),
+          description="Required data-contract field is null"),
+    Check("unknown_customer", "silver_daily_agg",
+          "c.CUSTOMER_SK IS NULL",
+          sample=("agg.EVENT_DATE", "agg.CUSTOMER_ID"),
+          description="Usage for a customer with no DIM_CUSTOMER version on that date"),
+    Check("unpriced_usage", "silver_daily_agg",
+          "c.CUSTOMER_SK IS NOT NULL AND p.RATE_SK IS NULL",
+          severity="warn",
+          sample=("agg.EVENT_DATE", "agg.CUSTOMER_ID", "c.PLAN_ID", "agg.PRODUCT_ID", "agg.UNIT"),
+          description="No rate for the customer's plan; row is dropped from Gold"),
+    Check("missing_fx_rate", "gold_daily_usage",
+          "f.COST_AMOUNT IS NOT NULL AND f.REPORTING_COST_AMOUNT IS NULL",
+          sample=("f.DATE_ID", "f.CURRENCY", "f.PRODUCT_ID"),
+          description="No DIM_FX_RATE window for the currency on that date; reporting totals would miss the row"),
+    # Same invariant as the close's integrity check: SUBTOTAL is the non-tax
+    # lines, TAX the tax lines, TOTAL all of them.
+    Check("invoice_subtotal_mismatch", "gold_invoices",
+          "ABS(i.SUBTOTAL - COALESCE(l.LINE_TOTAL, 0)) > 0.01",
+          sample=("i.INVOICE_ID", "i.SUBTOTAL", "l.LINE_TOTAL"),
+          description="Invoice header subtotal differs from its non-tax line items"),
+    Check("invoice_tax_mismatch", "gold_invoices",
+          "ABS(COALESCE(i.TAX, 0) - COALESCE(l.TAX_TOTAL, 0)) > 0.01",
+          sample=("i.INVOICE_ID", "i.TAX", "l.TAX_TOTAL"),
+          description="Invoice header tax differs from its tax lines"),
+    Check("invoice_total_mismatch", "gold_invoices",
+          "ABS(i.TOTAL - COALESCE(l.LINE_TOTAL, 0) - COALESCE(l.TAX_TOTAL, 0)) > 0.01",
+          sample=("i.INVOICE_ID", "i.TOTAL", "l.LINE_TOTAL", "l.TAX_TOTAL"),
+          description="Invoice header total differs from all of its line items"),
+]
+
+RESULTS_TABLE = "NIMBUSBILL.OPS.DQ_CHECK_RESULTS"
+
+
+def _sql_dates(days: list[date]) -> str:
+    return ", ".join(f"'{d.isoformat()}'::DATE" for d in sorted(set(days)))
+
+
+def _sql_months(days: list[date]) -> str:
+    return _sql_dates([d.replace(day=1) for d in days])
+
+
+def render_scan(source: Source, checks: list[Check], days: list[date], sample_size: int = 5) -> str:
+    """One query evaluating every check on `source` over the touched partitions."""
+    relation = source.relation.format(dates=_sql_dates(days), months=_sql_months(days))
+    flags = ",\n            ".join(
+        f"COALESCE({c.condition}, FALSE) AS F{i}" for i, c in enumerate(checks)
+    )
+    samples = ",\n            ".join(
+        "OBJECT_CONSTRUCT({}) AS S{}".format(
+            ", ".join(f"'{col.split('.')[-1]}', {col}" for col in c.sample) or "'row', NULL", i
+        )
+        for i, c in enumerate(checks)
+    )
+    ranks = ",\n        ".join(
+        f"IFF(F{i}, ROW_NUMBER() OVER (PARTITION BY F{i} ORDER BY NULL), NULL) AS R{i}"
+        for i in range(len(checks))
+    )
+    aggs = ",\n    ".join(
+        f"COUNT_IF(F{i}) AS FAILED_{i}, "
+        f"ARRAY_AGG(IFF(R{i} <= {sample_size}, S{i}, NULL)) AS SAMPLE_{i}"
+        for i in range(len(checks))
+    )
+    return f"""
+SELECT
+    COUNT(*) AS ROWS_SCANNED,
+    {aggs}
+FROM (
+    SELECT *,
+        {ranks}
+    FROM (
+        SELECT
+            {flags},
+            {samples}
+        {relation.strip()}
+    )
+)"""
+
+
+def _parse_sample(value) -> list:
+    if value is None:
+        return []
+    if isinstance(value, str):
+        return json.loads(value)
+    return list(value)
+
+
+def run_checks(cursor, run_id: str, days: list[date], sources: list[str] | None = None,
+               checks: list[Check] | None = None, sample_size: int = 5) -> list[CheckResult]:
+    """Run the declared checks, one fused scan per source, and record results."""
+    checks = checks if checks is not None else CHECKS
+    by_source: dict[str, list[Check]] = {}
+    for check in checks:
+        if check.severity not in SEVERITIES:
+            raise ValueError(f"Unknown severity {check.severity!r} for {check.name}")
+        if sources is None or check.source in sources:
+            by_source.setdefault(check.source, []).append(check)
+
+    results: list[CheckResult] = []
+    for source_name, source_checks in by_source.items():
+        t0 = time.perf_counter()
+        cursor.execute(render_scan(SOURCES[source_name], source_checks, days, sample_size))
+        row = cursor.fetchone()
+        elapsed_ms = int((time.perf_counter() - t0) * 1000)
+        rows_scanned = int(row[0] or 0)
+        for i, check in enumerate(source_checks):
+            results.append(CheckResult(
+                check=check,
+                rows_scanned=rows_scanned,
+                failed_rows=int(row[1 + 2 * i] or 0),
+                duration_ms=elapsed_ms,
+                samples=_parse_sample(row[2 + 2 * i]),
+            ))
+
+    record_results(cursor, run_id, days, results)
+    return results
+
+
+def record_results(cursor, run_id: str, days: list[date], results: list[CheckResult]):
+    scope = json.dumps(sorted({d.isoformat() for d in days}))
+    for r in results:
+        cursor.execute(
+            f"""
+            INSERT INTO {RESULTS_TABLE}
+                (RUN_ID, CHECK_NAME, SOURCE_NAME, SEVERITY, STATUS, SCOPE,
+                 ROWS_SCANNED, FAILED_ROWS, DURATION_MS, SAMPLE, CREATED_TS)
+            SELECT %(run_id)s, %(check)s, %(source)s, %(severity)s, %(status)s, PARSE_JSON(%(scope)s),
+                   %(scanned)s, %(failed)s, %(ms)s, PARSE_JSON(%(sample)s), CURRENT_TIMESTAMP()
+            """,
+            {
+                "run_id": run_id, "check": r.check.name, "source": r.check.source,
+                "severity": r.check.severity, "status": r.status, "scope": scope,
+                "scanned": r.rows_scanned, "failed": r.failed_rows, "ms": r.duration_ms,
+                "sample": json.dumps(r.samples, default=str),
+            },
+        )
+
+
+def gate(results: list[CheckResult]):
+    """Raise DQGateError if any error-severity check failed; warnings pass."""
+    failed = [r for r in results if r.status == "fail"]
+    for r in results:
+        if r.status != "pass":
+            print(f"DQ {r.status.upper()}: {r.check.name} — {r.failed_rows}/{r.rows_scanned} rows")
+    if failed:
+        names = ", ".join(f"{r.check.name} ({r.failed_rows})" for r in failed)
+        raise DQGateError(f"Data-quality gate failed: {names}")
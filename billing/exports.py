@@ -0,0 +1,185 @@
+"""
+exports.py
+
+Bulk invoice exports: every header and line item of a billing period as one
+gzip CSV or Parquet file, one row per line item (invoices without lines get a
+single row with empty line columns).
+
+Rows are fetched and written chunk by chunk, so memory stays bounded by the
+chunk size. Finished files are cached on disk under a fingerprint of the
+period's invoices and lines (HASH_AGG over their mutable columns); any
+change to the period yields a new fingerprint, a new artifact, and the old
+one is removed. A stable file is what lets the API serve HTTP range requests
+for resumable downloads.
+"""
+from __future__ import annotations
+
+import csv
+import gzip
+import hashlib
+import os
+import tempfile
+import threading
+from datetime import date
+from decimal import Decimal
+from typing import Iterable
+
+COLUMNS = [
+    "invoice_id", "customer_id", "customer_name", "billing_period_start", "billing_period_end",
+    "issued_ts", "status", "subtotal", "tax", "total", "currency",
+    "line_item_id", "line_type", "product_id", "unit", "quantity", "unit_price", "amount",
+]
+
+FORMATS = {
+    "csv": (".csv.gz", "application/gzip"),
+    "parquet": (".parquet", "application/vnd.apache.parquet"),
+}
+
+FINGERPRINT_SQL = """
+    SELECT
+        COUNT(*) AS INVOICE_COUNT,
+        HASH_AGG(i.INVOICE_ID, i.STATUS, i.SUBTOTAL, i.TAX, i.TOTAL, i.ISSUED_TS, i.LOAD_TS) AS HEADER_HASH,
+        (
+            SELECT HASH_AGG(li.INVOICE_ID, li.LINE_ITEM_ID, li.QUANTITY, li.UNIT_PRICE, li.AMOUNT, li.LOAD_TS)
+            FROM NIMBUSBILL.GOLD.FACT_INVOICE_LINE_ITEMS li
+            JOIN NIMBUSBILL.GOLD.FACT_INVOICES si ON si.INVOICE_ID = li.INVOICE_ID
+            WHERE si.BILLING_PERIOD_START = %(ps)s
+        ) AS LINE_HASH
+    FROM NIMBUSBILL.GOLD.FACT_INVOICES i
+    WHERE i.BILLING_PERIOD_START = %(ps)s
+"""
+
+EXPORT_SQL = """
+    SELECT
+        i.INVOICE_ID, c.CUSTOMER_ID, c.CUSTOMER_NAME,
+        i.BILLING_PERIOD_START, i.BILLING_PERIOD_END, i.ISSUED_TS, i.STATUS,
+        i.SUBTOTAL, i.TAX, i.TOTAL, i.CURRENCY,
+        li.LINE_ITEM_ID, li.LINE_TYPE, li.PRODUCT_ID, li.UNIT,
+        li.QUANTITY, li.UNIT_PRICE, li.AMOUNT
+    FROM NIMBUSBILL.GOLD.FACT_INVOICES i
+    LEFT JOIN NIMBUSBILL.GOLD.DIM_CUSTOMER c ON i.CUSTOMER_SK = c.CUSTOMER_SK
+    LEFT JOIN NIMBUSBILL.GOLD.FACT_INVOICE_LINE_ITEMS li ON li.INVOICE_ID = i.INVOICE_ID
+    WHERE i.BILLING_PERIOD_START = %(ps)s
+    ORDER BY i.INVOICE_ID, li.LINE_ITEM_ID
+"""
+
+
+def parse_period(period: str) -> date:
+    """'YYYY-MM' -> first day of that month."""
+    try:
+        year, month = period.split("-")
+        if len(year) != 4 or len(month) != 2:
+            raise ValueError
+        return date(int(year), int(month), 1)
+    except ValueError:
+        raise ValueError(f"period must be YYYY-MM, got {period!r}")
+
+
+def fingerprint(row: dict | None) -> str | None:
+    """Artifact version from FINGERPRINT_SQL's row; None if the period has no invoices."""
+    if not row or not row.get("invoice_count"):
+        return None
+    key = f"{row['invoice_count']}:{row.get('header_hash')}:{row.get('line_hash')}"
+    return hashlib.sha1(key.encode()).hexdigest()[:16]
+
+
+# ── Writers ─────────────────────────────────────────────────────────────────
+
+def write_csv_gz(chunks: Iterable[list[dict]], path: str) -> int:
+    rows = 0
+    with gzip.open(path, "wt", newline="", compresslevel=6) as f:
+        writer = csv.writer(f)
+        writer.writerow(COLUMNS)
+        for chunk in chunks:
+            writer.writerows([["" if r.get(c) is None else r.get(c) for c in COLUMNS] for r in chunk])
+            rows += len(chunk)
+    return rows
+
+
+def _parquet_schema():
+    import pyarrow as pa
+
+    money, qty = pa.decimal128(38, 10), pa.decimal128(38, 6)
+    types = {
+        "billing_period_start": pa.date32(), "billing_period_end": pa.date32(),
+        "issued_ts": pa.timestamp("us"),
+        "subtotal": money, "tax": money, "total": money,
+        "quantity": qty, "unit_price": money, "amount": money,
+    }
+    return pa.schema([(c, types.get(c, pa.string())) for c in COLUMNS])
+
+
+def _decimal(v, scale: int):
+    return v if v is None else round(Decimal(str(v)), scale)
+
+
+def write_parquet(chunks: Iterable[list[dict]], path: str) -> int:
+    """One row group per fetched chunk. Requires pyarrow."""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    schema = _parquet_schema()
+    decimals = {f.name: f.type.scale for f in schema if pa.types.is_decimal(f.type)}
+    rows = 0
+    with pq.ParquetWriter(path, schema, compression="zstd") as writer:
+        for chunk in chunks:
+            if not chunk:
+                continue
+            columns = {
+                c: [_decimal(r.get(c), decimals[c]) if c in decimals else r.get(c) for r in chunk]
+                for c in COLUMNS
+            }
+            writer.write_table(pa.Table.from_pydict(columns, schema=schema))
+            rows += len(chunk)
+    return rows
+
+
+WRITERS = {"csv": write_csv_gz, "parquet": write_parquet}
+
+
+# ── Artifact cache ──────────────────────────────────────────────────────────
+
+class ExportCache:
+    """Fingerprinted export files under `root`, built at most once per version."""
+
+    def __init__(self, root: str):
+        self.root = root
+        self._locks: dict[tuple[str, str], threading.Lock] = {}
+        self._guard = threading.Lock()
+
+    def path(self, period: str, fmt: str, version: str) -> str:
+        return os.path.join(self.root, f"invoices_{period}_{version}{FORMATS[fmt][0]}")
+
+    def _lock(self, period: str, fmt: str) -> threading.Lock:
+        with self._guard:
+            return self._locks.setdefault((period, fmt), threading.Lock())
+
+    def get_or_build(self, period: str, fmt: str, version: str, fetch_chunks) -> str:
+        """Path of the artifact for `version`, writing it from fetch_chunks() if missing."""
+        path = self.path(period, fmt, version)
+        if os.path.exists(path):
+            return path
+        with self._lock(period, fmt):
+            if os.path.exists(path):
+                return path
+            os.makedirs(self.root, exist_ok=True)
+            fd, tmp = tempfile.mkstemp(dir=self.root, suffix=".partial")
+            os.close(fd)
+            try:
+                WRITERS[fmt](fetch_chunks(), tmp)
+                os.replace(tmp, path)
+            except BaseException:
+                os.unlink(tmp)
+                raise
+            self._evict_stale(period, fmt, keep=path)
+        return path
+
+    def _evict_stale(self, period: str, fmt: str, keep: str):
+        prefix, suffix = f"invoices_{period}_", FORMATS[fmt][0]
+        for name in os.listdir(self.root):
+            full = os.path.join(self.root, name)
+            if name.startswith(prefix) and name.endswith(suffix) and full != keep:
+                try:
+                    os.unlink(full)
+                except FileNotFoundError:
+                    pass
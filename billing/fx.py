@@ -0,0 +1,194 @@
+"""
+fx.py
+
+Effective-dated FX rates into the reporting currency.
+
+GOLD.DIM_FX_RATE holds one window per currency and reporting currency,
+shaped like DIM_PRICING_RATE (EFFECTIVE_FROM..EFFECTIVE_TO inclusive, NULL
+end = open). The daily Gold step converts with it once and stores
+REPORTING_COST_AMOUNT next to COST_AMOUNT, so warehouse totals never join
+the rate table.
+
+Amounts Gold does not pre-convert (invoice totals) are converted in the API
+through `FxRateCache`: the windows are loaded once, each (currency, date) is
+resolved by binary search the first time it is asked for and then served
+from a dict. DIM_FX_RATE's (row count, max LOAD_TS) is probed at most every
+`refresh_seconds` and the cache reloaded when it moves.
+"""
+from __future__ import annotations
+
+import bisect
+import csv
+import threading
+import time
+from dataclasses import dataclass
+from datetime import date
+from typing import Callable
+
+REPORTING_CURRENCY = "USD"
+
+DIM_FX_RATE = "NIMBUSBILL.GOLD.DIM_FX_RATE"
+
+_VERSION_SQL = f"SELECT COUNT(*) AS ROW_COUNT, MAX(LOAD_TS) AS MAX_LOAD_TS FROM {DIM_FX_RATE}"
+
+_RATES_SQL = f"""
+    SELECT CURRENCY, REPORTING_CURRENCY, RATE, EFFECTIVE_FROM, EFFECTIVE_TO
+    FROM {DIM_FX_RATE}
+    WHERE REPORTING_CURRENCY = %(reporting)s
+    ORDER BY CURRENCY, EFFECTIVE_FROM
+"""
+
+OPEN_END = date(9999, 12, 31)
+
+
+def to_date(value) -> date | None:
+    """A date from a date, datetime or ISO string; blank means None."""
+    if value is None or value == "":
+        return None
+    if isinstance(value, date):
+        return value if type(value) is date else value.date()
+    return date.fromisoformat(str(value)[:10])
+
+
+@dataclass(frozen=True)
+class FxWindow:
+    currency: str
+    rate: float             # units of the reporting currency per unit of `currency`
+    effective_from: date
+    effective_to: date | None = None
+    reporting_currency: str = REPORTING_CURRENCY
+
+    @classmethod
+    def from_row(cls, row: dict) -> "FxWindow":
+        return cls(row["currency"].upper(), float(row["rate"]),
+                   to_date(row["effective_from"]), to_date(row.get("effective_to")),
+                   (row.get("reporting_currency") or REPORTING_CURRENCY).upper())
+
+
+def check_windows(windows: list[FxWindow]) -> None:
+    """Reject non-positive rates and overlapping windows of one currency."""
+    last: dict[tuple[str, str], FxWindow] = {}
+    for w in sorted(windows, key=lambda w: (w.reporting_currency, w.currency, w.effective_from)):
+        if w.rate <= 0:
+            raise ValueError(f"FX rate for {w.currency} from {w.effective_from} must be positive")
+        if w.effective_to is not None and w.effective_to < w.effective_from:
+            raise ValueError(f"FX window for {w.currency} ends before it starts: "
+                             f"{w.effective_from} > {w.effective_to}")
+        prev = last.get((w.reporting_currency, w.currency))
+        if prev is not None and (prev.effective_to or OPEN_END) >= w.effective_from:
+            raise ValueError(f"Overlapping FX windows for {w.currency}: "
+                             f"{prev.effective_from}..{prev.effective_to or ''} and "
+                             f"{w.effective_from}..{w.effective_to or ''}")
+        last[(w.reporting_currency, w.currency)] = w
+
+
+def read_rates_csv(path: str) -> list[FxWindow]:
+    """Read an fx_rates CSV (currency, reporting_currency, rate, effective_from, effective_to)."""
+    with open(path, newline="") as f:
+        windows = [FxWindow.from_row(row) for row in csv.DictReader(f)]
+    check_windows(windows)
+    return windows
+
+
+class FxRateCache:
+    """Rate lookups by (currency, date) against DIM_FX_RATE.
+
+    `fetch` is the API's `query(sql, params) -> list[dict]` (lower-cased keys).
+    The reporting currency converts at 1; a currency with no window covering
+    the date has no rate and converts to None.
+    """
+
+    def __init__(self, fetch: Callable[..., list[dict]], reporting_currency: str = REPORTING_CURRENCY,
+                 refresh_seconds: float = 3600.0, max_entries: int = 100_000,
+                 clock: Callable[[], float] = time.monotonic):
+        self.fetch = fetch
+        self.reporting_currency = reporting_currency
+        self.refresh_seconds = refresh_seconds
+        self.max_entries = max_entries
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+        self.loads = 0
+        self._starts: dict[str, list[date]] = {}
+        self._windows: dict[str, list[FxWindow]] = {}
+        self._by_day: dict[tuple[str, date], float | None] = {}
+        self._version: tuple | None = None
+        self._checked_at: float | None = None
+        self._lock = threading.Lock()
+
+    def _probe_version(self) -> tuple:
+        rows = self.fetch(_VERSION_SQL)
+        row = rows[0] if rows else {}
+        return (row.get("row_count"), row.get("max_load_ts"))
+
+    def load(self, windows: list[FxWindow] | None = None) -> int:
+        """(Re)load every window; from the warehouse unless `windows` is given."""
+        version = None
+        if windows is None:
+            version = self._probe_version()
+            windows = [FxWindow.from_row(r) for r in self.fetch(_RATES_SQL, {"reporting": self.reporting_currency})]
+        by_currency: dict[str, list[FxWindow]] = {}
+        windows = [w for w in windows if w.reporting_currency == self.reporting_currency]
+        for w in sorted(windows, key=lambda w: (w.currency, w.effective_from)):
+            by_currency.setdefault(w.currency, []).append(w)
+        with self._lock:
+            self._windows = by_currency
+            self._starts = {c: [w.effective_from for w in ws] for c, ws in by_currency.items()}
+            self._by_day.clear()
+            self._version = version
+            self._checked_at = self.clock()
+            self.loads += 1
+        return len(windows)
+
+    def maybe_refresh(self) -> bool:
+        """Reload if DIM_FX_RATE changed; probes at most every refresh_seconds."""
+        now = self.clock()
+        with self._lock:
+            if self._checked_at is not None and now - self._checked_at < self.refresh_seconds:
+                return False
+            self._checked_at = now
+        if self._probe_version() == self._version:
+            return False
+        self.load()
+        return True
+
+    def _resolve(self, currency: str, day: date) -> float | None:
+        starts = self._starts.get(currency)
+        if not starts:
+            return None
+        i = bisect.bisect_right(starts, day) - 1
+        if i < 0:
+            return None
+        w = self._windows[currency][i]
+        return w.rate if day <= (w.effective_to or OPEN_END) else None
+
+    def rate(self, currency: str | None, day) -> float | None:
+        """Reporting-currency units per unit of `currency` on `day`."""
+        if not currency:
+            return None
+        currency = currency.upper()
+        if currency == self.reporting_currency:
+            return 1.0
+        key = (currency, to_date(day))
+        with self._lock:
+            if key in self._by_day:
+                self.hits += 1
+                return self._by_day[key]
+            self.misses += 1
+            rate = self._resolve(*key)
+            if len(self._by_day) >= self.max_entries:
+                self._by_day.clear()
+            self._by_day[key] = rate
+            return rate
+
+    def convert(self, amount, currency: str | None, day) -> float | None:
+        if amount is None:
+            return None
+        rate = self.rate(currency, day)
+        return None if rate is None else float(amount) * rate
+
+    def info(self) -> dict:
+        with self._lock:
+            return {"reporting_currency": self.reporting_currency, "currencies": len(self._windows),
+                    "cached_days": len(self._by_day), "hits": self.hits, "misses": self.misses,
+                    "loads": self.loads}
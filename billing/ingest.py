@@ -0,0 +1,449 @@
+"""
+ingest.py
+
+Push ingestion of usage events for POST /events.
+
+Events are checked at the edge against the usage-event data contract
+(docs/data_contracts.md) with the same rules and reason codes as
+SILVER.V_USAGE_EVENTS_VALIDATED, except that the unit is only required to
+be present: whether the catalog prices it is left to the view, which still
+checks every Bronze row, so a catalog change never rejects traffic here.
+
+Accepted events are appended to a write-ahead log segment on local disk and
+to the open in-memory chunk; the caller is acknowledged only after the WAL
+write (and fsync, unless disabled), so an acknowledged event survives a
+crash of the process. A chunk is sealed once it holds `flush_events` events
+or `flush_bytes` bytes, or is `flush_seconds` old. The flusher thread gzips
+each sealed chunk into `events-<segment>.jsonl.gz` and hands it to the sink
+(PUT + COPY into BRONZE.USAGE_EVENTS_RAW); the WAL segment is deleted only
+after the sink returns. Segments left over from a crash are replayed on
+start. Chunk files are named after their segment, so a segment re-sent after
+a crash between COPY and delete is skipped by COPY's load history (and would
+be deduplicated on EVENT_ID in Silver regardless).
+
+Buffered plus unsent events are capped at `max_events`; beyond that
+`append` raises BufferFull and the API answers 429 with Retry-After. A sink
+outage therefore turns into back-pressure instead of unbounded memory.
+
+One WAL directory per process: `start()` takes an exclusive lock on it.
+"""
+from __future__ import annotations
+
+import fcntl
+import gzip
+import json
+import math
+import os
+import re
+import shutil
+import threading
+import time
+import uuid
+from dataclasses import asdict, dataclass, field
+from datetime import datetime
+from typing import Callable
+
+STAGE = "@NIMBUSBILL.BRONZE.EVENTS_INGEST_STAGE"
+SOURCE = "EVENTS_API"
+
+_SEGMENT = re.compile(r"^wal-(\d{14}-[0-9a-f]{8})\.log$")
+_TIMESTAMP = re.compile(
+    r"^(\d{4}-\d{2}-\d{2}(?:[T ]\d{2}:\d{2}(?::\d{2})?)?)(?:\.\d{1,9})?(?:Z|[+-]\d{2}(?::?\d{2})?)?$"
+)
+
+
+def _blank(value) -> bool:
+    return value is None or (isinstance(value, str) and not value.strip())
+
+
+def _valid_timestamp(value) -> bool:
+    m = _TIMESTAMP.match(value) if isinstance(value, str) else None
+    if not m:
+        return False
+    try:
+        datetime.fromisoformat(m.group(1))     # range checks (month 13, Feb 30)
+    except ValueError:
+        return False
+    return True
+
+
+def _quantity(value) -> float | None:
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        q = float(value)
+    elif isinstance(value, str):
+        try:
+            q = float(value)
+        except ValueError:
+            return None
+    else:
+        return None
+    return q if math.isfinite(q) else None
+
+
+def validate_event(event) -> list[str]:
+    """Violated contract rules, as V_USAGE_EVENTS_VALIDATED's ERROR_REASON codes; [] if valid."""
+    if not isinstance(event, dict):
+        return ["not_an_object"]
+    errors = []
+    if _blank(event.get("event_id")):
+        errors.append("missing_event_id")
+    if not _valid_timestamp(event.get("event_timestamp")):
+        errors.append("invalid_event_timestamp")
+    if _blank(event.get("customer_id")):
+        errors.append("missing_customer_id")
+    if _blank(event.get("product_id")):
+        errors.append("missing_product_id")
+    q = _quantity(event.get("quantity"))
+    if q is None:
+        errors.append("invalid_quantity")
+    elif q < 0:
+        errors.append("negative_quantity")
+    if _blank(event.get("unit")):
+        errors.append("unknown_unit")
+    return errors
+
+
+_decoder = json.JSONDecoder()
+_WS = re.compile(r"[ \t\n\r]*")
+
+
+def _one_line(raw: bytes) -> bytes:
+    # Newlines can only be whitespace between tokens (JSON strings escape them)
+    return raw.replace(b"\n", b" ").replace(b"\r", b" ") if b"\n" in raw or b"\r" in raw else raw
+
+
+def parse_batch(body: bytes, ndjson: bool = False) -> tuple[list, list[bytes]]:
+    """Events in a request body (one object, a JSON array or NDJSON) and each one's
+    original bytes as a single line, so Bronze keeps exactly what the client sent.
+
+    Raises ValueError on malformed JSON.
+    """
+    if ndjson:
+        raw = [line.strip() for line in body.splitlines() if line.strip()]
+        return [json.loads(line) for line in raw], raw
+    text = body.decode()
+    i = _WS.match(text).end()
+    if not text.startswith("[", i):
+        event = json.loads(text)
+        return [event], [_one_line(body.strip())]
+    # Walk the array with the scanner so each element's source span is known
+    ascii_only = len(text) == len(body)
+    events, raw = [], []
+    i = _WS.match(text, i + 1).end()
+    if text.startswith("]", i):
+        end = i + 1
+    else:
+        while True:
+            event, end = _decoder.raw_decode(text, i)
+            events.append(event)
+            raw.append(_one_line(body[i:end] if ascii_only else text[i:end].encode()))
+            i = _WS.match(text, end).end()
+            if text.startswith(",", i):
+                i = _WS.match(text, i + 1).end()
+                continue
+            if not text.startswith("]", i):
+                raise ValueError(f"Expecting ',' or ']' at char {i}")
+            end = i + 1
+            break
+    if text[end:].strip():
+        raise ValueError(f"Extra data at char {end}")
+    return events, raw
+
+
+class BufferFull(Exception):
+    """Accepting the events would exceed max_events; retry after `retry_after` seconds."""
+
+    def __init__(self, pending: int, retry_after: float):
+        super().__init__(f"event buffer full ({pending:,} events pending)")
+        self.pending = pending
+        self.retry_after = retry_after
+
+
+@dataclass
+class IngestStats:
+    accepted: int = 0            # events acknowledged (written to the WAL)
+    rejected: int = 0            # events refused with BufferFull
+    flushed_events: int = 0      # events handed to the sink
+    flushed_chunks: int = 0
+    recovered_chunks: int = 0    # WAL segments replayed on start
+    flush_errors: int = 0
+    last_flush_error: str | None = None
+
+    def to_dict(self) -> dict:
+        return asdict(self)
+
+
+@dataclass
+class _Chunk:
+    segment: str
+    lines: list = field(default_factory=list)
+    events: int = 0
+    bytes: int = 0
+    opened: float = field(default_factory=time.monotonic)
+    file: object = None          # open WAL segment while this is the live chunk
+
+
+def _new_segment() -> str:
+    return f"{time.strftime('%Y%m%d%H%M%S', time.gmtime())}-{uuid.uuid4().hex[:8]}"
+
+
+def chunk_name(segment: str) -> str:
+    return f"events-{segment}.jsonl.gz"
+
+
+class EventBuffer:
+    def __init__(
+        self,
+        wal_dir: str,
+        sink: Callable[[str, str, int], None],
+        max_events: int = 1_000_000,
+        flush_events: int = 200_000,
+        flush_bytes: int = 64 * 2**20,
+        flush_seconds: float = 10.0,
+        fsync: bool = True,
+        retry_seconds: float = 5.0,
+    ):
+        self.wal_dir = wal_dir
+        self.sink = sink
+        self.max_events = max_events
+        self.flush_events = flush_events
+        self.flush_bytes = flush_bytes
+        self.flush_seconds = flush_seconds
+        self.fsync = fsync
+        self.retry_seconds = retry_seconds
+        self.stats = IngestStats()
+        self._live: _Chunk | None = None
+        self._sealed: list[_Chunk] = []
+        self._pending = 0        # events in the live chunk and sealed chunks
+        self._lock = threading.Lock()
+        self._wake = threading.Condition(self._lock)
+        self._flush_lock = threading.Lock()
+        self._thread: threading.Thread | None = None
+        self._stopping = False
+        self._dir_lock = None
+
+    # ── Accepting events ────────────────────────────────────────────────────
+
+    def append(self, lines: list[bytes]) -> int:
+        """Durably buffer already-serialized events (one JSON object each, no newline)."""
+        if not lines:
+            return 0
+        data = b"\n".join(lines) + b"\n"
+        with self._lock:
+            if self._pending + len(lines) > self.max_events:
+                self.stats.rejected += len(lines)
+                raise BufferFull(self._pending, self.retry_seconds if self.stats.last_flush_error
+                                 else max(1.0, self.flush_seconds / 2))
+            chunk = self._live or self._open()
+            chunk.file.write(data)
+            chunk.file.flush()
+            fd = chunk.file.fileno()
+            chunk.lines.append(data)
+            chunk.events += len(lines)
+            chunk.bytes += len(data)
+            self._pending += len(lines)
+            self.stats.accepted += len(lines)
+            if chunk.events >= self.flush_events or chunk.bytes >= self.flush_bytes:
+                self._seal()
+                self._wake.notify()
+        if self.fsync:
+            # Outside the lock, so concurrent requests share journal commits. If the
+            # segment was sealed meanwhile, _seal synced it before closing the file.
+            try:
+                os.fsync(fd)
+            except OSError:
+                pass
+        return len(lines)
+
+    @property
+    def pending(self) -> int:
+        return self._pending
+
+    def _open(self) -> _Chunk:
+        os.makedirs(self.wal_dir, exist_ok=True)
+        chunk = _Chunk(_new_segment())
+        chunk.file = open(self._wal_path(chunk.segment), "ab")
+        self._live = chunk
+        return chunk
+
+    def _seal(self):
+        chunk, self._live = self._live, None
+        if chunk is None:
+            return
+        if self.fsync:
+            os.fsync(chunk.file.fileno())
+        chunk.file.close()
+        chunk.file = None
+        self._sealed.append(chunk)
+
+    def _wal_path(self, segment: str) -> str:
+        return os.path.join(self.wal_dir, f"wal-{segment}.log")
+
+    # ── Flushing ────────────────────────────────────────────────────────────
+
+    def flush(self, force: bool = False) -> int:
+        """Send every sealed chunk (and, if force or due, the live one); returns events sent.
+
+        Stops at the first sink failure; the chunk stays queued for the next try.
+        """
+        with self._lock:
+            live = self._live
+            if live is not None and (force or time.monotonic() - live.opened >= self.flush_seconds):
+                self._seal()
+        sent = 0
+        with self._flush_lock:
+            while True:
+                with self._lock:
+                    if not self._sealed:
+                        break
+                    chunk = self._sealed[0]
+                try:
+                    self._send(chunk)
+                except Exception as e:
+                    with self._lock:
+                        self.stats.flush_errors += 1
+                        self.stats.last_flush_error = f"{type(e).__name__}: {e}"
+                    break
+                with self._lock:
+                    self._sealed.pop(0)
+                    self._pending -= chunk.events
+                    self.stats.flushed_events += chunk.events
+                    self.stats.flushed_chunks += 1
+                    self.stats.last_flush_error = None
+                sent += chunk.events
+        return sent
+
+    def _send(self, chunk: _Chunk):
+        path = os.path.join(self.wal_dir, chunk_name(chunk.segment))
+        with open(path, "wb") as raw, gzip.GzipFile(fileobj=raw, mode="wb", compresslevel=1, mtime=0) as gz:
+            for data in chunk.lines:
+                gz.write(data)
+        try:
+            self.sink(path, chunk_name(chunk.segment), chunk.events)
+        finally:
+            if os.path.exists(path):
+                os.remove(path)
+        os.remove(self._wal_path(chunk.segment))
+
+    # ── Lifecycle ───────────────────────────────────────────────────────────
+
+    def recover(self) -> int:
+        """Queue WAL segments left by a previous process; returns events recovered.
+
+        A torn last line (the process died mid-write) was never acknowledged and is dropped.
+        """
+        if not os.path.isdir(self.wal_dir):
+            return 0
+        recovered = 0
+        for name in sorted(os.listdir(self.wal_dir)):
+            m = _SEGMENT.match(name)
+            if not m or (self._live and m.group(1) == self._live.segment):
+                continue
+            with open(os.path.join(self.wal_dir, name), "rb") as f:
+                data = f.read()
+            if not data.endswith(b"\n"):
+                data = data[:data.rfind(b"\n") + 1]
+            events = data.count(b"\n")
+            if not events:
+                os.remove(os.path.join(self.wal_dir, name))
+                continue
+            with self._lock:
+                self._sealed.append(_Chunk(m.group(1), [data], events, len(data)))
+                self._pending += events
+                self.stats.recovered_chunks += 1
+            recovered += events
+        return recovered
+
+    def start(self) -> int:
+        """Lock the WAL directory, replay leftover segments and start the flusher thread."""
+        os.makedirs(self.wal_dir, exist_ok=True)
+        self._dir_lock = open(os.path.join(self.wal_dir, "LOCK"), "w")
+        try:
+            fcntl.flock(self._dir_lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            self._dir_lock.close()
+            self._dir_lock = None
+            raise RuntimeError(f"WAL directory {self.wal_dir} is in use by another process")
+        recovered = self.recover()
+        self._stopping = False
+        self._thread = threading.Thread(target=self._run, name="event-flusher", daemon=True)
+        self._thread.start()
+        return recovered
+
+    def _run(self):
+        while True:
+            with self._lock:
+                if self._stopping:
+                    return
+                live = self._live
+                wait = self.flush_seconds - (time.monotonic() - live.opened) if live else self.flush_seconds
+                if not self._sealed and wait > 0:
+                    self._wake.wait(wait)
+                if self._stopping:
+                    return
+            self.flush()
+            if self.stats.last_flush_error:
+                with self._lock:
+                    self._wake.wait(self.retry_seconds)
+
+    def close(self, timeout: float = 30.0):
+        """Stop the flusher and send what is buffered; anything unsent stays in the WAL."""
+        with self._lock:
+            self._stopping = True
+            self._wake.notify_all()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+        self.flush(force=True)
+        if self._dir_lock is not None:
+            self._dir_lock.close()
+            self._dir_lock = None
+
+    def info(self) -> dict:
+        with self._lock:
+            return {"pending_events": self._pending, "sealed_chunks": len(self._sealed),
+                    **self.stats.to_dict()}
+
+
+# ── Sinks ───────────────────────────────────────────────────────────────────
+
+COPY_SQL = """
+    COPY INTO NIMBUSBILL.BRONZE.USAGE_EVENTS_RAW (INGEST_TS, SOURCE, DT, BATCH_ID, FILE_NAME, RAW)
+    FROM (
+        SELECT CURRENT_TIMESTAMP(), '{source}', CURRENT_DATE(), '{batch_id}', METADATA$FILENAME, $1
+        FROM {stage}/
+    )
+    FILES = ('{name}')
+    FILE_FORMAT = (TYPE = 'JSON' COMPRESSION = 'GZIP')
+    PURGE = TRUE
+"""
+
+
+class SnowflakeSink:
+    """PUT the chunk to EVENTS_INGEST_STAGE and COPY that one file into Bronze."""
+
+    def __init__(self, connect: Callable):
+        self.connect = connect
+
+    def __call__(self, path: str, name: str, events: int):
+        segment = name[len("events-"):-len(".jsonl.gz")]
+        conn = self.connect()
+        try:
+            cursor = conn.cursor()
+            cursor.execute(f"PUT file://{path} {STAGE} AUTO_COMPRESS=FALSE OVERWRITE=TRUE")
+            cursor.execute(COPY_SQL.format(source=SOURCE, batch_id=f"api_{segment}", stage=STAGE, name=name))
+        finally:
+            conn.close()
+
+
+class LocalSink:
+    """Move chunks into a directory; for development and the ingest benchmark."""
+
+    def __init__(self, directory: str):
+        self.directory = directory
+
+    def __call__(self, path: str, name: str, events: int):
+        os.makedirs(self.directory, exist_ok=True)
+        shutil.move(path, os.path.join(self.directory, name))
@@ -0,0 +1,166 @@
+"""
+landing.py
+
+Landing-file formats for usage events and how each is loaded into Bronze.
+
+JSONL (`usage_events_<date>.jsonl`) is the original format and the fallback:
+it is gzipped on PUT and COPY'd whole into USAGE_EVENTS_RAW.RAW (VARIANT),
+and Silver parses every field. Parquet (`usage_events_<date>.parquet`) is
+written with event_schema(), which types every field of the data contract
+(docs/data_contracts.md). It is COPY'd with MATCH_BY_COLUMN_NAME into the
+typed table BRONZE.USAGE_EVENTS_TYPED. Zstd-compressed it is somewhat smaller
+than gzipped JSONL (the random event IDs dominate both) and, above all, skips
+the per-field JSON parse; SILVER.V_USAGE_EVENTS_VALIDATED reads both tables.
+
+A typed file can only hold well-typed values: a timestamp that does not
+parse or a non-numeric quantity fails the write, not the load. Producers that
+cannot guarantee that keep writing JSONL, whose rows Silver quarantines
+individually.
+
+Requires pyarrow for Parquet.
+"""
+from __future__ import annotations
+
+import json
+import os
+from datetime import datetime, timezone
+
+RAW_TABLE = "NIMBUSBILL.BRONZE.USAGE_EVENTS_RAW"
+TYPED_TABLE = "NIMBUSBILL.BRONZE.USAGE_EVENTS_TYPED"
+FORMATS = ("parquet", "jsonl")      # preference order when both files exist
+
+# (contract field, arrow type, nullable); order is the file's column order
+EVENT_COLUMNS = [
+    ("event_id", "string", False),
+    ("event_timestamp", "timestamp[us]", False),     # UTC, like the contract's ISO 8601 'Z'
+    ("customer_id", "string", False),
+    ("product_id", "string", False),
+    ("plan_id", "string", True),
+    ("quantity", "decimal128(38, 6)", False),        # Silver's NUMBER(38, 6)
+    ("unit", "string", False),
+    ("region", "string", True),
+    ("schema_version", "string", False),
+]
+
+
+def event_schema():
+    import pyarrow as pa
+
+    types = {"string": pa.string(), "timestamp[us]": pa.timestamp("us"), "decimal128(38, 6)": pa.decimal128(38, 6)}
+    return pa.schema([pa.field(name, types[t], nullable=nullable) for name, t, nullable in EVENT_COLUMNS])
+
+
+def _utc(ts) -> datetime | None:
+    if ts is None:
+        return None
+    if isinstance(ts, str):
+        ts = datetime.fromisoformat(ts[:-1] + "+00:00" if ts.endswith("Z") else ts)
+    if ts.tzinfo is not None:
+        ts = ts.astimezone(timezone.utc).replace(tzinfo=None)
+    return ts
+
+
+def to_table(events: list[dict]):
+    """Events as an Arrow table with event_schema().
+
+    Raises ValueError (pyarrow.ArrowInvalid is one) on untypeable or missing values.
+    """
+    import pyarrow as pa
+
+    columns = {name: [e.get(name) for e in events] for name, _, _ in EVENT_COLUMNS}
+    columns["event_timestamp"] = [_utc(ts) for ts in columns["event_timestamp"]]
+    schema = event_schema()
+    arrays = []
+    for field in schema:
+        if field.name == "quantity":
+            array = pa.array(columns["quantity"], pa.float64()).cast(field.type)
+        else:
+            array = pa.array(columns[field.name], field.type)
+        if not field.nullable and array.null_count:
+            raise ValueError(f"{field.name} is required but missing in {array.null_count} event(s)")
+        arrays.append(array)
+    return pa.Table.from_arrays(arrays, schema=schema)
+
+
+def write_parquet(events: list[dict], path: str, row_group_size: int = 1_000_000):
+    import pyarrow.parquet as pq
+
+    pq.write_table(to_table(events), path, compression="zstd", row_group_size=row_group_size)
+
+
+def read_events(path: str, columns: list[str] | None = None) -> list[dict]:
+    """Events from a landing file of either format (Parquet timestamps come back as datetimes)."""
+    if path.endswith(".parquet"):
+        import pyarrow.parquet as pq
+
+        return pq.read_table(path, columns=columns).to_pylist()
+    with open(path) as f:
+        events = [json.loads(line) for line in f if line.strip()]
+    if columns:
+        events = [{c: e.get(c) for c in columns} for e in events]
+    return events
+
+
+def landing_file(directory: str, ds: str, formats: tuple = FORMATS) -> str | None:
+    """The day's landing file, Parquet first; None if there is none."""
+    for fmt in formats:
+        path = os.path.join(directory, f"usage_events_{ds}.{fmt}")
+        if os.path.exists(path):
+            return path
+    return None
+
+
+RAW_COPY_SQL = """
+    COPY INTO {table} (INGEST_TS, SOURCE, DT, BATCH_ID, FILE_NAME, RAW)
+    FROM (
+        SELECT CURRENT_TIMESTAMP(), '{source}', '{ds}', '{batch_id}', METADATA$FILENAME, $1
+        FROM @{stage}
+    )
+    FILES = ('{name}.gz')
+    FILE_FORMAT = (TYPE = 'JSON' STRIP_OUTER_ARRAY = FALSE)
+    PURGE = TRUE
+"""
+
+# MATCH_BY_COLUMN_NAME allows no transformations, so the load's own columns
+# are tagged by file name right after the COPY, in the same transaction.
+TYPED_COPY_SQL = """
+    COPY INTO {table}
+    FROM @{stage}
+    FILES = ('{name}')
+    FILE_FORMAT = (TYPE = 'PARQUET')
+    MATCH_BY_COLUMN_NAME = CASE_INSENSITIVE
+    INCLUDE_METADATA = (FILE_NAME = METADATA$FILENAME, INGEST_TS = METADATA$START_SCAN_TIME)
+    PURGE = TRUE
+"""
+
+TYPED_TAG_SQL = """
+    UPDATE {table} SET SOURCE = '{source}', DT = '{ds}', BATCH_ID = '{batch_id}'
+    WHERE BATCH_ID IS NULL AND FILE_NAME = '{name}'
+"""
+
+
+def _stage(table: str) -> str:
+    database, schema, name = table.split(".")
+    return f"{database}.{schema}.%{name}"
+
+
+def load_statements(path: str, ds: str, batch_id: str, source: str,
+                    raw_table: str = RAW_TABLE, typed_table: str = TYPED_TABLE) -> list[str]:
+    """PUT + COPY for one landing file into its Bronze table, by extension."""
+    path = os.path.abspath(path)
+    name = os.path.basename(path)
+    if name.endswith(".parquet"):
+        stage = _stage(typed_table)
+        params = dict(table=typed_table, stage=stage, name=name, source=source, ds=ds, batch_id=batch_id)
+        return [
+            f"PUT file://{path} @{stage} AUTO_COMPRESS=FALSE OVERWRITE=TRUE",
+            "BEGIN",
+            TYPED_COPY_SQL.format(**params),
+            TYPED_TAG_SQL.format(**params),
+            "COMMIT",
+        ]
+    stage = _stage(raw_table)
+    return [
+        f"PUT file://{path} @{stage} AUTO_COMPRESS=TRUE OVERWRITE=TRUE",
+        RAW_COPY_SQL.format(table=raw_table, stage=stage, name=name, source=source, ds=ds, batch_id=batch_id),
+    ]
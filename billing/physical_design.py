@@ -0,0 +1,308 @@
+"""
+physical_design.py
+
+Clustering and search-optimization layout of the Gold facts, derived from
+how the API reads them:
+
+  - daily usage is filtered by date range and customer (CUSTOMER_SK, resolved
+    in-process by billing/customer_keys.py), so it clusters on
+    (DATE_ID, CUSTOMER_SK);
+  - invoices are listed per customer and billing period, and fetched by
+    INVOICE_ID / filtered by STATUS, which search optimization serves;
+  - line items are only ever read by INVOICE_ID;
+  - credit balances are read by CUSTOMER_ID, and the ledger by drawdown day
+    and customer.
+
+The same keys are declared in sql/03_create_gold_tables.sql and the dbt mart
+configs. `clustering_report` records SYSTEM$CLUSTERING_INFORMATION per table
+in OPS.CLUSTERING_DEPTH_REPORT, and `run_pruning_benchmark` replays the API
+query shapes and reads partitions scanned vs total from the query profile.
+"""
+from __future__ import annotations
+
+import json
+import time
+from dataclasses import dataclass, field
+
+REPORT_TABLE = "NIMBUSBILL.OPS.CLUSTERING_DEPTH_REPORT"
+
+# Average depth above which a table is reported as degraded. Automatic
+# clustering keeps well-clustered tables in low single digits.
+DEFAULT_MAX_DEPTH = 4.0
+
+
+@dataclass(frozen=True)
+class ClusteringSpec:
+    table: str
+    keys: tuple[str, ...]
+    search_equality: tuple[str, ...] = ()  # columns for SEARCH OPTIMIZATION ON EQUALITY
+
+
+SPECS = [
+    ClusteringSpec("NIMBUSBILL.GOLD.FACT_CUSTOMER_DAILY_USAGE", ("DATE_ID", "CUSTOMER_SK")),
+    ClusteringSpec("NIMBUSBILL.GOLD.FACT_CUSTOMER_HOURLY_USAGE", ("DATE_ID", "CUSTOMER_SK")),
+    ClusteringSpec("NIMBUSBILL.GOLD.FACT_CUSTOMER_MONTHLY_USAGE", ("MONTH_ID", "CUSTOMER_SK")),
+    ClusteringSpec("NIMBUSBILL.GOLD.FACT_INVOICES", ("BILLING_PERIOD_START", "CUSTOMER_SK"),
+                   search_equality=("INVOICE_ID", "STATUS")),
+    ClusteringSpec("NIMBUSBILL.GOLD.FACT_INVOICE_LINE_ITEMS", ("INVOICE_ID",)),
+    ClusteringSpec("NIMBUSBILL.GOLD.FACT_CREDIT_LEDGER", ("DATE_ID", "CUSTOMER_ID")),
+    ClusteringSpec("NIMBUSBILL.GOLD.FACT_CREDIT_BALANCES", ("CUSTOMER_ID",), search_equality=("CUSTOMER_ID",)),
+]
+
+
+def ddl(spec: ClusteringSpec) -> list[str]:
+    """Idempotent statements applying `spec` to an existing table."""
+    statements = [
+        f"ALTER TABLE {spec.table} CLUSTER BY ({', '.join(spec.keys)})",
+        f"ALTER TABLE {spec.table} RESUME RECLUSTER",
+    ]
+    if spec.search_equality:
+        statements.append(
+            f"ALTER TABLE {spec.table} ADD SEARCH OPTIMIZATION ON EQUALITY({', '.join(spec.search_equality)})"
+        )
+    return statements
+
+
+# ── Clustering-depth report ─────────────────────────────────────────────────
+
+@dataclass
+class ClusteringHealth:
+    spec: ClusteringSpec
+    total_partitions: int
+    constant_partitions: int
+    average_overlaps: float
+    average_depth: float
+    histogram: dict = field(default_factory=dict)
+    max_depth: float = DEFAULT_MAX_DEPTH
+
+    @property
+    def status(self) -> str:
+        return "degraded" if self.average_depth > self.max_depth else "ok"
+
+
+def parse_clustering_info(spec: ClusteringSpec, raw, max_depth: float = DEFAULT_MAX_DEPTH) -> ClusteringHealth:
+    """Parse SYSTEM$CLUSTERING_INFORMATION output (a JSON string)."""
+    info = json.loads(raw) if isinstance(raw, str) else raw
+    return ClusteringHealth(
+        spec=spec,
+        total_partitions=int(info.get("total_partition_count", 0)),
+        constant_partitions=int(info.get("total_constant_partition_count", 0)),
+        average_overlaps=float(info.get("average_overlaps", 0.0)),
+        average_depth=float(info.get("average_depth", 0.0)),
+        histogram=info.get("partition_depth_histogram", {}),
+        max_depth=max_depth,
+    )
+
+
+def clustering_report(cursor, run_id: str, specs: list[ClusteringSpec] | None = None,
+                      max_depth: float = DEFAULT_MAX_DEPTH) -> list[ClusteringHealth]:
+    """Measure clustering depth on the declared keys and record it."""
+    report = []
+    for spec in specs if specs is not None else SPECS:
+        keys = f"({', '.join(spec.keys)})"
+        cursor.execute("SELECT SYSTEM$CLUSTERING_INFORMATION(%(t)s, %(k)s)", {"t": spec.table, "k": keys})
+        health = parse_clustering_info(spec, cursor.fetchone()[0], max_depth)
+        cursor.execute(
+            f"""
+            INSERT INTO {REPORT_TABLE}
+                (RUN_ID, TABLE_NAME, CLUSTER_KEYS, TOTAL_PARTITIONS, CONSTANT_PARTITIONS,
+                 AVERAGE_OVERLAPS, AVERAGE_DEPTH, DEPTH_HISTOGRAM, STATUS, CREATED_TS)
+            SELECT %(run_id)s, %(table)s, %(keys)s, %(total)s, %(constant)s,
+                   %(overlaps)s, %(depth)s, PARSE_JSON(%(hist)s), %(status)s, CURRENT_TIMESTAMP()
+            """,
+            {
+                "run_id": run_id, "table": spec.table, "keys": keys,
+                "total": health.total_partitions, "constant": health.constant_partitions,
+                "overlaps": health.average_overlaps, "depth": health.average_depth,
+                "hist": json.dumps(health.histogram), "status": health.status,
+            },
+        )
+        report.append(health)
+    return report
+
+
+# ── Pruning benchmark ───────────────────────────────────────────────────────
+
+@dataclass(frozen=True)
+class QueryShape:
+    """One API read path. `sample` returns rows of bind values named by `params`."""
+    name: str
+    sql: str
+    params: tuple[str, ...] = ()
+    sample: str = ""
+
+
+_SAMPLE_CUSTOMER = """
+    SELECT CUSTOMER_SK FROM NIMBUSBILL.GOLD.DIM_CUSTOMER
+    WHERE IS_CURRENT = TRUE SAMPLE ({n} ROWS)
+"""
+
+_SAMPLE_INVOICE = """
+    SELECT INVOICE_ID FROM NIMBUSBILL.GOLD.FACT_INVOICES SAMPLE ({n} ROWS)
+"""
+
+# Kept in step with the endpoint SQL in api/main.py. Customer filters are on
+# CUSTOMER_SK as resolved by billing/customer_keys.py (one sampled key here).
+QUERY_SHAPES = [
+    QueryShape(
+        "customer_usage_30d",
+        """
+        SELECT f.DATE_ID, f.PRODUCT_ID, f.UNIT, f.TOTAL_QUANTITY, f.COST_AMOUNT, f.CURRENCY
+        FROM NIMBUSBILL.GOLD.FACT_CUSTOMER_DAILY_USAGE f
+        WHERE f.CUSTOMER_SK IN (%(sks)s)
+          AND f.DATE_ID >= DATEADD('day', -30, CURRENT_DATE())
+        ORDER BY f.DATE_ID DESC, f.PRODUCT_ID
+        """,
+        ("sks",), _SAMPLE_CUSTOMER,
+    ),
+    QueryShape(
+        "usage_90d_all_customers",
+        """
+        SELECT f.DATE_ID, f.PRODUCT_ID, f.UNIT,
+               SUM(f.TOTAL_QUANTITY) AS TOTAL_QUANTITY, SUM(f.COST_AMOUNT) AS COST_AMOUNT
+        FROM NIMBUSBILL.GOLD.FACT_PRODUCT_DAILY_USAGE f
+        WHERE f.DATE_ID >= DATEADD('day', -90, CURRENT_DATE())
+        GROUP BY f.DATE_ID, f.PRODUCT_ID, f.UNIT ORDER BY f.DATE_ID DESC LIMIT 5000
+        """,
+    ),
+    QueryShape(
+        "customer_usage_12m_monthly",
+        """
+        SELECT f.MONTH_ID, f.PRODUCT_ID, f.UNIT,
+               SUM(f.TOTAL_QUANTITY) AS TOTAL_QUANTITY, SUM(f.COST_AMOUNT) AS COST_AMOUNT
+        FROM NIMBUSBILL.GOLD.FACT_CUSTOMER_MONTHLY_USAGE f
+        WHERE f.CUSTOMER_SK IN (%(sks)s)
+          AND f.MONTH_ID >= DATE_TRUNC('MONTH', DATEADD('day', -366, CURRENT_DATE()))
+        GROUP BY f.MONTH_ID, f.PRODUCT_ID, f.UNIT ORDER BY f.MONTH_ID DESC LIMIT 5000
+        """,
+        ("sks",), _SAMPLE_CUSTOMER,
+    ),
+    QueryShape(
+        "revenue_breakdown_mtd",
+        """
+        SELECT REGION, EVENT_PLAN_ID AS PLAN_ID, PRODUCT_ID, UNIT, CURRENCY,
+               SUM(COST_AMOUNT) AS REVENUE, SUM(REPORTING_COST_AMOUNT) AS REPORTING_REVENUE,
+               SUM(TOTAL_QUANTITY) AS TOTAL_QUANTITY
+        FROM NIMBUSBILL.GOLD.FACT_REVENUE_CUBE
+        WHERE DATE_ID >= DATE_TRUNC('MONTH', CURRENT_DATE())
+        GROUP BY REGION, EVENT_PLAN_ID, PRODUCT_ID, UNIT, CURRENCY ORDER BY REPORTING_REVENUE DESC
+        """,
+    ),
+    QueryShape(
+        "dashboard_mtd_revenue",
+        """
+        SELECT COALESCE(SUM(f.REPORTING_COST_AMOUNT), 0)
+        FROM NIMBUSBILL.GOLD.FACT_PRODUCT_DAILY_USAGE f
+        WHERE f.DATE_ID >= DATE_TRUNC('MONTH', CURRENT_DATE())
+        """,
+    ),
+    QueryShape(
+        "invoices_by_customer",
+        """
+        SELECT i.INVOICE_ID, i.BILLING_PERIOD_START, i.STATUS, i.TOTAL
+        FROM NIMBUSBILL.GOLD.FACT_INVOICES i
+        LEFT JOIN NIMBUSBILL.GOLD.DIM_CUSTOMER c ON i.CUSTOMER_SK = c.CUSTOMER_SK
+        WHERE i.CUSTOMER_SK IN (%(sks)s)
+        ORDER BY i.ISSUED_TS DESC
+        """,
+        ("sks",), _SAMPLE_CUSTOMER,
+    ),
+    QueryShape(
+        "invoices_by_status",
+        """
+        SELECT i.INVOICE_ID, i.BILLING_PERIOD_START, i.TOTAL
+        FROM NIMBUSBILL.GOLD.FACT_INVOICES i
+        WHERE i.STATUS = 'issued'
+        ORDER BY i.ISSUED_TS DESC
+        """,
+    ),
+    QueryShape(
+        "invoice_header",
+        """
+        SELECT i.INVOICE_ID, i.CUSTOMER_SK, i.STATUS, i.SUBTOTAL, i.TAX, i.TOTAL
+        FROM NIMBUSBILL.GOLD.FACT_INVOICES i
+        WHERE i.INVOICE_ID = %(iid)s
+        """,
+        ("iid",), _SAMPLE_INVOICE,
+    ),
+    QueryShape(
+        "invoice_line_items",
+        """
+        SELECT LINE_ITEM_ID, LINE_TYPE, PRODUCT_ID, UNIT, QUANTITY, UNIT_PRICE, AMOUNT
+        FROM NIMBUSBILL.GOLD.FACT_INVOICE_LINE_ITEMS
+        WHERE INVOICE_ID = %(iid)s
+        ORDER BY LOAD_TS
+        """,
+        ("iid",), _SAMPLE_INVOICE,
+    ),
+]
+
+_SCAN_STATS = """
+    SELECT
+        OPERATOR_ATTRIBUTES:table_name::STRING,
+        OPERATOR_STATISTICS:pruning:partitions_scanned::NUMBER,
+        OPERATOR_STATISTICS:pruning:partitions_total::NUMBER,
+        OPERATOR_STATISTICS:io:bytes_scanned::NUMBER
+    FROM TABLE(GET_QUERY_OPERATOR_STATS(%(qid)s))
+    WHERE OPERATOR_TYPE = 'TableScan'
+"""
+
+
+@dataclass
+class ShapeResult:
+    shape: str
+    runs: int = 0
+    elapsed_ms: list[float] = field(default_factory=list)
+    # table -> [partitions_scanned, partitions_total, bytes_scanned], summed over runs
+    tables: dict[str, list[int]] = field(default_factory=dict)
+
+    def add_scan(self, table: str, scanned, total, nbytes):
+        acc = self.tables.setdefault(table.split(".")[-1], [0, 0, 0])
+        acc[0] += int(scanned or 0)
+        acc[1] += int(total or 0)
+        acc[2] += int(nbytes or 0)
+
+    def pruning_ratio(self, table: str) -> float | None:
+        """Share of partitions pruned (1.0 = scanned nothing)."""
+        scanned, total, _ = self.tables.get(table, (0, 0, 0))
+        return 1.0 - scanned / total if total else None
+
+    def to_dict(self) -> dict:
+        ms = sorted(self.elapsed_ms)
+        return {
+            "shape": self.shape,
+            "runs": self.runs,
+            "p50_ms": ms[len(ms) // 2] if ms else None,
+            "tables": {
+                t: {"partitions_scanned": s, "partitions_total": n, "bytes_scanned": b,
+                    "pruning_ratio": self.pruning_ratio(t)}
+                for t, (s, n, b) in self.tables.items()
+            },
+        }
+
+
+def _sample_params(cursor, shape: QueryShape, samples: int) -> list[dict]:
+    if not shape.params:
+        return [{}] * samples
+    cursor.execute(shape.sample.format(n=samples))
+    return [dict(zip(shape.params, row)) for row in cursor.fetchall()]
+
+
+def run_pruning_benchmark(cursor, shapes: list[QueryShape] | None = None,
+                          samples: int = 5) -> list[ShapeResult]:
+    """Replay each shape `samples` times with the result cache off and collect scan stats."""
+    cursor.execute("ALTER SESSION SET USE_CACHED_RESULT = FALSE")
+    results = []
+    for shape in shapes if shapes is not None else QUERY_SHAPES:
+        result = ShapeResult(shape.name)
+        for params in _sample_params(cursor, shape, samples):
+            t0 = time.perf_counter()
+            cursor.execute(shape.sql, params)
+            cursor.fetchall()
+            result.elapsed_ms.append((time.perf_counter() - t0) * 1000)
+            result.runs += 1
+            cursor.execute(_SCAN_STATS, {"qid": cursor.sfqid})
+            for table, scanned, total, nbytes in cursor.fetchall():
+                result.add_scan(table, scanned, total, nbytes)
+        results.append(result)
+    return results
@@ -0,0 +1,169 @@
+"""
+rating.py
+
+In-memory pricing-rate index for Python-side rating.
+
+Loads the rate catalog (DIM_PRICING_RATE rows or a pricing_catalog CSV)
+once into a single sorted array keyed by (product, plan, unit) and window
+start, so a rate lookup is one binary search and a whole batch of usage
+rows is rated with one vectorized searchsorted.
+"""
+import csv
+from dataclasses import dataclass
+from datetime import date
+
+import numpy as np
+
+OPEN_END = np.datetime64("9999-12-31", "D")
+
+# Day numbers (days since 1970-01-01) stay below 2**22 up to 9999-12-31,
+# so key code and window start pack into one sortable int64.
+_DAY_BITS = 22
+
+DIM_PRICING_RATE_SQL = """
+    SELECT RATE_SK, RATE_ID, PRODUCT_ID, PLAN_ID, UNIT, UNIT_PRICE, CURRENCY,
+           EFFECTIVE_FROM, EFFECTIVE_TO
+    FROM NIMBUSBILL.GOLD.DIM_PRICING_RATE
+    ORDER BY PRODUCT_ID, PLAN_ID, UNIT, EFFECTIVE_FROM
+"""
+
+
+class RateOverlapError(ValueError):
+    """Raised when two rate windows for the same product/plan/unit overlap."""
+
+
+def to_day(value) -> np.datetime64:
+    """Coerce a date, datetime or ISO string to a numpy day; blank means open-ended."""
+    if value is None or value == "":
+        return OPEN_END
+    if isinstance(value, date):
+        return np.datetime64(value.isoformat()[:10], "D")
+    return np.datetime64(str(value)[:10], "D")
+
+
+def to_days(values) -> np.ndarray:
+    """Vectorized `to_day` for a sequence of dates or ISO strings."""
+    arr = np.asarray(values)
+    if np.issubdtype(arr.dtype, np.datetime64):
+        return arr.astype("datetime64[D]")
+    # Usage batches repeat a handful of dates; convert each distinct value once.
+    days = {v: to_day(v) for v in set(arr.tolist())}
+    return np.fromiter((days[v] for v in arr.tolist()), dtype="datetime64[D]", count=len(arr))
+
+
+def read_catalog_csv(path: str) -> list[dict]:
+    """Read a pricing_catalog CSV (see docs/data_contracts.md) into row dicts."""
+    with open(path, newline="") as f:
+        return list(csv.DictReader(f))
+
+
+@dataclass
+class RatedBatch:
+    """Result of rating a batch of usage rows against a RateIndex."""
+    rate_pos: np.ndarray    # position in the index, -1 when no rate applies
+    unit_price: np.ndarray
+    cost: np.ndarray
+    currency: np.ndarray
+
+    @property
+    def unpriced(self) -> np.ndarray:
+        return self.rate_pos < 0
+
+
+class RateIndex:
+    """Sorted per-(product, plan, unit) interval index over effective-dated rates."""
+
+    def __init__(self, rows: list[dict]):
+        self.key_codes: dict[tuple[str, str, str], int] = {}
+        parsed = []
+        for row in rows:
+            key = (row["product_id"], row["plan_id"], row["unit"])
+            code = self.key_codes.setdefault(key, len(self.key_codes))
+            start = to_day(row["effective_from"])
+            end = to_day(row.get("effective_to"))
+            if end < start:
+                raise ValueError(f"Rate window ends before it starts for {key}: {start} > {end}")
+            price = row.get("unit_price", row.get("price"))
+            if price is None:
+                raise ValueError(f"No unit_price for {key}")
+            parsed.append((code, start, end, float(price), row.get("currency") or "USD", row))
+
+        parsed.sort(key=lambda p: (p[0], p[1]))
+        n = len(parsed)
+        self.codes = np.array([p[0] for p in parsed], dtype=np.int64)
+        self.starts = np.array([p[1] for p in parsed], dtype="datetime64[D]")
+        self.ends = np.array([p[2] for p in parsed], dtype="datetime64[D]")
+        self.prices = np.array([p[3] for p in parsed], dtype=np.float64)
+        self.currencies = np.array([p[4] for p in parsed], dtype=object)
+        self.rows = [p[5] for p in parsed]
+        self._packed = (self.codes << _DAY_BITS) + self.starts.astype(np.int64) if n else np.empty(0, np.int64)
+
+        self._validate_non_overlapping()
+
+    @classmethod
+    def from_csv(cls, path: str) -> "RateIndex":
+        return cls(read_catalog_csv(path))
+
+    @classmethod
+    def from_warehouse(cls, query_fn) -> "RateIndex":
+        """Build from DIM_PRICING_RATE using a `query(sql) -> list[dict]` callable."""
+        return cls(query_fn(DIM_PRICING_RATE_SQL))
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    def _validate_non_overlapping(self):
+        """Data contract rule 1: windows for a product/plan/unit must not overlap."""
+        if len(self) < 2:
+            return
+        same_key = self.codes[1:] == self.codes[:-1]
+        overlap = same_key & (self.starts[1:] <= self.ends[:-1])
+        if overlap.any():
+            i = int(np.flatnonzero(overlap)[0])
+            prev = self.rows[i]
+            raise RateOverlapError(
+                f"Overlapping rate windows for "
+                f"{prev['product_id']}/{prev['plan_id']}/{prev['unit']}: "
+                f"{self.starts[i]}..{self.ends[i]} and {self.starts[i + 1]}..{self.ends[i + 1]}"
+            )
+
+    def encode(self, product_ids, plan_ids, units) -> np.ndarray:
+        """Map (product, plan, unit) columns to key codes; -1 for keys with no rate."""
+        lut = self.key_codes
+        keys = zip(np.asarray(product_ids).tolist(), np.asarray(plan_ids).tolist(), np.asarray(units).tolist())
+        return np.fromiter((lut.get(k, -1) for k in keys), dtype=np.int64, count=len(product_ids))
+
+    def locate(self, codes: np.ndarray, days: np.ndarray) -> np.ndarray:
+        """Index position of the rate window covering each (code, day); -1 if none."""
+        codes = np.asarray(codes, dtype=np.int64)
+        days = np.asarray(days, dtype="datetime64[D]")
+        if not len(self):
+            return np.full(codes.shape, -1, dtype=np.int64)
+        probe = (np.maximum(codes, 0) << _DAY_BITS) + days.astype(np.int64)
+        pos = np.searchsorted(self._packed, probe, side="right") - 1
+        safe = np.maximum(pos, 0)
+        hit = (codes >= 0) & (pos >= 0) & (self.codes[safe] == codes) & (days <= self.ends[safe])
+        return np.where(hit, pos, -1)
+
+    def rate(self, product_ids, plan_ids, units, dates, quantities) -> RatedBatch:
+        """Rate a batch of usage rows; cost is quantity * unit price (0 when unpriced)."""
+        pos = self.locate(self.encode(product_ids, plan_ids, units), to_days(dates))
+        return self.rate_positions(pos, quantities)
+
+    def rate_positions(self, pos: np.ndarray, quantities) -> RatedBatch:
+        hit = pos >= 0
+        safe = np.maximum(pos, 0)
+        price = np.where(hit, self.prices[safe] if len(self) else 0.0, 0.0)
+        currency = np.where(hit, self.currencies[safe] if len(self) else None, None)
+        return RatedBatch(
+            rate_pos=pos,
+            unit_price=price,
+            cost=np.asarray(quantities, dtype=np.float64) * price,
+            currency=currency,
+        )
+
+    def lookup(self, product_id: str, plan_id: str, unit: str, on_date) -> dict | None:
+        """Rate row in effect for one product/plan/unit on a date, or None."""
+        code = self.key_codes.get((product_id, plan_id, unit), -1)
+        pos = int(self.locate(np.array([code]), np.array([to_day(on_date)]))[0])
+        return self.rows[pos] if pos >= 0 else None
@@ -0,0 +1,140 @@
+"""
+repricing.py
+
+What-if repricing: re-rates historical USAGE_DAILY_AGG under a candidate
+pricing catalog and reports per-customer and per-product deltas against
+the current catalog, without writing anything to Gold.
+
+Usage is pulled pre-aggregated into "segments": date ranges inside which
+neither catalog changes price for any product/plan/unit. Rating a segment
+at its start date is therefore exact, and the warehouse collapses a year
+of daily rows into a handful per customer-product before anything crosses
+the wire. Segments are then rated chunk by chunk with RateIndex.
+"""
+from dataclasses import dataclass, field
+from datetime import date, timedelta
+from typing import Iterable
+
+import numpy as np
+
+from billing.rating import OPEN_END, RateIndex, to_day, to_days
+
+
+def segment_starts(date_from: date, date_to: date, *indexes: RateIndex) -> list[date]:
+    """Every date in [date_from, date_to] at which some rate window starts or ends."""
+    lo, hi = to_day(date_from), to_day(date_to)
+    bounds = {lo}
+    for index in indexes:
+        bounds.update(index.starts)
+        bounds.update(e + 1 for e in index.ends if e != OPEN_END)
+    return [d.astype(date) for d in sorted(b for b in bounds if lo <= b <= hi)]
+
+
+def usage_segments_sql(starts: list[date]) -> str:
+    """USAGE_DAILY_AGG rolled up to (segment, customer, plan, product, unit).
+
+    The plan is the one in effect on each usage date (SCD2 as-of join), so a
+    mid-range plan change yields separate rows per plan within a segment.
+
+    Expects %(df)s / %(dt)s bind parameters for the date range.
+    """
+    if not starts:
+        raise ValueError("No segments: the date range is empty")
+    case = " ".join(
+        f"WHEN agg.EVENT_DATE >= '{d.isoformat()}' THEN '{d.isoformat()}'::DATE"
+        for d in reversed(starts)
+    )
+    return f"""
+        SELECT
+            CASE {case} END       AS SEGMENT_START,
+            agg.CUSTOMER_ID,
+            c.PLAN_ID,
+            agg.PRODUCT_ID,
+            agg.UNIT,
+            SUM(agg.TOTAL_QUANTITY) AS TOTAL_QUANTITY
+        FROM NIMBUSBILL.SILVER.USAGE_DAILY_AGG agg
+        JOIN NIMBUSBILL.GOLD.DIM_CUSTOMER c
+            ON agg.CUSTOMER_ID = c.CUSTOMER_ID
+            AND agg.EVENT_DATE >= c.EFFECTIVE_START::DATE
+            AND agg.EVENT_DATE < COALESCE(c.EFFECTIVE_END::DATE, '9999-12-31')
+        WHERE agg.EVENT_DATE BETWEEN %(df)s AND %(dt)s
+        GROUP BY 1, 2, 3, 4, 5
+    """
+
+
+@dataclass
+class RepricingResult:
+    """Baseline vs candidate totals accumulated over all rated chunks."""
+    rows_rated: int = 0
+    unpriced_baseline: int = 0
+    unpriced_candidate: int = 0
+    by_customer: dict[str, list[float]] = field(default_factory=dict)
+    by_product: dict[str, list[float]] = field(default_factory=dict)
+
+    @property
+    def baseline_total(self) -> float:
+        return sum(v[0] for v in self.by_product.values())
+
+    @property
+    def candidate_total(self) -> float:
+        return sum(v[1] for v in self.by_product.values())
+
+    def customer_deltas(self, top: int | None = None) -> list[dict]:
+        """Per-customer deltas, largest absolute change first."""
+        return _deltas(self.by_customer, "customer_id", top)
+
+    def product_deltas(self) -> list[dict]:
+        return _deltas(self.by_product, "product_id", None)
+
+
+def _deltas(totals: dict[str, list[float]], key: str, top: int | None) -> list[dict]:
+    rows = [
+        {key: k, "baseline": b, "candidate": c, "delta": c - b}
+        for k, (b, c) in totals.items()
+    ]
+    rows.sort(key=lambda r: abs(r["delta"]), reverse=True)
+    return rows[:top] if top is not None else rows
+
+
+def _accumulate(totals: dict[str, list[float]], keys: list, baseline: np.ndarray, candidate: np.ndarray):
+    codes: dict = {}
+    inverse = np.fromiter((codes.setdefault(k, len(codes)) for k in keys), dtype=np.int64, count=len(keys))
+    b = np.bincount(inverse, weights=baseline, minlength=len(codes))
+    c = np.bincount(inverse, weights=candidate, minlength=len(codes))
+    for k, bv, cv in zip(codes, b.tolist(), c.tolist()):
+        acc = totals.setdefault(k, [0.0, 0.0])
+        acc[0] += bv
+        acc[1] += cv
+
+
+def simulate(chunks: Iterable[list[dict]], baseline: RateIndex, candidate: RateIndex) -> RepricingResult:
+    """Rate segment rows (see usage_segments_sql) under both catalogs."""
+    result = RepricingResult()
+    for rows in chunks:
+        if not rows:
+            continue
+        customers = [r["customer_id"] for r in rows]
+        plans = [r["plan_id"] for r in rows]
+        products = [r["product_id"] for r in rows]
+        units = [r["unit"] for r in rows]
+        days = to_days([r["segment_start"] for r in rows])
+        qty = np.array([float(r["total_quantity"]) for r in rows], dtype=np.float64)
+
+        base = baseline.rate(products, plans, units, days, qty)
+        cand = candidate.rate(products, plans, units, days, qty)
+
+        result.rows_rated += len(rows)
+        result.unpriced_baseline += int(base.unpriced.sum())
+        result.unpriced_candidate += int(cand.unpriced.sum())
+        _accumulate(result.by_customer, customers, base.cost, cand.cost)
+        _accumulate(result.by_product, products, base.cost, cand.cost)
+    return result
+
+
+def default_range(today: date | None = None) -> tuple[date, date]:
+    """The previous full calendar quarter."""
+    today = today or date.today()
+    q_start = date(today.year, 3 * ((today.month - 1) // 3) + 1, 1)
+    prev_end = q_start - timedelta(days=1)
+    prev_start = date(prev_end.year, 3 * ((prev_end.month - 1) // 3) + 1, 1)
+    return prev_start, prev_end
@@ -0,0 +1,109 @@
+"""
+singleflight.py
+
+Request coalescing for identical concurrent warehouse reads.
+
+When several API requests issue the same read (same normalized SQL and
+parameters) while one is already running, they wait for that execution and
+share its result instead of each firing a query. An error in the shared
+execution is raised to every waiter. The number of waiters per in-flight
+call is capped; callers beyond the cap run their own query rather than
+pile up behind one that may be slow.
+"""
+from __future__ import annotations
+
+import json
+import re
+import threading
+from dataclasses import asdict, dataclass
+from typing import Any, Callable
+
+_WHITESPACE = re.compile(r"\s+")
+_READ = re.compile(r"^\s*(SELECT|WITH|SHOW|DESCRIBE|DESC)\b", re.IGNORECASE)
+
+
+def normalize_sql(sql: str) -> str:
+    return _WHITESPACE.sub(" ", sql).strip()
+
+
+def is_read(sql: str) -> bool:
+    """Only reads are coalesced; two identical writes must both run."""
+    return bool(_READ.match(sql))
+
+
+def flight_key(sql: str, params: dict | None) -> str:
+    return normalize_sql(sql) + "\x00" + json.dumps(params or {}, sort_keys=True, default=str)
+
+
+@dataclass
+class FlightStats:
+    executions: int = 0   # calls that ran fn
+    coalesced: int = 0    # calls answered by another call's execution (queries saved)
+    overflow: int = 0     # calls that found the waiter cap full and ran fn themselves
+    errors: int = 0       # executions that raised
+
+    def to_dict(self) -> dict:
+        return asdict(self)
+
+
+class _Call:
+    __slots__ = ("done", "result", "error", "waiters")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result: Any = None
+        self.error: BaseException | None = None
+        self.waiters = 0
+
+
+class SingleFlight:
+    def __init__(self, max_waiters: int = 64):
+        self.max_waiters = max_waiters
+        self.stats = FlightStats()
+        self._calls: dict[str, _Call] = {}
+        self._lock = threading.Lock()
+
+    def do(self, key: str, fn: Callable[[], Any]) -> tuple[Any, bool]:
+        """Run fn once per key among concurrent callers; returns (result, shared)."""
+        with self._lock:
+            call = self._calls.get(key)
+            if call is not None and call.waiters < self.max_waiters:
+                call.waiters += 1
+                self.stats.coalesced += 1
+                leader = False
+            elif call is not None:
+                self.stats.overflow += 1
+                call, leader = None, False
+            else:
+                call = self._calls[key] = _Call()
+                leader = True
+
+        if call is None:
+            return self._execute(fn), False
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+
+        try:
+            call.result = self._execute(fn)
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result, False
+
+    def _execute(self, fn: Callable[[], Any]) -> Any:
+        with self._lock:
+            self.stats.executions += 1
+        try:
+            return fn()
+        except BaseException:
+            with self._lock:
+                self.stats.errors += 1
+            raise
@@ -0,0 +1,105 @@
+"""
+tax.py
+
+Effective-dated tax rules per country and product category.
+
+GOLD.DIM_TAX_RULE holds one window per (country, product category); a NULL
+category is the country's default and covers every category without a rule
+of its own. The month-end close resolves the rules in force on the last day
+of the billing period once, into OPS.INVOICE_TAX_RATES, and every invoice of
+the close joins that snapshot: one 'tax' line per invoice and rule, taxing
+the sum of the invoice's lines in its categories, rounded to cents. The
+header's TAX is the sum of its tax lines, so the integrity check (header
+TOTAL = sum of lines) holds by construction.
+
+This module validates rule loads and states the same precedence in Python.
+"""
+from __future__ import annotations
+
+import csv
+from dataclasses import dataclass
+from datetime import date
+from decimal import ROUND_HALF_UP, Decimal
+
+from billing.fx import OPEN_END, to_date
+
+DIM_TAX_RULE = "NIMBUSBILL.GOLD.DIM_TAX_RULE"
+
+
+@dataclass(frozen=True)
+class TaxRule:
+    rule_id: str
+    country: str
+    rate: float                     # fraction of the taxable amount, 0.2 = 20%
+    effective_from: date
+    effective_to: date | None = None
+    product_category: str | None = None     # None = every category of the country
+
+    @classmethod
+    def from_row(cls, row: dict) -> "TaxRule":
+        return cls(row["rule_id"], row["country"].upper(), float(row["rate"]),
+                   to_date(row["effective_from"]), to_date(row.get("effective_to")),
+                   row.get("product_category") or None)
+
+    def covers(self, day: date) -> bool:
+        return self.effective_from <= day <= (self.effective_to or OPEN_END)
+
+
+def check_rules(rules: list[TaxRule]) -> None:
+    """Reject duplicate ids, rates outside [0, 1) and overlapping windows of one (country, category)."""
+    ids: set[str] = set()
+    last: dict[tuple[str, str], TaxRule] = {}
+    for r in sorted(rules, key=lambda r: (r.country, r.product_category or "", r.effective_from)):
+        if r.rule_id in ids:
+            raise ValueError(f"Duplicate tax rule id {r.rule_id}")
+        ids.add(r.rule_id)
+        if not 0 <= r.rate < 1:
+            raise ValueError(f"Tax rate of {r.rule_id} must be in [0, 1), got {r.rate}")
+        if r.effective_to is not None and r.effective_to < r.effective_from:
+            raise ValueError(f"Tax rule {r.rule_id} ends before it starts: "
+                             f"{r.effective_from} > {r.effective_to}")
+        key = (r.country, r.product_category or "")
+        prev = last.get(key)
+        if prev is not None and (prev.effective_to or OPEN_END) >= r.effective_from:
+            raise ValueError(f"Overlapping tax rules for {r.country}/{r.product_category or '*'}: "
+                             f"{prev.rule_id} and {r.rule_id}")
+        last[key] = r
+
+
+def read_rules_csv(path: str) -> list[TaxRule]:
+    """Read a tax_rules CSV (rule_id, country, product_category, rate, effective_from, effective_to)."""
+    with open(path, newline="") as f:
+        rules = [TaxRule.from_row(row) for row in csv.DictReader(f)]
+    check_rules(rules)
+    return rules
+
+
+class TaxLookup:
+    """The rules in force on one tax date, memoized per (country, category).
+
+    A category's own rule wins over the country default; a country with
+    neither is not taxed (None).
+    """
+
+    def __init__(self, rules: list[TaxRule], day):
+        day = to_date(day)
+        self.day = day
+        self._rules = {(r.country, r.product_category): r for r in rules if r.covers(day)}
+        self._resolved: dict[tuple[str, str | None], TaxRule | None] = {}
+
+    def rule(self, country: str | None, category: str | None) -> TaxRule | None:
+        key = ((country or "").upper(), category)
+        if key not in self._resolved:
+            own = self._rules.get(key) if category is not None else None
+            self._resolved[key] = own or self._rules.get((key[0], None))
+        return self._resolved[key]
+
+    def tax(self, amounts: dict[str | None, float], country: str | None) -> dict[str, float]:
+        """Tax per rule id on an invoice's amounts by category, rounded half up to cents like ROUND()."""
+        taxable: dict[TaxRule, Decimal] = {}
+        for category, amount in amounts.items():
+            r = self.rule(country, category)
+            if r is not None:
+                taxable[r] = taxable.get(r, Decimal(0)) + Decimal(str(amount))
+        return {r.rule_id: float((base * Decimal(str(r.rate))).quantize(Decimal("0.01"), ROUND_HALF_UP))
+                for r, base in taxable.items()}
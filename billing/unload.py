@@ -0,0 +1,277 @@
+"""
+unload.py
+
+Warehouse-side export jobs for large usage extracts.
+
+Instead of pulling rows through the API, a job runs COPY INTO an internal
+stage with Parquet output partitioned by date and customer
+(`usage/<job_id>/date=YYYY-MM-DD/customer=<id>/...`). The API only records
+the job in OPS.EXPORT_JOBS and, once it succeeds, hands out presigned URLs
+for the files. `LocalStage` produces the same layout on local disk from the
+same SELECT, for development and tests.
+"""
+from __future__ import annotations
+
+import json
+import os
+import time
+import uuid
+from dataclasses import dataclass, field
+from datetime import date
+from decimal import Decimal
+from typing import Callable
+
+STAGE = "@NIMBUSBILL.OPS.EXPORT_STAGE"
+JOBS_TABLE = "NIMBUSBILL.OPS.EXPORT_JOBS"
+
+# Output columns, in SELECT order; LocalStage builds its Parquet schema from these.
+USAGE_COLUMNS = [
+    "date_id", "customer_id", "product_id", "unit", "region", "event_plan_id",
+    "total_quantity", "billable_quantity", "cost_amount", "currency",
+]
+
+
+@dataclass(frozen=True)
+class UsageExport:
+    date_from: date
+    date_to: date
+    customer_sks: tuple[int, ...] = ()  # empty = all customers
+
+    def __post_init__(self):
+        if self.date_from > self.date_to:
+            raise ValueError("date_from must not be after date_to")
+
+    def select_sql(self) -> str:
+        """The extract, with %(df)s / %(dt)s / %(sks)s bind parameters."""
+        sql = """
+            SELECT f.DATE_ID, c.CUSTOMER_ID, f.PRODUCT_ID, f.UNIT, f.REGION, f.EVENT_PLAN_ID,
+                   f.TOTAL_QUANTITY, f.BILLABLE_QUANTITY, f.COST_AMOUNT, f.CURRENCY
+            FROM NIMBUSBILL.GOLD.FACT_CUSTOMER_DAILY_USAGE f
+            JOIN NIMBUSBILL.GOLD.DIM_CUSTOMER c ON f.CUSTOMER_SK = c.CUSTOMER_SK
+            WHERE f.DATE_ID BETWEEN %(df)s AND %(dt)s"""
+        if self.customer_sks:
+            sql += "\n              AND f.CUSTOMER_SK IN (%(sks)s)"
+        return sql
+
+    def params(self) -> dict:
+        params = {"df": str(self.date_from), "dt": str(self.date_to)}
+        if self.customer_sks:
+            params["sks"] = self.customer_sks
+        return params
+
+    def to_json(self) -> str:
+        return json.dumps({"date_from": str(self.date_from), "date_to": str(self.date_to),
+                           "customer_sks": list(self.customer_sks)})
+
+
+@dataclass
+class UnloadResult:
+    rows: int
+    files: list[dict] = field(default_factory=list)  # {"path", "size"}
+
+    @property
+    def bytes(self) -> int:
+        return sum(f["size"] for f in self.files)
+
+
+def job_prefix(job_id: str) -> str:
+    return f"usage/{job_id}/"
+
+
+def partition_path(row: dict) -> str:
+    return f"date={row['date_id']}/customer={row['customer_id']}"
+
+
+def _usage_schema():
+    import pyarrow as pa
+
+    qty, money = pa.decimal128(38, 6), pa.decimal128(38, 10)
+    types = {"date_id": pa.date32(), "total_quantity": qty, "billable_quantity": qty, "cost_amount": money}
+    return pa.schema([(name, types.get(name, pa.string())) for name in USAGE_COLUMNS])
+
+
+def _usage_table(rows: list[dict], schema):
+    import pyarrow as pa
+
+    def column(f):
+        values = [r.get(f.name) for r in rows]
+        if not pa.types.is_decimal(f.type):
+            return values
+        return [v if v is None else round(Decimal(str(v)), f.type.scale) for v in values]
+
+    return pa.Table.from_pydict({f.name: column(f) for f in schema}, schema=schema)
+
+
+# ── Stages ──────────────────────────────────────────────────────────────────
+
+class SnowflakeStage:
+    """COPY INTO the internal export stage; `fetch` is the API's query()."""
+
+    def __init__(self, fetch: Callable[..., list[dict]], stage: str = STAGE):
+        self.fetch = fetch
+        self.stage = stage
+
+    def copy_sql(self, job_id: str, export: UsageExport) -> str:
+        return f"""
+            COPY INTO {self.stage}/{job_prefix(job_id)}
+            FROM ({export.select_sql()}
+            )
+            PARTITION BY ('date=' || TO_VARCHAR(DATE_ID, 'YYYY-MM-DD') || '/customer=' || CUSTOMER_ID)
+            FILE_FORMAT = (TYPE = PARQUET COMPRESSION = SNAPPY)
+            HEADER = TRUE
+            MAX_FILE_SIZE = 268435456
+        """
+
+    def _files_sql(self, urls: bool) -> str:
+        url = f", GET_PRESIGNED_URL({self.stage}, RELATIVE_PATH, %(expiry)s) AS URL" if urls else ""
+        return f"""
+            SELECT RELATIVE_PATH AS PATH, SIZE{url}
+            FROM DIRECTORY({self.stage})
+            WHERE STARTSWITH(RELATIVE_PATH, %(prefix)s)
+            ORDER BY RELATIVE_PATH
+        """
+
+    def unload(self, job_id: str, export: UsageExport) -> UnloadResult:
+        rows = self.fetch(self.copy_sql(job_id, export), export.params())
+        unloaded = sum(int(r.get("rows_unloaded") or 0) for r in rows)
+        self.fetch(f"ALTER STAGE {self.stage.lstrip('@')} REFRESH SUBPATH = %(prefix)s",
+                   {"prefix": job_prefix(job_id)})
+        files = self.fetch(self._files_sql(urls=False), {"prefix": job_prefix(job_id)})
+        return UnloadResult(unloaded, [{"path": f["path"], "size": int(f["size"])} for f in files])
+
+    def locations(self, job_id: str, expiry_seconds: int = 3600) -> list[dict]:
+        return self.fetch(self._files_sql(urls=True), {"prefix": job_prefix(job_id), "expiry": expiry_seconds})
+
+
+class LocalStage:
+    """Stand-in that writes the COPY layout to `root` from the same SELECT.
+
+    `fetch_chunks(sql, params)` yields lists of row dicts (the API's
+    query_chunks). Requires pyarrow.
+    """
+
+    def __init__(self, root: str, fetch_chunks: Callable):
+        self.root = root
+        self.fetch_chunks = fetch_chunks
+
+    def unload(self, job_id: str, export: UsageExport) -> UnloadResult:
+        import pyarrow.parquet as pq
+
+        schema = _usage_schema()
+        base = os.path.join(self.root, job_prefix(job_id))
+        sql = export.select_sql() + "\n            ORDER BY f.DATE_ID, c.CUSTOMER_ID"
+        files: list[dict] = []
+        counts: dict[str, int] = {}
+        writer, current, rows = None, None, 0
+
+        def close():
+            if writer is not None:
+                writer.close()
+                files[-1]["size"] = os.path.getsize(os.path.join(self.root, files[-1]["path"]))
+
+        try:
+            for chunk in self.fetch_chunks(sql, export.params()):
+                # Rows arrive ordered by partition, so one writer is open at a time.
+                start = 0
+                for i in range(len(chunk) + 1):
+                    part = partition_path(chunk[i]) if i < len(chunk) else None
+                    if i < len(chunk) and part == current:
+                        continue
+                    if i > start:
+                        writer.write_table(_usage_table(chunk[start:i], schema))
+                    if part is None:
+                        break
+                    close()
+                    n = counts[part] = counts.get(part, -1) + 1
+                    rel = f"{job_prefix(job_id)}{part}/data_{n}.snappy.parquet"
+                    os.makedirs(os.path.join(base, part), exist_ok=True)
+                    writer = pq.ParquetWriter(os.path.join(self.root, rel), schema, compression="snappy")
+                    files.append({"path": rel, "size": 0})
+                    current, start = part, i
+                rows += len(chunk)
+        finally:
+            close()
+        return UnloadResult(rows, files)
+
+    def locations(self, job_id: str, expiry_seconds: int = 3600) -> list[dict]:
+        base = os.path.join(self.root, job_prefix(job_id))
+        out = []
+        for dirpath, _, names in os.walk(base):
+            for name in sorted(names):
+                full = os.path.join(dirpath, name)
+                rel = os.path.relpath(full, self.root).replace(os.sep, "/")
+                out.append({"path": rel, "size": os.path.getsize(full), "url": full})
+        return sorted(out, key=lambda f: f["path"])
+
+
+# ── Job records ─────────────────────────────────────────────────────────────
+
+class ExportJobs:
+    """Creates, runs and reads jobs in OPS.EXPORT_JOBS."""
+
+    def __init__(self, fetch: Callable[..., list[dict]], stage, clock: Callable[[], float] = time.perf_counter):
+        self.fetch = fetch
+        self.stage = stage
+        self.clock = clock
+
+    def create(self, export: UsageExport) -> str:
+        job_id = f"exp_{uuid.uuid4().hex[:16]}"
+        self.fetch(
+            f"""
+            INSERT INTO {JOBS_TABLE} (JOB_ID, KIND, STATUS, PARAMS, STAGE_PATH, CREATED_TS)
+            SELECT %(job_id)s, 'usage', 'queued', PARSE_JSON(%(params)s), %(path)s, CURRENT_TIMESTAMP()
+            """,
+            {"job_id": job_id, "params": export.to_json(), "path": job_prefix(job_id)},
+        )
+        return job_id
+
+    def run(self, job_id: str, export: UsageExport):
+        """Unload and record the outcome; never raises (it runs after the response)."""
+        self.fetch(
+            f"UPDATE {JOBS_TABLE} SET STATUS = 'running', STARTED_TS = CURRENT_TIMESTAMP() WHERE JOB_ID = %(job_id)s",
+            {"job_id": job_id},
+        )
+        t0 = self.clock()
+        try:
+            result = self.stage.unload(job_id, export)
+        except Exception as e:
+            self.fetch(
+                f"""
+                UPDATE {JOBS_TABLE}
+                SET STATUS = 'failed', ERROR_MESSAGE = %(error)s, DURATION_MS = %(ms)s,
+                    FINISHED_TS = CURRENT_TIMESTAMP()
+                WHERE JOB_ID = %(job_id)s
+                """,
+                {"job_id": job_id, "error": str(e)[:4000], "ms": int((self.clock() - t0) * 1000)},
+            )
+            return
+        self.fetch(
+            f"""
+            UPDATE {JOBS_TABLE}
+            SET STATUS = 'succeeded', ROWS_UNLOADED = %(rows)s, FILE_COUNT = %(files)s,
+                BYTES_UNLOADED = %(bytes)s, DURATION_MS = %(ms)s, FINISHED_TS = CURRENT_TIMESTAMP()
+            WHERE JOB_ID = %(job_id)s
+            """,
+            {"job_id": job_id, "rows": result.rows, "files": len(result.files),
+             "bytes": result.bytes, "ms": int((self.clock() - t0) * 1000)},
+        )
+
+    def get(self, job_id: str) -> dict | None:
+        rows = self.fetch(
+            f"""
+            SELECT JOB_ID, KIND, STATUS, PARAMS, STAGE_PATH, ROWS_UNLOADED, FILE_COUNT,
+                   BYTES_UNLOADED, DURATION_MS, ERROR_MESSAGE, CREATED_TS, STARTED_TS, FINISHED_TS
+            FROM {JOBS_TABLE}
+            WHERE JOB_ID = %(job_id)s
+            """,
+            {"job_id": job_id},
+        )
+        if not rows:
+            return None
+        job = dict(rows[0])
+        if isinstance(job.get("params"), str):
+            job["params"] = json.loads(job["params"])
+        return job
+
+    def files(self, job_id: str, expiry_seconds: int = 3600) -> list[dict]:
+        return self.stage.locations(job_id, expiry_seconds)
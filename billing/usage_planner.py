@@ -0,0 +1,162 @@
+"""
+usage_planner.py
+
+Aggregate routing for /usage. A request names the dimensions it filters on
+(customer, product, region), a time grain and a date range; the planner
+answers it from the smallest precomputed table that can do so exactly:
+
+    FACT_PRODUCT_DAILY_USAGE      day    product               (all customers)
+    FACT_REVENUE_CUBE             day    product, region       (all customers)
+    FACT_CUSTOMER_MONTHLY_USAGE   month  customer, product     (whole months only)
+    FACT_CUSTOMER_DAILY_USAGE     day    customer, product, region
+    FACT_CUSTOMER_HOURLY_USAGE    hour   customer, product, region
+
+Sources are tried in that order (expected rows per query, smallest first).
+A source qualifies when it keeps every requested dimension, its time grain
+is at least as fine as the requested one and, for the monthly rollup, the
+range starts and ends on month boundaries. The hourly fact answers every
+request, so it is the fallback.
+
+Every plan records which source served it; counts are in `info()`.
+"""
+from __future__ import annotations
+
+import calendar
+import threading
+from collections import Counter
+from dataclasses import dataclass
+from datetime import date, timedelta
+
+GRAINS = ("hour", "day", "month")         # finest first
+DIMENSIONS = ("customer", "product", "region")
+
+# How far back each grain reaches; an earlier date_from is clipped to it
+LOOKBACK_DAYS = {"hour": 7, "day": 90, "month": 366}
+MAX_ROWS = 5000
+
+
+@dataclass(frozen=True)
+class Source:
+    name: str
+    table: str
+    grain: str
+    dimensions: frozenset
+    date_column: str = "f.DATE_ID"      # the month's first day for monthly sources
+    hour_column: str = ""
+
+
+SOURCES = [
+    Source("product_daily", "NIMBUSBILL.GOLD.FACT_PRODUCT_DAILY_USAGE", "day", frozenset({"product"})),
+    Source("revenue_cube", "NIMBUSBILL.GOLD.FACT_REVENUE_CUBE", "day", frozenset({"product", "region"})),
+    Source("customer_monthly", "NIMBUSBILL.GOLD.FACT_CUSTOMER_MONTHLY_USAGE", "month",
+           frozenset({"customer", "product"}), date_column="f.MONTH_ID"),
+    Source("customer_daily", "NIMBUSBILL.GOLD.FACT_CUSTOMER_DAILY_USAGE", "day",
+           frozenset({"customer", "product", "region"})),
+    Source("customer_hourly", "NIMBUSBILL.GOLD.FACT_CUSTOMER_HOURLY_USAGE", "hour",
+           frozenset({"customer", "product", "region"}), hour_column="f.HOUR_TS"),
+]
+
+
+@dataclass(frozen=True)
+class Plan:
+    source: Source
+    sql: str
+    params: dict
+    date_from: date
+    date_to: date | None
+
+
+def _month_end(d: date) -> date:
+    return d.replace(day=calendar.monthrange(d.year, d.month)[1])
+
+
+def can_answer(source: Source, dimensions: set, grain: str, date_from: date, date_to: date | None) -> bool:
+    if not dimensions <= source.dimensions:
+        return False
+    if GRAINS.index(source.grain) > GRAINS.index(grain):
+        return False
+    if source.grain == "month":
+        # A month row can't be split, so the range must cover whole months
+        return date_from.day == 1 and (date_to is None or date_to == _month_end(date_to))
+    return True
+
+
+def choose(dimensions: set, grain: str, date_from: date, date_to: date | None,
+           sources: list[Source] = SOURCES) -> Source:
+    unknown = dimensions - set(DIMENSIONS)
+    if unknown:
+        raise ValueError(f"unsupported dimensions {sorted(unknown)}")
+    return next(s for s in sources if can_answer(s, dimensions, grain, date_from, date_to))
+
+
+def plan(grain: str = "day", date_from: date | None = None, date_to: date | None = None,
+         sks: list | None = None, product_id: str | None = None, region: str | None = None,
+         today: date | None = None, sources: list[Source] = SOURCES) -> Plan:
+    """The /usage query (rows per bucket x product x unit x currency) on the cheapest exact source."""
+    if grain not in GRAINS:
+        raise ValueError(f"unsupported grain {grain!r}")
+    floor = (today or date.today()) - timedelta(days=LOOKBACK_DAYS[grain])
+    if grain == "month":
+        floor = floor.replace(day=1)          # whole months, so the monthly rollup can serve it
+    date_from = max(date_from, floor) if date_from else floor
+    dimensions = {"product"}                  # rows are always per product
+    if sks is not None:
+        dimensions.add("customer")
+    if region is not None:
+        dimensions.add("region")
+    source = choose(dimensions, grain, date_from, date_to, sources)
+
+    if grain == "hour":
+        buckets = [(source.date_column, "DATE_ID"), (source.hour_column, "HOUR_TS")]
+    elif grain == "month" and source.grain != "month":
+        buckets = [(f"DATE_TRUNC('MONTH', {source.date_column})", "DATE_ID")]
+    else:
+        buckets = [(source.date_column, "DATE_ID")]
+
+    where = [f"{source.date_column} >= %(df)s"]
+    params = {"df": str(date_from)}
+    if date_to is not None:
+        where.append(f"{source.date_column} <= %(dt)s")
+        params["dt"] = str(date_to)
+    if sks is not None:
+        where.append("f.CUSTOMER_SK IN (%(sks)s)")
+        params["sks"] = sks
+    if product_id is not None:
+        where.append("f.PRODUCT_ID = %(pid)s")
+        params["pid"] = product_id
+    if region is not None:
+        where.append("f.REGION = %(region)s")
+        params["region"] = region
+
+    group = ", ".join(expr for expr, _ in buckets)
+    sql = f"""
+        SELECT
+            {", ".join(f"{expr} AS {alias}" for expr, alias in buckets)}, f.PRODUCT_ID, f.UNIT, f.CURRENCY,
+            SUM(f.TOTAL_QUANTITY) AS TOTAL_QUANTITY,
+            SUM(f.COST_AMOUNT) AS COST_AMOUNT
+        FROM {source.table} f
+        WHERE {" AND ".join(where)}
+        GROUP BY {group}, f.PRODUCT_ID, f.UNIT, f.CURRENCY
+        ORDER BY {", ".join(f"{expr} DESC" for expr, _ in buckets)}
+        LIMIT {MAX_ROWS}
+    """
+    return Plan(source, sql, params, date_from, date_to)
+
+
+class UsagePlanner:
+    """`plan()` plus per-source counts of the requests each table served."""
+
+    def __init__(self, sources: list[Source] = SOURCES):
+        self.sources = sources
+        self.served: Counter = Counter()
+        self._lock = threading.Lock()
+
+    def plan(self, grain: str = "day", **kwargs) -> Plan:
+        result = plan(grain, sources=self.sources, **kwargs)
+        with self._lock:
+            self.served[result.source.name] += 1
+        return result
+
+    def info(self) -> dict:
+        with self._lock:
+            return {"served": dict(self.served)}
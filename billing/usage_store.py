@@ -0,0 +1,293 @@
+"""
+usage_store.py
+
+Serving store for per-customer usage series.
+
+The daily pipeline snapshots FACT_CUSTOMER_DAILY_USAGE from the start of a
+trailing window (90 days by default) into one binary file; the API
+memory-maps it and answers `/customers/{id}/usage` without a warehouse
+round-trip. Layout, all little-endian and 8-byte aligned:
+
+  header     magic, version, window start, as-of date, build time, counts,
+             section offsets
+  customers  (customer_sk i64, first series u32, series count u32), sorted by SK
+  series     (first point u64, point count u32, product/unit/currency codes u16)
+  dates      i32 days since 1970-01-01, ascending within each series
+  quantity   f64
+  cost       f64
+  strings    JSON lists the product/unit/currency codes index into
+
+A series is one (customer SK, product, unit, currency) combination; its
+points are contiguous in the three point columns. The file is written to a
+temp path and renamed into place, so readers see the old or the new file,
+never a partial one.
+"""
+from __future__ import annotations
+
+import json
+import mmap
+import os
+import struct
+import tempfile
+import threading
+import time
+from array import array
+from dataclasses import dataclass
+from datetime import date, timedelta
+from typing import Callable, Iterable
+
+import numpy as np
+
+MAGIC = b"NBUS"
+VERSION = 1
+EPOCH = date(1970, 1, 1)
+_EPOCH_ORDINAL = EPOCH.toordinal()
+DEFAULT_WINDOW_DAYS = 90
+
+# magic, version, window_start, as_of, built_at, n_customers, n_series, n_points,
+# offsets of customers/series/dates/quantity/cost/strings, strings length
+_HEADER = struct.Struct("<4sHxxiiqIIQ6QQ")
+
+_CUSTOMER = np.dtype([("sk", "<i8"), ("first", "<u4"), ("count", "<u4")])
+_SERIES = np.dtype([("first", "<u8"), ("count", "<u4"), ("product", "<u2"), ("unit", "<u2"),
+                    ("currency", "<u2"), ("_pad", "<u2")])
+
+# The fact is also split by region and event plan; a series point is their sum.
+SNAPSHOT_SQL = """
+    SELECT CUSTOMER_SK, PRODUCT_ID, UNIT, CURRENCY, DATE_ID,
+           SUM(TOTAL_QUANTITY) AS TOTAL_QUANTITY, SUM(COST_AMOUNT) AS COST_AMOUNT
+    FROM NIMBUSBILL.GOLD.FACT_CUSTOMER_DAILY_USAGE
+    WHERE DATE_ID >= %(start)s
+    GROUP BY CUSTOMER_SK, PRODUCT_ID, UNIT, CURRENCY, DATE_ID
+    ORDER BY CUSTOMER_SK, PRODUCT_ID, UNIT, CURRENCY, DATE_ID
+"""
+
+
+def _days(d: date) -> int:
+    return (d - EPOCH).days
+
+
+def _align(n: int) -> int:
+    return (n + 7) & ~7
+
+
+@dataclass
+class StoreSummary:
+    customers: int
+    series: int
+    points: int
+    bytes: int
+
+
+# ── Writer ──────────────────────────────────────────────────────────────────
+
+def write_store(rows: Iterable[tuple], path: str, window_start: date, as_of: date) -> StoreSummary:
+    """Write rows of (customer_sk, product_id, unit, currency, date_id, quantity, cost).
+
+    Rows must be ordered by customer_sk, product_id, unit, currency, date_id
+    (SNAPSHOT_SQL's order).
+    """
+    customers, series = [], []
+    dates, quantity, cost = array("i"), array("d"), array("d")
+    codes: dict[str, dict[str, int]] = {"products": {}, "units": {}, "currencies": {}}
+
+    def code(kind: str, value) -> int:
+        table = codes[kind]
+        return table.setdefault("" if value is None else str(value), len(table))
+
+    current_sk, current_key = None, None
+    for sk, product, unit, currency, day, qty, amount in rows:
+        sk = int(sk)
+        if sk != current_sk:
+            if current_sk is not None and sk < current_sk:
+                raise ValueError("rows must be ordered by customer_sk")
+            customers.append([sk, len(series), 0])
+            current_sk, current_key = sk, None
+        key = (product, unit, currency)
+        if key != current_key:
+            series.append([len(dates), 0, code("products", product), code("units", unit),
+                           code("currencies", currency), 0])
+            customers[-1][2] += 1
+            current_key = key
+        dates.append(_days(day))
+        quantity.append(float(qty or 0))
+        cost.append(float(amount or 0))
+        series[-1][1] += 1
+
+    strings = json.dumps({kind: list(table) for kind, table in codes.items()}).encode()
+    sections = [
+        np.array([tuple(c) for c in customers], dtype=_CUSTOMER).tobytes(),
+        np.array([tuple(s) for s in series], dtype=_SERIES).tobytes(),
+        dates.tobytes(), quantity.tobytes(), cost.tobytes(), strings,
+    ]
+    offsets, pos = [], _align(_HEADER.size)
+    for section in sections:
+        offsets.append(pos)
+        pos = _align(pos + len(section))
+
+    header = _HEADER.pack(MAGIC, VERSION, _days(window_start), _days(as_of), int(time.time()),
+                          len(customers), len(series), len(dates), *offsets, len(strings))
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=directory, suffix=".partial")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(header)
+            for offset, section in zip(offsets, sections):
+                f.write(b"\0" * (offset - f.tell()))
+                f.write(section)
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+    return StoreSummary(len(customers), len(series), len(dates), os.path.getsize(path))
+
+
+def publish(cursor, path: str, as_of: date, window_days: int = DEFAULT_WINDOW_DAYS,
+            fetch_size: int = 100_000) -> StoreSummary:
+    """Snapshot Gold usage from the window start onwards into `path`."""
+    window_start = as_of - timedelta(days=window_days - 1)
+    cursor.execute(SNAPSHOT_SQL, {"start": str(window_start)})
+
+    def rows():
+        while True:
+            batch = cursor.fetchmany(fetch_size)
+            if not batch:
+                return
+            yield from batch
+
+    return write_store(rows(), path, window_start, as_of)
+
+
+# ── Reader ──────────────────────────────────────────────────────────────────
+
+class SeriesFile:
+    """One memory-mapped store file."""
+
+    def __init__(self, path: str):
+        with open(path, "rb") as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        (magic, version, window_start, as_of, built_at, n_customers, n_series, n_points,
+         o_customers, o_series, o_dates, o_quantity, o_cost, o_strings,
+         strings_len) = _HEADER.unpack_from(self._mm, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"{path} is not a version {VERSION} usage store")
+        self.window_start = EPOCH + timedelta(days=window_start)
+        self.as_of = EPOCH + timedelta(days=as_of)
+        self.built_at = built_at
+        self.customers = np.frombuffer(self._mm, _CUSTOMER, n_customers, o_customers)
+        self.series = np.frombuffer(self._mm, _SERIES, n_series, o_series)
+        self.dates = np.frombuffer(self._mm, "<i4", n_points, o_dates)
+        self.quantity = np.frombuffer(self._mm, "<f8", n_points, o_quantity)
+        self.cost = np.frombuffer(self._mm, "<f8", n_points, o_cost)
+        strings = json.loads(self._mm[o_strings:o_strings + strings_len])
+        self.products, self.units = strings["products"], strings["units"]
+        self.currencies = [c or None for c in strings["currencies"]]
+
+    def rows(self, sks: Iterable[int], date_from: date | None = None,
+             date_to: date | None = None) -> list[dict]:
+        """Usage rows for the given SKs, newest first, like the warehouse query."""
+        lo = _days(date_from) if date_from else np.iinfo(np.int32).min
+        hi = _days(date_to) if date_to else np.iinfo(np.int32).max
+        index = self.customers["sk"]
+        ranges, labels = [], []
+        for sk in sks:
+            i = int(np.searchsorted(index, sk))
+            if i == len(index) or index[i] != sk:
+                continue
+            first, count = int(self.customers["first"][i]), int(self.customers["count"][i])
+            for start, n, product, unit, currency in self.series[
+                ["first", "count", "product", "unit", "currency"]
+            ][first:first + count].tolist():
+                days = self.dates[start:start + n]
+                a = start + int(np.searchsorted(days, lo, "left"))
+                b = start + int(np.searchsorted(days, hi, "right"))
+                if a < b:
+                    ranges.append((a, b))
+                    labels.append((self.products[product], self.units[unit], self.currencies[currency]))
+        if not ranges:
+            return []
+
+        # Gather every selected point, then order by date desc, product, unit.
+        points = np.concatenate([np.arange(a, b) for a, b in ranges])
+        series = np.repeat(np.arange(len(ranges)), [b - a for a, b in ranges])
+        rank = np.empty(len(labels), dtype=np.int64)
+        rank[sorted(range(len(labels)), key=labels.__getitem__)] = np.arange(len(labels))
+        order = np.lexsort((rank[series], -self.dates[points].astype(np.int64)))
+        points, series = points[order], series[order]
+
+        day_cache: dict[int, date] = {}
+        out = []
+        for d, q, c, s in zip(self.dates[points].tolist(), self.quantity[points].tolist(),
+                              self.cost[points].tolist(), series.tolist()):
+            day = day_cache.get(d)
+            if day is None:
+                day = day_cache[d] = date.fromordinal(_EPOCH_ORDINAL + d)
+            product, unit, currency = labels[s]
+            out.append({"date_id": day, "product_id": product, "unit": unit,
+                        "total_quantity": q, "cost_amount": c, "currency": currency})
+        return out
+
+
+class UsageSeriesStore:
+    """The API's view of the published store file.
+
+    Re-stats the file at most every `check_seconds` and maps the new one
+    when the pipeline has replaced it. `lookup` returns None whenever the
+    store can't answer exactly what the warehouse would (no file, too old,
+    or a range starting before the window), so the caller falls back.
+    """
+
+    def __init__(self, path: str, check_seconds: float = 30, max_age_hours: float = 36,
+                 clock: Callable[[], float] = time.time):
+        self.path = path
+        self.check_seconds = check_seconds
+        self.max_age_hours = max_age_hours
+        self.clock = clock
+        self.stats = {"hits": 0, "fallbacks": 0, "reloads": 0}
+        self._file: SeriesFile | None = None
+        self._identity = None
+        self._checked = float("-inf")
+        self._lock = threading.Lock()
+
+    def current(self) -> SeriesFile | None:
+        now = self.clock()
+        if now - self._checked < self.check_seconds:
+            return self._file
+        with self._lock:
+            if now - self._checked < self.check_seconds:
+                return self._file
+            self._checked = now
+            try:
+                st = os.stat(self.path)
+            except FileNotFoundError:
+                self._file, self._identity = None, None
+                return None
+            identity = (st.st_ino, st.st_mtime_ns, st.st_size)
+            if identity != self._identity:
+                # The previous mapping is released when the last reader drops it.
+                self._file, self._identity = SeriesFile(self.path), identity
+                self.stats["reloads"] += 1
+            return self._file
+
+    def lookup(self, sks: Iterable[int], date_from: date | None,
+               date_to: date | None = None) -> list[dict] | None:
+        store = self.current()
+        if (
+            store is None
+            or date_from is None
+            or date_from < store.window_start
+            or self.clock() - store.built_at > self.max_age_hours * 3600
+        ):
+            self.stats["fallbacks"] += 1
+            return None
+        self.stats["hits"] += 1
+        return store.rows(sks, date_from, date_to)
+
+    def info(self) -> dict:
+        store = self._file
+        info = {"path": self.path, **self.stats}
+        if store is not None:
+            info.update(window_start=str(store.window_start), as_of=str(store.as_of),
+                        customers=len(store.customers), points=len(store.dates))
+        return info
@@ -3,6 +3,7 @@ import random
 import uuid
 import argparse
 import os
+import sys
 from datetime import datetime, timedelta
 
 
@@ -67,25 +68,33 @@ def generate_events(date_str, num_customers, events_per_customer, late_prob=0.01
 
     return events
 
-def save_events(events, date_str, output_dir):
+def save_events(events, date_str, output_dir, fmt="jsonl"):
+    """Write the day's landing file as JSONL (default) or Parquet (billing/landing.py schema)."""
     os.makedirs(output_dir, exist_ok=True)
-    filename = f"usage_events_{date_str}.jsonl"
+    filename = f"usage_events_{date_str}.{fmt}"
     filepath = os.path.join(output_dir, filename)
-    
-    with open(filepath, 'w') as f:
-        for event in events:
-            f.write(json.dumps(event) + "\n")
+
+    if fmt == "parquet":
+        from billing.landing import write_parquet
+        write_parquet(events, filepath)
+    else:
+        with open(filepath, 'w') as f:
+            for event in events:
+                f.write(json.dumps(event) + "\n")
             
     print(f"Generated {len(events)} events to {filepath}")
 
 if __name__ == "__main__":
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
     parser = argparse.ArgumentParser(description="Generate usage events")
     parser.add_argument("--date", type=str, default=datetime.now().strftime("%Y-%m-%d"), help="Date to generate for (YYYY-MM-DD)")
     parser.add_argument("--customers", type=int, default=10, help="Number of customers")
     parser.add_argument("--events", type=int, default=5, help="Avg events per customer")
     parser.add_argument("--output", type=str, default=".", help="Output directory")
+    parser.add_argument("--format", choices=["jsonl", "parquet"], default="jsonl", help="Landing file format")
     
     args = parser.parse_args()
     
     events = generate_events(args.date, args.customers, args.events)
-    save_events(events, args.date, args.output)
+    save_events(events, args.date, args.output, args.format)
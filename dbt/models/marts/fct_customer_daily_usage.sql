@@ -1,41 +1,37 @@
--- Daily usage costs per customer x product, joined with pricing rates.
+{{ config(cluster_by=['date_id', 'customer_sk']) }}
 
-WITH daily_agg AS (
+-- Daily usage costs per customer x product x region x event plan, rolled up from the hourly fact.
+-- Every hour of a day is priced at the same rate, so the daily cost applies
+-- that rate to the summed hours. The cost is also kept in the reporting
+-- currency (USD) at the DIM_FX_RATE window covering the day.
+
+WITH daily AS (
     SELECT
-        event_date,
+        date_id,
+        customer_sk,
         customer_id,
         product_id,
         unit,
-        SUM(quantity)  AS total_quantity,
-        COUNT(*)       AS event_count
-    FROM {{ ref('stg_usage_events') }}
-    GROUP BY 1, 2, 3, 4
-),
-
-customers AS (
-    SELECT * FROM NIMBUSBILL.GOLD.DIM_CUSTOMER
-    WHERE IS_CURRENT = TRUE
+        region,
+        event_plan_id,
+        SUM(total_quantity)                     AS total_quantity,
+        SUM(billable_quantity)                  AS billable_quantity,
+        (SUM(billable_quantity) * unit_price)   AS cost_amount,
+        currency,
+        SUM(event_count)                        AS event_count
+    FROM {{ ref('fct_customer_hourly_usage') }}
+    GROUP BY date_id, customer_sk, customer_id, product_id, unit, region, event_plan_id, unit_price, currency
 ),
 
-pricing AS (
-    SELECT * FROM {{ ref('stg_pricing') }}
+fx AS (
+    SELECT * FROM NIMBUSBILL.GOLD.DIM_FX_RATE WHERE REPORTING_CURRENCY = 'USD'
 )
 
 SELECT
-    agg.event_date                          AS date_id,
-    c.CUSTOMER_SK                           AS customer_sk,
-    agg.product_id,
-    agg.unit,
-    agg.total_quantity,
-    agg.total_quantity                      AS billable_quantity,
-    (agg.total_quantity * p.unit_price)     AS cost_amount,
-    p.currency,
-    agg.event_count
-FROM daily_agg agg
-JOIN customers c
-    ON agg.customer_id = c.CUSTOMER_ID
-JOIN pricing p
-    ON agg.product_id = p.product_id
-    AND agg.unit = p.unit
-    AND agg.event_date BETWEEN p.effective_from
-        AND COALESCE(p.effective_to, '9999-12-31')
+    d.*,
+    IFF(d.currency = 'USD', 1, fx.RATE)                 AS fx_rate,
+    d.cost_amount * IFF(d.currency = 'USD', 1, fx.RATE) AS reporting_cost_amount
+FROM daily d
+LEFT JOIN fx
+    ON fx.CURRENCY = d.currency
+    AND d.date_id BETWEEN fx.EFFECTIVE_FROM AND COALESCE(fx.EFFECTIVE_TO, '9999-12-31')
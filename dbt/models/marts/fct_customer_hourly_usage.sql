@@ -0,0 +1,55 @@
+{{ config(cluster_by=['date_id', 'customer_sk']) }}
+
+-- Hourly usage costs per customer x product x region x event plan, priced with the customer version
+-- (and plan) in effect on the usage date. fct_customer_daily_usage rolls up
+-- from this model instead of scanning the events again.
+
+WITH hourly_agg AS (
+    SELECT
+        event_date,
+        DATE_TRUNC('HOUR', event_ts)    AS hour_ts,
+        customer_id,
+        product_id,
+        unit,
+        COALESCE(region, 'unknown')     AS region,
+        COALESCE(plan_id, 'unknown')    AS event_plan_id,
+        SUM(quantity)  AS total_quantity,
+        COUNT(*)       AS event_count
+    FROM {{ ref('stg_usage_events') }}
+    GROUP BY 1, 2, 3, 4, 5, 6, 7
+),
+
+customers AS (
+    SELECT * FROM NIMBUSBILL.GOLD.DIM_CUSTOMER
+),
+
+pricing AS (
+    SELECT * FROM {{ ref('stg_pricing') }}
+)
+
+SELECT
+    agg.event_date                          AS date_id,
+    agg.hour_ts,
+    c.CUSTOMER_SK                           AS customer_sk,
+    agg.customer_id,
+    agg.product_id,
+    agg.unit,
+    agg.region,
+    agg.event_plan_id,
+    agg.total_quantity,
+    agg.total_quantity                      AS billable_quantity,
+    p.unit_price,
+    (agg.total_quantity * p.unit_price)     AS cost_amount,
+    p.currency,
+    agg.event_count
+FROM hourly_agg agg
+JOIN customers c
+    ON agg.customer_id = c.CUSTOMER_ID
+    AND agg.event_date >= c.EFFECTIVE_START::DATE
+    AND agg.event_date < COALESCE(c.EFFECTIVE_END::DATE, '9999-12-31')
+JOIN pricing p
+    ON agg.product_id = p.product_id
+    AND agg.unit = p.unit
+    AND p.plan_id = c.PLAN_ID
+    AND agg.event_date BETWEEN p.effective_from
+        AND COALESCE(p.effective_to, '9999-12-31')
@@ -0,0 +1,18 @@
+{{ config(cluster_by=['month_id', 'customer_sk']) }}
+
+-- Usage per customer x product and calendar month (month_id = first day),
+-- for month-aligned /usage ranges.
+
+SELECT
+    DATE_TRUNC('MONTH', date_id)            AS month_id,
+    customer_sk,
+    customer_id,
+    product_id,
+    unit,
+    currency,
+    SUM(total_quantity)                     AS total_quantity,
+    SUM(billable_quantity)                  AS billable_quantity,
+    SUM(cost_amount)                        AS cost_amount,
+    SUM(reporting_cost_amount)              AS reporting_cost_amount
+FROM {{ ref('fct_customer_daily_usage') }}
+GROUP BY 1, customer_sk, customer_id, product_id, unit, currency
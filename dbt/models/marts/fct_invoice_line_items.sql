@@ -1,20 +1,22 @@
--- Per-product line items for each monthly invoice.
+{{ config(cluster_by=['invoice_id']) }}
+
+-- Per-product usage lines and per-rule tax lines for each monthly invoice.
 
 WITH product_monthly AS (
     SELECT
-        customer_sk,
+        customer_id,
         DATE_TRUNC('MONTH', date_id)::DATE  AS billing_period_start,
         product_id,
         unit,
         SUM(total_quantity)                 AS quantity,
         SUM(cost_amount)                    AS amount,
-        MAX(currency)                       AS currency
+        currency
     FROM {{ ref('fct_customer_daily_usage') }}
-    GROUP BY 1, 2, 3, 4
+    GROUP BY 1, 2, 3, 4, currency
 ),
 
 invoices AS (
-    SELECT invoice_id, customer_sk, billing_period_start
+    SELECT invoice_id, customer_id, billing_period_start, currency
     FROM {{ ref('fct_invoices') }}
 )
 
@@ -33,6 +35,26 @@ SELECT
     pm.currency
 FROM product_monthly pm
 JOIN invoices inv
-    ON pm.customer_sk = inv.customer_sk
+    ON pm.customer_id = inv.customer_id
     AND pm.billing_period_start = inv.billing_period_start
+    AND pm.currency = inv.currency
 WHERE pm.amount > 0
+
+UNION ALL
+
+SELECT
+    {{ dbt_utils.generate_surrogate_key(['inv.invoice_id', 't.rule_id']) }}
+                                            AS line_item_id,
+    inv.invoice_id,
+    'tax'                                   AS line_type,
+    NULL                                    AS product_id,
+    NULL                                    AS unit,
+    t.taxable_amount                        AS quantity,
+    t.tax_rate                              AS unit_price,
+    t.tax_amount                            AS amount,
+    t.currency
+FROM {{ ref('fct_invoice_tax') }} t
+JOIN invoices inv
+    ON t.customer_id = inv.customer_id
+    AND t.billing_period_start = inv.billing_period_start
+    AND t.currency = inv.currency
@@ -0,0 +1,43 @@
+-- Tax per invoice and rule, shared by fct_invoices (header tax) and
+-- fct_invoice_line_items ('tax' lines). Same rules as the month-end close:
+-- the DIM_TAX_RULE windows covering the period's last day, a category's own
+-- rule over the country default, rounded to cents per rule.
+
+WITH category_costs AS (
+    SELECT
+        u.customer_id,
+        DATE_TRUNC('MONTH', u.date_id)::DATE    AS billing_period_start,
+        LAST_DAY(u.date_id)                     AS billing_period_end,
+        u.currency,
+        p.CATEGORY                              AS product_category,
+        SUM(u.cost_amount)                      AS amount
+    FROM {{ ref('fct_customer_daily_usage') }} u
+    LEFT JOIN NIMBUSBILL.GOLD.DIM_PRODUCT p ON p.PRODUCT_ID = u.product_id
+    GROUP BY 1, 2, 3, u.currency, p.CATEGORY
+),
+
+rules AS (
+    SELECT * FROM NIMBUSBILL.GOLD.DIM_TAX_RULE
+)
+
+SELECT
+    c.customer_id,
+    c.billing_period_start,
+    c.currency,
+    COALESCE(own.RULE_ID, dflt.RULE_ID)         AS rule_id,
+    COALESCE(own.TAX_RATE, dflt.TAX_RATE)       AS tax_rate,
+    SUM(c.amount)                               AS taxable_amount,
+    ROUND(SUM(c.amount) * COALESCE(own.TAX_RATE, dflt.TAX_RATE), 2)
+                                                AS tax_amount
+FROM category_costs c
+JOIN {{ ref('stg_customers') }} cust ON cust.customer_id = c.customer_id
+LEFT JOIN rules own
+    ON own.COUNTRY = cust.country
+    AND own.PRODUCT_CATEGORY = c.product_category
+    AND c.billing_period_end BETWEEN own.EFFECTIVE_FROM AND COALESCE(own.EFFECTIVE_TO, '9999-12-31')
+LEFT JOIN rules dflt
+    ON dflt.COUNTRY = cust.country
+    AND dflt.PRODUCT_CATEGORY IS NULL
+    AND c.billing_period_end BETWEEN dflt.EFFECTIVE_FROM AND COALESCE(dflt.EFFECTIVE_TO, '9999-12-31')
+WHERE COALESCE(own.RULE_ID, dflt.RULE_ID) IS NOT NULL
+GROUP BY 1, 2, 3, 4, 5
@@ -1,27 +1,48 @@
--- Monthly invoice rollup: one row per customer per billing period.
+{{ config(
+    cluster_by=['billing_period_start', 'customer_sk'],
+    post_hook="ALTER TABLE {{ this }} ADD SEARCH OPTIMIZATION ON EQUALITY(invoice_id, status)"
+) }}
+
+-- Monthly invoice rollup: one row per customer, billing period and currency
+-- billed (amounts are never summed across currencies).
+-- Usage priced under several SCD2 versions of a customer lands on one
+-- invoice, billed to the latest version (highest surrogate key) in the period.
+-- Tax is the sum of the invoice's tax lines (fct_invoice_tax).
 
 WITH monthly_costs AS (
     SELECT
-        customer_sk,
+        customer_id,
+        MAX(customer_sk)                    AS customer_sk,
         DATE_TRUNC('MONTH', date_id)::DATE  AS billing_period_start,
         LAST_DAY(date_id)                   AS billing_period_end,
         SUM(cost_amount)                    AS subtotal,
-        MAX(currency)                       AS currency
+        currency
     FROM {{ ref('fct_customer_daily_usage') }}
+    GROUP BY customer_id, 3, 4, currency
+),
+
+invoice_tax AS (
+    SELECT customer_id, billing_period_start, currency, SUM(tax_amount) AS tax
+    FROM {{ ref('fct_invoice_tax') }}
     GROUP BY 1, 2, 3
 )
 
 SELECT
-    {{ dbt_utils.generate_surrogate_key(['customer_sk', 'billing_period_start']) }}
+    {{ dbt_utils.generate_surrogate_key(['mc.customer_id', 'mc.billing_period_start', 'mc.currency']) }}
                                             AS invoice_id,
-    customer_sk,
-    billing_period_start,
-    billing_period_end,
+    mc.customer_sk,
+    mc.customer_id,
+    mc.billing_period_start,
+    mc.billing_period_end,
     CURRENT_TIMESTAMP()                     AS issued_ts,
     'issued'                                AS status,
-    subtotal,
-    0                                       AS tax,
-    subtotal                                AS total,
-    currency
-FROM monthly_costs
-WHERE subtotal > 0
+    mc.subtotal,
+    COALESCE(t.tax, 0)                      AS tax,
+    mc.subtotal + COALESCE(t.tax, 0)        AS total,
+    mc.currency
+FROM monthly_costs mc
+LEFT JOIN invoice_tax t
+    ON t.customer_id = mc.customer_id
+    AND t.billing_period_start = mc.billing_period_start
+    AND t.currency = mc.currency
+WHERE mc.subtotal > 0
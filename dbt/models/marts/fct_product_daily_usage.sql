@@ -0,0 +1,14 @@
+-- All customers' usage per product and day: the rollup /usage reads when no
+-- customer filter is given.
+
+SELECT
+    date_id,
+    product_id,
+    unit,
+    currency,
+    SUM(total_quantity)                     AS total_quantity,
+    SUM(billable_quantity)                  AS billable_quantity,
+    SUM(cost_amount)                        AS cost_amount,
+    SUM(reporting_cost_amount)              AS reporting_cost_amount
+FROM {{ ref('fct_customer_daily_usage') }}
+GROUP BY date_id, product_id, unit, currency
@@ -0,0 +1,16 @@
+-- Revenue per day x region x event plan x product across all customers, for
+-- /revenue/breakdown.
+
+SELECT
+    date_id,
+    region,
+    event_plan_id,
+    product_id,
+    unit,
+    currency,
+    SUM(total_quantity)                     AS total_quantity,
+    SUM(billable_quantity)                  AS billable_quantity,
+    SUM(cost_amount)                        AS cost_amount,
+    SUM(reporting_cost_amount)              AS reporting_cost_amount
+FROM {{ ref('fct_customer_daily_usage') }}
+GROUP BY date_id, region, event_plan_id, product_id, unit, currency
@@ -1,4 +1,5 @@
--- Latest pricing rates per product/plan from Bronze catalog.
+-- Effective-dated pricing windows per product/plan/unit from Bronze catalog
+-- (latest load wins when the same window is re-ingested).
 
 WITH parsed AS (
     SELECT
@@ -11,7 +12,8 @@ WITH parsed AS (
         TRY_CAST(RAW:effective_to::STRING AS DATE) AS effective_to,
         INGEST_TS,
         ROW_NUMBER() OVER (
-            PARTITION BY RAW:product_id::STRING, RAW:plan_id::STRING
+            PARTITION BY RAW:product_id::STRING, RAW:plan_id::STRING,
+                         RAW:unit::STRING, RAW:effective_from::DATE
             ORDER BY INGEST_TS DESC
         ) AS _row_num
     FROM {{ source('bronze', 'PRICING_CATALOG_RAW') }}
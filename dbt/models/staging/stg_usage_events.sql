@@ -1,25 +1,64 @@
--- Parse raw JSON from Bronze and deduplicate by event_id.
+-- Parse raw JSON from Bronze (typed Parquet loads need no parse), drop
+-- data-contract violations and deduplicate by event_id. Mirrors
+-- SILVER.V_USAGE_EVENTS_VALIDATED; violating rows are quarantined by the
+-- Airflow pipeline, not here.
 
 WITH parsed AS (
     SELECT
-        RAW:event_id::STRING           AS event_id,
-        RAW:event_timestamp::TIMESTAMP_NTZ AS event_ts,
-        TO_DATE(RAW:event_timestamp::TIMESTAMP_NTZ) AS event_date,
-        RAW:customer_id::STRING        AS customer_id,
-        RAW:product_id::STRING         AS product_id,
-        RAW:plan_id::STRING            AS plan_id,
-        RAW:region::STRING             AS region,
-        RAW:unit::STRING               AS unit,
-        RAW:quantity::NUMBER(38,6)     AS quantity,
+        NULLIF(TRIM(RAW:event_id::STRING), '')            AS event_id,
+        TRY_TO_TIMESTAMP_NTZ(RAW:event_timestamp::STRING) AS event_ts,
+        NULLIF(TRIM(RAW:customer_id::STRING), '')         AS customer_id,
+        NULLIF(TRIM(RAW:product_id::STRING), '')          AS product_id,
+        RAW:plan_id::STRING                               AS plan_id,
+        RAW:region::STRING                                AS region,
+        NULLIF(TRIM(RAW:unit::STRING), '')                AS unit,
+        TRY_TO_NUMBER(RAW:quantity::STRING, 38, 6)        AS quantity,
         SOURCE,
         BATCH_ID,
-        MD5(RAW)                       AS raw_hash,
+        MD5(RAW)                                          AS raw_hash
+    FROM {{ source('bronze', 'USAGE_EVENTS_RAW') }}
+
+    UNION ALL
+
+    -- Parquet landings are already typed; the hash matches the view's rebuilt RAW
+    SELECT
+        NULLIF(TRIM(EVENT_ID), ''),
+        EVENT_TIMESTAMP,
+        NULLIF(TRIM(CUSTOMER_ID), ''),
+        NULLIF(TRIM(PRODUCT_ID), ''),
+        PLAN_ID,
+        REGION,
+        NULLIF(TRIM(UNIT), ''),
+        QUANTITY,
+        SOURCE,
+        BATCH_ID,
+        MD5(OBJECT_CONSTRUCT(
+            'event_id', EVENT_ID,
+            'event_timestamp', TO_VARCHAR(EVENT_TIMESTAMP, 'YYYY-MM-DD"T"HH24:MI:SS.FF6"Z"'),
+            'customer_id', CUSTOMER_ID, 'product_id', PRODUCT_ID, 'plan_id', PLAN_ID,
+            'quantity', QUANTITY, 'unit', UNIT, 'region', REGION,
+            'schema_version', SCHEMA_VERSION
+        ))
+    FROM {{ source('bronze', 'USAGE_EVENTS_TYPED') }}
+),
+
+valid AS (
+    SELECT
+        p.*,
+        TO_DATE(p.event_ts) AS event_date,
         ROW_NUMBER() OVER (
-            PARTITION BY RAW:event_id::STRING
-            ORDER BY RAW:event_timestamp::TIMESTAMP_NTZ DESC
+            PARTITION BY p.event_id
+            ORDER BY p.event_ts DESC
         ) AS _row_num
-    FROM {{ source('bronze', 'USAGE_EVENTS_RAW') }}
-    WHERE RAW:event_id IS NOT NULL
+    FROM parsed p
+    WHERE p.event_id IS NOT NULL
+      AND p.event_ts IS NOT NULL
+      AND p.customer_id IS NOT NULL
+      AND p.quantity >= 0
+      AND EXISTS (
+          SELECT 1 FROM {{ ref('stg_pricing') }} r
+          WHERE r.product_id = p.product_id AND r.unit = p.unit
+      )
 )
 
 SELECT
@@ -35,5 +74,5 @@ SELECT
     source,
     batch_id,
     raw_hash
-FROM parsed
+FROM valid
 WHERE _row_num = 1
@@ -10,9 +10,15 @@ import os
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
 
 import argparse
+import tempfile
 import snowflake.connector
 from datetime import datetime, timedelta
 from dotenv import load_dotenv
+from billing.anomalies import detect as detect_anomalies
+from billing.credits import apply_drawdown
+from billing.dedup import prefilter_batch
+from billing.landing import landing_file, load_statements, read_events
+from billing.usage_store import publish as publish_usage_store
 from datagen.generate_usage_events import generate_events, save_events
 
 load_dotenv()
@@ -33,39 +39,92 @@ def get_connection():
     )
 
 
-def load_day(cursor, date_str: str, batch_id: str):
+def load_day(cursor, date_str: str, batch_id: str, file_path: str = None):
     """Load one day of events through Bronze -> Silver -> Gold."""
-    file_path = os.path.abspath(
-        os.path.join(DATA_DIR, f"usage_events_{date_str}.jsonl")
-    )
-    if not os.path.exists(file_path):
-        print(f"  Warning: {file_path} not found, skipping")
+    file_path = file_path or landing_file(DATA_DIR, date_str)
+    if file_path is None or not os.path.exists(file_path):
+        print(f"  Warning: no landing file for {date_str}, skipping")
         return
+    file_path = os.path.abspath(file_path)
 
-    # Bronze: stage and copy raw JSON
-    cursor.execute(
-        f"PUT file://{file_path} @NIMBUSBILL.BRONZE.%USAGE_EVENTS_RAW "
-        f"AUTO_COMPRESS=TRUE OVERWRITE=TRUE"
-    )
+    # Dedup pre-filter: lets Silver append definitely-new rows without the MERGE
+    events = read_events(file_path, columns=["event_id", "event_timestamp"])
+    with tempfile.TemporaryDirectory() as workdir:
+        prefilter_batch(cursor, batch_id, events, workdir, datetime.strptime(date_str, "%Y-%m-%d").date())
+
+    # Bronze: stage and copy (Parquet -> typed table, JSONL -> RAW variant)
+    for statement in load_statements(file_path, date_str, batch_id, source="BACKFILL"):
+        cursor.execute(statement)
+
+    # Silver: validate, quarantine contract violations, append prefiltered
+    # new rows and merge the rest
+    cursor.execute("""
+        CREATE OR REPLACE TEMPORARY TABLE NIMBUSBILL.SILVER.USAGE_EVENTS_BATCH
+        LIKE NIMBUSBILL.SILVER.USAGE_EVENTS_CLEAN
+    """)
+    cursor.execute("BEGIN")
     cursor.execute(f"""
-        COPY INTO NIMBUSBILL.BRONZE.USAGE_EVENTS_RAW
-            (INGEST_TS, SOURCE, DT, BATCH_ID, FILE_NAME, RAW)
-        FROM (
-            SELECT CURRENT_TIMESTAMP(), 'BACKFILL', '{date_str}',
-                   '{batch_id}', METADATA$FILENAME, $1
-            FROM @NIMBUSBILL.BRONZE.%USAGE_EVENTS_RAW
-        )
-        FILE_FORMAT = (TYPE = 'JSON' STRIP_OUTER_ARRAY = FALSE)
-        PURGE = TRUE
+        INSERT FIRST
+            WHEN ERROR_REASON IS NULL AND IS_NEW THEN
+                INTO NIMBUSBILL.SILVER.USAGE_EVENTS_CLEAN
+                    (EVENT_ID, EVENT_TS, EVENT_DATE, CUSTOMER_ID, PRODUCT_ID,
+                     PLAN_ID, REGION, UNIT, QUANTITY, SOURCE, LOAD_TS, BATCH_ID, RAW_HASH)
+                VALUES (EVENT_ID, EVENT_TS, EVENT_DATE, CUSTOMER_ID, PRODUCT_ID,
+                        PLAN_ID, REGION, UNIT, QUANTITY, SOURCE, CURRENT_TIMESTAMP(),
+                        '{batch_id}', RAW_HASH)
+            WHEN ERROR_REASON IS NULL THEN
+                INTO NIMBUSBILL.SILVER.USAGE_EVENTS_BATCH
+                    (EVENT_ID, EVENT_TS, EVENT_DATE, CUSTOMER_ID, PRODUCT_ID,
+                     PLAN_ID, REGION, UNIT, QUANTITY, SOURCE, BATCH_ID, RAW_HASH)
+                VALUES (EVENT_ID, EVENT_TS, EVENT_DATE, CUSTOMER_ID, PRODUCT_ID,
+                        PLAN_ID, REGION, UNIT, QUANTITY, SOURCE, '{batch_id}', RAW_HASH)
+            WHEN NOT ALREADY_QUARANTINED THEN
+                INTO NIMBUSBILL.SILVER.USAGE_EVENTS_QUARANTINE
+                    (INGEST_TS, DT, SOURCE, ERROR_REASON, RAW, BATCH_ID, EVENT_ID, RAW_HASH)
+                VALUES (CURRENT_TIMESTAMP(), DT, SOURCE, ERROR_REASON, RAW,
+                        '{batch_id}', EVENT_ID, RAW_HASH)
+        SELECT
+            v.*,
+            q.RAW_HASH IS NOT NULL AS ALREADY_QUARANTINED,
+            (pf.BATCH_ID IS NOT NULL AND dc.EVENT_ID IS NULL
+             AND COUNT(*) OVER (PARTITION BY v.EVENT_ID) = 1) AS IS_NEW
+        FROM NIMBUSBILL.SILVER.V_USAGE_EVENTS_VALIDATED v
+        LEFT JOIN (SELECT DISTINCT RAW_HASH FROM NIMBUSBILL.SILVER.USAGE_EVENTS_QUARANTINE) q
+            ON q.RAW_HASH = v.RAW_HASH
+        LEFT JOIN NIMBUSBILL.OPS.DEDUP_BATCHES pf
+            ON pf.BATCH_ID = v.BATCH_ID AND pf.BATCH_ID = '{batch_id}' AND pf.CONSUMED_TS IS NULL
+        LEFT JOIN NIMBUSBILL.OPS.DEDUP_CANDIDATES dc
+            ON dc.BATCH_ID = v.BATCH_ID AND dc.EVENT_ID = v.EVENT_ID
+        WHERE v.ORIGIN = 'BRONZE'
+          AND (v.EVENT_DATE = '{date_str}' OR (v.EVENT_DATE IS NULL AND v.DT = '{date_str}'))
+    """)
+    cursor.execute(f"""
+        UPDATE NIMBUSBILL.OPS.DEDUP_BATCHES SET CONSUMED_TS = CURRENT_TIMESTAMP()
+        WHERE BATCH_ID = '{batch_id}' AND CONSUMED_TS IS NULL
     """)
+    merge_batch(cursor, batch_id)
+    cursor.execute(f"""
+        UPDATE NIMBUSBILL.OPS.DEDUP_BATCHES b
+        SET MERGE_MATCHED = r."number of rows updated", MERGE_INSERTED = r."number of rows inserted"
+        FROM TABLE(RESULT_SCAN(LAST_QUERY_ID(-1))) r
+        WHERE b.BATCH_ID = '{batch_id}'
+    """)
+    cursor.execute("COMMIT")
+    rebuild_day(cursor, date_str, batch_id)
+    # Days load oldest first, so baselines and credit balances build up as they
+    # would in production.
+    day = datetime.strptime(date_str, "%Y-%m-%d").date()
+    detect_anomalies(cursor, day, batch_id)
+    apply_drawdown(cursor, day, batch_id)
+
 
-    # Silver: merge and deduplicate
+def merge_batch(cursor, batch_id: str):
+    """Merge this session's USAGE_EVENTS_BATCH into USAGE_EVENTS_CLEAN, deduplicating on EVENT_ID."""
     cursor.execute(f"""
         MERGE INTO NIMBUSBILL.SILVER.USAGE_EVENTS_CLEAN T
         USING (
             SELECT *
-            FROM NIMBUSBILL.SILVER.V_USAGE_EVENTS_PARSED
-            WHERE EVENT_DATE = '{date_str}'
+            FROM NIMBUSBILL.SILVER.USAGE_EVENTS_BATCH
             QUALIFY ROW_NUMBER() OVER (PARTITION BY EVENT_ID ORDER BY EVENT_TS DESC) = 1
         ) S
         ON T.EVENT_ID = S.EVENT_ID
@@ -80,40 +139,139 @@ def load_day(cursor, date_str: str, batch_id: str):
                     CURRENT_TIMESTAMP(), '{batch_id}', S.RAW_HASH);
     """)
 
-    # Silver: rebuild daily aggregates for this date
+
+def rebuild_day(cursor, date_str: str, batch_id: str):
+    """Rebuild the hourly and daily aggregates, Gold usage facts and rollups for one date from Silver."""
+    # Silver: one scan of the day's events into hours, then hours into the day
+    cursor.execute(f"DELETE FROM NIMBUSBILL.SILVER.USAGE_HOURLY_AGG WHERE EVENT_DATE = '{date_str}'")
+    cursor.execute(f"""
+        INSERT INTO NIMBUSBILL.SILVER.USAGE_HOURLY_AGG
+            (EVENT_DATE, EVENT_HOUR, CUSTOMER_ID, PRODUCT_ID, UNIT, REGION, PLAN_ID,
+             TOTAL_QUANTITY, EVENT_COUNT, LAST_EVENT_TS, LOAD_TS, BATCH_ID)
+        SELECT EVENT_DATE, DATE_TRUNC('HOUR', EVENT_TS), CUSTOMER_ID, PRODUCT_ID, UNIT,
+               COALESCE(REGION, 'unknown'), COALESCE(PLAN_ID, 'unknown'),
+               SUM(QUANTITY), COUNT(*), MAX(EVENT_TS),
+               CURRENT_TIMESTAMP(), '{batch_id}'
+        FROM NIMBUSBILL.SILVER.USAGE_EVENTS_CLEAN
+        WHERE EVENT_DATE = '{date_str}'
+        GROUP BY 1, 2, 3, 4, 5, 6, 7
+    """)
     cursor.execute(f"DELETE FROM NIMBUSBILL.SILVER.USAGE_DAILY_AGG WHERE EVENT_DATE = '{date_str}'")
     cursor.execute(f"""
         INSERT INTO NIMBUSBILL.SILVER.USAGE_DAILY_AGG
-            (EVENT_DATE, CUSTOMER_ID, PRODUCT_ID, UNIT, TOTAL_QUANTITY,
+            (EVENT_DATE, CUSTOMER_ID, PRODUCT_ID, UNIT, REGION, PLAN_ID, TOTAL_QUANTITY,
              EVENT_COUNT, LAST_EVENT_TS, LOAD_TS, BATCH_ID)
-        SELECT EVENT_DATE, CUSTOMER_ID, PRODUCT_ID, UNIT,
-               SUM(QUANTITY), COUNT(*), MAX(EVENT_TS),
+        SELECT EVENT_DATE, CUSTOMER_ID, PRODUCT_ID, UNIT, REGION, PLAN_ID,
+               SUM(TOTAL_QUANTITY), SUM(EVENT_COUNT), MAX(LAST_EVENT_TS),
                CURRENT_TIMESTAMP(), '{batch_id}'
-        FROM NIMBUSBILL.SILVER.USAGE_EVENTS_CLEAN
+        FROM NIMBUSBILL.SILVER.USAGE_HOURLY_AGG
         WHERE EVENT_DATE = '{date_str}'
-        GROUP BY 1, 2, 3, 4
+        GROUP BY 1, 2, 3, 4, 5, 6
     """)
 
-    # Gold: compute daily costs
-    cursor.execute(f"DELETE FROM NIMBUSBILL.GOLD.FACT_CUSTOMER_DAILY_USAGE WHERE DATE_ID = '{date_str}'")
+    # Gold: price the hours, then roll them up to the day at the same rate
+    # (converted to the reporting currency with the day's DIM_FX_RATE)
+    cursor.execute(f"DELETE FROM NIMBUSBILL.GOLD.FACT_CUSTOMER_HOURLY_USAGE WHERE DATE_ID = '{date_str}'")
     cursor.execute(f"""
-        INSERT INTO NIMBUSBILL.GOLD.FACT_CUSTOMER_DAILY_USAGE
-            (DATE_ID, CUSTOMER_SK, PRODUCT_ID, UNIT, TOTAL_QUANTITY,
+        INSERT INTO NIMBUSBILL.GOLD.FACT_CUSTOMER_HOURLY_USAGE
+            (DATE_ID, HOUR_TS, CUSTOMER_SK, PRODUCT_ID, UNIT, REGION, EVENT_PLAN_ID, TOTAL_QUANTITY,
              BILLABLE_QUANTITY, COST_AMOUNT, CURRENCY, RATE_SK, LOAD_TS, BATCH_ID)
         SELECT
-            agg.EVENT_DATE, c.CUSTOMER_SK, agg.PRODUCT_ID, agg.UNIT,
+            agg.EVENT_DATE, agg.EVENT_HOUR, c.CUSTOMER_SK, agg.PRODUCT_ID, agg.UNIT,
+            agg.REGION, agg.PLAN_ID,
             agg.TOTAL_QUANTITY, agg.TOTAL_QUANTITY,
             (agg.TOTAL_QUANTITY * p.UNIT_PRICE), p.CURRENCY, p.RATE_SK,
             CURRENT_TIMESTAMP(), '{batch_id}'
-        FROM NIMBUSBILL.SILVER.USAGE_DAILY_AGG agg
+        FROM NIMBUSBILL.SILVER.USAGE_HOURLY_AGG agg
         JOIN NIMBUSBILL.GOLD.DIM_CUSTOMER c
-            ON agg.CUSTOMER_ID = c.CUSTOMER_ID AND c.IS_CURRENT = TRUE
+            ON agg.CUSTOMER_ID = c.CUSTOMER_ID
+            AND agg.EVENT_DATE >= c.EFFECTIVE_START::DATE
+            AND agg.EVENT_DATE < COALESCE(c.EFFECTIVE_END::DATE, '9999-12-31')
         JOIN NIMBUSBILL.GOLD.DIM_PRICING_RATE p
             ON agg.PRODUCT_ID = p.PRODUCT_ID AND agg.UNIT = p.UNIT
+            AND p.PLAN_ID = c.PLAN_ID
             AND (agg.EVENT_DATE BETWEEN p.EFFECTIVE_FROM
                  AND COALESCE(p.EFFECTIVE_TO, '9999-12-31'))
         WHERE agg.EVENT_DATE = '{date_str}'
     """)
+    cursor.execute(f"DELETE FROM NIMBUSBILL.GOLD.FACT_CUSTOMER_DAILY_USAGE WHERE DATE_ID = '{date_str}'")
+    cursor.execute(f"""
+        INSERT INTO NIMBUSBILL.GOLD.FACT_CUSTOMER_DAILY_USAGE
+            (DATE_ID, CUSTOMER_SK, PRODUCT_ID, UNIT, REGION, EVENT_PLAN_ID, TOTAL_QUANTITY,
+             BILLABLE_QUANTITY, COST_AMOUNT, CURRENCY, FX_RATE, REPORTING_COST_AMOUNT,
+             RATE_SK, LOAD_TS, BATCH_ID)
+        SELECT
+            h.DATE_ID, h.CUSTOMER_SK, h.PRODUCT_ID, h.UNIT, h.REGION, h.EVENT_PLAN_ID,
+            SUM(h.TOTAL_QUANTITY), SUM(h.BILLABLE_QUANTITY),
+            (SUM(h.BILLABLE_QUANTITY) * p.UNIT_PRICE), p.CURRENCY,
+            IFF(p.CURRENCY = 'USD', 1, fx.RATE),
+            (SUM(h.BILLABLE_QUANTITY) * p.UNIT_PRICE) * IFF(p.CURRENCY = 'USD', 1, fx.RATE),
+            p.RATE_SK, CURRENT_TIMESTAMP(), '{batch_id}'
+        FROM NIMBUSBILL.GOLD.FACT_CUSTOMER_HOURLY_USAGE h
+        JOIN NIMBUSBILL.GOLD.DIM_PRICING_RATE p ON p.RATE_SK = h.RATE_SK
+        LEFT JOIN NIMBUSBILL.GOLD.DIM_FX_RATE fx
+            ON fx.CURRENCY = p.CURRENCY AND fx.REPORTING_CURRENCY = 'USD'
+            AND h.DATE_ID BETWEEN fx.EFFECTIVE_FROM AND COALESCE(fx.EFFECTIVE_TO, '9999-12-31')
+        WHERE h.DATE_ID = '{date_str}'
+        GROUP BY h.DATE_ID, h.CUSTOMER_SK, h.PRODUCT_ID, h.UNIT, h.REGION, h.EVENT_PLAN_ID,
+                 p.UNIT_PRICE, p.CURRENCY, p.RATE_SK, fx.RATE
+    """)
+
+    # Rollups for /usage (billing/usage_planner.py) and /revenue/breakdown: the day per
+    # product, the month per customer, the day per region x event plan x product
+    cursor.execute(f"DELETE FROM NIMBUSBILL.GOLD.FACT_PRODUCT_DAILY_USAGE WHERE DATE_ID = '{date_str}'")
+    cursor.execute(f"""
+        INSERT INTO NIMBUSBILL.GOLD.FACT_PRODUCT_DAILY_USAGE
+            (DATE_ID, PRODUCT_ID, UNIT, CURRENCY, TOTAL_QUANTITY, BILLABLE_QUANTITY,
+             COST_AMOUNT, REPORTING_COST_AMOUNT, LOAD_TS, BATCH_ID)
+        SELECT DATE_ID, PRODUCT_ID, UNIT, CURRENCY,
+               SUM(TOTAL_QUANTITY), SUM(BILLABLE_QUANTITY), SUM(COST_AMOUNT), SUM(REPORTING_COST_AMOUNT),
+               CURRENT_TIMESTAMP(), '{batch_id}'
+        FROM NIMBUSBILL.GOLD.FACT_CUSTOMER_DAILY_USAGE
+        WHERE DATE_ID = '{date_str}'
+        GROUP BY DATE_ID, PRODUCT_ID, UNIT, CURRENCY
+    """)
+    cursor.execute(f"""
+        DELETE FROM NIMBUSBILL.GOLD.FACT_CUSTOMER_MONTHLY_USAGE
+        WHERE MONTH_ID = DATE_TRUNC('MONTH', '{date_str}'::DATE)
+    """)
+    cursor.execute(f"""
+        INSERT INTO NIMBUSBILL.GOLD.FACT_CUSTOMER_MONTHLY_USAGE
+            (MONTH_ID, CUSTOMER_SK, PRODUCT_ID, UNIT, CURRENCY, TOTAL_QUANTITY,
+             BILLABLE_QUANTITY, COST_AMOUNT, REPORTING_COST_AMOUNT, LOAD_TS, BATCH_ID)
+        SELECT DATE_TRUNC('MONTH', DATE_ID), CUSTOMER_SK, PRODUCT_ID, UNIT, CURRENCY,
+               SUM(TOTAL_QUANTITY), SUM(BILLABLE_QUANTITY), SUM(COST_AMOUNT), SUM(REPORTING_COST_AMOUNT),
+               CURRENT_TIMESTAMP(), '{batch_id}'
+        FROM NIMBUSBILL.GOLD.FACT_CUSTOMER_DAILY_USAGE
+        WHERE DATE_ID BETWEEN DATE_TRUNC('MONTH', '{date_str}'::DATE) AND LAST_DAY('{date_str}'::DATE)
+        GROUP BY 1, CUSTOMER_SK, PRODUCT_ID, UNIT, CURRENCY
+    """)
+    cursor.execute(f"DELETE FROM NIMBUSBILL.GOLD.FACT_REVENUE_CUBE WHERE DATE_ID = '{date_str}'")
+    cursor.execute(f"""
+        INSERT INTO NIMBUSBILL.GOLD.FACT_REVENUE_CUBE
+            (DATE_ID, REGION, EVENT_PLAN_ID, PRODUCT_ID, UNIT, CURRENCY, TOTAL_QUANTITY,
+             BILLABLE_QUANTITY, COST_AMOUNT, REPORTING_COST_AMOUNT, LOAD_TS, BATCH_ID)
+        SELECT DATE_ID, REGION, EVENT_PLAN_ID, PRODUCT_ID, UNIT, CURRENCY,
+               SUM(TOTAL_QUANTITY), SUM(BILLABLE_QUANTITY), SUM(COST_AMOUNT), SUM(REPORTING_COST_AMOUNT),
+               CURRENT_TIMESTAMP(), '{batch_id}'
+        FROM NIMBUSBILL.GOLD.FACT_CUSTOMER_DAILY_USAGE
+        WHERE DATE_ID = '{date_str}'
+        GROUP BY DATE_ID, REGION, EVENT_PLAN_ID, PRODUCT_ID, UNIT, CURRENCY
+    """)
+
+    # Invariant: pricing never multiplies rows beyond the Silver aggregate.
+    # The join runs on hours; the daily fact only regroups them.
+    cursor.execute(f"""
+        SELECT
+            (SELECT COUNT(*) FROM NIMBUSBILL.GOLD.FACT_CUSTOMER_HOURLY_USAGE WHERE DATE_ID = '{date_str}'),
+            (SELECT COUNT(*) FROM NIMBUSBILL.SILVER.USAGE_HOURLY_AGG WHERE EVENT_DATE = '{date_str}')
+    """)
+    gold_rows, agg_rows = cursor.fetchone()
+    if gold_rows > agg_rows:
+        raise RuntimeError(
+            f"{date_str}: FACT_CUSTOMER_HOURLY_USAGE has {gold_rows} rows for "
+            f"{agg_rows} USAGE_HOURLY_AGG rows; pricing join fanned out"
+        )
 
 
 def main():
@@ -121,6 +279,7 @@ def main():
     parser.add_argument("--days", type=int, default=30)
     parser.add_argument("--customers", type=int, default=10)
     parser.add_argument("--events", type=int, default=5, help="avg events per customer per day")
+    parser.add_argument("--format", choices=["jsonl", "parquet"], default="jsonl", help="landing file format")
     args = parser.parse_args()
 
     os.makedirs(DATA_DIR, exist_ok=True)
@@ -137,7 +296,7 @@ def main():
             late_prob=0.02,
             duplicate_prob=0.01,
         )
-        save_events(events, d, DATA_DIR)
+        save_events(events, d, DATA_DIR, args.format)
 
     print("Loading into Snowflake (Bronze -> Silver -> Gold)...")
     conn = get_connection()
@@ -146,7 +305,7 @@ def main():
         for i, d in enumerate(dates, 1):
             batch_id = f"backfill_{d}"
             print(f"  [{i:>2}/{len(dates)}] {d} ... ", end="", flush=True)
-            load_day(cursor, d, batch_id)
+            load_day(cursor, d, batch_id, os.path.join(DATA_DIR, f"usage_events_{d}.{args.format}"))
             print("done")
         conn.commit()
     finally:
@@ -169,6 +328,17 @@ def main():
         cursor.close()
         conn.close()
 
+    store_path = os.getenv("USAGE_STORE_PATH")
+    if store_path:
+        conn = get_connection()
+        cursor = conn.cursor()
+        try:
+            summary = publish_usage_store(cursor, store_path, today - timedelta(days=1))
+        finally:
+            cursor.close()
+            conn.close()
+        print(f"Published usage store {store_path} ({summary.points} points).")
+
     print(f"Backfill complete: {args.days} days loaded.")
 
 
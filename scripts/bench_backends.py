@@ -0,0 +1,455 @@
+"""
+bench_backends.py
+
+Backends for scripts/benchmark_pipeline.py. A backend runs the pipeline's
+stages over a generated dataset and replays the API query shapes; the runner
+only times the calls.
+
+LocalBackend (the default) runs on an embedded DuckDB database. The Bronze,
+Silver, Gold and OPS DDL (sql/01-04) and the DAGs' own SQL are translated on the
+fly (types, IFF, DATEADD, UUID_STRING, bind parameters), so the daily
+aggregate, Gold costing, month-end close and late-arrival reconciliation run
+the production statements. Ingest and Silver validation/dedup are local
+equivalents of COPY INTO and the INSERT FIRST/MERGE, which have no DuckDB
+counterpart; the dedup pre-filter is not used, every batch takes the MERGE
+path. Numbers compare commits with each other, they do not size a warehouse.
+
+SnowflakeBackend runs the same stages through scripts/backfill_history.py and
+the DAG SQL against the configured account. It writes to the target
+database, so point it at a freshly initialised scratch one (init_snowflake.py,
+no seed data): setup loads the dataset's customers and rates, and the seed
+products, plans and tax rules, itself.
+"""
+from __future__ import annotations
+
+import sys
+import os
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import ast
+import csv
+import json
+import math
+import re
+import tempfile
+from datetime import date
+from typing import Callable
+
+from billing.tax import read_rules_csv
+from datagen.generate_pricing import PRICING_RULES
+
+ROOT = os.path.join(os.path.dirname(__file__), "..")
+DAG_DIR = os.path.join(ROOT, "airflow", "dags")
+SQL_DIR = os.path.join(ROOT, "sql")
+
+# Dimension rows loaded by setup are effective from here, before any dataset.
+DIM_EFFECTIVE_FROM = "2000-01-01"
+
+
+def seed_products() -> list[tuple]:
+    """(product_id, name, category, description) rows of seeds/products.csv."""
+    with open(os.path.join(ROOT, "seeds", "products.csv"), newline="") as f:
+        return [(r["product_id"], r["product_name"], r["category"], r["description"])
+                for r in csv.DictReader(f)]
+
+
+def seed_plans() -> list[tuple]:
+    """(plan_id, name, base_fee, currency) rows of seeds/plans.csv."""
+    with open(os.path.join(ROOT, "seeds", "plans.csv"), newline="") as f:
+        return [(r["plan_id"], r["plan_name"], r["base_fee"], r["currency"]) for r in csv.DictReader(f)]
+
+
+def seed_tax_rules() -> list[tuple]:
+    """(rule_id, country, category, rate, from, to, is_current) rows of seeds/tax_rules.csv."""
+    return [(r.rule_id, r.country, r.product_category, r.rate, r.effective_from, r.effective_to,
+             r.effective_to is None)
+            for r in read_rules_csv(os.path.join(ROOT, "seeds", "tax_rules.csv"))]
+
+
+# ── DAG SQL ─────────────────────────────────────────────────────────────────
+
+def dag_sql(dag_file: str, task_id: str) -> str:
+    """The `sql=` of the SnowflakeOperator with `task_id` in airflow/dags/<dag_file>."""
+    with open(os.path.join(DAG_DIR, dag_file)) as f:
+        tree = ast.parse(f.read())
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Call) and getattr(node.func, "id", None) == "SnowflakeOperator":
+            kwargs = {k.arg: k.value for k in node.keywords}
+            if getattr(kwargs.get("task_id"), "value", None) == task_id:
+                return kwargs["sql"].value
+    raise KeyError(f"{dag_file} has no SnowflakeOperator {task_id!r}")
+
+
+def render(sql: str, **context) -> str:
+    """Fill the Jinja variables the DAG SQL uses ({{ ds }}, {{ run_id }}, ...)."""
+    return re.sub(r"\{\{\s*(\w+)\s*\}\}", lambda m: str(context[m.group(1)]), sql)
+
+
+def statements(sql: str) -> list[str]:
+    """Split a script on `;` at end of line, dropping comments."""
+    sql = re.sub(r"--[^\n]*", "", sql)
+    return [s.strip() for s in re.split(r";[ \t]*(?:\n|$)", sql) if s.strip()]
+
+
+def pin_current_date(sql: str, as_of: date) -> str:
+    """Evaluate CURRENT_DATE() at the dataset's as-of date instead of today."""
+    return re.sub(r"CURRENT_DATE\(\)", f"'{as_of}'::DATE", sql, flags=re.IGNORECASE)
+
+
+# ── Dialect translation (Snowflake -> DuckDB) ───────────────────────────────
+
+_MACROS = [
+    "CREATE OR REPLACE MACRO IFF(cond, a, b) AS CASE WHEN cond THEN a ELSE b END",
+    "CREATE OR REPLACE MACRO UUID_STRING() AS uuid()::VARCHAR",
+    "CREATE OR REPLACE MACRO SQUARE(x) AS x * x",
+    """CREATE OR REPLACE MACRO DATEADD(part, n, d) AS CAST(CASE lower(part)
+           WHEN 'day' THEN d + to_days(CAST(n AS INTEGER))
+           WHEN 'week' THEN d + to_days(CAST(n AS INTEGER) * 7)
+           WHEN 'month' THEN d + to_months(CAST(n AS INTEGER))
+           WHEN 'year' THEN d + to_years(CAST(n AS INTEGER)) END AS DATE)""",
+]
+
+
+def to_duckdb(sql: str) -> str:
+    sql = re.sub(r"CURRENT_TIMESTAMP\(\)", "CURRENT_TIMESTAMP", sql, flags=re.IGNORECASE)
+    sql = re.sub(r"SAMPLE\s*\(\s*(\d+)\s+ROWS\s*\)", r"USING SAMPLE \1 ROWS", sql, flags=re.IGNORECASE)
+    # Snowflake binds a tuple as a comma list: `x IN (%(sks)s)`
+    sql = re.sub(r"([\w.]+)\s+IN\s*\(\s*%\((\w+)\)s\s*\)", r"list_contains($\2, \1)", sql)
+    sql = re.sub(r"%\((\w+)\)s", r"$\1", sql)
+    if re.match(r"\s*CREATE\b", sql, re.IGNORECASE):
+        # Session tables created by billing/* modules; sql/ DDL has been through ddl_to_duckdb
+        sql = re.sub(r"NUMBER\((\d+)\s*,\s*(\d+)\)", r"DECIMAL(\1,\2)", sql)
+        sql = re.sub(r"\bNUMBER\b", "BIGINT", sql)
+    if re.match(r"\s*(MERGE|UPDATE)\b", sql, re.IGNORECASE):
+        # DuckDB rejects qualified target columns in UPDATE ... SET
+        sql = re.sub(r"(\bSET\s+|,\s*)[A-Za-z_]\w*\.(\w+)(?=\s*=)", r"\1\2", sql)
+    return sql
+
+
+def ddl_to_duckdb(script: str) -> list[str]:
+    """CREATE TABLE statements of a sql/0N file, as DuckDB DDL. Everything else is skipped."""
+    out, schema = [], None
+    for stmt in statements(script):
+        use = re.match(r"USE SCHEMA\s+([\w.]+)", stmt, re.IGNORECASE)
+        if use:
+            schema = use.group(1)
+            continue
+        create = re.match(r"CREATE TABLE IF NOT EXISTS\s+(\w+)\s*\(", stmt, re.IGNORECASE)
+        if not create:
+            continue
+        table = f"{schema}.{create.group(1)}"
+        body = stmt[create.end():]
+        body = re.sub(r"\)\s*CLUSTER BY\s*\(.*?\)\s*$", ")", body, flags=re.DOTALL)
+        body = re.sub(r"^\s*CONSTRAINT\b.*$\n?", "", body, flags=re.MULTILINE)
+        body = re.sub(r",\s*\)\s*$", "\n)", body)
+        body = re.sub(r"\s+PRIMARY KEY\b", "", body)
+        if re.search(r"AUTOINCREMENT", body):
+            seq = f"{schema}.SEQ_{create.group(1)}"
+            out.append(f"CREATE SEQUENCE IF NOT EXISTS {seq}")
+            body = re.sub(r"NUMBER AUTOINCREMENT(\s+START \d+ INCREMENT \d+)?",
+                          f"BIGINT DEFAULT nextval('{seq}')", body)
+        body = re.sub(r"NUMBER\((\d+)\s*,\s*(\d+)\)", r"DECIMAL(\1,\2)", body)
+        body = re.sub(r"\bNUMBER\b", "BIGINT", body)
+        body = body.replace("TIMESTAMP_NTZ", "TIMESTAMP").replace("VARIANT", "VARCHAR")
+        out.append(to_duckdb(f"CREATE TABLE IF NOT EXISTS {table} ({body}"))
+    return out
+
+
+# ── Backends ────────────────────────────────────────────────────────────────
+
+class Backend:
+    """Stages return the number of rows they processed (for rows/s)."""
+    name = ""
+
+    def __init__(self, as_of: date):
+        self.as_of = as_of
+
+    def setup(self, dataset) -> int:
+        raise NotImplementedError
+
+    def daily_stages(self, day: str, path: str, batch_id: str) -> list[tuple[str, Callable[[], int]]]:
+        """(stage name, fn) pairs loading one day's event file."""
+        raise NotImplementedError
+
+    def execute(self, sql: str, params: dict | None = None) -> list[tuple]:
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+    def run_task(self, dag_file: str, task_id: str, **context) -> int:
+        """Run one DAG task's SQL; rows written, failing if a check SELECT trips."""
+        written = 0
+        for stmt in statements(render(dag_sql(dag_file, task_id), **context)):
+            rows = self.execute(pin_current_date(stmt, self.as_of))
+            verb = stmt.split(None, 1)[0].upper()
+            if verb in ("INSERT", "MERGE", "UPDATE") and rows:
+                written += int(rows[0][0] or 0)
+            elif verb == "SELECT":
+                value = rows[0][0] if rows else None
+                if value is None or (isinstance(value, float) and math.isinf(value)):
+                    raise RuntimeError(f"{task_id}: check failed")
+        return written
+
+    def month_end(self, period_start: str, period_end: str, run_id: str) -> int:
+        context = dict(prev_ds_month_start=period_start, prev_ds_month_end=period_end, run_id=run_id)
+        return sum(self.run_task("month_end_invoice_close.py", task, **context) for task in (
+            "snapshot_tax_rates", "prorate_base_fees", "generate_invoice_headers", "generate_invoice_line_items",
+            "generate_base_fee_lines", "generate_tax_lines", "apply_invoice_tax", "check_invoice_integrity"))
+
+    def reconcile(self, run_id: str) -> int:
+        return sum(self.run_task("late_arrival_reconciliation.py", task, run_id=run_id) for task in (
+            "detect_late_events", "create_adjustment_lines", "tax_adjustment_lines", "update_invoice_totals"))
+
+    def sample(self, shape, n: int) -> list[dict]:
+        if not shape.params:
+            return [{}] * n
+        # SK lists bind as tuples, like the API's customer filters
+        return [{p: (v,) if p == "sks" else v for p, v in zip(shape.params, row)}
+                for row in self.execute(shape.sample.format(n=n))]
+
+    def replay(self, shape, params: dict) -> int:
+        return len(self.execute(pin_current_date(shape.sql, self.as_of), params))
+
+
+class LocalBackend(Backend):
+    name = "local"
+
+    def __init__(self, as_of: date, workdir: str | None = None, threads: int | None = None):
+        import duckdb
+
+        super().__init__(as_of)
+        self._tmp = tempfile.TemporaryDirectory(dir=workdir)
+        self.db = duckdb.connect()
+        if threads:
+            self.db.execute(f"SET threads = {int(threads)}")
+        self.db.execute(f"ATTACH '{os.path.join(self._tmp.name, 'nimbusbill.duckdb')}' AS NIMBUSBILL")
+        self.db.execute("USE NIMBUSBILL")
+        for schema in ("BRONZE", "SILVER", "GOLD", "OPS"):
+            self.db.execute(f"CREATE SCHEMA IF NOT EXISTS {schema}")
+        for stmt in _MACROS:
+            self.db.execute(stmt)
+        for name in ("01_create_bronze_tables.sql", "02_create_silver_tables.sql", "03_create_gold_tables.sql",
+                     "04_create_ops_tables.sql"):
+            with open(os.path.join(SQL_DIR, name)) as f:
+                for stmt in ddl_to_duckdb(f.read()):
+                    self.db.execute(stmt)
+
+    def execute(self, sql: str, params: dict | None = None) -> list[tuple]:
+        params = {k: list(v) if isinstance(v, tuple) else v for k, v in (params or {}).items()}
+        return self.db.execute(to_duckdb(sql), params or None).fetchall()
+
+    def cursor(self) -> "LocalCursor":
+        return LocalCursor(self)
+
+    def close(self):
+        self.db.close()
+        self._tmp.cleanup()
+
+    def setup(self, dataset) -> int:
+        self.db.execute(f"""
+            INSERT INTO NIMBUSBILL.GOLD.DIM_CUSTOMER
+                (CUSTOMER_SK, CUSTOMER_ID, CUSTOMER_NAME, STATUS, COUNTRY, PLAN_ID,
+                 EFFECTIVE_START, EFFECTIVE_END, IS_CURRENT, RECORD_HASH)
+            SELECT CAST(split_part(customer_id, '_', 2) AS BIGINT), customer_id, customer_name,
+                   status, country, plan_id, TIMESTAMP '{DIM_EFFECTIVE_FROM}', NULL, TRUE,
+                   md5(concat_ws('|', customer_name, status, country, plan_id))
+            FROM read_json_auto($path)
+        """, {"path": dataset.customers_path})
+        self.db.executemany(
+            """
+            INSERT INTO NIMBUSBILL.GOLD.DIM_PRICING_RATE
+                (RATE_SK, RATE_ID, PRODUCT_ID, PLAN_ID, UNIT, UNIT_PRICE, CURRENCY,
+                 EFFECTIVE_FROM, EFFECTIVE_TO, IS_CURRENT)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, NULL, TRUE)
+            """,
+            [(i, f"rate_{i:03d}", r["product_id"], r["plan_id"], r["unit"], r["price"], r["curr"],
+              DIM_EFFECTIVE_FROM) for i, r in enumerate(PRICING_RULES, 1)],
+        )
+        products, plans, rules = seed_products(), seed_plans(), seed_tax_rules()
+        self.db.executemany("INSERT INTO NIMBUSBILL.GOLD.DIM_PRODUCT VALUES (?, ?, ?, ?)", products)
+        self.db.executemany("INSERT INTO NIMBUSBILL.GOLD.DIM_PLAN VALUES (?, ?, ?, ?)", plans)
+        self.db.executemany(
+            """
+            INSERT INTO NIMBUSBILL.GOLD.DIM_TAX_RULE
+                (RULE_ID, COUNTRY, PRODUCT_CATEGORY, TAX_RATE, EFFECTIVE_FROM, EFFECTIVE_TO, IS_CURRENT)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            """,
+            rules,
+        )
+        return dataset.customers + len(PRICING_RULES) + len(products) + len(plans) + len(rules)
+
+    def daily_stages(self, day: str, path: str, batch_id: str):
+        context = dict(ds=day, run_id=batch_id)
+        return [
+            ("ingest", lambda: self._ingest(day, path, batch_id)),
+            ("silver", lambda: self._silver(day, batch_id, **context)),
+            ("gold", lambda: self._gold(**context)),
+        ]
+
+    def _ingest(self, day: str, path: str, batch_id: str) -> int:
+        return self.db.execute("""
+            INSERT INTO NIMBUSBILL.BRONZE.USAGE_EVENTS_RAW (INGEST_TS, SOURCE, DT, BATCH_ID, FILE_NAME, RAW)
+            SELECT CURRENT_TIMESTAMP, 'BENCH', $day::DATE, $batch, $path, json::VARCHAR
+            FROM read_ndjson_objects($path)
+        """, {"day": day, "batch": batch_id, "path": path}).fetchone()[0]
+
+    def _silver(self, day: str, batch_id: str, **context) -> int:
+        """V_USAGE_EVENTS_VALIDATED, quarantine and the EVENT_ID MERGE for one Bronze
+        batch, then the DAG's daily aggregate rebuild. Rows: the batch's events."""
+        params = {"day": day, "batch": batch_id}
+        self.db.execute("""
+            CREATE OR REPLACE TEMPORARY TABLE USAGE_EVENTS_BATCH AS
+            WITH typed AS (
+                SELECT DT, SOURCE, BATCH_ID, RAW,
+                       NULLIF(TRIM(json_extract_string(RAW, '$.event_id')), '') AS EVENT_ID,
+                       TRY_CAST(json_extract_string(RAW, '$.event_timestamp') AS TIMESTAMP) AS EVENT_TS,
+                       NULLIF(TRIM(json_extract_string(RAW, '$.customer_id')), '') AS CUSTOMER_ID,
+                       NULLIF(TRIM(json_extract_string(RAW, '$.product_id')), '') AS PRODUCT_ID,
+                       json_extract_string(RAW, '$.plan_id') AS PLAN_ID,
+                       json_extract_string(RAW, '$.region') AS REGION,
+                       NULLIF(TRIM(json_extract_string(RAW, '$.unit')), '') AS UNIT,
+                       TRY_CAST(json_extract_string(RAW, '$.quantity') AS DECIMAL(38,6)) AS QUANTITY
+                FROM NIMBUSBILL.BRONZE.USAGE_EVENTS_RAW
+                WHERE BATCH_ID = $batch
+            ),
+            known_units AS (
+                SELECT DISTINCT PRODUCT_ID, UNIT FROM NIMBUSBILL.GOLD.DIM_PRICING_RATE
+            )
+            SELECT t.*, t.EVENT_TS::DATE AS EVENT_DATE, md5(t.RAW) AS RAW_HASH,
+                   NULLIF(concat_ws(',',
+                       IFF(t.EVENT_ID IS NULL, 'missing_event_id', NULL),
+                       IFF(t.EVENT_TS IS NULL, 'invalid_event_timestamp', NULL),
+                       IFF(t.CUSTOMER_ID IS NULL, 'missing_customer_id', NULL),
+                       IFF(t.PRODUCT_ID IS NULL, 'missing_product_id', NULL),
+                       IFF(t.QUANTITY IS NULL, 'invalid_quantity', NULL),
+                       IFF(t.QUANTITY < 0, 'negative_quantity', NULL),
+                       IFF(t.UNIT IS NULL OR (t.PRODUCT_ID IS NOT NULL AND u.PRODUCT_ID IS NULL),
+                           'unknown_unit', NULL)
+                   ), '') AS ERROR_REASON
+            FROM typed t
+            LEFT JOIN known_units u ON u.PRODUCT_ID = t.PRODUCT_ID AND u.UNIT = t.UNIT
+            WHERE t.EVENT_TS::DATE = $day::DATE OR (t.EVENT_TS IS NULL AND t.DT = $day::DATE)
+        """, params)
+        self.db.execute("""
+            INSERT INTO NIMBUSBILL.SILVER.USAGE_EVENTS_QUARANTINE
+                (INGEST_TS, DT, SOURCE, ERROR_REASON, RAW, BATCH_ID, EVENT_ID, RAW_HASH)
+            SELECT CURRENT_TIMESTAMP, DT, SOURCE, ERROR_REASON, RAW, BATCH_ID, EVENT_ID, RAW_HASH
+            FROM USAGE_EVENTS_BATCH b
+            WHERE ERROR_REASON IS NOT NULL
+              AND NOT EXISTS (SELECT 1 FROM NIMBUSBILL.SILVER.USAGE_EVENTS_QUARANTINE q
+                              WHERE q.RAW_HASH = b.RAW_HASH)
+        """)
+        self.db.execute("""
+            MERGE INTO NIMBUSBILL.SILVER.USAGE_EVENTS_CLEAN T
+            USING (
+                SELECT * FROM USAGE_EVENTS_BATCH
+                WHERE ERROR_REASON IS NULL
+                QUALIFY ROW_NUMBER() OVER (PARTITION BY EVENT_ID ORDER BY EVENT_TS DESC) = 1
+            ) S
+            ON T.EVENT_ID = S.EVENT_ID
+            WHEN MATCHED THEN
+                UPDATE SET LOAD_TS = CURRENT_TIMESTAMP, BATCH_ID = S.BATCH_ID, RAW_HASH = S.RAW_HASH
+            WHEN NOT MATCHED THEN
+                INSERT (EVENT_ID, EVENT_TS, EVENT_DATE, CUSTOMER_ID, PRODUCT_ID, PLAN_ID, REGION, UNIT,
+                        QUANTITY, SOURCE, LOAD_TS, BATCH_ID, RAW_HASH)
+                VALUES (S.EVENT_ID, S.EVENT_TS, S.EVENT_DATE, S.CUSTOMER_ID, S.PRODUCT_ID, S.PLAN_ID,
+                        S.REGION, S.UNIT, S.QUANTITY, S.SOURCE, CURRENT_TIMESTAMP, S.BATCH_ID, S.RAW_HASH)
+        """)
+        self.run_task("daily_usage_billing_pipeline.py", "silver_daily_agg_rebuild", **context)
+        return self.db.execute("SELECT COUNT(*) FROM USAGE_EVENTS_BATCH").fetchone()[0]
+
+    def _gold(self, **context) -> int:
+        rows = self.run_task("daily_usage_billing_pipeline.py", "gold_compute_daily_costs", **context)
+        self.run_task("daily_usage_billing_pipeline.py", "dq_check_gold_cardinality", **context)
+        return rows
+
+
+class LocalCursor:
+    """DB-API style cursor over a LocalBackend, so billing/* jobs that take a
+    Snowflake cursor run their own statements on DuckDB."""
+
+    def __init__(self, backend: LocalBackend):
+        self.backend = backend
+        self._rows: list[tuple] = []
+
+    def execute(self, sql: str, params: dict | None = None):
+        self._rows = self.backend.execute(sql, params)
+
+    def fetchone(self) -> tuple | None:
+        return self._rows.pop(0) if self._rows else None
+
+    def fetchall(self) -> list[tuple]:
+        rows, self._rows = self._rows, []
+        return rows
+
+
+class SnowflakeBackend(Backend):
+    name = "snowflake"
+
+    def __init__(self, as_of: date):
+        from scripts.run_dq_checks import get_connection
+
+        super().__init__(as_of)
+        self.conn = get_connection()
+        self.cursor = self.conn.cursor()
+        self.cursor.execute("ALTER SESSION SET USE_CACHED_RESULT = FALSE")
+
+    def execute(self, sql: str, params: dict | None = None) -> list[tuple]:
+        self.cursor.execute(sql, params)
+        return self.cursor.fetchall()
+
+    def close(self):
+        self.cursor.close()
+        self.conn.close()
+
+    def setup(self, dataset) -> int:
+        with open(dataset.customers_path) as f:
+            customers = [json.loads(line) for line in f if line.strip()]
+        self.cursor.executemany(
+            """
+            INSERT INTO NIMBUSBILL.GOLD.DIM_CUSTOMER
+                (CUSTOMER_SK, CUSTOMER_ID, CUSTOMER_NAME, STATUS, COUNTRY, PLAN_ID,
+                 EFFECTIVE_START, EFFECTIVE_END, IS_CURRENT, RECORD_HASH)
+            VALUES (%(sk)s, %(customer_id)s, %(customer_name)s, %(status)s, %(country)s, %(plan_id)s,
+                    %(start)s, NULL, TRUE, NULL)
+            """,
+            [{**c, "sk": int(c["customer_id"].split("_")[1]), "start": DIM_EFFECTIVE_FROM} for c in customers],
+        )
+        self.cursor.executemany(
+            """
+            INSERT INTO NIMBUSBILL.GOLD.DIM_PRICING_RATE
+                (RATE_SK, RATE_ID, PRODUCT_ID, PLAN_ID, UNIT, UNIT_PRICE, CURRENCY,
+                 EFFECTIVE_FROM, EFFECTIVE_TO, IS_CURRENT)
+            VALUES (%(sk)s, %(rate_id)s, %(product_id)s, %(plan_id)s, %(unit)s, %(price)s, %(curr)s,
+                    %(start)s, NULL, TRUE)
+            """,
+            [{**r, "sk": i, "rate_id": f"rate_{i:03d}", "start": DIM_EFFECTIVE_FROM}
+             for i, r in enumerate(PRICING_RULES, 1)],
+        )
+        products, plans, rules = seed_products(), seed_plans(), seed_tax_rules()
+        self.cursor.executemany("INSERT INTO NIMBUSBILL.GOLD.DIM_PRODUCT VALUES (%s, %s, %s, %s)", products)
+        self.cursor.executemany("INSERT INTO NIMBUSBILL.GOLD.DIM_PLAN VALUES (%s, %s, %s, %s)", plans)
+        self.cursor.executemany(
+            """
+            INSERT INTO NIMBUSBILL.GOLD.DIM_TAX_RULE
+                (RULE_ID, COUNTRY, PRODUCT_CATEGORY, TAX_RATE, EFFECTIVE_FROM, EFFECTIVE_TO, IS_CURRENT)
+            VALUES (%s, %s, %s, %s, %s, %s, %s)
+            """,
+            rules,
+        )
+        return len(customers) + len(PRICING_RULES) + len(products) + len(plans) + len(rules)
+
+    def daily_stages(self, day: str, path: str, batch_id: str):
+        from scripts.backfill_history import load_day
+
+        def daily_load() -> int:
+            load_day(self.cursor, day, batch_id, file_path=path)
+            with open(path) as f:
+                return sum(1 for _ in f)
+
+        return [("daily_load", daily_load)]
+
+
+BACKENDS = {LocalBackend.name: LocalBackend, SnowflakeBackend.name: SnowflakeBackend}
@@ -0,0 +1,138 @@
+"""
+benchmark_base_fees.py
+
+Benchmarks the month-end base-fee proration (prorate_base_fees,
+generate_invoice_headers and generate_base_fee_lines in
+airflow/dags/month_end_invoice_close.py) against a large customer
+dimension, running the DAG's own SQL on the local DuckDB backend of
+benchmark_pipeline.py (scripts/bench_backends.py).
+
+Builds --customers current customers, all versions effective before the
+period, then adds mid-period SCD2 history: --plan-changes of them switch
+plan on a random day (split lines), --renames get a new version on the
+same plan (must stay one line) and --cancellations are cancelled mid-period
+(prorated up to the cancellation). No usage is loaded, so every invoice
+comes from base fees alone. Reports per-task time and rows and checks the
+lines against the expected proration.
+
+    python scripts/benchmark_base_fees.py --customers 500000
+"""
+import sys
+import os
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import argparse
+import calendar
+import json
+import time
+from datetime import date
+
+from scripts.bench_backends import DIM_EFFECTIVE_FROM, LocalBackend, seed_plans
+
+PERIOD_START = "2024-01-01"
+PERIOD_END = "2024-01-31"
+TASKS = ("prorate_base_fees", "generate_invoice_headers", "generate_base_fee_lines")
+PLANS = ["plan_free", "plan_starter", "plan_pro", "plan_enterprise"]
+
+
+def build_dimension(backend: LocalBackend, customers: int, plan_changes: float, renames: float,
+                    cancellations: float, seed: int):
+    """Current versions for every customer plus mid-period history, generated in the engine."""
+    db = backend.db
+    db.execute(f"SELECT setseed({(seed % 1000) / 1000})")
+    db.executemany("INSERT INTO NIMBUSBILL.GOLD.DIM_PLAN VALUES (?, ?, ?, ?)", seed_plans())
+    # kind: 0 unchanged, 1 plan change, 2 rename, 3 cancellation; day: 2..28 of the period
+    db.execute(f"""
+        CREATE TEMP TABLE base AS
+        SELECT i AS sk, 'cust_' || i AS customer_id,
+               {PLANS}[1 + (i % 4)] AS plan_id,
+               CASE WHEN r < {plan_changes} THEN 1
+                    WHEN r < {plan_changes + renames} THEN 2
+                    WHEN r < {plan_changes + renames + cancellations} THEN 3 ELSE 0 END AS kind,
+               DATE '{PERIOD_START}' + CAST(1 + floor(random() * 27) AS INTEGER) AS change_day
+        FROM (SELECT i, random() AS r FROM range(1, {customers} + 1) t(i))
+    """)
+    db.execute(f"""
+        INSERT INTO NIMBUSBILL.GOLD.DIM_CUSTOMER
+            (CUSTOMER_SK, CUSTOMER_ID, CUSTOMER_NAME, STATUS, COUNTRY, PLAN_ID,
+             EFFECTIVE_START, EFFECTIVE_END, IS_CURRENT)
+        SELECT sk, customer_id, customer_id, 'active', 'US', plan_id, TIMESTAMP '{DIM_EFFECTIVE_FROM}',
+               IF(kind = 0, NULL, CAST(change_day AS TIMESTAMP)), kind = 0
+        FROM base
+        UNION ALL
+        SELECT {customers} + sk, customer_id, customer_id || IF(kind = 2, ' (renamed)', ''),
+               IF(kind = 3, 'cancelled', 'active'), 'US',
+               IF(kind = 1, {PLANS}[1 + ((sk + 1) % 4)], plan_id),
+               CAST(change_day AS TIMESTAMP), NULL, TRUE
+        FROM base WHERE kind > 0
+    """)
+
+
+def expected(backend: LocalBackend) -> dict:
+    """Lines and amount the close should produce, computed per customer from `base`."""
+    days = calendar.monthrange(*date.fromisoformat(PERIOD_START).timetuple()[:2])[1]
+    return dict(zip(("lines", "amount"), backend.db.execute(f"""
+        WITH segments AS (
+            SELECT plan_id, IF(kind IN (1, 3), datediff('day', DATE '{PERIOD_START}', change_day), {days}) AS d
+            FROM base
+            UNION ALL
+            SELECT {PLANS}[1 + ((sk + 1) % 4)], {days} - datediff('day', DATE '{PERIOD_START}', change_day)
+            FROM base WHERE kind = 1
+        )
+        SELECT COUNT(*), SUM(ROUND(CAST(p.BASE_FEE * s.d / {days} AS DECIMAL(38,10)), 2))
+        FROM segments s JOIN NIMBUSBILL.GOLD.DIM_PLAN p ON p.PLAN_ID = s.plan_id
+        WHERE p.BASE_FEE > 0 AND s.d > 0
+    """).fetchone()))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark month-end base-fee proration")
+    parser.add_argument("--customers", type=int, default=500_000)
+    parser.add_argument("--plan-changes", type=float, default=0.05, help="Share switching plan mid-period")
+    parser.add_argument("--renames", type=float, default=0.05, help="Share with a same-plan version mid-period")
+    parser.add_argument("--cancellations", type=float, default=0.02, help="Share cancelled mid-period")
+    parser.add_argument("--threads", type=int, help="engine threads")
+    parser.add_argument("--json-out", help="Also write results to this JSON file")
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    backend = LocalBackend(date.fromisoformat(PERIOD_END), threads=args.threads)
+    try:
+        t0 = time.perf_counter()
+        build_dimension(backend, args.customers, args.plan_changes, args.renames, args.cancellations, args.seed)
+        versions = backend.db.execute("SELECT COUNT(*) FROM NIMBUSBILL.GOLD.DIM_CUSTOMER").fetchone()[0]
+        print(f"DIM_CUSTOMER: {versions:,} versions for {args.customers:,} customers "
+              f"({time.perf_counter() - t0:.1f}s to build)")
+
+        context = dict(prev_ds_month_start=PERIOD_START, prev_ds_month_end=PERIOD_END, run_id="bench_base_fees")
+        results = {"customers": args.customers, "versions": versions, "tasks": {}}
+        for task in TASKS:
+            t0 = time.perf_counter()
+            rows = backend.run_task("month_end_invoice_close.py", task, **context)
+            results["tasks"][task] = {"rows": rows, "seconds": round(time.perf_counter() - t0, 3)}
+
+        lines, amount, split = backend.db.execute("""
+            SELECT COUNT(*), SUM(AMOUNT),
+                   COUNT(*) - COUNT(DISTINCT INVOICE_ID)
+            FROM NIMBUSBILL.GOLD.FACT_INVOICE_LINE_ITEMS WHERE LINE_TYPE = 'base_fee'
+        """).fetchone()
+        want = expected(backend)
+        results["check"] = {"lines": lines, "expected_lines": want["lines"], "split_invoices": split,
+                            "amount": float(amount), "expected_amount": float(want["amount"]),
+                            "ok": lines == want["lines"] and abs(float(amount) - float(want["amount"])) < 0.01}
+    finally:
+        backend.close()
+
+    print(f"\n{'task':<26} {'rows':>10} {'seconds':>8} {'rows/s':>12}")
+    for task, r in results["tasks"].items():
+        print(f"{task:<26} {r['rows']:>10,} {r['seconds']:>8.2f} {r['rows'] / max(r['seconds'], 1e-9):>12,.0f}")
+    print(f"\ncheck: {json.dumps(results['check'])}")
+    if args.json_out:
+        with open(args.json_out, "w") as f:
+            json.dump(results, f, indent=2)
+    sys.exit(0 if results["check"]["ok"] else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,161 @@
+"""
+benchmark_customer_keys.py
+
+Measures p50/p99 latency of the customer-scoped API reads with and without
+the in-process CUSTOMER_ID -> CUSTOMER_SK map (billing/customer_keys.py):
+
+  join    the previous query shape, joining DIM_CUSTOMER on CUSTOMER_ID
+  cold    map miss: key lookup query + fact query filtered on CUSTOMER_SK
+  warm    map hit: fact query filtered on CUSTOMER_SK only
+
+Runs on one connection with the result cache off, so the numbers are query
+time, not connection setup. Also reports the cost of a map hit in-process.
+
+    python scripts/benchmark_customer_keys.py --customers 50 --rounds 3
+"""
+import sys
+import os
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import argparse
+import json
+import time
+
+import numpy as np
+import snowflake.connector
+from billing.customer_keys import CustomerKeyMap
+from scripts.run_dq_checks import get_connection
+
+SHAPES = {
+    "customer_usage": (
+        """
+        SELECT f.DATE_ID, f.PRODUCT_ID, f.UNIT, f.TOTAL_QUANTITY, f.COST_AMOUNT, f.CURRENCY
+        FROM NIMBUSBILL.GOLD.FACT_CUSTOMER_DAILY_USAGE f
+        JOIN NIMBUSBILL.GOLD.DIM_CUSTOMER c ON f.CUSTOMER_SK = c.CUSTOMER_SK
+        WHERE c.CUSTOMER_ID = %(cid)s
+        ORDER BY f.DATE_ID DESC, f.PRODUCT_ID
+        """,
+        """
+        SELECT f.DATE_ID, f.PRODUCT_ID, f.UNIT, f.TOTAL_QUANTITY, f.COST_AMOUNT, f.CURRENCY
+        FROM NIMBUSBILL.GOLD.FACT_CUSTOMER_DAILY_USAGE f
+        WHERE f.CUSTOMER_SK IN (%(sks)s)
+        ORDER BY f.DATE_ID DESC, f.PRODUCT_ID
+        """,
+    ),
+    "usage_90d": (
+        """
+        SELECT f.DATE_ID, f.PRODUCT_ID, f.UNIT, SUM(f.TOTAL_QUANTITY), SUM(f.COST_AMOUNT)
+        FROM NIMBUSBILL.GOLD.FACT_CUSTOMER_DAILY_USAGE f
+        JOIN NIMBUSBILL.GOLD.DIM_CUSTOMER c ON f.CUSTOMER_SK = c.CUSTOMER_SK
+        WHERE f.DATE_ID >= DATEADD('day', -90, CURRENT_DATE()) AND c.CUSTOMER_ID = %(cid)s
+        GROUP BY f.DATE_ID, f.PRODUCT_ID, f.UNIT ORDER BY f.DATE_ID DESC LIMIT 5000
+        """,
+        """
+        SELECT f.DATE_ID, f.PRODUCT_ID, f.UNIT, SUM(f.TOTAL_QUANTITY), SUM(f.COST_AMOUNT)
+        FROM NIMBUSBILL.GOLD.FACT_CUSTOMER_DAILY_USAGE f
+        WHERE f.DATE_ID >= DATEADD('day', -90, CURRENT_DATE()) AND f.CUSTOMER_SK IN (%(sks)s)
+        GROUP BY f.DATE_ID, f.PRODUCT_ID, f.UNIT ORDER BY f.DATE_ID DESC LIMIT 5000
+        """,
+    ),
+    "invoices": (
+        """
+        SELECT i.INVOICE_ID, c.CUSTOMER_NAME, i.STATUS, i.TOTAL
+        FROM NIMBUSBILL.GOLD.FACT_INVOICES i
+        LEFT JOIN NIMBUSBILL.GOLD.DIM_CUSTOMER c ON i.CUSTOMER_SK = c.CUSTOMER_SK
+        WHERE c.CUSTOMER_ID = %(cid)s
+        ORDER BY i.ISSUED_TS DESC
+        """,
+        """
+        SELECT i.INVOICE_ID, c.CUSTOMER_NAME, i.STATUS, i.TOTAL
+        FROM NIMBUSBILL.GOLD.FACT_INVOICES i
+        LEFT JOIN NIMBUSBILL.GOLD.DIM_CUSTOMER c ON i.CUSTOMER_SK = c.CUSTOMER_SK
+        WHERE i.CUSTOMER_SK IN (%(sks)s)
+        ORDER BY i.ISSUED_TS DESC
+        """,
+    ),
+}
+
+
+def percentiles(samples_ms: list[float]) -> dict:
+    a = np.asarray(samples_ms)
+    return {"n": len(a), "p50_ms": float(np.percentile(a, 50)), "p99_ms": float(np.percentile(a, 99))}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="p50/p99 of customer reads with and without the key map")
+    parser.add_argument("--customers", type=int, default=50, help="Customer IDs sampled from DIM_CUSTOMER")
+    parser.add_argument("--rounds", type=int, default=3, help="Warm-map passes over the sample")
+    parser.add_argument("--json-out", help="Also write results to this JSON file")
+    args = parser.parse_args()
+
+    conn = get_connection()
+    cur = conn.cursor(snowflake.connector.DictCursor)
+
+    def fetch(sql, params=None):
+        cur.execute(sql, params or {})
+        return [{k.lower(): v for k, v in row.items()} for row in cur.fetchall()]
+
+    def timed(sql, params) -> float:
+        t0 = time.perf_counter()
+        fetch(sql, params)
+        return (time.perf_counter() - t0) * 1000
+
+    results = {}
+    try:
+        fetch("ALTER SESSION SET USE_CACHED_RESULT = FALSE")
+        ids = [r["customer_id"] for r in fetch(
+            f"SELECT CUSTOMER_ID FROM NIMBUSBILL.GOLD.DIM_CUSTOMER WHERE IS_CURRENT = TRUE "
+            f"SAMPLE ({args.customers} ROWS)"
+        )]
+        for name, (join_sql, sk_sql) in SHAPES.items():
+            join_ms, cold_ms, warm_ms = [], [], []
+            keys = CustomerKeyMap(fetch, capacity=max(len(ids), 1), refresh_seconds=3600)
+            for cid in ids:
+                t0 = time.perf_counter()
+                sks = keys.sks(cid)
+                fetch(sk_sql, {"sks": sks})
+                cold_ms.append((time.perf_counter() - t0) * 1000)
+            for _ in range(args.rounds):
+                for cid in ids:
+                    join_ms.append(timed(join_sql, {"cid": cid}))
+                    t0 = time.perf_counter()
+                    sks = keys.sks(cid)
+                    fetch(sk_sql, {"sks": sks})
+                    warm_ms.append((time.perf_counter() - t0) * 1000)
+            results[name] = {
+                "join": percentiles(join_ms),
+                "cold": percentiles(cold_ms),
+                "warm": percentiles(warm_ms),
+            }
+
+        keys = CustomerKeyMap(fetch, capacity=max(len(ids), 1), refresh_seconds=3600)
+        for cid in ids:
+            keys.sks(cid)
+        hit_us = []
+        for _ in range(1000):
+            for cid in ids:
+                t0 = time.perf_counter_ns()
+                keys.sks(cid)
+                hit_us.append((time.perf_counter_ns() - t0) / 1000)
+        results["map_hit_us"] = {"p50": float(np.percentile(hit_us, 50)), "p99": float(np.percentile(hit_us, 99))}
+    finally:
+        cur.close()
+        conn.close()
+
+    print(f"{'shape':<16} {'path':<6} {'n':>6} {'p50 ms':>9} {'p99 ms':>9}")
+    for name in SHAPES:
+        for path in ("join", "cold", "warm"):
+            r = results[name][path]
+            print(f"{name:<16} {path:<6} {r['n']:>6} {r['p50_ms']:>9.1f} {r['p99_ms']:>9.1f}")
+    hit = results["map_hit_us"]
+    print(f"\nmap hit in-process: p50 {hit['p50']:.2f} us, p99 {hit['p99']:.2f} us")
+
+    if args.json_out:
+        with open(args.json_out, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"\nWrote {args.json_out}")
+
+
+if __name__ == "__main__":
+    main()
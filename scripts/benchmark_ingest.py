@@ -0,0 +1,171 @@
+"""
+benchmark_ingest.py
+
+Throughput benchmark for POST /events. Concurrent clients post batches of
+generated usage events (JSON arrays or NDJSON) and the run reports accepted
+events/s, request latency percentiles and 429s. In-process (the default)
+the app's buffer writes its WAL and chunks to a temporary directory through
+the local sink; afterwards every chunk is read back to check that each
+acknowledged event landed exactly once.
+
+    python scripts/benchmark_ingest.py --events 500000 --batch 1000 --concurrency 8
+    python scripts/benchmark_ingest.py --format ndjson --no-fsync
+    python scripts/benchmark_ingest.py --url http://localhost:8000 --events 100000
+
+Exits 1 when throughput is below --target (50k events/s by default).
+"""
+from __future__ import annotations
+
+import sys
+import os
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import argparse
+import asyncio
+import gzip
+import json
+import random
+import tempfile
+import time
+import uuid
+from datetime import datetime, timedelta
+
+import httpx
+
+from billing.ingest import EventBuffer, LocalSink
+from datagen.generate_usage_events import PRODUCTS, REGIONS, UNITS
+from scripts.loadtest_api import _import_api, _percentile
+
+
+def make_batches(events: int, batch: int, fmt: str, invalid_share: float, seed: int) -> list[bytes]:
+    rng = random.Random(seed)
+    start = datetime(2024, 1, 1)
+    bodies = []
+    for offset in range(0, events, batch):
+        rows = []
+        for _ in range(min(batch, events - offset)):
+            product_id = rng.choice(PRODUCTS)
+            rows.append({
+                "event_id": str(uuid.UUID(int=rng.getrandbits(128))),
+                "event_timestamp": (start + timedelta(seconds=rng.randrange(86400))).isoformat() + "Z",
+                "customer_id": f"cust_{rng.randint(1, 1000)}",
+                "product_id": product_id,
+                "quantity": -1 if rng.random() < invalid_share else rng.randint(1, 500),
+                "unit": UNITS[product_id],
+                "region": rng.choice(REGIONS),
+                "schema_version": "1.0",
+            })
+        if fmt == "ndjson":
+            bodies.append(b"\n".join(json.dumps(r).encode() for r in rows))
+        else:
+            bodies.append(json.dumps(rows).encode())
+    return bodies
+
+
+async def drive(client: httpx.AsyncClient, bodies: list[bytes], fmt: str, concurrency: int) -> dict:
+    content_type = "application/x-ndjson" if fmt == "ndjson" else "application/json"
+    queue = list(reversed(bodies))
+    latencies, stats = [], {"accepted": 0, "rejected": 0, "throttled": 0, "errors": 0}
+
+    async def worker():
+        while queue:
+            body = queue.pop()
+            while True:
+                t0 = time.perf_counter()
+                r = await client.post("/events", content=body, headers={"content-type": content_type})
+                latencies.append((time.perf_counter() - t0) * 1000)
+                if r.status_code != 429:
+                    break
+                stats["throttled"] += 1
+                await asyncio.sleep(float(r.headers.get("retry-after", "1")))
+            if r.status_code == 202:
+                result = r.json()
+                stats["accepted"] += result["accepted"]
+                stats["rejected"] += len(result["rejected"])
+            else:
+                stats["errors"] += 1
+
+    t0 = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    stats["seconds"] = time.perf_counter() - t0
+    latencies.sort()
+    stats.update(requests=len(latencies), p50_ms=_percentile(latencies, 0.5), p99_ms=_percentile(latencies, 0.99))
+    return stats
+
+
+def chunk_events(directory: str) -> tuple[int, int, int]:
+    """(events, distinct event_ids, compressed bytes) across the sink's chunks."""
+    events, ids, size = 0, set(), 0
+    for name in os.listdir(directory) if os.path.isdir(directory) else []:
+        path = os.path.join(directory, name)
+        size += os.path.getsize(path)
+        with gzip.open(path, "rb") as f:
+            for line in f:
+                events += 1
+                ids.add(json.loads(line)["event_id"])
+    return events, len(ids), size
+
+
+def main():
+    parser = argparse.ArgumentParser(description="POST /events throughput benchmark")
+    parser.add_argument("--events", type=int, default=500_000)
+    parser.add_argument("--batch", type=int, default=1_000, help="events per request")
+    parser.add_argument("--concurrency", type=int, default=8, help="concurrent clients")
+    parser.add_argument("--format", choices=("json", "ndjson"), default="json")
+    parser.add_argument("--invalid-share", type=float, default=0.0, help="share of events violating the contract")
+    parser.add_argument("--no-fsync", action="store_true", help="skip fsync on WAL appends (in-process only)")
+    parser.add_argument("--url", help="benchmark a running API instead of the app in-process")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--target", type=float, default=50_000, help="events/s below which the run fails")
+    parser.add_argument("--json-out", help="Also write results to this JSON file")
+    args = parser.parse_args()
+
+    bodies = make_batches(args.events, args.batch, args.format, args.invalid_share, args.seed)
+
+    async def run(client):
+        async with client:
+            return await drive(client, bodies, args.format, args.concurrency)
+
+    workdir = None
+    if args.url:
+        stats = asyncio.run(run(httpx.AsyncClient(base_url=args.url, timeout=60)))
+    else:
+        api = _import_api()
+        workdir = tempfile.mkdtemp(prefix="nimbusbill_ingest_bench_")
+        api.event_buffer = EventBuffer(os.path.join(workdir, "wal"), LocalSink(os.path.join(workdir, "chunks")),
+                                       fsync=not args.no_fsync)
+        transport = httpx.ASGITransport(app=api.app)
+        stats = asyncio.run(run(httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=60)))
+        t0 = time.perf_counter()
+        api.event_buffer.flush(force=True)
+        stats["final_flush_seconds"] = time.perf_counter() - t0
+        stats["chunks"] = api.event_buffer.stats.flushed_chunks
+        landed, distinct, stats["chunk_bytes"] = chunk_events(os.path.join(workdir, "chunks"))
+        stats["landed"] = landed
+        if landed != stats["accepted"] or distinct != landed:
+            print(f"error: {stats['accepted']:,} acknowledged but {landed:,} landed ({distinct:,} distinct)")
+            stats["errors"] += 1
+
+    stats["events_per_s"] = stats["accepted"] / stats["seconds"] if stats["seconds"] else 0.0
+    print(f"{stats['accepted']:,} events accepted in {stats['seconds']:.2f} s over {stats['requests']:,} requests "
+          f"({args.batch:,}/batch, {args.format}, {args.concurrency} clients)")
+    print(f"  throughput  {stats['events_per_s']:>12,.0f} events/s")
+    print(f"  latency     p50 {stats['p50_ms'] or 0:.1f} ms   p99 {stats['p99_ms'] or 0:.1f} ms")
+    print(f"  rejected    {stats['rejected']:,}   429s {stats['throttled']:,}   errors {stats['errors']:,}")
+    if workdir:
+        print(f"  chunks      {stats['chunks']} ({stats['chunk_bytes'] / 2**20:.1f} MiB gzip), "
+              f"final flush {stats['final_flush_seconds']:.2f} s")
+    if args.json_out:
+        with open(args.json_out, "w") as f:
+            json.dump({"args": vars(args), "results": stats}, f, indent=2)
+        print(f"\nWrote {args.json_out}")
+
+    ok = not stats["errors"] and stats["events_per_s"] >= args.target
+    if not ok:
+        print(f"\nFAIL: below {args.target:,.0f} events/s or errors")
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
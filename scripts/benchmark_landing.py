@@ -0,0 +1,173 @@
+"""
+benchmark_landing.py
+
+Compares landing-file formats (billing/landing.py) for one generated day of
+usage events: JSONL, the gzipped JSONL that PUT uploads, and Parquet.
+Reports file size and write time per format, then the load cost locally in
+DuckDB: parsing every contract field out of JSON objects (what Silver does
+for USAGE_EVENTS_RAW) vs. reading the typed Parquet columns as they are.
+
+DuckDB timings are a proxy for the warehouse's parse cost. With --snowflake
+the PUT and COPY statements from load_statements() are also timed against
+temporary copies of the Bronze tables.
+
+    python scripts/benchmark_landing.py --customers 20000 --events 50
+    python scripts/benchmark_landing.py --customers 2000 --snowflake
+"""
+import sys
+import os
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import argparse
+import gzip
+import json
+import random
+import shutil
+import tempfile
+import time
+
+from billing.landing import load_statements, write_parquet
+from datagen.generate_usage_events import generate_events, save_events
+
+# Silver's parse of one RAW object (sql/05_views_and_helpers.sql), in DuckDB
+PARSE_JSON_SQL = """
+    SELECT COUNT(*), SUM(QUANTITY), COUNT(DISTINCT CUSTOMER_ID)
+    FROM (
+        SELECT NULLIF(TRIM(json_extract_string(json, '$.event_id')), '') AS EVENT_ID,
+               TRY_CAST(json_extract_string(json, '$.event_timestamp') AS TIMESTAMP) AS EVENT_TS,
+               NULLIF(TRIM(json_extract_string(json, '$.customer_id')), '') AS CUSTOMER_ID,
+               NULLIF(TRIM(json_extract_string(json, '$.product_id')), '') AS PRODUCT_ID,
+               json_extract_string(json, '$.plan_id') AS PLAN_ID,
+               json_extract_string(json, '$.region') AS REGION,
+               NULLIF(TRIM(json_extract_string(json, '$.unit')), '') AS UNIT,
+               TRY_CAST(json_extract_string(json, '$.quantity') AS DECIMAL(38,6)) AS QUANTITY
+        FROM read_ndjson_objects($path)
+    )
+"""
+
+READ_PARQUET_SQL = """
+    SELECT COUNT(*), SUM(quantity), COUNT(DISTINCT customer_id)
+    FROM read_parquet($path)
+"""
+
+
+def timed(fn, repeat: int = 1):
+    """(best seconds, last result) over `repeat` runs."""
+    best, result = float("inf"), None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - t0)
+    return best, result
+
+
+def write_files(events: list[dict], date_str: str, workdir: str) -> dict:
+    paths = {
+        "jsonl": os.path.join(workdir, f"usage_events_{date_str}.jsonl"),
+        "parquet": os.path.join(workdir, f"usage_events_{date_str}.parquet"),
+    }
+    paths["jsonl.gz"] = paths["jsonl"] + ".gz"
+    results = {}
+
+    seconds, _ = timed(lambda: save_events(events, date_str, workdir, "jsonl"))
+    results["jsonl"] = {"write_s": seconds}
+
+    def gzip_jsonl():
+        with open(paths["jsonl"], "rb") as src, gzip.open(paths["jsonl.gz"], "wb") as dst:
+            shutil.copyfileobj(src, dst)
+    seconds, _ = timed(gzip_jsonl)
+    results["jsonl.gz"] = {"write_s": results["jsonl"]["write_s"] + seconds}
+
+    seconds, _ = timed(lambda: write_parquet(events, paths["parquet"]))
+    results["parquet"] = {"write_s": seconds}
+
+    for fmt, path in paths.items():
+        results[fmt].update(path=path, bytes=os.path.getsize(path))
+    return results
+
+
+def local_load(results: dict, repeat: int):
+    import duckdb
+
+    db = duckdb.connect()
+    checks = {}
+    for fmt, sql in (("jsonl", PARSE_JSON_SQL), ("jsonl.gz", PARSE_JSON_SQL), ("parquet", READ_PARQUET_SQL)):
+        seconds, row = timed(lambda: db.execute(sql, {"path": results[fmt]["path"]}).fetchone(), repeat)
+        results[fmt]["load_s"] = seconds
+        checks[fmt] = (row[0], float(row[1]), row[2])
+    db.close()
+    # every format must carry the same events
+    return len(set(checks.values())) == 1
+
+
+def snowflake_load(results: dict, date_str: str):
+    from scripts.run_dq_checks import get_connection
+
+    conn = get_connection()
+    cursor = conn.cursor()
+    raw_table, typed_table = "NIMBUSBILL.BRONZE.BENCH_EVENTS_RAW", "NIMBUSBILL.BRONZE.BENCH_EVENTS_TYPED"
+    try:
+        cursor.execute(f"CREATE OR REPLACE TEMPORARY TABLE {raw_table} LIKE NIMBUSBILL.BRONZE.USAGE_EVENTS_RAW")
+        cursor.execute(f"CREATE OR REPLACE TEMPORARY TABLE {typed_table} LIKE NIMBUSBILL.BRONZE.USAGE_EVENTS_TYPED")
+        for fmt in ("jsonl", "parquet"):
+            statements = load_statements(results[fmt]["path"], date_str, f"bench_{fmt}", "BENCH",
+                                         raw_table=raw_table, typed_table=typed_table)
+            put_s, _ = timed(lambda: cursor.execute(statements[0]))
+            copy_s, _ = timed(lambda: [cursor.execute(s) for s in statements[1:]])
+            results[fmt].update(put_s=put_s, copy_s=copy_s)
+    finally:
+        cursor.close()
+        conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare JSONL and Parquet landing files")
+    parser.add_argument("--customers", type=int, default=10_000)
+    parser.add_argument("--events", type=int, default=50, help="avg events per customer")
+    parser.add_argument("--date", default="2024-01-15")
+    parser.add_argument("--repeat", type=int, default=3, help="best of N for local load timings")
+    parser.add_argument("--snowflake", action="store_true", help="also time PUT + COPY into Snowflake")
+    parser.add_argument("--json-out", help="Also write results to this JSON file")
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    print(f"Generating {args.customers:,} customers x ~{args.events} events for {args.date}...")
+    events = generate_events(args.date, args.customers, args.events)
+
+    workdir = tempfile.mkdtemp(prefix="nimbusbill_landing_bench_")
+    try:
+        results = write_files(events, args.date, workdir)
+        consistent = local_load(results, args.repeat)
+        if args.snowflake:
+            snowflake_load(results, args.date)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    base = results["jsonl.gz"]
+    print(f"\n{len(events):,} events")
+    print(f"{'format':<10} {'size MiB':>9} {'vs gz':>6} {'write s':>8} {'load s':>7}"
+          + (f" {'PUT s':>6} {'COPY s':>7}" if args.snowflake else ""))
+    for fmt, r in results.items():
+        line = (f"{fmt:<10} {r['bytes'] / 2**20:>9.1f} {r['bytes'] / base['bytes']:>6.2f} "
+                f"{r['write_s']:>8.2f} {r['load_s']:>7.3f}")
+        if args.snowflake and "put_s" in r:
+            line += f" {r['put_s']:>6.2f} {r['copy_s']:>7.2f}"
+        print(line)
+    print(f"\nParquet is {results['parquet']['bytes'] / base['bytes']:.0%} the size of gzipped JSONL "
+          f"and loads {base['load_s'] / results['parquet']['load_s']:.0f}x faster locally")
+    if not consistent:
+        print("error: formats disagree on row count, total quantity or customers")
+
+    if args.json_out:
+        with open(args.json_out, "w") as f:
+            json.dump({"args": vars(args), "events": len(events),
+                       "results": {k: {m: v for m, v in r.items() if m != "path"} for k, r in results.items()}},
+                      f, indent=2)
+        print(f"\nWrote {args.json_out}")
+    sys.exit(0 if consistent else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,253 @@
+"""
+benchmark_pipeline.py
+
+End-to-end pipeline benchmark at fixed scale factors. SFn is n x 1,000
+customers over 30 days (about 5 events per customer per day, datagen's
+defaults for late and duplicate events) on a fixed calendar starting
+2024-01-01. A run loads every day through ingest -> Silver -> Gold, closes
+January, loads a late batch for an already invoiced day, runs the
+late-arrival reconciliation and replays the API query shapes
+(billing/physical_design.py) at the dataset's as-of date.
+
+Per stage it records wall time, rows processed, rows/s and the process's
+peak RSS so far (a high-water mark: it never drops between stages). Results
+go to JSON for comparison across commits:
+
+    python scripts/benchmark_pipeline.py --sf 1 --json-out base.json
+    git checkout my-branch
+    python scripts/benchmark_pipeline.py --sf 1 --json-out new.json
+    python scripts/benchmark_pipeline.py --compare base.json new.json --tolerance 0.15
+
+Datasets are generated once per (scale factor, seed) under
+datagen/data/bench/ and reused, so both sides of a comparison read the same
+files. The default backend is an embedded DuckDB database (pip install
+duckdb); see scripts/bench_backends.py for what each backend runs.
+"""
+from __future__ import annotations
+
+import sys
+import os
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import argparse
+import json
+import platform
+import random
+import resource
+import subprocess
+import time
+from datetime import date, timedelta
+
+from billing.physical_design import QUERY_SHAPES
+from datagen.generate_customers import generate_customers, save_customers
+from datagen.generate_usage_events import generate_events, save_events
+from scripts.bench_backends import BACKENDS
+
+BENCH_DIR = os.path.join(os.path.dirname(__file__), "..", "datagen", "data", "bench")
+CUSTOMERS_PER_SF = 1_000
+DAYS = 30
+EVENTS_PER_CUSTOMER = 5
+START = date(2024, 1, 1)
+PERIOD_START, PERIOD_END = "2024-01-01", "2024-01-31"
+LATE_SHARE = 0.1          # share of customers with usage in the late batch
+
+# Slowdowns smaller than this in absolute terms are run-to-run noise, whatever the ratio
+NOISE_FLOOR = {"seconds": 0.25, "p50_ms": 2.0}
+
+
+class Dataset:
+    def __init__(self, sf: float, seed: int):
+        self.sf, self.seed = sf, seed
+        self.customers = max(1, int(sf * CUSTOMERS_PER_SF))
+        self.days = [str(START + timedelta(days=d)) for d in range(DAYS)]
+        self.late_day = self.days[-1]
+        self.as_of = START + timedelta(days=DAYS - 1)
+        self.root = os.path.abspath(os.path.join(BENCH_DIR, f"sf{sf:g}_seed{seed}"))
+        self.customers_path = os.path.join(self.root, f"customers_{self.days[0]}.jsonl")
+        self.late_path = os.path.join(self.root, "late", f"usage_events_{self.late_day}_late.jsonl")
+        self.manifest = os.path.join(self.root, "dataset.json")
+
+    def events_path(self, day: str) -> str:
+        return os.path.join(self.root, f"usage_events_{day}.jsonl")
+
+    def ensure(self) -> dict:
+        """Generate the dataset unless a complete one is already on disk."""
+        if os.path.exists(self.manifest):
+            with open(self.manifest) as f:
+                return json.load(f)
+        print(f"Generating SF{self.sf:g} ({self.customers:,} customers x {DAYS} days) in {self.root}...")
+        random.seed(self.seed)
+        save_customers(generate_customers(self.days[0], self.customers), self.days[0], self.root)
+        events = 0
+        for day in self.days:
+            batch = generate_events(day, self.customers, EVENTS_PER_CUSTOMER)
+            save_events(batch, day, self.root)
+            events += len(batch)
+        # Extra usage for the last day, delivered after January is invoiced
+        late = generate_events(self.late_day, max(1, int(self.customers * LATE_SHARE)), 1,
+                               late_prob=0.0, duplicate_prob=0.0)
+        os.makedirs(os.path.dirname(self.late_path), exist_ok=True)
+        with open(self.late_path, "w") as f:
+            f.writelines(json.dumps(e) + "\n" for e in late)
+        manifest = {"sf": self.sf, "seed": self.seed, "customers": self.customers, "days": DAYS,
+                    "events": events, "late_events": len(late)}
+        with open(self.manifest, "w") as f:
+            json.dump(manifest, f, indent=2)
+        return manifest
+
+
+def _peak_rss_mb() -> float:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 2**20 if sys.platform == "darwin" else peak / 2**10   # bytes on macOS, KiB elsewhere
+
+
+def _git_commit() -> str | None:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True, cwd=os.path.dirname(__file__)).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Timer:
+    def __init__(self):
+        self.stages: dict[str, dict] = {}
+
+    def run(self, stage: str, fn):
+        t0 = time.perf_counter()
+        rows = fn()
+        elapsed = time.perf_counter() - t0
+        s = self.stages.setdefault(stage, {"seconds": 0.0, "rows": 0})
+        s["seconds"] += elapsed
+        s["rows"] += int(rows or 0)
+        s["rows_per_s"] = s["rows"] / s["seconds"] if s["seconds"] else None
+        s["peak_rss_mb"] = round(_peak_rss_mb(), 1)
+        return rows
+
+
+def _percentile(samples: list, q: float) -> float | None:
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))]
+
+
+def replay_api(backend, samples: int, repeat: int) -> dict:
+    results = {}
+    for shape in QUERY_SHAPES:
+        params_list = backend.sample(shape, samples)
+        elapsed_ms, rows = [], 0
+        for _ in range(repeat):
+            for params in params_list:
+                t0 = time.perf_counter()
+                rows += backend.replay(shape, params)
+                elapsed_ms.append((time.perf_counter() - t0) * 1000)
+        results[shape.name] = {"runs": len(elapsed_ms), "rows": rows,
+                               "p50_ms": _percentile(elapsed_ms, 0.5), "p99_ms": _percentile(elapsed_ms, 0.99)}
+    return results
+
+
+def run(args) -> dict:
+    dataset = Dataset(args.sf, args.seed)
+    manifest = dataset.ensure()
+    backend_cls = BACKENDS[args.backend]
+    backend = backend_cls(dataset.as_of, **({"threads": args.threads} if args.threads else {}))
+    timer = Timer()
+    t_start = time.perf_counter()
+    try:
+        timer.run("setup", lambda: backend.setup(dataset))
+        for i, day in enumerate(dataset.days, 1):
+            print(f"  [{i:>2}/{len(dataset.days)}] {day}", end="\r", flush=True)
+            for stage, fn in backend.daily_stages(day, dataset.events_path(day), f"bench_{day}"):
+                timer.run(stage, fn)
+        print()
+        timer.run("month_end", lambda: backend.month_end(PERIOD_START, PERIOD_END, "bench_close"))
+        for _, fn in backend.daily_stages(dataset.late_day, dataset.late_path, "bench_late"):
+            timer.run("late_load", fn)
+        timer.run("reconciliation", lambda: backend.reconcile("bench_recon"))
+        api = replay_api(backend, args.api_samples, args.api_repeat)
+    finally:
+        backend.close()
+
+    return {
+        "meta": {
+            "commit": _git_commit(), "backend": args.backend, "sf": args.sf, "seed": args.seed,
+            "dataset": manifest, "as_of": str(dataset.as_of), "python": platform.python_version(),
+            "platform": platform.platform(), "run_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        },
+        "total_seconds": time.perf_counter() - t_start,
+        "stages": timer.stages,
+        "api": api,
+    }
+
+
+def print_results(results: dict):
+    meta = results["meta"]
+    print(f"SF{meta['sf']:g} on {meta['backend']} @ {meta['commit'] or '?'}: "
+          f"{results['total_seconds']:.1f} s total")
+    print(f"{'stage':<16} {'seconds':>9} {'rows':>12} {'rows/s':>12} {'peak RSS MB':>12}")
+    for stage, s in results["stages"].items():
+        print(f"{stage:<16} {s['seconds']:>9.2f} {s['rows']:>12,} {s['rows_per_s'] or 0:>12,.0f} "
+              f"{s['peak_rss_mb']:>12.1f}")
+    print(f"\n{'api shape':<26} {'runs':>6} {'p50 ms':>9} {'p99 ms':>9}")
+    for name, r in results["api"].items():
+        print(f"{name:<26} {r['runs']:>6} {r['p50_ms'] or 0:>9.2f} {r['p99_ms'] or 0:>9.2f}")
+
+
+def compare(base_path: str, new_path: str, tolerance: float) -> int:
+    """Print stage and API deltas; the number of metrics slower than tolerance allows
+    (and by more than NOISE_FLOOR)."""
+    with open(base_path) as f:
+        base = json.load(f)
+    with open(new_path) as f:
+        new = json.load(f)
+    if (base["meta"]["sf"], base["meta"]["backend"]) != (new["meta"]["sf"], new["meta"]["backend"]):
+        print("warning: comparing runs with different scale factor or backend")
+
+    metrics = [(f"stage {k}", "seconds", base["stages"][k], new["stages"][k])
+               for k in base["stages"] if k in new["stages"]]
+    metrics += [(f"api {k}", "p50_ms", base["api"][k], new["api"][k]) for k in base["api"] if k in new["api"]]
+    regressions = 0
+    print(f"{'metric':<42} {'base':>10} {'new':>10} {'change':>8}")
+    for name, key, b, n in metrics:
+        if not b.get(key) or n.get(key) is None:
+            continue
+        change = n[key] / b[key] - 1
+        flag = ""
+        if change > tolerance and n[key] - b[key] > NOISE_FLOOR[key]:
+            regressions += 1
+            flag = "  REGRESSION"
+        print(f"{name + ' (' + key + ')':<42} {b[key]:>10.2f} {n[key]:>10.2f} {change:>+8.1%}{flag}")
+    print(f"\n{regressions} regression(s) beyond {tolerance:.0%}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="End-to-end pipeline benchmark at a fixed scale factor")
+    parser.add_argument("--sf", type=float, default=1, help="scale factor: SFn = n x 1,000 customers x 30 days")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--backend", choices=sorted(BACKENDS), default="local")
+    parser.add_argument("--threads", type=int, help="engine threads (local backend)")
+    parser.add_argument("--api-samples", type=int, default=5, help="sampled keys per API shape")
+    parser.add_argument("--api-repeat", type=int, default=5, help="replays per sampled key")
+    parser.add_argument("--json-out", help="Also write results to this JSON file")
+    parser.add_argument("--compare", nargs=2, metavar=("BASE", "NEW"),
+                        help="Compare two --json-out files instead of running")
+    parser.add_argument("--tolerance", type=float, default=0.10,
+                        help="relative slowdown that counts as a regression in --compare")
+    args = parser.parse_args()
+
+    if args.compare:
+        sys.exit(1 if compare(*args.compare, args.tolerance) else 0)
+
+    results = run(args)
+    print_results(results)
+    if args.json_out:
+        with open(args.json_out, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"\nWrote {args.json_out}")
+
+
+if __name__ == "__main__":
+    main()
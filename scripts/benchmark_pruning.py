@@ -0,0 +1,110 @@
+"""
+benchmark_pruning.py
+
+Replays the API's query shapes against the Gold facts (result cache off) and
+reports partitions scanned vs total per table from the query profile, so a
+physical-design change can be checked before and after:
+
+    python scripts/benchmark_pruning.py --json-out before.json
+    python scripts/benchmark_pruning.py --apply-ddl      # cluster keys + search optimization
+    # ...wait for automatic clustering (see OPS.CLUSTERING_DEPTH_REPORT)...
+    python scripts/benchmark_pruning.py --json-out after.json
+    python scripts/benchmark_pruning.py --compare before.json after.json
+"""
+import sys
+import os
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import argparse
+import json
+import uuid
+from billing.physical_design import QUERY_SHAPES, SPECS, clustering_report, ddl, run_pruning_benchmark
+from scripts.run_dq_checks import get_connection
+
+
+def _pct(ratio) -> str:
+    return f"{ratio:.1%}" if ratio is not None else "-"
+
+
+def print_results(rows: list[dict]):
+    print(f"{'shape':<26} {'table':<28} {'scanned':>9} {'total':>9} {'pruned':>8} {'p50 ms':>8}")
+    for r in rows:
+        for table, t in r["tables"].items():
+            pruned = _pct(t["pruning_ratio"])
+            print(f"{r['shape']:<26} {table:<28} {t['partitions_scanned']:>9,} "
+                  f"{t['partitions_total']:>9,} {pruned:>8} {r['p50_ms'] or 0:>8.0f}")
+
+
+def compare(before_path: str, after_path: str):
+    with open(before_path) as f:
+        before = {r["shape"]: r for r in json.load(f)["shapes"]}
+    with open(after_path) as f:
+        after = {r["shape"]: r for r in json.load(f)["shapes"]}
+    print(f"{'shape':<26} {'table':<28} {'pruned before':>14} {'pruned after':>13} {'p50 ms':>15}")
+    for name, a in after.items():
+        b = before.get(name)
+        if not b:
+            continue
+        for table, ta in a["tables"].items():
+            tb = b["tables"].get(table)
+            if not tb:
+                continue
+            print(f"{name:<26} {table:<28} {_pct(tb['pruning_ratio']):>14} {_pct(ta['pruning_ratio']):>13} "
+                  f"{b['p50_ms'] or 0:>7.0f}->{a['p50_ms'] or 0:<7.0f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay API query shapes and measure partition pruning")
+    parser.add_argument("--samples", type=int, default=5, help="Bind-value samples per shape")
+    parser.add_argument("--shape", action="append", choices=[s.name for s in QUERY_SHAPES],
+                        help="Limit to these shapes (repeatable); default all")
+    parser.add_argument("--json-out", help="Write results to this file")
+    parser.add_argument("--apply-ddl", action="store_true",
+                        help="Apply the declared clustering keys / search optimization and exit")
+    parser.add_argument("--compare", nargs=2, metavar=("BEFORE", "AFTER"),
+                        help="Compare two --json-out files and exit")
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    conn = get_connection()
+    cursor = conn.cursor()
+    try:
+        if args.apply_ddl:
+            for spec in SPECS:
+                for stmt in ddl(spec):
+                    print(stmt)
+                    cursor.execute(stmt)
+            return
+
+        shapes = [s for s in QUERY_SHAPES if not args.shape or s.name in args.shape]
+        results = [r.to_dict() for r in run_pruning_benchmark(cursor, shapes, args.samples)]
+        depth = clustering_report(cursor, f"benchmark_{uuid.uuid4().hex[:12]}")
+    finally:
+        cursor.close()
+        conn.close()
+
+    print_results(results)
+    print()
+    for h in depth:
+        print(f"{h.spec.table:<45} depth {h.average_depth:>6.2f}  overlaps {h.average_overlaps:>6.2f}  {h.status}")
+
+    if args.json_out:
+        payload = {
+            "shapes": results,
+            "clustering": [
+                {"table": h.spec.table, "keys": list(h.spec.keys), "average_depth": h.average_depth,
+                 "average_overlaps": h.average_overlaps, "total_partitions": h.total_partitions}
+                for h in depth
+            ],
+        }
+        with open(args.json_out, "w") as f:
+            json.dump(payload, f, indent=2)
+        print(f"\nWrote {args.json_out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+"""
+benchmark_usage_store.py
+
+Builds a synthetic per-customer usage store (billing/usage_store.py) and
+measures what /customers/{id}/usage costs when served from it: file size,
+build time, and p50/p99 lookup latency for a 90-day window, both for the
+raw store read and including the API's response-model validation and JSON
+serialization.
+
+No warehouse needed:
+
+    python scripts/benchmark_usage_store.py --customers 100000 --products 8
+"""
+import sys
+import os
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import argparse
+import json
+import random
+import tempfile
+import time
+from datetime import date, timedelta
+from typing import List, Optional
+
+import numpy as np
+from pydantic import BaseModel, TypeAdapter
+from billing.usage_store import DEFAULT_WINDOW_DAYS, SeriesFile, write_store
+
+
+class DailyUsage(BaseModel):
+    """Same fields as the API's response model."""
+    date_id: date
+    product_id: str
+    unit: str
+    total_quantity: float
+    cost_amount: float
+    currency: Optional[str] = None
+
+
+def synthetic_rows(customers: int, products: int, days: int, as_of: date, seed: int):
+    rng = random.Random(seed)
+    start = as_of - timedelta(days=days - 1)
+    for sk in range(1, customers + 1):
+        for p in range(products):
+            for d in range(days):
+                qty = rng.randint(0, 50_000)
+                yield sk, f"prod_{p:02d}", "requests", "USD", start + timedelta(days=d), qty, qty * 0.0001
+
+
+def percentiles(samples_ms: list) -> dict:
+    a = np.asarray(samples_ms)
+    return {"n": len(a), "p50_ms": float(np.percentile(a, 50)), "p99_ms": float(np.percentile(a, 99))}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Size and lookup latency of the usage series store")
+    parser.add_argument("--customers", type=int, default=20_000)
+    parser.add_argument("--products", type=int, default=8)
+    parser.add_argument("--days", type=int, default=DEFAULT_WINDOW_DAYS)
+    parser.add_argument("--lookups", type=int, default=2_000)
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--json-out", help="Also write results to this JSON file")
+    args = parser.parse_args()
+
+    as_of = date.today() - timedelta(days=1)
+    window_start = as_of - timedelta(days=args.days - 1)
+    with tempfile.TemporaryDirectory() as workdir:
+        path = os.path.join(workdir, "usage_series.nbus")
+        t0 = time.perf_counter()
+        summary = write_store(synthetic_rows(args.customers, args.products, args.days, as_of, args.seed),
+                              path, window_start, as_of)
+        build_s = time.perf_counter() - t0
+
+        t0 = time.perf_counter()
+        store = SeriesFile(path)
+        open_ms = (time.perf_counter() - t0) * 1000
+
+        response = TypeAdapter(List[DailyUsage])
+        rng = random.Random(args.seed)
+        store_ms, api_ms = [], []
+        for _ in range(args.lookups):
+            sk = rng.randint(1, args.customers)
+            t0 = time.perf_counter()
+            rows = store.rows([sk], window_start)
+            t1 = time.perf_counter()
+            response.dump_json(response.validate_python(rows))
+            t2 = time.perf_counter()
+            store_ms.append((t1 - t0) * 1000)
+            api_ms.append((t2 - t0) * 1000)
+
+    results = {
+        "customers": summary.customers, "series": summary.series, "points": summary.points,
+        "file_bytes": summary.bytes, "bytes_per_point": summary.bytes / max(summary.points, 1),
+        "build_s": build_s, "open_ms": open_ms, "rows_per_lookup": len(rows),
+        "store_read": percentiles(store_ms), "with_response": percentiles(api_ms),
+    }
+
+    print(f"store: {summary.customers} customers, {summary.series} series, {summary.points} points, "
+          f"{summary.bytes / 1e6:.1f} MB ({results['bytes_per_point']:.1f} B/point)")
+    print(f"build {build_s:.1f} s, open {open_ms:.2f} ms, {len(rows)} rows per lookup")
+    for name in ("store_read", "with_response"):
+        r = results[name]
+        print(f"{name:<22} p50 {r['p50_ms']:>7.2f} ms   p99 {r['p99_ms']:>7.2f} ms")
+
+    if args.json_out:
+        with open(args.json_out, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"\nWrote {args.json_out}")
+
+
+if __name__ == "__main__":
+    main()
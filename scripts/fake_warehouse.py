@@ -0,0 +1,193 @@
+"""
+fake_warehouse.py
+
+Stand-in for snowflake.connector used by scripts/loadtest_api.py. Each query
+is matched against an ordered list of rules (first regex hit wins) that set
+its simulated latency, jitter, result size and injected error rate. Rows are
+synthesized from the query's SELECT list: the column names decide the value
+types, so the API's response models validate them as they would real rows.
+
+A rule looks like
+
+    {"match": "FACT_INVOICE_LINE_ITEMS", "latency_ms": 90, "jitter_ms": 30,
+     "rows": 12, "error_rate": 0.0}
+
+Latency is slept in the calling thread, like a blocking connector call.
+"""
+from __future__ import annotations
+
+import random
+import re
+import threading
+import time
+from dataclasses import dataclass
+from datetime import date, datetime, timedelta
+
+DEFAULT_RULE = {"match": "", "latency_ms": 50, "jitter_ms": 10, "rows": 1, "error_rate": 0.0}
+
+
+class InjectedError(Exception):
+    """Raised by a rule's error_rate; surfaces as a 500 like a warehouse failure."""
+
+
+@dataclass
+class Rule:
+    pattern: re.Pattern
+    latency_ms: float
+    jitter_ms: float
+    rows: int
+    error_rate: float
+
+    @classmethod
+    def from_dict(cls, d: dict) -> "Rule":
+        d = {**DEFAULT_RULE, **d}
+        return cls(re.compile(d["match"], re.IGNORECASE), float(d["latency_ms"]),
+                   float(d["jitter_ms"]), int(d["rows"]), float(d["error_rate"]))
+
+
+# ── Row synthesis ───────────────────────────────────────────────────────────
+
+def _top_level_split(text: str) -> list[str]:
+    parts, depth, start = [], 0, 0
+    for i, ch in enumerate(text):
+        if ch == "(":
+            depth += 1
+        elif ch == ")":
+            depth -= 1
+        elif ch == "," and depth == 0:
+            parts.append(text[start:i])
+            start = i + 1
+    parts.append(text[start:])
+    return [p.strip() for p in parts if p.strip()]
+
+
+def select_columns(sql: str) -> list[str]:
+    """Output column names of the outermost SELECT (aliases, else the bare column)."""
+    upper = sql.upper()
+    start = upper.find("SELECT")
+    if start < 0:
+        return []
+    depth, i = 0, start + 6
+    for m in re.finditer(r"[()]|\bFROM\b", upper[i:]):
+        tok = m.group(0)
+        if tok == "(":
+            depth += 1
+        elif tok == ")":
+            depth -= 1
+        elif depth == 0:
+            select_list = sql[i:i + m.start()]
+            break
+    else:
+        select_list = sql[i:]
+    columns = []
+    for item in _top_level_split(select_list):
+        alias = re.search(r"(?:\bAS\s+)?([A-Za-z_]\w*)\s*$", item, re.IGNORECASE)
+        columns.append((alias.group(1) if alias else item).upper())
+    return columns
+
+
+_TODAY = date.today()
+_TEXT = {"STATUS": "issued", "CURRENCY": "USD", "UNIT": "requests", "KIND": "spike",
+         "COUNTRY": "US", "LINE_TYPE": "usage", "PLAN_ID": "plan_pro", "PRODUCT_ID": "prod_api_requests"}
+_COUNTS = {"TOTAL_CUSTOMERS", "ACTIVE_INVOICES", "TOTAL_EVENTS_TODAY", "ROW_COUNT", "MAX_SK",
+           "OBSERVATIONS", "EVENT_COUNT"}
+
+
+def _value(column: str, i: int):
+    if column in _TEXT:
+        return _TEXT[column]
+    if column == "SKS":
+        return str(i + 1)
+    if column == "DATE_ID" or column.endswith(("_DATE", "_START", "_END", "_FROM", "_TO")):
+        return _TODAY - timedelta(days=i % 90)
+    if column.endswith("_TS"):
+        return datetime.combine(_TODAY, datetime.min.time()) - timedelta(hours=i)
+    if column.endswith("_SK") or column in _COUNTS:
+        return i + 1
+    if column == "CUSTOMER_ID":
+        return f"cust_{i + 1}"
+    if column.endswith("_ID") or column.endswith("NAME"):
+        return f"{column.lower()}_{i + 1}"
+    if column.startswith("IS_"):
+        return True
+    return round(10.0 + (i * 7919 % 1000) / 10, 4)
+
+
+def synthesize(columns: list[str], n: int) -> list[dict]:
+    return [{c: _value(c, i) for c in columns} for i in range(n)]
+
+
+# ── Connector ───────────────────────────────────────────────────────────────
+
+class FakeWarehouse:
+    def __init__(self, rules: list[dict], seed: int = 0):
+        self.rules = [Rule.from_dict(r) for r in rules] + [Rule.from_dict(DEFAULT_RULE)]
+        self.queries = 0
+        self.errors = 0
+        self._rows: dict[tuple, list[dict]] = {}
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def rule_for(self, sql: str) -> Rule:
+        return next(r for r in self.rules if r.pattern.search(sql))
+
+    def connect(self, **_) -> "FakeConnection":
+        return FakeConnection(self)
+
+    def run(self, sql: str) -> list[dict]:
+        rule = self.rule_for(sql)
+        with self._lock:
+            self.queries += 1
+            delay = max(0.0, self._rng.gauss(rule.latency_ms, rule.jitter_ms)) / 1000
+            fail = self._rng.random() < rule.error_rate
+            if fail:
+                self.errors += 1
+        time.sleep(delay)
+        if fail:
+            raise InjectedError(f"injected failure for /{rule.pattern.pattern}/")
+        key = (sql, rule.rows)
+        rows = self._rows.get(key)
+        if rows is None:
+            rows = self._rows[key] = synthesize(select_columns(sql), rule.rows)
+        return rows
+
+
+class FakeCursor:
+    def __init__(self, warehouse: FakeWarehouse, as_dict: bool):
+        self.warehouse = warehouse
+        self.as_dict = as_dict
+        self.sfqid = None
+        self._rows: list = []
+
+    def execute(self, sql: str, params=None):
+        rows = self.warehouse.run(sql)
+        self._rows = list(rows) if self.as_dict else [tuple(r.values()) for r in rows]
+        return self
+
+    def fetchall(self):
+        rows, self._rows = self._rows, []
+        return rows
+
+    def fetchmany(self, size: int = 1):
+        rows, self._rows = self._rows[:size], self._rows[size:]
+        return rows
+
+    def fetchone(self):
+        return self._rows.pop(0) if self._rows else None
+
+    def close(self):
+        pass
+
+
+class FakeConnection:
+    def __init__(self, warehouse: FakeWarehouse):
+        self.warehouse = warehouse
+
+    def cursor(self, cursor_class=None) -> FakeCursor:
+        return FakeCursor(self.warehouse, as_dict=cursor_class is not None)
+
+    def commit(self):
+        pass
+
+    def close(self):
+        pass
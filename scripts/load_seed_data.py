@@ -1,13 +1,21 @@
 """
 load_seed_data.py
 
-Loads reference data (products, plans, customers, pricing) into
-Snowflake via Bronze ingestion + Gold dimension updates.
+Loads reference data (products, plans, customers, pricing, FX rates, tax rules) and
+prepaid credit grants into Snowflake via Bronze ingestion + Gold dimension updates.
 """
-import snowflake.connector
+import sys
 import os
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import snowflake.connector
 import glob
 from dotenv import load_dotenv
+from billing.credits import read_grants_csv
+from billing.fx import read_rates_csv
+from billing.rating import RateIndex
+from billing.tax import read_rules_csv
 
 load_dotenv()
 
@@ -18,6 +26,13 @@ WAREHOUSE = os.getenv("SNOWFLAKE_WAREHOUSE", "COMPUTE_WH")
 DATABASE  = os.getenv("SNOWFLAKE_DATABASE",  "NIMBUSBILL")
 
 
+# Change-detection hash over the SCD2-tracked customer attributes.
+CUSTOMER_HASH_SQL = (
+    "MD5(CONCAT_WS('|', COALESCE({t}CUSTOMER_NAME, ''), COALESCE({t}STATUS, ''), "
+    "COALESCE({t}COUNTRY, ''), COALESCE({t}PLAN_ID, '')))"
+)
+
+
 def get_connection():
     return snowflake.connector.connect(
         user=USER, password=PASSWORD, account=ACCOUNT,
@@ -68,27 +83,54 @@ def load_customers(cursor):
         FILE_FORMAT = (TYPE = 'JSON')
     """)
 
-    cursor.execute("""
+    # Rows written before SCD2 tracking have no hash and start at load time;
+    # give them a hash and let the first version cover all prior history.
+    cursor.execute(f"""
+        UPDATE NIMBUSBILL.GOLD.DIM_CUSTOMER
+        SET RECORD_HASH = {CUSTOMER_HASH_SQL.format(t="")},
+            EFFECTIVE_START = '1900-01-01'::TIMESTAMP_NTZ
+        WHERE RECORD_HASH IS NULL
+    """)
+
+    # SCD2 in one set-based MERGE: each changed customer appears twice in the
+    # source, once keyed (closes the current version) and once with a NULL key
+    # (never matches, so inserts the new version). New customers insert once.
+    cursor.execute(f"""
         MERGE INTO NIMBUSBILL.GOLD.DIM_CUSTOMER T
         USING (
-            SELECT
-                RAW:customer_id::STRING   AS CUSTOMER_ID,
-                RAW:customer_name::STRING AS CUSTOMER_NAME,
-                RAW:status::STRING        AS STATUS,
-                RAW:country::STRING       AS COUNTRY,
-                RAW:plan_id::STRING       AS PLAN_ID,
-                CURRENT_TIMESTAMP()       AS EFFECTIVE_START
-            FROM NIMBUSBILL.BRONZE.CUSTOMERS_RAW
-            WHERE BATCH_ID = 'SEED_LOAD'
-        ) S ON T.CUSTOMER_ID = S.CUSTOMER_ID
-        WHEN MATCHED THEN UPDATE SET
-            T.CUSTOMER_NAME = S.CUSTOMER_NAME,
-            T.STATUS = S.STATUS,
-            T.PLAN_ID = S.PLAN_ID,
-            T.IS_CURRENT = TRUE
+            WITH snap AS (
+                SELECT
+                    RAW:customer_id::STRING   AS CUSTOMER_ID,
+                    RAW:customer_name::STRING AS CUSTOMER_NAME,
+                    RAW:status::STRING        AS STATUS,
+                    RAW:country::STRING       AS COUNTRY,
+                    RAW:plan_id::STRING       AS PLAN_ID,
+                    COALESCE(TRY_TO_TIMESTAMP_NTZ(RAW:updated_at::STRING), CURRENT_TIMESTAMP()) AS EFFECTIVE_START
+                FROM NIMBUSBILL.BRONZE.CUSTOMERS_RAW
+                WHERE BATCH_ID = 'SEED_LOAD' AND RAW:customer_id IS NOT NULL
+                QUALIFY ROW_NUMBER() OVER (PARTITION BY CUSTOMER_ID ORDER BY EFFECTIVE_START DESC) = 1
+            ),
+            hashed AS (
+                SELECT s.*, {CUSTOMER_HASH_SQL.format(t="s.")} AS RECORD_HASH FROM snap s
+            )
+            SELECT h.CUSTOMER_ID AS MERGE_KEY, h.* FROM hashed h
+            UNION ALL
+            SELECT NULL AS MERGE_KEY, h.*
+            FROM hashed h
+            JOIN NIMBUSBILL.GOLD.DIM_CUSTOMER d
+                ON d.CUSTOMER_ID = h.CUSTOMER_ID AND d.IS_CURRENT = TRUE
+            WHERE d.RECORD_HASH IS DISTINCT FROM h.RECORD_HASH
+        ) S
+        ON T.CUSTOMER_ID = S.MERGE_KEY AND T.IS_CURRENT = TRUE
+        WHEN MATCHED AND T.RECORD_HASH IS DISTINCT FROM S.RECORD_HASH THEN UPDATE SET
+            T.EFFECTIVE_END = S.EFFECTIVE_START,
+            T.IS_CURRENT = FALSE
         WHEN NOT MATCHED THEN INSERT
-            (CUSTOMER_ID, CUSTOMER_NAME, STATUS, COUNTRY, PLAN_ID, EFFECTIVE_START, IS_CURRENT)
-            VALUES (S.CUSTOMER_ID, S.CUSTOMER_NAME, S.STATUS, S.COUNTRY, S.PLAN_ID, S.EFFECTIVE_START, TRUE)
+            (CUSTOMER_ID, CUSTOMER_NAME, STATUS, COUNTRY, PLAN_ID,
+             EFFECTIVE_START, EFFECTIVE_END, IS_CURRENT, RECORD_HASH)
+            VALUES (S.CUSTOMER_ID, S.CUSTOMER_NAME, S.STATUS, S.COUNTRY, S.PLAN_ID,
+                    IFF(S.MERGE_KEY IS NULL, S.EFFECTIVE_START, '1900-01-01'::TIMESTAMP_NTZ),
+                    NULL, TRUE, S.RECORD_HASH)
     """)
 
 
@@ -99,6 +141,9 @@ def load_pricing(cursor):
         print(f"  Not found: {path}")
         return
 
+    # Reject files whose own windows overlap before anything reaches Snowflake.
+    RateIndex.from_csv(path)
+
     cursor.execute("DELETE FROM NIMBUSBILL.BRONZE.PRICING_CATALOG_RAW WHERE BATCH_ID = 'SEED_LOAD'")
     cursor.execute(f"PUT file://{path} @NIMBUSBILL.BRONZE.%PRICING_CATALOG_RAW AUTO_COMPRESS=TRUE OVERWRITE=TRUE")
     cursor.execute("""
@@ -107,6 +152,7 @@ def load_pricing(cursor):
             SELECT
                 CURRENT_TIMESTAMP(), CURRENT_DATE(), 'SEED_LOAD',
                 OBJECT_CONSTRUCT(
+                    'rate_id', $1,
                     'product_id', $2, 'plan_id', $3, 'unit', $4,
                     'price', $5, 'currency', $6,
                     'effective_from', $7, 'effective_to', $8
@@ -117,17 +163,177 @@ def load_pricing(cursor):
     """)
 
     cursor.execute("""
-        INSERT INTO NIMBUSBILL.GOLD.DIM_PRICING_RATE
-            (PRODUCT_ID, PLAN_ID, UNIT, UNIT_PRICE, CURRENCY, EFFECTIVE_FROM, EFFECTIVE_TO, IS_CURRENT)
+        CREATE OR REPLACE TEMPORARY TABLE TMP_PRICING_STAGE AS
         SELECT
-            RAW:product_id::STRING, RAW:plan_id::STRING, RAW:unit::STRING,
-            RAW:price::FLOAT, RAW:currency::STRING,
-            RAW:effective_from::DATE, TRY_CAST(RAW:effective_to::STRING AS DATE),
-            TRUE
+            RAW:rate_id::STRING AS RATE_ID,
+            RAW:product_id::STRING AS PRODUCT_ID, RAW:plan_id::STRING AS PLAN_ID, RAW:unit::STRING AS UNIT,
+            RAW:price::NUMBER(38,10) AS UNIT_PRICE, RAW:currency::STRING AS CURRENCY,
+            RAW:effective_from::DATE AS EFFECTIVE_FROM,
+            TRY_CAST(RAW:effective_to::STRING AS DATE) AS EFFECTIVE_TO
         FROM NIMBUSBILL.BRONZE.PRICING_CATALOG_RAW
         WHERE BATCH_ID = 'SEED_LOAD'
     """)
 
+    # SCD2 guard: an incoming window may only overlap the open current window
+    # it supersedes, or reload a window that already exists at the same price
+    # (closing it, if the existing window is still open).
+    cursor.execute("""
+        SELECT COUNT(*)
+        FROM TMP_PRICING_STAGE s
+        JOIN NIMBUSBILL.GOLD.DIM_PRICING_RATE d
+            ON s.PRODUCT_ID = d.PRODUCT_ID AND s.PLAN_ID = d.PLAN_ID AND s.UNIT = d.UNIT
+            AND s.EFFECTIVE_FROM <= COALESCE(d.EFFECTIVE_TO, '9999-12-31')
+            AND d.EFFECTIVE_FROM <= COALESCE(s.EFFECTIVE_TO, '9999-12-31')
+        WHERE NOT (d.EFFECTIVE_TO IS NULL AND d.EFFECTIVE_FROM < s.EFFECTIVE_FROM)
+          AND NOT (d.EFFECTIVE_FROM = s.EFFECTIVE_FROM
+                   AND (d.EFFECTIVE_TO IS NULL OR EQUAL_NULL(d.EFFECTIVE_TO, s.EFFECTIVE_TO))
+                   AND d.UNIT_PRICE = s.UNIT_PRICE
+                   AND d.CURRENCY = s.CURRENCY)
+    """)
+    overlaps = cursor.fetchone()[0]
+    if overlaps:
+        raise ValueError(f"Pricing catalog overlaps {overlaps} existing rate window(s); load rejected")
+
+    cursor.execute("BEGIN")
+    try:
+        # Close the open window of every product/plan/unit that gets a newer rate.
+        cursor.execute("""
+            UPDATE NIMBUSBILL.GOLD.DIM_PRICING_RATE T
+            SET T.EFFECTIVE_TO = DATEADD('day', -1, S.NEXT_FROM), T.IS_CURRENT = FALSE
+            FROM (
+                SELECT PRODUCT_ID, PLAN_ID, UNIT, MIN(EFFECTIVE_FROM) AS NEXT_FROM
+                FROM TMP_PRICING_STAGE
+                GROUP BY 1, 2, 3
+            ) S
+            WHERE T.PRODUCT_ID = S.PRODUCT_ID AND T.PLAN_ID = S.PLAN_ID AND T.UNIT = S.UNIT
+              AND T.EFFECTIVE_TO IS NULL
+              AND T.EFFECTIVE_FROM < S.NEXT_FROM
+        """)
+        cursor.execute("""
+            MERGE INTO NIMBUSBILL.GOLD.DIM_PRICING_RATE T
+            USING TMP_PRICING_STAGE S
+            ON T.PRODUCT_ID = S.PRODUCT_ID AND T.PLAN_ID = S.PLAN_ID AND T.UNIT = S.UNIT
+               AND T.EFFECTIVE_FROM = S.EFFECTIVE_FROM
+            WHEN MATCHED AND T.EFFECTIVE_TO IS NULL AND S.EFFECTIVE_TO IS NOT NULL THEN UPDATE SET
+                T.EFFECTIVE_TO = S.EFFECTIVE_TO, T.IS_CURRENT = FALSE
+            WHEN NOT MATCHED THEN INSERT
+                (RATE_ID, PRODUCT_ID, PLAN_ID, UNIT, UNIT_PRICE, CURRENCY, EFFECTIVE_FROM, EFFECTIVE_TO, IS_CURRENT)
+                VALUES (S.RATE_ID, S.PRODUCT_ID, S.PLAN_ID, S.UNIT, S.UNIT_PRICE, S.CURRENCY,
+                        S.EFFECTIVE_FROM, S.EFFECTIVE_TO, S.EFFECTIVE_TO IS NULL)
+        """)
+        cursor.execute("COMMIT")
+    except Exception:
+        cursor.execute("ROLLBACK")
+        raise
+
+
+def load_fx_rates(cursor):
+    print("Loading FX rates...")
+    path = os.path.abspath("seeds/fx_rates.csv")
+    # Rejects non-positive rates and overlapping windows within the file.
+    rows = [(w.currency, w.reporting_currency, w.rate, w.effective_from, w.effective_to)
+            for w in read_rates_csv(path)]
+
+    cursor.execute("""
+        CREATE OR REPLACE TEMPORARY TABLE TMP_FX_STAGE (
+            CURRENCY STRING, REPORTING_CURRENCY STRING, RATE NUMBER(38,12),
+            EFFECTIVE_FROM DATE, EFFECTIVE_TO DATE
+        )
+    """)
+    cursor.executemany("INSERT INTO TMP_FX_STAGE VALUES (%s, %s, %s, %s, %s)", rows)
+
+    cursor.execute("BEGIN")
+    try:
+        # Same SCD2 handling as pricing: a newer window closes the open one.
+        cursor.execute("""
+            UPDATE NIMBUSBILL.GOLD.DIM_FX_RATE T
+            SET T.EFFECTIVE_TO = DATEADD('day', -1, S.NEXT_FROM), T.IS_CURRENT = FALSE
+            FROM (
+                SELECT CURRENCY, REPORTING_CURRENCY, MIN(EFFECTIVE_FROM) AS NEXT_FROM
+                FROM TMP_FX_STAGE
+                GROUP BY 1, 2
+            ) S
+            WHERE T.CURRENCY = S.CURRENCY AND T.REPORTING_CURRENCY = S.REPORTING_CURRENCY
+              AND T.EFFECTIVE_TO IS NULL
+              AND T.EFFECTIVE_FROM < S.NEXT_FROM
+        """)
+        cursor.execute("""
+            MERGE INTO NIMBUSBILL.GOLD.DIM_FX_RATE T
+            USING TMP_FX_STAGE S
+            ON T.CURRENCY = S.CURRENCY AND T.REPORTING_CURRENCY = S.REPORTING_CURRENCY
+               AND T.EFFECTIVE_FROM = S.EFFECTIVE_FROM
+            WHEN MATCHED THEN UPDATE SET
+                T.RATE = S.RATE, T.EFFECTIVE_TO = S.EFFECTIVE_TO,
+                T.IS_CURRENT = S.EFFECTIVE_TO IS NULL, T.LOAD_TS = CURRENT_TIMESTAMP()
+            WHEN NOT MATCHED THEN INSERT
+                (CURRENCY, REPORTING_CURRENCY, RATE, EFFECTIVE_FROM, EFFECTIVE_TO, IS_CURRENT, LOAD_TS)
+                VALUES (S.CURRENCY, S.REPORTING_CURRENCY, S.RATE, S.EFFECTIVE_FROM, S.EFFECTIVE_TO,
+                        S.EFFECTIVE_TO IS NULL, CURRENT_TIMESTAMP())
+        """)
+        cursor.execute("COMMIT")
+    except Exception:
+        cursor.execute("ROLLBACK")
+        raise
+
+
+def load_tax_rules(cursor):
+    print("Loading tax rules...")
+    path = os.path.abspath("seeds/tax_rules.csv")
+    # Rejects duplicate ids, rates outside [0, 1) and overlapping windows.
+    rows = [(r.rule_id, r.country, r.product_category, r.rate, r.effective_from, r.effective_to)
+            for r in read_rules_csv(path)]
+
+    cursor.execute("""
+        CREATE OR REPLACE TEMPORARY TABLE TMP_TAX_RULE_STAGE (
+            RULE_ID STRING, COUNTRY STRING, PRODUCT_CATEGORY STRING, TAX_RATE NUMBER(9,6),
+            EFFECTIVE_FROM DATE, EFFECTIVE_TO DATE
+        )
+    """)
+    cursor.executemany("INSERT INTO TMP_TAX_RULE_STAGE VALUES (%s, %s, %s, %s, %s, %s)", rows)
+
+    # The file carries every window explicitly, so rules are upserted by id.
+    cursor.execute("""
+        MERGE INTO NIMBUSBILL.GOLD.DIM_TAX_RULE T
+        USING TMP_TAX_RULE_STAGE S
+        ON T.RULE_ID = S.RULE_ID
+        WHEN MATCHED THEN UPDATE SET
+            T.COUNTRY = S.COUNTRY, T.PRODUCT_CATEGORY = S.PRODUCT_CATEGORY, T.TAX_RATE = S.TAX_RATE,
+            T.EFFECTIVE_FROM = S.EFFECTIVE_FROM, T.EFFECTIVE_TO = S.EFFECTIVE_TO,
+            T.IS_CURRENT = S.EFFECTIVE_TO IS NULL, T.LOAD_TS = CURRENT_TIMESTAMP()
+        WHEN NOT MATCHED THEN INSERT
+            (RULE_ID, COUNTRY, PRODUCT_CATEGORY, TAX_RATE, EFFECTIVE_FROM, EFFECTIVE_TO, IS_CURRENT, LOAD_TS)
+            VALUES (S.RULE_ID, S.COUNTRY, S.PRODUCT_CATEGORY, S.TAX_RATE, S.EFFECTIVE_FROM, S.EFFECTIVE_TO,
+                    S.EFFECTIVE_TO IS NULL, CURRENT_TIMESTAMP())
+    """)
+
+
+def load_credit_grants(cursor):
+    print("Loading credit grants...")
+    path = os.path.abspath("seeds/credit_grants.csv")
+    # Rejects duplicate ids, non-positive amounts and inverted windows.
+    rows = [(g.grant_id, g.customer_id, g.amount, g.currency, g.granted_date, g.expires_date)
+            for g in read_grants_csv(path)]
+
+    cursor.execute("""
+        CREATE OR REPLACE TEMPORARY TABLE TMP_CREDIT_GRANT_STAGE (
+            GRANT_ID STRING, CUSTOMER_ID STRING, AMOUNT NUMBER(38,10), CURRENCY STRING,
+            GRANTED_DATE DATE, EXPIRES_DATE DATE
+        )
+    """)
+    cursor.executemany("INSERT INTO TMP_CREDIT_GRANT_STAGE VALUES (%s, %s, %s, %s, %s, %s)", rows)
+
+    # Grants are immutable once loaded: the daily drawdown posts them to the
+    # ledger, so corrections are new grants, not edits.
+    cursor.execute("""
+        MERGE INTO NIMBUSBILL.GOLD.FACT_CREDIT_GRANTS T
+        USING TMP_CREDIT_GRANT_STAGE S
+        ON T.GRANT_ID = S.GRANT_ID
+        WHEN NOT MATCHED THEN INSERT
+            (GRANT_ID, CUSTOMER_ID, AMOUNT, CURRENCY, GRANTED_DATE, EXPIRES_DATE, REMAINING_AMOUNT, LOAD_TS)
+            VALUES (S.GRANT_ID, S.CUSTOMER_ID, S.AMOUNT, S.CURRENCY, S.GRANTED_DATE, S.EXPIRES_DATE, 0,
+                    CURRENT_TIMESTAMP())
+    """)
+
 
 def main():
     conn = get_connection()
@@ -137,6 +343,9 @@ def main():
         load_plans(cur)
         load_customers(cur)
         load_pricing(cur)
+        load_fx_rates(cur)
+        load_tax_rules(cur)
+        load_credit_grants(cur)
         print("All reference data loaded.")
     finally:
         cur.close()
@@ -0,0 +1,442 @@
+"""
+loadtest_api.py
+
+Load test for api/main.py. Virtual users replay a weighted mix of dashboard
+page views (each page fires its API requests concurrently, as the Next.js
+pages do through SWR) against the app, which talks to a fake warehouse
+(scripts/fake_warehouse.py) with per-query latency, result sizes and error
+rates from the profile. Reports RPS, p50/p95/p99 and error rate overall, per
+endpoint and per page view, and checks them against an SLO:
+
+    python scripts/loadtest_api.py --users 50 --duration 30 --json-out base.json
+    python scripts/loadtest_api.py --mode uvicorn --users 50 --baseline base.json
+    python scripts/loadtest_api.py --url http://staging:8000     # real server, real warehouse
+
+Modes: `inprocess` drives the ASGI app directly (no sockets), `uvicorn` serves
+it on a local port and goes over HTTP, `--url` targets a server started
+elsewhere (the fake warehouse does not apply there). Exit status is 1 when an
+absolute SLO is missed or, with --baseline, when a metric regressed beyond
+the SLO's allowed ratio.
+
+Profiles are JSON ({"pages", "warehouse", "ids", "slo"}); --dump-profile
+writes the built-in dashboard profile as a starting point, and
+--record-from builds the page mix from a uvicorn access log:
+
+    python scripts/loadtest_api.py --record-from access.log --dump-profile recorded.json
+    python scripts/loadtest_api.py --profile recorded.json
+"""
+from __future__ import annotations
+
+import sys
+import os
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import argparse
+import asyncio
+import json
+import random
+import re
+import socket
+import subprocess
+import threading
+import time
+from collections import Counter
+from datetime import date, timedelta
+from urllib.parse import parse_qsl, urlencode, urlsplit
+
+from scripts.fake_warehouse import FakeWarehouse
+
+# Page views of the web dashboard (web/app/*) and the requests each one makes.
+# Warehouse rules are matched in order against the SQL the endpoints send.
+DASHBOARD_PROFILE = {
+    "name": "dashboard",
+    "pages": [
+        {"name": "overview", "weight": 30, "requests": ["/dashboard/summary"]},
+        {"name": "customers", "weight": 12, "requests": ["/customers"]},
+        {"name": "customer_detail", "weight": 20,
+         "requests": ["/customers", "/customers/{customer_id}/usage?date_from={days_ago_90}"]},
+        {"name": "invoices", "weight": 12, "requests": ["/invoices", "/customers"]},
+        {"name": "invoice_detail", "weight": 10, "requests": ["/invoices/{invoice_id}"]},
+        {"name": "usage", "weight": 8, "requests": ["/usage", "/customers"]},
+        {"name": "pricing", "weight": 4, "requests": ["/pricing"]},
+        {"name": "pipeline", "weight": 4, "requests": ["/pipeline/status?limit=20"]},
+    ],
+    "warehouse": [
+        {"match": r"MAX\(CUSTOMER_SK\) AS MAX_SK", "latency_ms": 15, "jitter_ms": 5, "rows": 1},
+        {"match": r"LISTAGG\(CUSTOMER_SK", "latency_ms": 120, "jitter_ms": 20, "rows": 1000},
+        {"match": r"FROM NIMBUSBILL\.GOLD\.DIM_CUSTOMER WHERE CUSTOMER_(ID|SK) =",
+         "latency_ms": 20, "jitter_ms": 5, "rows": 1},
+        {"match": r"total_revenue_mtd", "latency_ms": 80, "jitter_ms": 20, "rows": 1},
+        {"match": r"DIM_FX_RATE", "latency_ms": 20, "jitter_ms": 5, "rows": 10},
+        {"match": r"FROM NIMBUSBILL\.GOLD\.FACT_INVOICE_LINE_ITEMS", "latency_ms": 60, "jitter_ms": 15,
+         "rows": 12},
+        {"match": r"INVOICE_ID = %\(iid\)s", "latency_ms": 40, "jitter_ms": 10, "rows": 1},
+        {"match": r"FROM NIMBUSBILL\.GOLD\.FACT_INVOICES", "latency_ms": 150, "jitter_ms": 40, "rows": 200},
+        {"match": r"FACT_PRODUCT_DAILY_USAGE", "latency_ms": 40, "jitter_ms": 10, "rows": 360},
+        {"match": r"FACT_REVENUE_CUBE", "latency_ms": 40, "jitter_ms": 10, "rows": 60},
+        {"match": r"GROUP BY f\.DATE_ID", "latency_ms": 300, "jitter_ms": 80, "rows": 360},
+        {"match": r"FACT_CUSTOMER_DAILY_USAGE", "latency_ms": 120, "jitter_ms": 30, "rows": 360},
+        {"match": r"DIM_PRICING_RATE", "latency_ms": 40, "jitter_ms": 10, "rows": 10},
+        {"match": r"PIPELINE_RUN_AUDIT", "latency_ms": 40, "jitter_ms": 10, "rows": 20},
+        {"match": r"DIM_CUSTOMER", "latency_ms": 90, "jitter_ms": 20, "rows": 1000},
+    ],
+    "ids": {"customers": 1000, "invoices": 5000},
+    "slo": {
+        "overall": {"p95_ms": 800, "p99_ms": 1500, "error_rate": 0.01},
+        "endpoints": {"/invoices/{invoice_id}": {"p99_ms": 500}},
+        # Allowed relative change against --baseline (rps: allowed drop)
+        "regression": {"p95_ms": 0.20, "p99_ms": 0.25, "rps": 0.15, "error_rate": 0.005},
+    },
+}
+
+
+# ── Traffic ─────────────────────────────────────────────────────────────────
+
+class Traffic:
+    """Weighted page picker that fills path placeholders with sampled IDs."""
+
+    def __init__(self, profile: dict, rng: random.Random):
+        self.pages = profile["pages"]
+        self.weights = [p["weight"] for p in self.pages]
+        self.ids = {"customers": 1000, "invoices": 1000, **profile.get("ids", {})}
+        self.rng = rng
+
+    def _fill(self, name: str) -> str:
+        days = re.fullmatch(r"days_ago_(\d+)", name)
+        if days:
+            return str(date.today() - timedelta(days=int(days.group(1))))
+        if name == "customer_id":
+            return f"cust_{self.rng.randint(1, self.ids['customers'])}"
+        if name == "invoice_id":
+            return f"inv_{self.rng.randint(1, self.ids['invoices'])}"
+        raise KeyError(f"unknown placeholder {{{name}}}")
+
+    def next_page(self) -> tuple[str, list[tuple[str, str]]]:
+        """(page name, [(endpoint template, concrete URL)])"""
+        page = self.rng.choices(self.pages, self.weights)[0]
+        return page["name"], [
+            (urlsplit(t).path, re.sub(r"\{(\w+)\}", lambda m: self._fill(m.group(1)), t))
+            for t in page["requests"]
+        ]
+
+
+def record_profile(log_path: str, base: dict) -> dict:
+    """`base` with its page mix replaced by the endpoint mix of a uvicorn access log."""
+    routes = [r for r in _import_api().app.routes if hasattr(r, "path_regex")]
+    line_re = re.compile(r'"GET (\S+) HTTP/[\d.]+" (\d{3})')
+    counts: Counter = Counter()
+    with open(log_path) as f:
+        for line in f:
+            m = line_re.search(line)
+            if not m:
+                continue
+            parts = urlsplit(m.group(1))
+            route = next((r for r in routes if r.path_regex.match(parts.path)), None)
+            if route is None:
+                continue
+            query = [(k, "{customer_id}" if k == "customer_id" else v) for k, v in parse_qsl(parts.query)]
+            template = route.path + ("?" + urlencode(sorted(query), safe="{}") if query else "")
+            counts[template] += 1
+    if not counts:
+        raise SystemExit(f"no GET requests to known routes in {log_path}")
+    pages = [{"name": t, "weight": n, "requests": [t]} for t, n in counts.most_common()]
+    return {**base, "name": f"recorded:{os.path.basename(log_path)}", "pages": pages}
+
+
+# ── Driver ──────────────────────────────────────────────────────────────────
+
+class Recorder:
+    def __init__(self):
+        self.requests: list[tuple[str, int, float]] = []   # (endpoint, status, ms); status 0 = transport error
+        self.pages: list[tuple[str, float, bool]] = []      # (page, ms, all ok)
+
+
+async def _user(client, traffic: Traffic, recorder: Recorder, measure_from: float, stop_at: float,
+                think_s: float):
+    async def one(endpoint: str, url: str) -> bool:
+        t0 = time.perf_counter()
+        try:
+            status = (await client.get(url)).status_code
+        except Exception:
+            status = 0
+        if t0 >= measure_from:
+            recorder.requests.append((endpoint, status, (time.perf_counter() - t0) * 1000))
+        return 200 <= status < 400
+
+    while time.perf_counter() < stop_at:
+        page, calls = traffic.next_page()
+        t0 = time.perf_counter()
+        ok = await asyncio.gather(*(one(e, u) for e, u in calls))
+        if t0 >= measure_from:
+            recorder.pages.append((page, (time.perf_counter() - t0) * 1000, all(ok)))
+        if think_s:
+            await asyncio.sleep(think_s)
+
+
+async def drive(client, profile: dict, users: int, duration: float, warmup: float, think_ms: float,
+                seed: int) -> tuple[Recorder, float]:
+    recorder = Recorder()
+    start = time.perf_counter()
+    measure_from, stop_at = start + warmup, start + warmup + duration
+    await asyncio.gather(*(
+        _user(client, Traffic(profile, random.Random(seed + i)), recorder, measure_from, stop_at, think_ms / 1000)
+        for i in range(users)
+    ))
+    return recorder, time.perf_counter() - measure_from
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+async def run_inprocess(app, args, profile):
+    import httpx
+
+    async with app.router.lifespan_context(app):
+        transport = httpx.ASGITransport(app=app, raise_app_exceptions=False)
+        async with httpx.AsyncClient(transport=transport, base_url="http://loadtest", timeout=args.timeout) as client:
+            return await drive(client, profile, args.users, args.duration, args.warmup, args.think_ms, args.seed)
+
+
+async def run_http(base_url: str, args, profile):
+    import httpx
+
+    limits = httpx.Limits(max_connections=args.users, max_keepalive_connections=args.users)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=args.timeout) as client:
+        return await drive(client, profile, args.users, args.duration, args.warmup, args.think_ms, args.seed)
+
+
+def run_uvicorn(app, args, profile):
+    import uvicorn
+
+    port = _free_port()
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning",
+                                           access_log=False))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        if not thread.is_alive():
+            raise SystemExit("uvicorn failed to start")
+        time.sleep(0.05)
+    try:
+        return asyncio.run(run_http(f"http://127.0.0.1:{port}", args, profile))
+    finally:
+        server.should_exit = True
+        thread.join(timeout=10)
+
+
+def _import_api():
+    # Credentials are only read at import; the fake warehouse never uses them.
+    for var in ("SNOWFLAKE_ACCOUNT", "SNOWFLAKE_USER", "SNOWFLAKE_PASSWORD"):
+        os.environ.setdefault(var, "loadtest")
+    import api.main
+
+    return api.main
+
+
+def load_app(warehouse: FakeWarehouse):
+    """api.main with its connector replaced by the fake warehouse."""
+    api = _import_api()
+    api.get_connection = warehouse.connect
+    return api
+
+
+# ── Report ──────────────────────────────────────────────────────────────────
+
+def _percentile(ordered: list, q: float):
+    if not ordered:
+        return None
+    return ordered[min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))]
+
+
+def _summary(latencies: list, errors: int, seconds: float) -> dict:
+    ordered = sorted(latencies)
+    n = len(ordered)
+    return {
+        "requests": n, "errors": errors, "error_rate": errors / n if n else 0.0,
+        "rps": n / seconds if seconds else None,
+        "p50_ms": _percentile(ordered, 0.50), "p95_ms": _percentile(ordered, 0.95),
+        "p99_ms": _percentile(ordered, 0.99), "max_ms": ordered[-1] if ordered else None,
+    }
+
+
+def summarize(recorder: Recorder, seconds: float) -> dict:
+    by_endpoint: dict[str, list] = {}
+    for endpoint, status, ms in recorder.requests:
+        by_endpoint.setdefault(endpoint, []).append((status, ms))
+    by_page: dict[str, list] = {}
+    for page, ms, ok in recorder.pages:
+        by_page.setdefault(page, []).append((ok, ms))
+
+    def errors(statuses) -> int:
+        return sum(1 for s in statuses if not 200 <= s < 400)
+
+    return {
+        "seconds": seconds,
+        "overall": _summary([ms for _, _, ms in recorder.requests],
+                            errors(s for _, s, _ in recorder.requests), seconds),
+        "endpoints": {
+            e: _summary([ms for _, ms in rows], errors(s for s, _ in rows), seconds)
+            for e, rows in sorted(by_endpoint.items())
+        },
+        "pages": {
+            p: _summary([ms for _, ms in rows], sum(1 for ok, _ in rows if not ok), seconds)
+            for p, rows in sorted(by_page.items())
+        },
+    }
+
+
+def print_report(results: dict):
+    def row(name, s):
+        print(f"{name:<44} {s['requests']:>8,} {s['rps'] or 0:>8.1f} {s['error_rate']:>7.2%} "
+              f"{s['p50_ms'] or 0:>8.1f} {s['p95_ms'] or 0:>8.1f} {s['p99_ms'] or 0:>8.1f}")
+
+    meta = results["meta"]
+    print(f"{meta['profile']} | {meta['mode']} | {meta['users']} users | {results['seconds']:.1f} s measured")
+    header = f"{'':<44} {'requests':>8} {'rps':>8} {'errors':>7} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}"
+    print(header)
+    row("overall", results["overall"])
+    print("\nendpoints")
+    for name, s in results["endpoints"].items():
+        row("  " + name, s)
+    print("\npage views")
+    for name, s in results["pages"].items():
+        row("  " + name, s)
+    if "warehouse" in results:
+        w = results["warehouse"]
+        print(f"\nwarehouse: {w['queries']:,} queries, {w['errors']:,} injected errors; "
+              f"coalesced {w['coalescing']['coalesced']:,}")
+
+
+# ── SLO ─────────────────────────────────────────────────────────────────────
+
+def check_slo(results: dict, slo: dict, baseline: dict | None = None) -> list[str]:
+    """Violations of the absolute limits and, given a baseline, of the allowed regressions."""
+    violations = []
+
+    def limits(name: str, s: dict, spec: dict):
+        for key, limit in spec.items():
+            value = s.get(key.replace("min_", ""))
+            if value is None:
+                continue
+            if key.startswith("min_") and value < limit:
+                violations.append(f"{name} {key[4:]} {value:.3g} < {limit}")
+            elif not key.startswith("min_") and value > limit:
+                violations.append(f"{name} {key} {value:.3g} > {limit}")
+
+    limits("overall", results["overall"], slo.get("overall", {}))
+    for endpoint, spec in slo.get("endpoints", {}).items():
+        if endpoint in results["endpoints"]:
+            limits(endpoint, results["endpoints"][endpoint], spec)
+
+    if baseline:
+        for name, new in [("overall", results["overall"]), *results["endpoints"].items()]:
+            old = baseline["overall"] if name == "overall" else baseline["endpoints"].get(name)
+            if not old:
+                continue
+            for key, allowed in slo.get("regression", {}).items():
+                if old.get(key) is None or new.get(key) is None:
+                    continue
+                if key == "error_rate":
+                    regressed = new[key] - old[key] > allowed
+                elif key == "rps":
+                    regressed = name == "overall" and new[key] < old[key] * (1 - allowed)
+                else:
+                    regressed = new[key] > old[key] * (1 + allowed)
+                if regressed:
+                    violations.append(f"{name} {key} {old[key]:.3g} -> {new[key]:.3g} (allowed {allowed:g})")
+    return violations
+
+
+def _git_commit() -> str | None:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True, cwd=os.path.dirname(__file__)).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the API with a weighted dashboard traffic mix")
+    parser.add_argument("--mode", choices=["inprocess", "uvicorn"], default="inprocess")
+    parser.add_argument("--url", help="Target a running server instead (no fake warehouse)")
+    parser.add_argument("--profile", help="Profile JSON (default: built-in dashboard profile)")
+    parser.add_argument("--users", type=int, default=20, help="concurrent virtual users")
+    parser.add_argument("--duration", type=float, default=20, help="measured seconds")
+    parser.add_argument("--warmup", type=float, default=3, help="seconds before measuring starts")
+    parser.add_argument("--think-ms", type=float, default=0, help="pause between a user's page views")
+    parser.add_argument("--timeout", type=float, default=30)
+    parser.add_argument("--latency-scale", type=float, default=1.0,
+                        help="multiply every warehouse rule's latency and jitter")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--slo", help="SLO JSON overriding the profile's")
+    parser.add_argument("--baseline", help="Earlier --json-out to check regressions against")
+    parser.add_argument("--json-out", help="Also write results to this JSON file")
+    parser.add_argument("--record-from", help="Build the page mix from a uvicorn access log")
+    parser.add_argument("--dump-profile", help="Write the (recorded) profile to this file and exit")
+    args = parser.parse_args()
+
+    profile = DASHBOARD_PROFILE
+    if args.profile:
+        with open(args.profile) as f:
+            profile = json.load(f)
+    if args.record_from:
+        profile = record_profile(args.record_from, profile)
+    if args.dump_profile:
+        with open(args.dump_profile, "w") as f:
+            json.dump(profile, f, indent=2)
+        print(f"Wrote {args.dump_profile} ({len(profile['pages'])} pages)")
+        return
+
+    rules = [{**r, "latency_ms": r.get("latency_ms", 50) * args.latency_scale,
+              "jitter_ms": r.get("jitter_ms", 10) * args.latency_scale} for r in profile["warehouse"]]
+    warehouse = FakeWarehouse(rules, seed=args.seed)
+    if args.url:
+        recorder, seconds = asyncio.run(run_http(args.url, args, profile))
+        api = None
+    else:
+        api = load_app(warehouse)
+        if args.mode == "inprocess":
+            recorder, seconds = asyncio.run(run_inprocess(api.app, args, profile))
+        else:
+            recorder, seconds = run_uvicorn(api.app, args, profile)
+
+    results = summarize(recorder, seconds)
+    results["meta"] = {
+        "commit": _git_commit(), "profile": profile.get("name", args.profile), "mode": args.url or args.mode,
+        "users": args.users, "think_ms": args.think_ms, "latency_scale": args.latency_scale,
+        "seed": args.seed, "run_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    }
+    if api is not None:
+        results["warehouse"] = {"queries": warehouse.queries, "errors": warehouse.errors,
+                                "coalescing": api.query_flights.stats.to_dict()}
+    print_report(results)
+
+    slo = profile.get("slo", {})
+    if args.slo:
+        with open(args.slo) as f:
+            slo = json.load(f)
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    violations = check_slo(results, slo, baseline)
+    results["slo_violations"] = violations
+
+    if args.json_out:
+        with open(args.json_out, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"\nWrote {args.json_out}")
+    if violations:
+        print("\nSLO violations:")
+        for v in violations:
+            print(f"  {v}")
+        sys.exit(1)
+    print("\nSLO met")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+"""
+replay_quarantine.py
+
+Re-ingests usage events from SILVER.USAGE_EVENTS_QUARANTINE after their RAW
+payload has been fixed in place, e.g.
+
+    UPDATE NIMBUSBILL.SILVER.USAGE_EVENTS_QUARANTINE
+    SET RAW = OBJECT_INSERT(RAW, 'unit', 'requests', TRUE)
+    WHERE ERROR_REASON = 'unknown_unit' AND RAW:product_id = 'prod_api_requests';
+
+Quarantined rows are re-validated with the same rules as the Silver stage
+(V_USAGE_EVENTS_VALIDATED). Rows that now pass are merged into
+USAGE_EVENTS_CLEAN and marked replayed, and daily aggregates and Gold costs
+are rebuilt for every event date they touch. Rows that still fail get their
+ERROR_REASON refreshed.
+
+    python scripts/replay_quarantine.py --from 2024-01-01 --to 2024-01-31 --dry-run
+"""
+import sys
+import os
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import argparse
+import uuid
+from datetime import date
+from scripts.backfill_history import get_connection, merge_batch, rebuild_day
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay fixed quarantine rows into Silver and Gold")
+    parser.add_argument("--from", dest="date_from", type=date.fromisoformat,
+                        help="First quarantine DT to consider (default: all)")
+    parser.add_argument("--to", dest="date_to", type=date.fromisoformat,
+                        help="Last quarantine DT to consider (default: --from, or all)")
+    parser.add_argument("--dry-run", action="store_true", help="Only report what would be replayed")
+    args = parser.parse_args()
+
+    scope = "v.ORIGIN = 'QUARANTINE'"
+    if args.date_from:
+        date_to = args.date_to or args.date_from
+        scope += f" AND v.DT BETWEEN '{args.date_from.isoformat()}' AND '{date_to.isoformat()}'"
+
+    batch_id = f"replay_{uuid.uuid4().hex[:12]}"
+    conn = get_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.execute(f"""
+            SELECT COALESCE(v.ERROR_REASON, '(fixed)') AS REASON, COUNT(*)
+            FROM NIMBUSBILL.SILVER.V_USAGE_EVENTS_VALIDATED v
+            WHERE {scope}
+            GROUP BY 1 ORDER BY 2 DESC
+        """)
+        summary = cursor.fetchall()
+        if not summary:
+            print("Quarantine is empty for this range.")
+            return
+        print(f"{'reason':<60} {'rows':>10}")
+        for reason, n in summary:
+            print(f"{reason:<60} {n:>10,}")
+        fixed = sum(n for reason, n in summary if reason == "(fixed)")
+        if args.dry_run or not fixed:
+            print(f"\n{fixed:,} rows would be replayed." if args.dry_run else "\nNothing to replay.")
+            return
+
+        # DDL commits implicitly in Snowflake, so create the batch table first.
+        cursor.execute("""
+            CREATE OR REPLACE TEMPORARY TABLE NIMBUSBILL.SILVER.USAGE_EVENTS_BATCH
+            LIKE NIMBUSBILL.SILVER.USAGE_EVENTS_CLEAN
+        """)
+        cursor.execute("BEGIN")
+        try:
+            cursor.execute(f"""
+                UPDATE NIMBUSBILL.SILVER.USAGE_EVENTS_QUARANTINE q
+                SET ERROR_REASON = v.ERROR_REASON,
+                    REPLAY_BATCH_ID = IFF(v.ERROR_REASON IS NULL, '{batch_id}', NULL)
+                FROM NIMBUSBILL.SILVER.V_USAGE_EVENTS_VALIDATED v
+                WHERE {scope}
+                  AND q.RAW_HASH = v.QUARANTINE_HASH
+                  AND q.REPLAYED_TS IS NULL
+            """)
+            cursor.execute(f"""
+                INSERT INTO NIMBUSBILL.SILVER.USAGE_EVENTS_BATCH
+                    (EVENT_ID, EVENT_TS, EVENT_DATE, CUSTOMER_ID, PRODUCT_ID,
+                     PLAN_ID, REGION, UNIT, QUANTITY, SOURCE, BATCH_ID, RAW_HASH)
+                SELECT EVENT_ID, EVENT_TS, EVENT_DATE, CUSTOMER_ID, PRODUCT_ID,
+                       PLAN_ID, REGION, UNIT, QUANTITY, SOURCE, '{batch_id}', RAW_HASH
+                FROM NIMBUSBILL.SILVER.V_USAGE_EVENTS_VALIDATED v
+                WHERE v.ORIGIN = 'QUARANTINE' AND v.REPLAY_BATCH_ID = '{batch_id}'
+                  AND v.ERROR_REASON IS NULL
+            """)
+            merge_batch(cursor, batch_id)
+            cursor.execute(f"""
+                UPDATE NIMBUSBILL.SILVER.USAGE_EVENTS_QUARANTINE
+                SET REPLAYED_TS = CURRENT_TIMESTAMP()
+                WHERE REPLAY_BATCH_ID = '{batch_id}'
+            """)
+            cursor.execute("SELECT DISTINCT EVENT_DATE FROM NIMBUSBILL.SILVER.USAGE_EVENTS_BATCH ORDER BY 1")
+            dates = [row[0].isoformat() for row in cursor.fetchall()]
+            for d in dates:
+                print(f"  Rebuilding aggregates and costs for {d}")
+                rebuild_day(cursor, d, batch_id)
+            cursor.execute("COMMIT")
+        except Exception:
+            cursor.execute("ROLLBACK")
+            raise
+    finally:
+        cursor.close()
+        conn.close()
+
+    print(f"\nReplayed {fixed:,} rows as {batch_id} across {len(dates)} event dates.")
+
+
+if __name__ == "__main__":
+    main()
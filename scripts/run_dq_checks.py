@@ -0,0 +1,83 @@
+"""
+run_dq_checks.py
+
+Runs the declarative data-quality checks (billing/dq.py) for one or more
+dates outside Airflow, e.g. after a backfill. Each source is checked in a
+single scan limited to the given EVENT_DATE partitions; results land in
+OPS.DQ_CHECK_RESULTS and the exit code is non-zero on error-severity
+failures.
+
+    python scripts/run_dq_checks.py --from 2024-01-01 --to 2024-01-31
+    python scripts/run_dq_checks.py --from 2024-01-15 --print-sql
+"""
+import sys
+import os
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import argparse
+import uuid
+import snowflake.connector
+from datetime import date, timedelta
+from dotenv import load_dotenv
+from billing.dq import CHECKS, SOURCES, DQGateError, gate, render_scan, run_checks
+
+load_dotenv()
+
+ACCOUNT   = os.getenv("SNOWFLAKE_ACCOUNT")
+USER      = os.getenv("SNOWFLAKE_USER")
+PASSWORD  = os.getenv("SNOWFLAKE_PASSWORD")
+WAREHOUSE = os.getenv("SNOWFLAKE_WAREHOUSE", "COMPUTE_WH")
+DATABASE  = os.getenv("SNOWFLAKE_DATABASE",  "NIMBUSBILL")
+
+
+def get_connection():
+    return snowflake.connector.connect(
+        user=USER, password=PASSWORD, account=ACCOUNT,
+        warehouse=WAREHOUSE, database=DATABASE, schema="PUBLIC",
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run partition-scoped data-quality checks")
+    parser.add_argument("--from", dest="date_from", type=date.fromisoformat, required=True)
+    parser.add_argument("--to", dest="date_to", type=date.fromisoformat)
+    parser.add_argument("--source", action="append", choices=sorted(SOURCES),
+                        help="Limit to these sources (repeatable); default all")
+    parser.add_argument("--print-sql", action="store_true", help="Print the fused scans and exit")
+    args = parser.parse_args()
+
+    date_to = args.date_to or args.date_from
+    days = [args.date_from + timedelta(days=i) for i in range((date_to - args.date_from).days + 1)]
+    sources = args.source or sorted(SOURCES)
+
+    if args.print_sql:
+        for name in sources:
+            checks = [c for c in CHECKS if c.source == name]
+            print(f"-- {name}: {', '.join(c.name for c in checks)}")
+            print(render_scan(SOURCES[name], checks, days) + ";\n")
+        return
+
+    run_id = f"manual_{uuid.uuid4().hex[:12]}"
+    conn = get_connection()
+    cursor = conn.cursor()
+    try:
+        results = run_checks(cursor, run_id, days, sources=sources)
+    finally:
+        cursor.close()
+        conn.close()
+
+    print(f"\n{'check':<28} {'severity':<8} {'status':<6} {'failed':>10} {'scanned':>12} {'ms':>7}")
+    for r in results:
+        print(f"{r.check.name:<28} {r.check.severity:<8} {r.status:<6} "
+              f"{r.failed_rows:>10,} {r.rows_scanned:>12,} {r.duration_ms:>7}")
+    print(f"\nRun {run_id} recorded in OPS.DQ_CHECK_RESULTS")
+    try:
+        gate(results)
+    except DQGateError as e:
+        print(e)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -2,7 +2,9 @@
 seed_invoices.py
 
 Generate invoices and line items from existing FACT_CUSTOMER_DAILY_USAGE data.
-Groups usage by customer and month, creates invoice headers and per-product line items.
+Groups usage by customer and month, creates invoice headers and per-product line items,
+then taxes them like the month-end close with the DIM_TAX_RULE rules in force on each
+period's last day.
 """
 import os
 import sys
@@ -41,21 +43,22 @@ def main():
             )
             SELECT
                 UUID_STRING(),
-                CUSTOMER_SK,
-                DATE_TRUNC('MONTH', MIN(DATE_ID))::DATE,
-                LAST_DAY(MAX(DATE_ID)),
+                MAX(u.CUSTOMER_SK),
+                DATE_TRUNC('MONTH', MIN(u.DATE_ID))::DATE,
+                LAST_DAY(MAX(u.DATE_ID)),
                 CURRENT_TIMESTAMP(),
                 'issued',
-                SUM(COST_AMOUNT),
-                ROUND(SUM(COST_AMOUNT) * 0.08, 2),
-                ROUND(SUM(COST_AMOUNT) * 1.08, 2),
-                MAX(CURRENCY),
+                SUM(u.COST_AMOUNT),
+                0,
+                SUM(u.COST_AMOUNT),
+                u.CURRENCY,
                 CURRENT_TIMESTAMP(),
                 'seed_invoices'
-            FROM NIMBUSBILL.GOLD.FACT_CUSTOMER_DAILY_USAGE
-            WHERE DATE_ID >= DATE_TRUNC('MONTH', CURRENT_DATE()) - INTERVAL '2 MONTHS'
-            GROUP BY CUSTOMER_SK, DATE_TRUNC('MONTH', DATE_ID)
-            HAVING SUM(COST_AMOUNT) > 0
+            FROM NIMBUSBILL.GOLD.FACT_CUSTOMER_DAILY_USAGE u
+            JOIN NIMBUSBILL.GOLD.DIM_CUSTOMER v ON u.CUSTOMER_SK = v.CUSTOMER_SK
+            WHERE u.DATE_ID >= DATE_TRUNC('MONTH', CURRENT_DATE()) - INTERVAL '2 MONTHS'
+            GROUP BY v.CUSTOMER_ID, DATE_TRUNC('MONTH', u.DATE_ID), u.CURRENCY
+            HAVING SUM(u.COST_AMOUNT) > 0
         """)
         inv_count = cur.rowcount
         print(f"  Created {inv_count} invoices.")
@@ -82,9 +85,12 @@ def main():
                 'seed_invoices',
                 CURRENT_TIMESTAMP()
             FROM NIMBUSBILL.GOLD.FACT_CUSTOMER_DAILY_USAGE u
+            JOIN NIMBUSBILL.GOLD.DIM_CUSTOMER v ON u.CUSTOMER_SK = v.CUSTOMER_SK
             JOIN NIMBUSBILL.GOLD.FACT_INVOICES inv
-                ON u.CUSTOMER_SK = inv.CUSTOMER_SK
-                AND u.DATE_ID BETWEEN inv.BILLING_PERIOD_START AND inv.BILLING_PERIOD_END
+                ON u.DATE_ID BETWEEN inv.BILLING_PERIOD_START AND inv.BILLING_PERIOD_END
+            JOIN NIMBUSBILL.GOLD.DIM_CUSTOMER iv
+                ON inv.CUSTOMER_SK = iv.CUSTOMER_SK AND iv.CUSTOMER_ID = v.CUSTOMER_ID
+                AND inv.CURRENCY = u.CURRENCY
             LEFT JOIN NIMBUSBILL.GOLD.DIM_PRICING_RATE r ON u.RATE_SK = r.RATE_SK
             WHERE inv.BATCH_ID = 'seed_invoices'
             GROUP BY inv.INVOICE_ID, u.PRODUCT_ID, u.UNIT
@@ -92,6 +98,57 @@ def main():
         li_count = cur.rowcount
         print(f"  Created {li_count} line items.")
 
+        print("Generating tax lines...")
+        cur.execute("""
+            INSERT INTO NIMBUSBILL.GOLD.FACT_INVOICE_LINE_ITEMS (
+                INVOICE_ID, LINE_ITEM_ID, LINE_TYPE, PRODUCT_ID, UNIT,
+                QUANTITY, UNIT_PRICE, AMOUNT, RATE_SK,
+                USAGE_WINDOW_START, USAGE_WINDOW_END, CALC_BATCH_ID, LOAD_TS, TAX_RULE_ID
+            )
+            SELECT
+                t.INVOICE_ID, UUID_STRING(), 'tax', NULL, NULL,
+                t.TAXABLE_AMOUNT, t.TAX_RATE, ROUND(t.TAXABLE_AMOUNT * t.TAX_RATE, 2), NULL,
+                t.BILLING_PERIOD_START, t.BILLING_PERIOD_END, 'seed_invoices', CURRENT_TIMESTAMP(), t.RULE_ID
+            FROM (
+                SELECT
+                    inv.INVOICE_ID, inv.BILLING_PERIOD_START, inv.BILLING_PERIOD_END,
+                    COALESCE(own.RULE_ID, dflt.RULE_ID) AS RULE_ID,
+                    COALESCE(own.TAX_RATE, dflt.TAX_RATE) AS TAX_RATE,
+                    SUM(li.AMOUNT) AS TAXABLE_AMOUNT
+                FROM NIMBUSBILL.GOLD.FACT_INVOICES inv
+                JOIN NIMBUSBILL.GOLD.FACT_INVOICE_LINE_ITEMS li ON li.INVOICE_ID = inv.INVOICE_ID
+                JOIN NIMBUSBILL.GOLD.DIM_CUSTOMER c ON c.CUSTOMER_SK = inv.CUSTOMER_SK
+                LEFT JOIN NIMBUSBILL.GOLD.DIM_PRODUCT p ON p.PRODUCT_ID = li.PRODUCT_ID
+                -- Several periods are seeded at once, so rules are matched per period end
+                LEFT JOIN NIMBUSBILL.GOLD.DIM_TAX_RULE own
+                    ON own.COUNTRY = c.COUNTRY AND own.PRODUCT_CATEGORY = p.CATEGORY
+                    AND inv.BILLING_PERIOD_END BETWEEN own.EFFECTIVE_FROM
+                                                   AND COALESCE(own.EFFECTIVE_TO, '9999-12-31'::DATE)
+                LEFT JOIN NIMBUSBILL.GOLD.DIM_TAX_RULE dflt
+                    ON dflt.COUNTRY = c.COUNTRY AND dflt.PRODUCT_CATEGORY IS NULL
+                    AND inv.BILLING_PERIOD_END BETWEEN dflt.EFFECTIVE_FROM
+                                                   AND COALESCE(dflt.EFFECTIVE_TO, '9999-12-31'::DATE)
+                WHERE inv.BATCH_ID = 'seed_invoices'
+                  AND li.LINE_TYPE <> 'tax'
+                  AND COALESCE(own.RULE_ID, dflt.RULE_ID) IS NOT NULL
+                GROUP BY 1, 2, 3, 4, 5
+            ) t
+        """)
+        tax_count = cur.rowcount
+        cur.execute("""
+            MERGE INTO NIMBUSBILL.GOLD.FACT_INVOICES T
+            USING (
+                SELECT INVOICE_ID, SUM(AMOUNT) AS TAX
+                FROM NIMBUSBILL.GOLD.FACT_INVOICE_LINE_ITEMS
+                WHERE CALC_BATCH_ID = 'seed_invoices' AND LINE_TYPE = 'tax'
+                GROUP BY INVOICE_ID
+            ) S
+            ON T.INVOICE_ID = S.INVOICE_ID AND T.BATCH_ID = 'seed_invoices'
+            WHEN MATCHED THEN
+                UPDATE SET T.TAX = S.TAX, T.TOTAL = T.SUBTOTAL + S.TAX
+        """)
+        print(f"  Created {tax_count} tax lines.")
+
         conn.commit()
         print(f"Done. {inv_count} invoices with {li_count} line items seeded.")
 
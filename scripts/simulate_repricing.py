@@ -0,0 +1,94 @@
+"""
+simulate_repricing.py
+
+What-if repricing: re-rates USAGE_DAILY_AGG over a date range under a
+candidate pricing catalog CSV and prints per-product deltas against the
+current DIM_PRICING_RATE. Nothing is written to Gold.
+
+    python scripts/simulate_repricing.py --catalog new_prices.csv \
+        --from 2024-01-01 --to 2024-03-31 --customers-csv deltas.csv
+"""
+import sys
+import os
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import argparse
+import csv
+import time
+import snowflake.connector
+from datetime import date
+from dotenv import load_dotenv
+from billing.rating import RateIndex, DIM_PRICING_RATE_SQL
+from billing.repricing import default_range, segment_starts, simulate, usage_segments_sql
+
+load_dotenv()
+
+ACCOUNT   = os.environ["SNOWFLAKE_ACCOUNT"]
+USER      = os.environ["SNOWFLAKE_USER"]
+PASSWORD  = os.environ["SNOWFLAKE_PASSWORD"]
+WAREHOUSE = os.getenv("SNOWFLAKE_WAREHOUSE", "COMPUTE_WH")
+DATABASE  = os.getenv("SNOWFLAKE_DATABASE",  "NIMBUSBILL")
+
+
+def get_connection():
+    return snowflake.connector.connect(
+        user=USER, password=PASSWORD, account=ACCOUNT,
+        warehouse=WAREHOUSE, database=DATABASE, schema="PUBLIC",
+    )
+
+
+def fetch_chunks(cursor, chunk_size: int):
+    while True:
+        rows = cursor.fetchmany(chunk_size)
+        if not rows:
+            return
+        yield [{k.lower(): v for k, v in row.items()} for row in rows]
+
+
+def main():
+    default_from, default_to = default_range()
+    parser = argparse.ArgumentParser(description="Re-rate historical usage under a candidate catalog")
+    parser.add_argument("--catalog", required=True, help="Candidate pricing_catalog CSV")
+    parser.add_argument("--from", dest="date_from", type=date.fromisoformat, default=default_from)
+    parser.add_argument("--to", dest="date_to", type=date.fromisoformat, default=default_to)
+    parser.add_argument("--chunk-size", type=int, default=100_000)
+    parser.add_argument("--customers-csv", help="Write per-customer deltas to this CSV")
+    args = parser.parse_args()
+
+    candidate = RateIndex.from_csv(args.catalog)
+
+    conn = get_connection()
+    cur = conn.cursor(snowflake.connector.DictCursor)
+    try:
+        cur.execute(DIM_PRICING_RATE_SQL)
+        baseline = RateIndex([{k.lower(): v for k, v in r.items()} for r in cur.fetchall()])
+
+        starts = segment_starts(args.date_from, args.date_to, baseline, candidate)
+        print(f"Re-rating {args.date_from} .. {args.date_to} in {len(starts)} rate segment(s)...")
+        t0 = time.perf_counter()
+        cur.execute(usage_segments_sql(starts), {"df": str(args.date_from), "dt": str(args.date_to)})
+        result = simulate(fetch_chunks(cur, args.chunk_size), baseline, candidate)
+        elapsed = time.perf_counter() - t0
+    finally:
+        cur.close()
+        conn.close()
+
+    print(f"  {result.rows_rated} segment rows rated in {elapsed:.1f}s "
+          f"({result.unpriced_baseline} unpriced under current, {result.unpriced_candidate} under candidate)")
+    print(f"\n{'product_id':<24}{'current':>16}{'candidate':>16}{'delta':>16}")
+    for row in result.product_deltas():
+        print(f"{row['product_id']:<24}{row['baseline']:>16.2f}{row['candidate']:>16.2f}{row['delta']:>16.2f}")
+    print(f"{'TOTAL':<24}{result.baseline_total:>16.2f}{result.candidate_total:>16.2f}"
+          f"{result.candidate_total - result.baseline_total:>16.2f}")
+
+    if args.customers_csv:
+        with open(args.customers_csv, "w", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=["customer_id", "baseline", "candidate", "delta"])
+            writer.writeheader()
+            writer.writerows(result.customer_deltas())
+        print(f"\nPer-customer deltas written to {args.customers_csv}")
+
+
+if __name__ == "__main__":
+    main()
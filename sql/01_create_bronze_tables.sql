@@ -28,3 +28,32 @@ CREATE TABLE IF NOT EXISTS PRICING_CATALOG_RAW (
     BATCH_ID STRING,
     RAW VARIANT
 );
+
+-- 1.4 Push ingestion stage (see billing/ingest.py)
+-- Gzip JSONL chunks from POST /events; COPY'd one file at a time into
+-- USAGE_EVENTS_RAW and purged. Kept apart from the table stage so the daily
+-- file COPY never picks them up.
+CREATE STAGE IF NOT EXISTS EVENTS_INGEST_STAGE
+    FILE_FORMAT = (TYPE = 'JSON' COMPRESSION = 'GZIP');
+
+-- 1.5 Usage Events Typed (Parquet landing files, see billing/landing.py)
+-- Columns match the data contract and are loaded with MATCH_BY_COLUMN_NAME;
+-- SOURCE / DT / BATCH_ID are tagged by FILE_NAME after each COPY. Silver
+-- validates these rows together with USAGE_EVENTS_RAW.
+CREATE TABLE IF NOT EXISTS USAGE_EVENTS_TYPED (
+    EVENT_ID STRING,
+    EVENT_TIMESTAMP TIMESTAMP_NTZ,
+    CUSTOMER_ID STRING,
+    PRODUCT_ID STRING,
+    PLAN_ID STRING,
+    QUANTITY NUMBER(38, 6),
+    UNIT STRING,
+    REGION STRING,
+    SCHEMA_VERSION STRING,
+    INGEST_TS TIMESTAMP_NTZ DEFAULT CURRENT_TIMESTAMP(),
+    SOURCE STRING,
+    DT DATE,
+    BATCH_ID STRING,
+    FILE_NAME STRING
+)
+CLUSTER BY (DT);
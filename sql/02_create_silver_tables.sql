@@ -21,15 +21,27 @@ CREATE TABLE IF NOT EXISTS USAGE_EVENTS_CLEAN (
 CLUSTER BY (EVENT_DATE, CUSTOMER_ID);
 
 -- 2.2 Usage Events Quarantine
+-- Rows failing the data contract (see V_USAGE_EVENTS_VALIDATED). Fix RAW in
+-- place and run scripts/replay_quarantine.py to re-ingest them.
 CREATE TABLE IF NOT EXISTS USAGE_EVENTS_QUARANTINE (
     INGEST_TS TIMESTAMP_NTZ DEFAULT CURRENT_TIMESTAMP(),
     DT DATE,
     SOURCE STRING,
-    ERROR_REASON STRING,
+    ERROR_REASON STRING, -- Comma-separated violated rules
     RAW VARIANT,
-    BATCH_ID STRING
+    BATCH_ID STRING,
+    EVENT_ID STRING,
+    RAW_HASH STRING,     -- MD5 of the RAW as received; stable across fixes
+    REPLAY_BATCH_ID STRING,
+    REPLAYED_TS TIMESTAMP_NTZ
 );
 
+-- Existing deployments
+ALTER TABLE USAGE_EVENTS_QUARANTINE ADD COLUMN IF NOT EXISTS EVENT_ID STRING;
+ALTER TABLE USAGE_EVENTS_QUARANTINE ADD COLUMN IF NOT EXISTS RAW_HASH STRING;
+ALTER TABLE USAGE_EVENTS_QUARANTINE ADD COLUMN IF NOT EXISTS REPLAY_BATCH_ID STRING;
+ALTER TABLE USAGE_EVENTS_QUARANTINE ADD COLUMN IF NOT EXISTS REPLAYED_TS TIMESTAMP_NTZ;
+
 -- 2.3 Customer Current (Latest Snapshot)
 CREATE TABLE IF NOT EXISTS CUSTOMER_CURRENT (
     CUSTOMER_ID STRING,
@@ -59,15 +71,45 @@ CREATE TABLE IF NOT EXISTS PRICING_RATES (
 );
 
 -- 2.5 Usage Daily Aggregate (Pre-Pricing)
+-- Rolled up from USAGE_HOURLY_AGG, not from another scan of USAGE_EVENTS_CLEAN.
 CREATE TABLE IF NOT EXISTS USAGE_DAILY_AGG (
     EVENT_DATE DATE,
     CUSTOMER_ID STRING,
     PRODUCT_ID STRING,
     UNIT STRING,
+    REGION STRING,
+    PLAN_ID STRING, -- plan reported on the events; pricing uses DIM_CUSTOMER's
     TOTAL_QUANTITY NUMBER(38,6),
     EVENT_COUNT NUMBER,
     LAST_EVENT_TS TIMESTAMP_NTZ,
     LOAD_TS TIMESTAMP_NTZ,
     BATCH_ID STRING,
-    CONSTRAINT PK_USAGE_DAILY_AGG PRIMARY KEY (EVENT_DATE, CUSTOMER_ID, PRODUCT_ID, UNIT)
+    CONSTRAINT PK_USAGE_DAILY_AGG PRIMARY KEY (EVENT_DATE, CUSTOMER_ID, PRODUCT_ID, UNIT, REGION, PLAN_ID)
 );
+
+-- 2.6 Usage Hourly Aggregate (Pre-Pricing)
+-- Rebuilt per EVENT_DATE from USAGE_EVENTS_CLEAN; the daily aggregate and
+-- both Gold usage facts are derived from it. Events without a region or
+-- plan are grouped under 'unknown' so both can be part of the key.
+CREATE TABLE IF NOT EXISTS USAGE_HOURLY_AGG (
+    EVENT_DATE DATE,
+    EVENT_HOUR TIMESTAMP_NTZ, -- DATE_TRUNC('HOUR', EVENT_TS)
+    CUSTOMER_ID STRING,
+    PRODUCT_ID STRING,
+    UNIT STRING,
+    REGION STRING,
+    PLAN_ID STRING, -- plan reported on the events; pricing uses DIM_CUSTOMER's
+    TOTAL_QUANTITY NUMBER(38,6),
+    EVENT_COUNT NUMBER,
+    LAST_EVENT_TS TIMESTAMP_NTZ,
+    LOAD_TS TIMESTAMP_NTZ,
+    BATCH_ID STRING,
+    CONSTRAINT PK_USAGE_HOURLY_AGG PRIMARY KEY (EVENT_HOUR, CUSTOMER_ID, PRODUCT_ID, UNIT, REGION, PLAN_ID)
+)
+CLUSTER BY (EVENT_DATE, CUSTOMER_ID);
+
+-- Existing deployments: dates rebuilt after this fill REGION / PLAN_ID
+ALTER TABLE USAGE_DAILY_AGG ADD COLUMN IF NOT EXISTS REGION STRING;
+ALTER TABLE USAGE_DAILY_AGG ADD COLUMN IF NOT EXISTS PLAN_ID STRING;
+ALTER TABLE USAGE_HOURLY_AGG ADD COLUMN IF NOT EXISTS REGION STRING;
+ALTER TABLE USAGE_HOURLY_AGG ADD COLUMN IF NOT EXISTS PLAN_ID STRING;
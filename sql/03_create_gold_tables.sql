@@ -26,7 +26,11 @@ CREATE TABLE IF NOT EXISTS DIM_CUSTOMER (
     IS_CURRENT BOOLEAN,
     RECORD_HASH STRING, -- MD5 of attributes for change detection
     CONSTRAINT PK_DIM_CUSTOMER PRIMARY KEY (CUSTOMER_SK)
-);
+)
+CLUSTER BY (CUSTOMER_ID, EFFECTIVE_START);
+
+-- Existing deployments: as-of joins probe versions by (CUSTOMER_ID, EFFECTIVE_START)
+ALTER TABLE DIM_CUSTOMER CLUSTER BY (CUSTOMER_ID, EFFECTIVE_START);
 
 -- 3.1.3 Product Dimension
 CREATE TABLE IF NOT EXISTS DIM_PRODUCT (
@@ -59,6 +63,37 @@ CREATE TABLE IF NOT EXISTS DIM_PRICING_RATE (
     CONSTRAINT PK_DIM_RATE PRIMARY KEY (RATE_SK)
 );
 
+-- 3.1.6 FX Rate Dimension (effective-dated, like DIM_PRICING_RATE)
+-- RATE = REPORTING_CURRENCY units per CURRENCY unit; windows of a currency
+-- never overlap (billing/fx.py checks loads). The reporting currency itself
+-- has no rows and converts at 1.
+CREATE TABLE IF NOT EXISTS DIM_FX_RATE (
+    CURRENCY STRING,
+    REPORTING_CURRENCY STRING,
+    RATE NUMBER(38,12),
+    EFFECTIVE_FROM DATE,
+    EFFECTIVE_TO DATE,
+    IS_CURRENT BOOLEAN,
+    LOAD_TS TIMESTAMP_NTZ DEFAULT CURRENT_TIMESTAMP(),
+    CONSTRAINT PK_DIM_FX_RATE PRIMARY KEY (CURRENCY, REPORTING_CURRENCY, EFFECTIVE_FROM)
+);
+
+-- 3.1.7 Tax Rule Dimension (effective-dated per country and product category)
+-- A NULL PRODUCT_CATEGORY is the country's default; a category's own rule
+-- wins over it. Windows of one (COUNTRY, PRODUCT_CATEGORY) never overlap
+-- (billing/tax.py checks loads). Countries without a rule are not taxed.
+CREATE TABLE IF NOT EXISTS DIM_TAX_RULE (
+    RULE_ID STRING,
+    COUNTRY STRING,
+    PRODUCT_CATEGORY STRING,
+    TAX_RATE NUMBER(9,6), -- 0.2 = 20%
+    EFFECTIVE_FROM DATE,
+    EFFECTIVE_TO DATE,
+    IS_CURRENT BOOLEAN,
+    LOAD_TS TIMESTAMP_NTZ DEFAULT CURRENT_TIMESTAMP(),
+    CONSTRAINT PK_DIM_TAX_RULE PRIMARY KEY (RULE_ID)
+);
+
 -- 3.2 Facts
 -- 3.2.1 Daily Usage Fact
 CREATE TABLE IF NOT EXISTS FACT_CUSTOMER_DAILY_USAGE (
@@ -66,16 +101,21 @@ CREATE TABLE IF NOT EXISTS FACT_CUSTOMER_DAILY_USAGE (
     CUSTOMER_SK NUMBER,
     PRODUCT_ID STRING,
     UNIT STRING,
+    REGION STRING,
+    EVENT_PLAN_ID STRING, -- plan reported on the events; the price follows RATE_SK
     TOTAL_QUANTITY NUMBER(38,6),
     BILLABLE_QUANTITY NUMBER(38,6),
     COST_AMOUNT NUMBER(38,10),
     CURRENCY STRING,
+    FX_RATE NUMBER(38,12), -- DIM_FX_RATE on DATE_ID; 1 for the reporting currency
+    REPORTING_COST_AMOUNT NUMBER(38,10), -- COST_AMOUNT * FX_RATE
     RATE_SK NUMBER,
     LOAD_TS TIMESTAMP_NTZ DEFAULT CURRENT_TIMESTAMP(),
     BATCH_ID STRING,
     CONSTRAINT FK_FCDU_DATE FOREIGN KEY (DATE_ID) REFERENCES DIM_DATE(DATE_ID),
     CONSTRAINT FK_FCDU_CUST FOREIGN KEY (CUSTOMER_SK) REFERENCES DIM_CUSTOMER(CUSTOMER_SK)
-);
+)
+CLUSTER BY (DATE_ID, CUSTOMER_SK);
 
 -- 3.2.2 Invoices Fact
 CREATE TABLE IF NOT EXISTS FACT_INVOICES (
@@ -91,14 +131,15 @@ CREATE TABLE IF NOT EXISTS FACT_INVOICES (
     CURRENCY STRING,
     LOAD_TS TIMESTAMP_NTZ DEFAULT CURRENT_TIMESTAMP(),
     BATCH_ID STRING
-);
+)
+CLUSTER BY (BILLING_PERIOD_START, CUSTOMER_SK);
 
 -- 3.2.3 Invoice Line Items Fact
 CREATE TABLE IF NOT EXISTS FACT_INVOICE_LINE_ITEMS (
     INVOICE_ID STRING,
     LINE_ITEM_ID STRING,
     LINE_TYPE STRING, -- base_fee, usage, overage, adjustment, tax
-    PRODUCT_ID STRING, -- Nullable for base fees
+    PRODUCT_ID STRING, -- Nullable for base fees and tax
     UNIT STRING,
     QUANTITY NUMBER(38,6),
     UNIT_PRICE NUMBER(38,10),
@@ -108,8 +149,11 @@ CREATE TABLE IF NOT EXISTS FACT_INVOICE_LINE_ITEMS (
     USAGE_WINDOW_END DATE,
     CALC_BATCH_ID STRING,
     LOAD_TS TIMESTAMP_NTZ,
+    TAX_RULE_ID STRING, -- tax lines: the DIM_TAX_RULE applied
+    PLAN_ID STRING, -- base-fee lines: the plan billed
     CONSTRAINT PK_FILI PRIMARY KEY (INVOICE_ID, LINE_ITEM_ID)
-);
+)
+CLUSTER BY (INVOICE_ID);
 
 -- 3.2.4 Billing Audit Fact
 CREATE TABLE IF NOT EXISTS FACT_BILLING_AUDIT (
@@ -124,3 +168,163 @@ CREATE TABLE IF NOT EXISTS FACT_BILLING_AUDIT (
     CALC_BATCH_ID STRING,
     CREATED_TS TIMESTAMP_NTZ DEFAULT CURRENT_TIMESTAMP()
 );
+
+-- 3.2.5 Hourly Usage Fact
+-- Priced like the daily fact (customer version and rate in effect on DATE_ID);
+-- FACT_CUSTOMER_DAILY_USAGE is rolled up from it. Serves hourly usage curves.
+CREATE TABLE IF NOT EXISTS FACT_CUSTOMER_HOURLY_USAGE (
+    DATE_ID DATE,
+    HOUR_TS TIMESTAMP_NTZ,
+    CUSTOMER_SK NUMBER,
+    PRODUCT_ID STRING,
+    UNIT STRING,
+    REGION STRING,
+    EVENT_PLAN_ID STRING,
+    TOTAL_QUANTITY NUMBER(38,6),
+    BILLABLE_QUANTITY NUMBER(38,6),
+    COST_AMOUNT NUMBER(38,10),
+    CURRENCY STRING,
+    RATE_SK NUMBER,
+    LOAD_TS TIMESTAMP_NTZ DEFAULT CURRENT_TIMESTAMP(),
+    BATCH_ID STRING,
+    CONSTRAINT FK_FCHU_DATE FOREIGN KEY (DATE_ID) REFERENCES DIM_DATE(DATE_ID),
+    CONSTRAINT FK_FCHU_CUST FOREIGN KEY (CUSTOMER_SK) REFERENCES DIM_CUSTOMER(CUSTOMER_SK)
+)
+CLUSTER BY (DATE_ID, CUSTOMER_SK);
+
+-- Existing deployments: dates rebuilt after this fill REGION / EVENT_PLAN_ID
+ALTER TABLE FACT_CUSTOMER_DAILY_USAGE ADD COLUMN IF NOT EXISTS REGION STRING;
+ALTER TABLE FACT_CUSTOMER_DAILY_USAGE ADD COLUMN IF NOT EXISTS EVENT_PLAN_ID STRING;
+ALTER TABLE FACT_CUSTOMER_HOURLY_USAGE ADD COLUMN IF NOT EXISTS REGION STRING;
+ALTER TABLE FACT_CUSTOMER_HOURLY_USAGE ADD COLUMN IF NOT EXISTS EVENT_PLAN_ID STRING;
+
+-- 3.2.6 Usage Rollups
+-- Maintained from FACT_CUSTOMER_DAILY_USAGE by the daily Gold step; the
+-- /usage planner (billing/usage_planner.py) reads the smallest one that
+-- answers a request exactly.
+-- All customers per product and day.
+CREATE TABLE IF NOT EXISTS FACT_PRODUCT_DAILY_USAGE (
+    DATE_ID DATE,
+    PRODUCT_ID STRING,
+    UNIT STRING,
+    CURRENCY STRING,
+    TOTAL_QUANTITY NUMBER(38,6),
+    BILLABLE_QUANTITY NUMBER(38,6),
+    COST_AMOUNT NUMBER(38,10),
+    REPORTING_COST_AMOUNT NUMBER(38,10),
+    LOAD_TS TIMESTAMP_NTZ DEFAULT CURRENT_TIMESTAMP(),
+    BATCH_ID STRING,
+    CONSTRAINT PK_FPDU PRIMARY KEY (DATE_ID, PRODUCT_ID, UNIT, CURRENCY)
+);
+
+-- Per customer version and product, by calendar month (MONTH_ID = first day).
+CREATE TABLE IF NOT EXISTS FACT_CUSTOMER_MONTHLY_USAGE (
+    MONTH_ID DATE,
+    CUSTOMER_SK NUMBER,
+    PRODUCT_ID STRING,
+    UNIT STRING,
+    CURRENCY STRING,
+    TOTAL_QUANTITY NUMBER(38,6),
+    BILLABLE_QUANTITY NUMBER(38,6),
+    COST_AMOUNT NUMBER(38,10),
+    REPORTING_COST_AMOUNT NUMBER(38,10),
+    LOAD_TS TIMESTAMP_NTZ DEFAULT CURRENT_TIMESTAMP(),
+    BATCH_ID STRING,
+    CONSTRAINT PK_FCMU PRIMARY KEY (MONTH_ID, CUSTOMER_SK, PRODUCT_ID, UNIT, CURRENCY),
+    CONSTRAINT FK_FCMU_CUST FOREIGN KEY (CUSTOMER_SK) REFERENCES DIM_CUSTOMER(CUSTOMER_SK)
+)
+CLUSTER BY (MONTH_ID, CUSTOMER_SK);
+
+-- 3.2.7 Revenue Cube
+-- Day x region x event plan x product, summed over customers from
+-- FACT_CUSTOMER_DAILY_USAGE; rebuilt for the run's day only. Serves
+-- /revenue/breakdown (and region-filtered /usage) in a few rows per day.
+CREATE TABLE IF NOT EXISTS FACT_REVENUE_CUBE (
+    DATE_ID DATE,
+    REGION STRING,
+    EVENT_PLAN_ID STRING,
+    PRODUCT_ID STRING,
+    UNIT STRING,
+    CURRENCY STRING,
+    TOTAL_QUANTITY NUMBER(38,6),
+    BILLABLE_QUANTITY NUMBER(38,6),
+    COST_AMOUNT NUMBER(38,10),
+    REPORTING_COST_AMOUNT NUMBER(38,10),
+    LOAD_TS TIMESTAMP_NTZ DEFAULT CURRENT_TIMESTAMP(),
+    BATCH_ID STRING,
+    CONSTRAINT PK_FRC PRIMARY KEY (DATE_ID, REGION, EVENT_PLAN_ID, PRODUCT_ID, UNIT, CURRENCY)
+);
+
+-- 3.2.8 Prepaid Credits (see billing/credits.py)
+-- Grants are loaded with REMAINING_AMOUNT = 0 and posted by the daily
+-- drawdown; from then on REMAINING_AMOUNT = sum of the grant's ledger entries.
+CREATE TABLE IF NOT EXISTS FACT_CREDIT_GRANTS (
+    GRANT_ID STRING PRIMARY KEY,
+    CUSTOMER_ID STRING,
+    AMOUNT NUMBER(38,10),
+    CURRENCY STRING, -- drawn by usage costed in this currency only
+    GRANTED_DATE DATE, -- first day the credits can be drawn
+    EXPIRES_DATE DATE, -- last day the credits can be drawn
+    REMAINING_AMOUNT NUMBER(38,10) DEFAULT 0,
+    POSTED_DATE DATE, -- run day of the 'grant' entry; NULL until posted
+    LOAD_TS TIMESTAMP_NTZ DEFAULT CURRENT_TIMESTAMP(),
+    UPDATED_TS TIMESTAMP_NTZ
+)
+CLUSTER BY (CUSTOMER_ID);
+
+-- Append-only; AMOUNT is signed from the customer's side (grant +, expiration,
+-- drawdown -, reversal undoes a re-run day's drawdowns).
+CREATE TABLE IF NOT EXISTS FACT_CREDIT_LEDGER (
+    ENTRY_ID STRING PRIMARY KEY,
+    DATE_ID DATE, -- the drawdown run's day
+    CUSTOMER_ID STRING,
+    CURRENCY STRING,
+    GRANT_ID STRING,
+    ENTRY_TYPE STRING, -- grant, expiration, drawdown, reversal
+    AMOUNT NUMBER(38,10),
+    BATCH_ID STRING,
+    CREATED_TS TIMESTAMP_NTZ DEFAULT CURRENT_TIMESTAMP()
+)
+CLUSTER BY (DATE_ID, CUSTOMER_ID);
+
+-- Materialized running balance: each drawdown run adds the net of its entries.
+-- Serves /customers/{id}/balance by key.
+CREATE TABLE IF NOT EXISTS FACT_CREDIT_BALANCES (
+    CUSTOMER_ID STRING,
+    CURRENCY STRING,
+    BALANCE NUMBER(38,10),
+    LAST_ENTRY_DATE DATE, -- days before this are not drawn again
+    UPDATED_TS TIMESTAMP_NTZ DEFAULT CURRENT_TIMESTAMP(),
+    CONSTRAINT PK_FCB PRIMARY KEY (CUSTOMER_ID, CURRENCY)
+)
+CLUSTER BY (CUSTOMER_ID);
+
+-- Existing deployments: dates rebuilt after this fill the reporting-currency amounts
+ALTER TABLE FACT_CUSTOMER_DAILY_USAGE ADD COLUMN IF NOT EXISTS FX_RATE NUMBER(38,12);
+ALTER TABLE FACT_CUSTOMER_DAILY_USAGE ADD COLUMN IF NOT EXISTS REPORTING_COST_AMOUNT NUMBER(38,10);
+ALTER TABLE FACT_PRODUCT_DAILY_USAGE ADD COLUMN IF NOT EXISTS REPORTING_COST_AMOUNT NUMBER(38,10);
+ALTER TABLE FACT_CUSTOMER_MONTHLY_USAGE ADD COLUMN IF NOT EXISTS REPORTING_COST_AMOUNT NUMBER(38,10);
+ALTER TABLE FACT_REVENUE_CUBE ADD COLUMN IF NOT EXISTS REPORTING_COST_AMOUNT NUMBER(38,10);
+
+-- Existing deployments: tax lines record their rule from the next close on
+ALTER TABLE FACT_INVOICE_LINE_ITEMS ADD COLUMN IF NOT EXISTS TAX_RULE_ID STRING;
+
+-- Existing deployments: base-fee lines record their plan from the next close on
+ALTER TABLE FACT_INVOICE_LINE_ITEMS ADD COLUMN IF NOT EXISTS PLAN_ID STRING;
+
+-- 3.3 Physical design (see billing/physical_design.py)
+-- Keys follow the API's filters: usage by date range + customer, invoices by
+-- customer + period, line items by invoice. ALTERs cover existing deployments.
+ALTER TABLE FACT_CUSTOMER_DAILY_USAGE CLUSTER BY (DATE_ID, CUSTOMER_SK);
+ALTER TABLE FACT_CUSTOMER_HOURLY_USAGE CLUSTER BY (DATE_ID, CUSTOMER_SK);
+ALTER TABLE FACT_CUSTOMER_MONTHLY_USAGE CLUSTER BY (MONTH_ID, CUSTOMER_SK);
+ALTER TABLE FACT_INVOICES CLUSTER BY (BILLING_PERIOD_START, CUSTOMER_SK);
+ALTER TABLE FACT_INVOICE_LINE_ITEMS CLUSTER BY (INVOICE_ID);
+ALTER TABLE FACT_CREDIT_LEDGER CLUSTER BY (DATE_ID, CUSTOMER_ID);
+ALTER TABLE FACT_CREDIT_BALANCES CLUSTER BY (CUSTOMER_ID);
+
+-- Point lookups by INVOICE_ID and STATUS filters cut across the clustering key.
+-- Search optimization requires Enterprise Edition or higher.
+ALTER TABLE FACT_INVOICES ADD SEARCH OPTIMIZATION ON EQUALITY(INVOICE_ID, STATUS);
+-- /customers/{id}/balance reads one customer's rows.
+ALTER TABLE FACT_CREDIT_BALANCES ADD SEARCH OPTIMIZATION ON EQUALITY(CUSTOMER_ID);
@@ -24,3 +24,199 @@ CREATE TABLE IF NOT EXISTS PIPELINE_RUN_AUDIT (
     ERROR_MESSAGE STRING,
     CREATED_TS TIMESTAMP_NTZ DEFAULT CURRENT_TIMESTAMP()
 );
+
+-- 4.3 Data-Quality Check Results (one row per check per run, see billing/dq.py)
+CREATE TABLE IF NOT EXISTS DQ_CHECK_RESULTS (
+    RUN_ID STRING,
+    CHECK_NAME STRING,
+    SOURCE_NAME STRING,
+    SEVERITY STRING,         -- error | warn
+    STATUS STRING,           -- pass | warn | fail
+    SCOPE VARIANT,           -- partitions (EVENT_DATEs) the scan was limited to
+    ROWS_SCANNED NUMBER,
+    FAILED_ROWS NUMBER,
+    DURATION_MS NUMBER,      -- wall time of the fused scan shared by the source's checks
+    SAMPLE VARIANT,          -- up to 5 failing rows
+    CREATED_TS TIMESTAMP_NTZ DEFAULT CURRENT_TIMESTAMP()
+);
+
+-- 4.4 Event-ID Duplicate Pre-Filter (see billing/dedup.py)
+-- One register-blocked Bloom filter per event date, stored as a file on the stage.
+CREATE STAGE IF NOT EXISTS EVENT_ID_FILTER_STAGE;
+
+CREATE TABLE IF NOT EXISTS EVENT_ID_FILTER_SHARDS (
+    SHARD_DATE DATE,
+    FILE_NAME STRING,
+    NUM_WORDS NUMBER,        -- 64-bit words in the filter
+    NUM_HASHES NUMBER,
+    ITEM_COUNT NUMBER,
+    EST_FPR FLOAT,           -- From the fraction of bits set
+    UPDATED_TS TIMESTAMP_NTZ,
+    CONSTRAINT PK_EVENT_ID_FILTER_SHARDS PRIMARY KEY (SHARD_DATE)
+);
+
+-- Per-batch routing decision and filter metrics. Silver appends rows of an
+-- unconsumed batch that are not listed in DEDUP_CANDIDATES and MERGEs the rest.
+CREATE TABLE IF NOT EXISTS DEDUP_BATCHES (
+    BATCH_ID STRING,
+    EVENTS_PROBED NUMBER,
+    FILTER_HITS NUMBER,          -- True duplicates + false positives
+    IN_BATCH_DUPLICATES NUMBER,
+    OUT_OF_WINDOW NUMBER,        -- Older than the filter window or dated after the run; always merged
+    CANDIDATES NUMBER,           -- Distinct EVENT_IDs routed to the MERGE
+    SHARDS_PROBED NUMBER,
+    FILTER_BYTES NUMBER,
+    EST_FPR FLOAT,               -- Chance an unseen ID hits any probed shard
+    PROBE_MS NUMBER,
+    SYNC_MS NUMBER,
+    MERGE_MATCHED NUMBER,        -- Rows the MERGE found already in Silver
+    MERGE_INSERTED NUMBER,
+    CONSUMED_TS TIMESTAMP_NTZ,   -- Set by the Silver stage; later re-runs merge everything
+    CREATED_TS TIMESTAMP_NTZ DEFAULT CURRENT_TIMESTAMP(),
+    CONSTRAINT PK_DEDUP_BATCHES PRIMARY KEY (BATCH_ID)
+);
+
+CREATE TABLE IF NOT EXISTS DEDUP_CANDIDATES (
+    BATCH_ID STRING,
+    EVENT_ID STRING
+)
+CLUSTER BY (BATCH_ID);
+
+-- Observed false-positive rate: filter hits that turned out not to exist in Silver
+CREATE OR REPLACE VIEW V_DEDUP_FILTER_FPR AS
+SELECT
+    BATCH_ID,
+    EVENTS_PROBED,
+    FILTER_HITS,
+    MERGE_MATCHED,
+    EST_FPR,
+    GREATEST(FILTER_HITS - MERGE_MATCHED, 0) / NULLIF(EVENTS_PROBED - MERGE_MATCHED, 0) AS OBSERVED_FPR,
+    (EVENTS_PROBED - CANDIDATES) / NULLIF(EVENTS_PROBED, 0) AS APPEND_RATIO,
+    PROBE_MS,
+    SYNC_MS,
+    CREATED_TS
+FROM DEDUP_BATCHES
+WHERE CONSUMED_TS IS NOT NULL;
+
+-- 4.5 Clustering Depth Report (one row per Gold fact per run, see billing/physical_design.py)
+CREATE TABLE IF NOT EXISTS CLUSTERING_DEPTH_REPORT (
+    RUN_ID STRING,
+    TABLE_NAME STRING,
+    CLUSTER_KEYS STRING,
+    TOTAL_PARTITIONS NUMBER,
+    CONSTANT_PARTITIONS NUMBER,  -- Partitions whose key range is a single value
+    AVERAGE_OVERLAPS FLOAT,
+    AVERAGE_DEPTH FLOAT,         -- Lower is better; 1.0 is perfectly clustered
+    DEPTH_HISTOGRAM VARIANT,
+    STATUS STRING,               -- ok | degraded
+    CREATED_TS TIMESTAMP_NTZ DEFAULT CURRENT_TIMESTAMP()
+);
+
+-- 4.6 Warehouse-side export jobs (see billing/unload.py)
+-- Directory table lets the API list unloaded files and presign them.
+CREATE STAGE IF NOT EXISTS EXPORT_STAGE
+    DIRECTORY = (ENABLE = TRUE)
+    ENCRYPTION = (TYPE = 'SNOWFLAKE_SSE');
+
+CREATE TABLE IF NOT EXISTS EXPORT_JOBS (
+    JOB_ID STRING,
+    KIND STRING,                 -- usage
+    STATUS STRING,               -- queued | running | succeeded | failed
+    PARAMS VARIANT,              -- date range and customer keys
+    STAGE_PATH STRING,           -- prefix under @EXPORT_STAGE
+    ROWS_UNLOADED NUMBER,
+    FILE_COUNT NUMBER,
+    BYTES_UNLOADED NUMBER,
+    DURATION_MS NUMBER,          -- COPY + stage refresh
+    ERROR_MESSAGE STRING,
+    CREATED_TS TIMESTAMP_NTZ DEFAULT CURRENT_TIMESTAMP(),
+    STARTED_TS TIMESTAMP_NTZ,
+    FINISHED_TS TIMESTAMP_NTZ,
+    CONSTRAINT PK_EXPORT_JOBS PRIMARY KEY (JOB_ID)
+);
+
+-- 4.7 Usage anomaly detection (see billing/anomalies.py)
+-- One row per (customer, product, unit): EWMA baseline of daily quantity,
+-- plus the baseline before the last folded day so that day can be re-run.
+CREATE TABLE IF NOT EXISTS USAGE_BASELINES (
+    CUSTOMER_ID STRING,
+    PRODUCT_ID STRING,
+    UNIT STRING,
+    EWMA_MEAN FLOAT,
+    EWMA_VAR FLOAT,
+    OBSERVATIONS NUMBER,         -- Days with usage folded in
+    LAST_DATE DATE,
+    LAST_QUANTITY FLOAT,
+    PREV_MEAN FLOAT,
+    PREV_VAR FLOAT,
+    PREV_OBSERVATIONS NUMBER,
+    PREV_DATE DATE,
+    UPDATED_TS TIMESTAMP_NTZ DEFAULT CURRENT_TIMESTAMP(),
+    CONSTRAINT PK_USAGE_BASELINES PRIMARY KEY (CUSTOMER_ID, PRODUCT_ID, UNIT)
+);
+
+-- Per-product overrides; PRODUCT_ID = '*' is the default for all products.
+CREATE TABLE IF NOT EXISTS USAGE_ANOMALY_THRESHOLDS (
+    PRODUCT_ID STRING,
+    ALPHA FLOAT,                 -- EWMA weight of the newest day
+    Z_THRESHOLD FLOAT,           -- Flag when |x - mean| >= Z_THRESHOLD * stddev ...
+    MIN_RELATIVE_CHANGE FLOAT,   -- ... and |x - mean| >= MIN_RELATIVE_CHANGE * mean
+    MIN_OBSERVATIONS NUMBER,     -- Days of baseline required before flagging
+    UPDATED_TS TIMESTAMP_NTZ DEFAULT CURRENT_TIMESTAMP(),
+    CONSTRAINT PK_USAGE_ANOMALY_THRESHOLDS PRIMARY KEY (PRODUCT_ID)
+);
+
+MERGE INTO USAGE_ANOMALY_THRESHOLDS t
+USING (SELECT '*' AS PRODUCT_ID) s ON t.PRODUCT_ID = s.PRODUCT_ID
+WHEN NOT MATCHED THEN INSERT (PRODUCT_ID, ALPHA, Z_THRESHOLD, MIN_RELATIVE_CHANGE, MIN_OBSERVATIONS)
+    VALUES ('*', 0.1, 4.0, 0.5, 7);
+
+CREATE TABLE IF NOT EXISTS USAGE_ANOMALIES (
+    DATE_ID DATE,
+    CUSTOMER_ID STRING,
+    PRODUCT_ID STRING,
+    UNIT STRING,
+    KIND STRING,                 -- spike | drop
+    QUANTITY FLOAT,
+    COST_AMOUNT NUMBER(38, 10),
+    CURRENCY STRING,
+    BASELINE_MEAN FLOAT,         -- Baseline before DATE_ID
+    BASELINE_STDDEV FLOAT,
+    Z_SCORE FLOAT,               -- NULL when the baseline had no variance
+    RELATIVE_CHANGE FLOAT,       -- (QUANTITY - BASELINE_MEAN) / BASELINE_MEAN
+    OBSERVATIONS NUMBER,
+    RUN_ID STRING,
+    CREATED_TS TIMESTAMP_NTZ DEFAULT CURRENT_TIMESTAMP()
+);
+
+-- 4.8 Tax rates resolved per invoice close (see billing/tax.py)
+-- The DIM_TAX_RULE rows in force on the period's last day, snapshotted once
+-- per close run; every invoice of the run is taxed from this snapshot.
+CREATE TABLE IF NOT EXISTS INVOICE_TAX_RATES (
+    BATCH_ID STRING,             -- Close run_id, = FACT_INVOICES.BATCH_ID
+    TAX_DATE DATE,
+    RULE_ID STRING,
+    COUNTRY STRING,
+    PRODUCT_CATEGORY STRING,     -- NULL = the country's default
+    TAX_RATE NUMBER(9,6),
+    CREATED_TS TIMESTAMP_NTZ DEFAULT CURRENT_TIMESTAMP()
+);
+
+-- 4.9 Prorated base fees per invoice close
+-- One row per customer and run of consecutive DIM_CUSTOMER versions on the
+-- same billable plan within the period, built once per close run; the
+-- invoice headers and base_fee lines are both generated from it.
+CREATE TABLE IF NOT EXISTS INVOICE_BASE_FEES (
+    BATCH_ID STRING,             -- Close run_id, = FACT_INVOICES.BATCH_ID
+    CUSTOMER_ID STRING,
+    CUSTOMER_SK NUMBER,          -- Latest version in the segment
+    PLAN_ID STRING,
+    SEGMENT_START DATE,
+    SEGMENT_END DATE,
+    DAYS_ON_PLAN NUMBER,
+    DAYS_IN_PERIOD NUMBER,
+    BASE_FEE NUMBER(38,2),       -- DIM_PLAN.BASE_FEE for a full period
+    AMOUNT NUMBER(38,2),         -- BASE_FEE * DAYS_ON_PLAN / DAYS_IN_PERIOD, rounded to cents
+    CURRENCY STRING,
+    CREATED_TS TIMESTAMP_NTZ DEFAULT CURRENT_TIMESTAMP()
+);
@@ -1,21 +1,99 @@
 -- 05_views_and_helpers.sql
 USE SCHEMA NIMBUSBILL.SILVER;
 
+-- Helper View: Validate Usage Events
+-- Parses every field with TRY_* casts and checks the usage-event data contract
+-- (docs/data_contracts.md) in one pass. ERROR_REASON lists every violated rule
+-- (comma-separated) or is NULL for a valid row. Covers both fresh Bronze rows
+-- and not-yet-replayed quarantine rows, so the Silver split and the quarantine
+-- replay apply exactly the same rules. Parquet landings (BRONZE.USAGE_EVENTS_TYPED)
+-- arrive typed and skip the parse; their RAW is rebuilt from the columns so
+-- quarantine rows and hashes look the same as for JSON rows.
+CREATE OR REPLACE VIEW V_USAGE_EVENTS_VALIDATED AS
+WITH src AS (
+    SELECT 'BRONZE' AS ORIGIN, DT, SOURCE, BATCH_ID, RAW,
+           MD5(RAW) AS QUARANTINE_HASH, NULL AS REPLAY_BATCH_ID
+    FROM NIMBUSBILL.BRONZE.USAGE_EVENTS_RAW
+    UNION ALL
+    SELECT 'QUARANTINE', DT, SOURCE, BATCH_ID, RAW,
+           RAW_HASH, REPLAY_BATCH_ID
+    FROM NIMBUSBILL.SILVER.USAGE_EVENTS_QUARANTINE
+    WHERE REPLAYED_TS IS NULL
+),
+typed AS (
+    SELECT
+        src.*,
+        NULLIF(TRIM(RAW:event_id::STRING), '') AS EVENT_ID,
+        TRY_TO_TIMESTAMP_NTZ(RAW:event_timestamp::STRING) AS EVENT_TS,
+        NULLIF(TRIM(RAW:customer_id::STRING), '') AS CUSTOMER_ID,
+        NULLIF(TRIM(RAW:product_id::STRING), '') AS PRODUCT_ID,
+        RAW:plan_id::STRING AS PLAN_ID,
+        RAW:region::STRING AS REGION,
+        NULLIF(TRIM(RAW:unit::STRING), '') AS UNIT,
+        TRY_TO_NUMBER(RAW:quantity::STRING, 38, 6) AS QUANTITY
+    FROM src
+    UNION ALL
+    SELECT
+        'BRONZE', DT, SOURCE, BATCH_ID, RAW, MD5(RAW), NULL,
+        NULLIF(TRIM(EVENT_ID), ''),
+        EVENT_TIMESTAMP,
+        NULLIF(TRIM(CUSTOMER_ID), ''),
+        NULLIF(TRIM(PRODUCT_ID), ''),
+        PLAN_ID,
+        REGION,
+        NULLIF(TRIM(UNIT), ''),
+        QUANTITY
+    FROM (
+        SELECT b.*,
+               OBJECT_CONSTRUCT(
+                   'event_id', EVENT_ID,
+                   'event_timestamp', TO_VARCHAR(EVENT_TIMESTAMP, 'YYYY-MM-DD"T"HH24:MI:SS.FF6"Z"'),
+                   'customer_id', CUSTOMER_ID, 'product_id', PRODUCT_ID, 'plan_id', PLAN_ID,
+                   'quantity', QUANTITY, 'unit', UNIT, 'region', REGION,
+                   'schema_version', SCHEMA_VERSION
+               ) AS RAW
+        FROM NIMBUSBILL.BRONZE.USAGE_EVENTS_TYPED b
+    )
+),
+known_units AS (
+    -- Product/unit pairs the rate catalog can price
+    SELECT DISTINCT PRODUCT_ID, UNIT FROM NIMBUSBILL.GOLD.DIM_PRICING_RATE
+)
+SELECT
+    t.ORIGIN,
+    t.DT,
+    t.EVENT_ID,
+    t.EVENT_TS,
+    TO_DATE(t.EVENT_TS) AS EVENT_DATE,
+    t.CUSTOMER_ID,
+    t.PRODUCT_ID,
+    t.PLAN_ID,
+    t.REGION,
+    t.UNIT,
+    t.QUANTITY,
+    t.SOURCE,
+    t.BATCH_ID,
+    t.RAW,
+    MD5(t.RAW) AS RAW_HASH,
+    t.QUARANTINE_HASH,
+    t.REPLAY_BATCH_ID,
+    NULLIF(ARRAY_TO_STRING(ARRAY_CONSTRUCT_COMPACT(
+        IFF(t.EVENT_ID IS NULL, 'missing_event_id', NULL),
+        IFF(t.EVENT_TS IS NULL, 'invalid_event_timestamp', NULL),
+        IFF(t.CUSTOMER_ID IS NULL, 'missing_customer_id', NULL),
+        IFF(t.PRODUCT_ID IS NULL, 'missing_product_id', NULL),
+        IFF(t.QUANTITY IS NULL, 'invalid_quantity', NULL),
+        IFF(t.QUANTITY < 0, 'negative_quantity', NULL),
+        IFF(t.UNIT IS NULL OR (t.PRODUCT_ID IS NOT NULL AND u.PRODUCT_ID IS NULL), 'unknown_unit', NULL)
+    ), ','), '') AS ERROR_REASON
+FROM typed t
+LEFT JOIN known_units u
+    ON u.PRODUCT_ID = t.PRODUCT_ID AND u.UNIT = t.UNIT;
+
 -- Helper View: Parse Usage Events
--- Helps flatten JSON for the MERGE statement
+-- Valid Bronze rows only; kept for ad-hoc queries.
 CREATE OR REPLACE VIEW V_USAGE_EVENTS_PARSED AS
-SELECT
-    RAW:event_id::STRING AS EVENT_ID,
-    RAW:event_timestamp::TIMESTAMP_NTZ AS EVENT_TS,
-    TO_DATE(RAW:event_timestamp::TIMESTAMP_NTZ) AS EVENT_DATE,
-    RAW:customer_id::STRING AS CUSTOMER_ID,
-    RAW:product_id::STRING AS PRODUCT_ID,
-    RAW:plan_id::STRING AS PLAN_ID,
-    RAW:region::STRING AS REGION,
-    RAW:unit::STRING AS UNIT,
-    RAW:quantity::NUMBER(38,6) AS QUANTITY,
-    SOURCE,
-    BATCH_ID,
-    MD5(RAW) AS RAW_HASH
-FROM NIMBUSBILL.BRONZE.USAGE_EVENTS_RAW
-WHERE RAW:event_id IS NOT NULL;
+SELECT EVENT_ID, EVENT_TS, EVENT_DATE, CUSTOMER_ID, PRODUCT_ID, PLAN_ID, REGION,
+       UNIT, QUANTITY, SOURCE, BATCH_ID, RAW_HASH
+FROM V_USAGE_EVENTS_VALIDATED
+WHERE ORIGIN = 'BRONZE' AND ERROR_REASON IS NULL;
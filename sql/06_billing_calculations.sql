@@ -9,12 +9,47 @@
 -----------------------------------------------------------
 -- 1. Silver Transformation (Merge/Dedupe)
 -----------------------------------------------------------
--- MERGE into USAGE_EVENTS_CLEAN
+-- Validate Bronze once and split: rows the duplicate pre-filter proved new
+-- (billing/dedup.py) go straight to USAGE_EVENTS_CLEAN, other valid rows to a
+-- session batch table for the MERGE, contract violations to quarantine
+-- (see V_USAGE_EVENTS_VALIDATED)
+CREATE OR REPLACE TEMPORARY TABLE NIMBUSBILL.SILVER.USAGE_EVENTS_BATCH LIKE NIMBUSBILL.SILVER.USAGE_EVENTS_CLEAN;
+
+BEGIN;
+
+INSERT FIRST
+    WHEN ERROR_REASON IS NULL AND IS_NEW THEN
+        INTO NIMBUSBILL.SILVER.USAGE_EVENTS_CLEAN (EVENT_ID, EVENT_TS, EVENT_DATE, CUSTOMER_ID, PRODUCT_ID, PLAN_ID, REGION, UNIT, QUANTITY, SOURCE, LOAD_TS, BATCH_ID, RAW_HASH)
+        VALUES (EVENT_ID, EVENT_TS, EVENT_DATE, CUSTOMER_ID, PRODUCT_ID, PLAN_ID, REGION, UNIT, QUANTITY, SOURCE, CURRENT_TIMESTAMP(), $BATCH_ID, RAW_HASH)
+    WHEN ERROR_REASON IS NULL THEN
+        INTO NIMBUSBILL.SILVER.USAGE_EVENTS_BATCH (EVENT_ID, EVENT_TS, EVENT_DATE, CUSTOMER_ID, PRODUCT_ID, PLAN_ID, REGION, UNIT, QUANTITY, SOURCE, BATCH_ID, RAW_HASH)
+        VALUES (EVENT_ID, EVENT_TS, EVENT_DATE, CUSTOMER_ID, PRODUCT_ID, PLAN_ID, REGION, UNIT, QUANTITY, SOURCE, $BATCH_ID, RAW_HASH)
+    WHEN NOT ALREADY_QUARANTINED THEN
+        INTO NIMBUSBILL.SILVER.USAGE_EVENTS_QUARANTINE (INGEST_TS, DT, SOURCE, ERROR_REASON, RAW, BATCH_ID, EVENT_ID, RAW_HASH)
+        VALUES (CURRENT_TIMESTAMP(), DT, SOURCE, ERROR_REASON, RAW, $BATCH_ID, EVENT_ID, RAW_HASH)
+SELECT
+    v.*,
+    q.RAW_HASH IS NOT NULL AS ALREADY_QUARANTINED,
+    (pf.BATCH_ID IS NOT NULL AND dc.EVENT_ID IS NULL
+     AND COUNT(*) OVER (PARTITION BY v.EVENT_ID) = 1) AS IS_NEW
+FROM NIMBUSBILL.SILVER.V_USAGE_EVENTS_VALIDATED v
+LEFT JOIN (SELECT DISTINCT RAW_HASH FROM NIMBUSBILL.SILVER.USAGE_EVENTS_QUARANTINE) q
+    ON q.RAW_HASH = v.RAW_HASH
+LEFT JOIN NIMBUSBILL.OPS.DEDUP_BATCHES pf
+    ON pf.BATCH_ID = v.BATCH_ID AND pf.BATCH_ID = $BATCH_ID AND pf.CONSUMED_TS IS NULL
+LEFT JOIN NIMBUSBILL.OPS.DEDUP_CANDIDATES dc
+    ON dc.BATCH_ID = v.BATCH_ID AND dc.EVENT_ID = v.EVENT_ID
+WHERE v.ORIGIN = 'BRONZE'
+  AND (v.EVENT_DATE = $PROCESS_DATE OR (v.EVENT_DATE IS NULL AND v.DT = $PROCESS_DATE));
+
+UPDATE NIMBUSBILL.OPS.DEDUP_BATCHES SET CONSUMED_TS = CURRENT_TIMESTAMP()
+WHERE BATCH_ID = $BATCH_ID AND CONSUMED_TS IS NULL;
+
+-- MERGE the remaining (possibly duplicate) rows into USAGE_EVENTS_CLEAN
 MERGE INTO NIMBUSBILL.SILVER.USAGE_EVENTS_CLEAN T
 USING (
-    SELECT * 
-    FROM NIMBUSBILL.SILVER.V_USAGE_EVENTS_PARSED 
-    WHERE EVENT_DATE = $PROCESS_DATE
+    SELECT *
+    FROM NIMBUSBILL.SILVER.USAGE_EVENTS_BATCH
     QUALIFY ROW_NUMBER() OVER (PARTITION BY EVENT_ID ORDER BY EVENT_TS DESC) = 1
 ) S
 ON T.EVENT_ID = S.EVENT_ID
@@ -27,19 +62,31 @@ WHEN NOT MATCHED THEN
     INSERT (EVENT_ID, EVENT_TS, EVENT_DATE, CUSTOMER_ID, PRODUCT_ID, PLAN_ID, REGION, UNIT, QUANTITY, SOURCE, LOAD_TS, BATCH_ID, RAW_HASH)
     VALUES (S.EVENT_ID, S.EVENT_TS, S.EVENT_DATE, S.CUSTOMER_ID, S.PRODUCT_ID, S.PLAN_ID, S.REGION, S.UNIT, S.QUANTITY, S.SOURCE, CURRENT_TIMESTAMP(), $BATCH_ID, S.RAW_HASH);
 
+-- Filter metrics: how many MERGE rows were real duplicates
+UPDATE NIMBUSBILL.OPS.DEDUP_BATCHES b
+SET MERGE_MATCHED = r."number of rows updated", MERGE_INSERTED = r."number of rows inserted"
+FROM TABLE(RESULT_SCAN(LAST_QUERY_ID(-1))) r
+WHERE b.BATCH_ID = $BATCH_ID;
+
+COMMIT;
+
 -----------------------------------------------------------
--- 2. Silver Daily Aggregate (Rolling Window)
+-- 2. Silver Hourly and Daily Aggregates
 -----------------------------------------------------------
 -- Delete existing aggregates for the process date (Idempotency)
-DELETE FROM NIMBUSBILL.SILVER.USAGE_DAILY_AGG WHERE EVENT_DATE = $PROCESS_DATE;
+DELETE FROM NIMBUSBILL.SILVER.USAGE_HOURLY_AGG WHERE EVENT_DATE = $PROCESS_DATE;
 
--- Insert aggregated usage
-INSERT INTO NIMBUSBILL.SILVER.USAGE_DAILY_AGG (EVENT_DATE, CUSTOMER_ID, PRODUCT_ID, UNIT, TOTAL_QUANTITY, EVENT_COUNT, LAST_EVENT_TS, LOAD_TS, BATCH_ID)
+-- The only scan of USAGE_EVENTS_CLEAN: events into hours, keeping region and
+-- the plan reported on the events (missing ones as 'unknown')
+INSERT INTO NIMBUSBILL.SILVER.USAGE_HOURLY_AGG (EVENT_DATE, EVENT_HOUR, CUSTOMER_ID, PRODUCT_ID, UNIT, REGION, PLAN_ID, TOTAL_QUANTITY, EVENT_COUNT, LAST_EVENT_TS, LOAD_TS, BATCH_ID)
 SELECT
     EVENT_DATE,
+    DATE_TRUNC('HOUR', EVENT_TS),
     CUSTOMER_ID,
     PRODUCT_ID,
     UNIT,
+    COALESCE(REGION, 'unknown'),
+    COALESCE(PLAN_ID, 'unknown'),
     SUM(QUANTITY),
     COUNT(*),
     MAX(EVENT_TS),
@@ -47,22 +94,45 @@ SELECT
     $BATCH_ID
 FROM NIMBUSBILL.SILVER.USAGE_EVENTS_CLEAN
 WHERE EVENT_DATE = $PROCESS_DATE
-GROUP BY 1, 2, 3, 4;
+GROUP BY 1, 2, 3, 4, 5, 6, 7;
+
+DELETE FROM NIMBUSBILL.SILVER.USAGE_DAILY_AGG WHERE EVENT_DATE = $PROCESS_DATE;
+
+-- Hours into days
+INSERT INTO NIMBUSBILL.SILVER.USAGE_DAILY_AGG (EVENT_DATE, CUSTOMER_ID, PRODUCT_ID, UNIT, REGION, PLAN_ID, TOTAL_QUANTITY, EVENT_COUNT, LAST_EVENT_TS, LOAD_TS, BATCH_ID)
+SELECT
+    EVENT_DATE,
+    CUSTOMER_ID,
+    PRODUCT_ID,
+    UNIT,
+    REGION,
+    PLAN_ID,
+    SUM(TOTAL_QUANTITY),
+    SUM(EVENT_COUNT),
+    MAX(LAST_EVENT_TS),
+    CURRENT_TIMESTAMP(),
+    $BATCH_ID
+FROM NIMBUSBILL.SILVER.USAGE_HOURLY_AGG
+WHERE EVENT_DATE = $PROCESS_DATE
+GROUP BY 1, 2, 3, 4, 5, 6;
 
 -----------------------------------------------------------
--- 3. Gold Daily Costs (Apply Pricing)
+-- 3. Gold Hourly and Daily Costs (Apply Pricing)
 -----------------------------------------------------------
 -- Delete existing Gold facts for the process date
-DELETE FROM NIMBUSBILL.GOLD.FACT_CUSTOMER_DAILY_USAGE WHERE DATE_ID = $PROCESS_DATE;
+DELETE FROM NIMBUSBILL.GOLD.FACT_CUSTOMER_HOURLY_USAGE WHERE DATE_ID = $PROCESS_DATE;
 
-INSERT INTO NIMBUSBILL.GOLD.FACT_CUSTOMER_DAILY_USAGE (
-    DATE_ID, CUSTOMER_SK, PRODUCT_ID, UNIT, TOTAL_QUANTITY, BILLABLE_QUANTITY, COST_AMOUNT, CURRENCY, RATE_SK, LOAD_TS, BATCH_ID
+INSERT INTO NIMBUSBILL.GOLD.FACT_CUSTOMER_HOURLY_USAGE (
+    DATE_ID, HOUR_TS, CUSTOMER_SK, PRODUCT_ID, UNIT, REGION, EVENT_PLAN_ID, TOTAL_QUANTITY, BILLABLE_QUANTITY, COST_AMOUNT, CURRENCY, RATE_SK, LOAD_TS, BATCH_ID
 )
 SELECT
     agg.EVENT_DATE,
+    agg.EVENT_HOUR,
     c.CUSTOMER_SK,
     agg.PRODUCT_ID,
     agg.UNIT,
+    agg.REGION,
+    agg.PLAN_ID,
     agg.TOTAL_QUANTITY,
     agg.TOTAL_QUANTITY AS BILLABLE_QUANTITY, -- Logic for tiered pricing could replace this
     (agg.TOTAL_QUANTITY * p.UNIT_PRICE) AS COST_AMOUNT,
@@ -70,12 +140,99 @@ SELECT
     p.RATE_SK,
     CURRENT_TIMESTAMP(),
     $BATCH_ID
-FROM NIMBUSBILL.SILVER.USAGE_DAILY_AGG agg
+FROM NIMBUSBILL.SILVER.USAGE_HOURLY_AGG agg
 JOIN NIMBUSBILL.GOLD.DIM_CUSTOMER c 
     ON agg.CUSTOMER_ID = c.CUSTOMER_ID 
-    AND c.IS_CURRENT = TRUE -- Simplified for daily run; strictly should check effective dates
+    -- As-of join: the customer version (and plan) in effect on the usage date
+    AND agg.EVENT_DATE >= c.EFFECTIVE_START::DATE
+    AND agg.EVENT_DATE < COALESCE(c.EFFECTIVE_END::DATE, '9999-12-31')
 JOIN NIMBUSBILL.GOLD.DIM_PRICING_RATE p 
     ON agg.PRODUCT_ID = p.PRODUCT_ID 
     AND agg.UNIT = p.UNIT 
+    AND p.PLAN_ID = c.PLAN_ID -- Customer's plan; without it every plan's rate fans out the join
     AND (agg.EVENT_DATE BETWEEN p.EFFECTIVE_FROM AND COALESCE(p.EFFECTIVE_TO, '9999-12-31'))
 WHERE agg.EVENT_DATE = $PROCESS_DATE;
+
+DELETE FROM NIMBUSBILL.GOLD.FACT_CUSTOMER_DAILY_USAGE WHERE DATE_ID = $PROCESS_DATE;
+
+-- Every hour of a day is priced at the same rate, so the daily cost is that
+-- rate applied to the summed hours (no per-hour rounding carried over).
+-- The cost is also converted into the reporting currency (USD) with the
+-- DIM_FX_RATE window covering the day; no window leaves it NULL (DQ missing_fx_rate)
+INSERT INTO NIMBUSBILL.GOLD.FACT_CUSTOMER_DAILY_USAGE (
+    DATE_ID, CUSTOMER_SK, PRODUCT_ID, UNIT, REGION, EVENT_PLAN_ID, TOTAL_QUANTITY, BILLABLE_QUANTITY, COST_AMOUNT, CURRENCY,
+    FX_RATE, REPORTING_COST_AMOUNT, RATE_SK, LOAD_TS, BATCH_ID
+)
+SELECT
+    h.DATE_ID,
+    h.CUSTOMER_SK,
+    h.PRODUCT_ID,
+    h.UNIT,
+    h.REGION,
+    h.EVENT_PLAN_ID,
+    SUM(h.TOTAL_QUANTITY),
+    SUM(h.BILLABLE_QUANTITY),
+    (SUM(h.BILLABLE_QUANTITY) * p.UNIT_PRICE) AS COST_AMOUNT,
+    p.CURRENCY,
+    IFF(p.CURRENCY = 'USD', 1, fx.RATE) AS FX_RATE,
+    (SUM(h.BILLABLE_QUANTITY) * p.UNIT_PRICE) * IFF(p.CURRENCY = 'USD', 1, fx.RATE) AS REPORTING_COST_AMOUNT,
+    p.RATE_SK,
+    CURRENT_TIMESTAMP(),
+    $BATCH_ID
+FROM NIMBUSBILL.GOLD.FACT_CUSTOMER_HOURLY_USAGE h
+JOIN NIMBUSBILL.GOLD.DIM_PRICING_RATE p ON p.RATE_SK = h.RATE_SK
+LEFT JOIN NIMBUSBILL.GOLD.DIM_FX_RATE fx
+    ON fx.CURRENCY = p.CURRENCY
+    AND fx.REPORTING_CURRENCY = 'USD'
+    AND h.DATE_ID BETWEEN fx.EFFECTIVE_FROM AND COALESCE(fx.EFFECTIVE_TO, '9999-12-31')
+WHERE h.DATE_ID = $PROCESS_DATE
+GROUP BY h.DATE_ID, h.CUSTOMER_SK, h.PRODUCT_ID, h.UNIT, h.REGION, h.EVENT_PLAN_ID, p.UNIT_PRICE, p.CURRENCY, p.RATE_SK, fx.RATE;
+
+-- Rollups the /usage planner reads (billing/usage_planner.py): all customers
+-- per product for the day, the day's month per customer (re-summed whole),
+-- and the day's region x event plan x product revenue cube
+DELETE FROM NIMBUSBILL.GOLD.FACT_PRODUCT_DAILY_USAGE WHERE DATE_ID = $PROCESS_DATE;
+
+INSERT INTO NIMBUSBILL.GOLD.FACT_PRODUCT_DAILY_USAGE (
+    DATE_ID, PRODUCT_ID, UNIT, CURRENCY, TOTAL_QUANTITY, BILLABLE_QUANTITY, COST_AMOUNT, REPORTING_COST_AMOUNT, LOAD_TS, BATCH_ID
+)
+SELECT DATE_ID, PRODUCT_ID, UNIT, CURRENCY,
+       SUM(TOTAL_QUANTITY), SUM(BILLABLE_QUANTITY), SUM(COST_AMOUNT), SUM(REPORTING_COST_AMOUNT),
+       CURRENT_TIMESTAMP(), $BATCH_ID
+FROM NIMBUSBILL.GOLD.FACT_CUSTOMER_DAILY_USAGE
+WHERE DATE_ID = $PROCESS_DATE
+GROUP BY DATE_ID, PRODUCT_ID, UNIT, CURRENCY;
+
+DELETE FROM NIMBUSBILL.GOLD.FACT_CUSTOMER_MONTHLY_USAGE WHERE MONTH_ID = DATE_TRUNC('MONTH', $PROCESS_DATE::DATE);
+
+INSERT INTO NIMBUSBILL.GOLD.FACT_CUSTOMER_MONTHLY_USAGE (
+    MONTH_ID, CUSTOMER_SK, PRODUCT_ID, UNIT, CURRENCY, TOTAL_QUANTITY, BILLABLE_QUANTITY, COST_AMOUNT, REPORTING_COST_AMOUNT, LOAD_TS, BATCH_ID
+)
+SELECT DATE_TRUNC('MONTH', DATE_ID), CUSTOMER_SK, PRODUCT_ID, UNIT, CURRENCY,
+       SUM(TOTAL_QUANTITY), SUM(BILLABLE_QUANTITY), SUM(COST_AMOUNT), SUM(REPORTING_COST_AMOUNT),
+       CURRENT_TIMESTAMP(), $BATCH_ID
+FROM NIMBUSBILL.GOLD.FACT_CUSTOMER_DAILY_USAGE
+WHERE DATE_ID BETWEEN DATE_TRUNC('MONTH', $PROCESS_DATE::DATE) AND LAST_DAY($PROCESS_DATE::DATE)
+GROUP BY 1, CUSTOMER_SK, PRODUCT_ID, UNIT, CURRENCY;
+
+DELETE FROM NIMBUSBILL.GOLD.FACT_REVENUE_CUBE WHERE DATE_ID = $PROCESS_DATE;
+
+INSERT INTO NIMBUSBILL.GOLD.FACT_REVENUE_CUBE (
+    DATE_ID, REGION, EVENT_PLAN_ID, PRODUCT_ID, UNIT, CURRENCY, TOTAL_QUANTITY, BILLABLE_QUANTITY, COST_AMOUNT, REPORTING_COST_AMOUNT, LOAD_TS, BATCH_ID
+)
+SELECT DATE_ID, REGION, EVENT_PLAN_ID, PRODUCT_ID, UNIT, CURRENCY,
+       SUM(TOTAL_QUANTITY), SUM(BILLABLE_QUANTITY), SUM(COST_AMOUNT), SUM(REPORTING_COST_AMOUNT),
+       CURRENT_TIMESTAMP(), $BATCH_ID
+FROM NIMBUSBILL.GOLD.FACT_CUSTOMER_DAILY_USAGE
+WHERE DATE_ID = $PROCESS_DATE
+GROUP BY DATE_ID, REGION, EVENT_PLAN_ID, PRODUCT_ID, UNIT, CURRENCY;
+
+-- Invariant: pricing must not multiply rows beyond the Silver aggregates (fails on violation)
+SELECT 1 / IFF(
+    (SELECT COUNT(*) FROM NIMBUSBILL.GOLD.FACT_CUSTOMER_DAILY_USAGE WHERE DATE_ID = $PROCESS_DATE)
+        > (SELECT COUNT(*) FROM NIMBUSBILL.SILVER.USAGE_DAILY_AGG WHERE EVENT_DATE = $PROCESS_DATE)
+    OR (SELECT COUNT(*) FROM NIMBUSBILL.GOLD.FACT_CUSTOMER_HOURLY_USAGE WHERE DATE_ID = $PROCESS_DATE)
+        > (SELECT COUNT(*) FROM NIMBUSBILL.SILVER.USAGE_HOURLY_AGG WHERE EVENT_DATE = $PROCESS_DATE),
+    0,
+    1
+);
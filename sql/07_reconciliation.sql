@@ -14,8 +14,10 @@ SELECT
     i.INVOICE_ID,
     i.ISSUED_TS
 FROM NIMBUSBILL.SILVER.USAGE_EVENTS_CLEAN e
+JOIN NIMBUSBILL.GOLD.DIM_CUSTOMER ic
+    ON ic.CUSTOMER_ID = e.CUSTOMER_ID -- Any SCD2 version; the invoice pins the one billed
 JOIN NIMBUSBILL.GOLD.FACT_INVOICES i 
-    ON e.CUSTOMER_ID = (SELECT CUSTOMER_ID FROM NIMBUSBILL.GOLD.DIM_CUSTOMER WHERE CUSTOMER_SK = i.CUSTOMER_SK LIMIT 1) -- Simplify for example
+    ON i.CUSTOMER_SK = ic.CUSTOMER_SK
     AND e.EVENT_DATE BETWEEN i.BILLING_PERIOD_START AND i.BILLING_PERIOD_END
 WHERE i.STATUS = 'issued'
   AND e.LOAD_TS > i.ISSUED_TS;
@@ -14,6 +14,18 @@ def _make_mock_cursor(rows: list[dict]):
     """Create a mock cursor that returns the given rows."""
     cursor = MagicMock()
     cursor.fetchall.return_value = rows
+    pending: list[dict] = []
+
+    def execute(*args, **kwargs):
+        pending[:] = rows
+
+    def fetchmany(size=1):
+        batch = pending[:size]
+        del pending[:size]
+        return batch
+
+    cursor.execute.side_effect = execute
+    cursor.fetchmany.side_effect = fetchmany
     return cursor
 
 
@@ -91,6 +103,38 @@ class TestInvoices:
         response = client.get("/invoices/nonexistent_id")
         assert response.status_code == 404
 
+    def test_invoice_totals_converted_to_reporting_currency(self, client_with_data):
+        import api.main
+        from billing.fx import FxRateCache, FxWindow
+
+        fx = FxRateCache(lambda *a: [], refresh_seconds=3600)
+        fx.load([FxWindow("EUR", 1.10, date(2023, 1, 1), date(2023, 12, 31)),
+                 FxWindow("EUR", 1.08, date(2024, 1, 1))])
+        with patch.object(api.main, "fx_rates", fx):
+            usd = client_with_data.get("/invoices").json()[0]
+            with patch("api.main.query", return_value=[{
+                "invoice_id": "inv_eur", "customer_sk": 2, "billing_period_start": date(2024, 1, 1),
+                "billing_period_end": date(2024, 1, 31), "status": "issued", "subtotal": 100.0, "tax": 0.0,
+                "total": 100.0, "currency": "EUR"}]):
+                eur = client_with_data.get("/invoices").json()[0]
+        assert usd["total_reporting"] == 125.50 and usd["reporting_currency"] == "USD"
+        assert eur["total_reporting"] == pytest.approx(108.0)
+
+    def test_invoice_pdf_renders_tax_lines(self, client):
+        header = {"invoice_id": "inv_1", "customer_sk": 1, "customer_name": "Acme", "customer_id": "cust_1",
+                  "billing_period_start": date(2024, 1, 1), "billing_period_end": date(2024, 1, 31),
+                  "status": "issued", "subtotal": 100.0, "tax": 20.0, "total": 120.0, "currency": "GBP"}
+        lines = [
+            {"line_item_id": "li_1", "line_type": "usage", "product_id": "prod_api_requests", "unit": "requests",
+             "quantity": 1e6, "unit_price": 0.0001, "amount": 100.0},
+            {"line_item_id": "li_2", "line_type": "tax", "product_id": None, "unit": None,
+             "quantity": 100.0, "unit_price": 0.2, "amount": 20.0},
+        ]
+        with patch("api.main.query", side_effect=[[header], lines]):
+            response = client.get("/invoices/inv_1/pdf")
+        assert response.status_code == 200
+        assert response.content.startswith(b"%PDF")
+
 
 # ═══════════════════════════════════════════════════════════════════════════
 # Customer endpoints
@@ -106,6 +150,41 @@ class TestCustomers:
         response = client.get("/customers/cust_1/usage")
         assert response.status_code == 200
 
+    def test_customer_usage_served_from_store(self, tmp_path):
+        import api.main
+        from billing.usage_store import UsageSeriesStore, write_store
+
+        path = str(tmp_path / "usage_series.nbus")
+        write_store([(7, "prod_api_requests", "requests", "USD", date(2024, 3, 1), 10, 0.5),
+                     (7, "prod_api_requests", "requests", "USD", date(2024, 3, 2), 20, 1.0)],
+                    path, date(2024, 1, 1), date(2024, 3, 2))
+        with patch("api.main.get_connection") as mock_conn, \
+                patch.object(api.main, "usage_store", UsageSeriesStore(path, max_age_hours=1)), \
+                patch.object(api.main.customer_keys, "sks", return_value=(7,)):
+            response = TestClient(api.main.app).get("/customers/cust_1/usage?date_from=2024-03-02")
+        assert response.status_code == 200
+        assert response.json() == [{"date_id": "2024-03-02", "product_id": "prod_api_requests", "unit": "requests",
+                                    "total_quantity": 20.0, "cost_amount": 1.0, "currency": "USD"}]
+        # Only the lifespan connectivity probe touched Snowflake.
+        assert mock_conn.return_value.cursor.return_value.fetchall.call_count == 0
+
+    def test_customer_balance_reads_materialized_row(self, client):
+        rows = [{"customer_id": "cust_1", "currency": "USD", "balance": 4250.5,
+                 "last_entry_date": date(2024, 3, 4), "updated_ts": datetime(2024, 3, 5, 2, 40)}]
+        with patch("api.main.query", return_value=rows) as mock_query:
+            response = client.get("/customers/cust_1/balance")
+        assert response.status_code == 200
+        assert response.json()[0]["balance"] == 4250.5
+        # One keyed read of the balance table, never the ledger.
+        sql, params = mock_query.call_args[0]
+        assert "FACT_CREDIT_BALANCES" in sql and "FACT_CREDIT_LEDGER" not in sql
+        assert params == {"cid": "cust_1"}
+
+    def test_customer_balance_empty_without_credits(self, client):
+        response = client.get("/customers/cust_9/balance")
+        assert response.status_code == 200
+        assert response.json() == []
+
 
 # ═══════════════════════════════════════════════════════════════════════════
 # Dashboard endpoint
@@ -116,6 +195,17 @@ class TestDashboard:
         response = client.get("/dashboard/summary")
         assert response.status_code == 200
 
+    def test_dashboard_revenue_is_in_reporting_currency(self):
+        rows = [{"TOTAL_REVENUE_MTD": 1234.5, "TOTAL_CUSTOMERS": 10, "ACTIVE_INVOICES": 3,
+                 "TOTAL_EVENTS_TODAY": 0, "AVG_DAILY_REVENUE": 41.15}]
+        with patch("api.main.get_connection") as mock_conn:
+            mock_conn.return_value = _make_mock_connection(rows)
+            from api.main import app
+            response = TestClient(app).get("/dashboard/summary")
+        assert response.json()["reporting_currency"] == "USD"
+        sql, _ = mock_conn.return_value.cursor.return_value.execute.call_args[0]
+        assert "SUM(f.REPORTING_COST_AMOUNT)" in sql and "SUM(COST_AMOUNT)" not in sql
+
 
 # ═══════════════════════════════════════════════════════════════════════════
 # Usage endpoint
@@ -131,6 +221,82 @@ class TestUsage:
         response = client.get("/usage?date_from=2024-01-01&date_to=2024-01-31")
         assert response.status_code == 200
 
+    def test_usage_hourly_grain_reads_hourly_fact(self):
+        rows = [{"DATE_ID": date(2024, 3, 5), "HOUR_TS": datetime(2024, 3, 5, 14), "PRODUCT_ID": "prod_api_requests",
+                 "UNIT": "requests", "TOTAL_QUANTITY": 1200.0, "COST_AMOUNT": 0.12, "CURRENCY": "USD"}]
+        with patch("api.main.get_connection") as mock_conn:
+            mock_conn.return_value = _make_mock_connection(rows)
+            from api.main import app
+            response = TestClient(app).get("/usage?grain=hour&date_from=2024-03-05")
+        assert response.status_code == 200
+        assert response.json()[0]["hour_ts"] == "2024-03-05T14:00:00"
+        sql, _ = mock_conn.return_value.cursor.return_value.execute.call_args[0]
+        assert "FACT_CUSTOMER_HOURLY_USAGE" in sql and "GROUP BY f.DATE_ID, f.HOUR_TS" in sql
+
+    def test_usage_monthly_grain_rolls_up_product_days(self):
+        with patch("api.main.get_connection") as mock_conn:
+            mock_conn.return_value = _make_mock_connection([])
+            from api.main import app
+            response = TestClient(app).get("/usage?grain=month")
+        assert response.status_code == 200
+        sql, _ = mock_conn.return_value.cursor.return_value.execute.call_args[0]
+        assert "FACT_PRODUCT_DAILY_USAGE" in sql and "DATE_TRUNC('MONTH', f.DATE_ID) AS DATE_ID" in sql
+
+    def test_usage_routes_customer_months_and_regions(self):
+        import api.main
+
+        with patch("api.main.get_connection") as mock_conn, \
+                patch.object(api.main.customer_keys, "sks", return_value=(7,)):
+            mock_conn.return_value = _make_mock_connection([])
+            client = TestClient(api.main.app)
+            assert client.get("/usage?grain=month&customer_id=cust_1").status_code == 200
+            sql, params = mock_conn.return_value.cursor.return_value.execute.call_args[0]
+            assert "FACT_CUSTOMER_MONTHLY_USAGE" in sql and params["sks"] == (7,)
+            assert client.get("/usage?customer_id=cust_1&region=eu-central-1").status_code == 200
+            sql, params = mock_conn.return_value.cursor.return_value.execute.call_args[0]
+            assert "FACT_CUSTOMER_DAILY_USAGE" in sql and params["region"] == "eu-central-1"
+        assert api.main.usage_planner.info()["served"]["customer_monthly"] >= 1
+
+    def test_usage_rejects_unknown_grain(self, client):
+        assert client.get("/usage?grain=week").status_code == 422
+
+
+# ═══════════════════════════════════════════════════════════════════════════
+# Revenue breakdown
+# ═══════════════════════════════════════════════════════════════════════════
+
+class TestRevenueBreakdown:
+    def test_breakdown_reads_the_cube(self):
+        rows = [{"REGION": "us-east-1", "PLAN_ID": "plan_pro", "PRODUCT_ID": "prod_api_requests", "UNIT": "requests",
+                 "CURRENCY": "USD", "REVENUE": 12.5, "TOTAL_QUANTITY": 125000.0}]
+        with patch("api.main.get_connection") as mock_conn:
+            mock_conn.return_value = _make_mock_connection(rows)
+            from api.main import app
+            response = TestClient(app).get("/revenue/breakdown?date_from=2024-01-01")
+        assert response.status_code == 200
+        assert response.json()[0]["plan_id"] == "plan_pro" and response.json()[0]["revenue"] == 12.5
+        sql, params = mock_conn.return_value.cursor.return_value.execute.call_args[0]
+        assert "FROM NIMBUSBILL.GOLD.FACT_REVENUE_CUBE" in sql
+        assert "GROUP BY REGION, EVENT_PLAN_ID, PRODUCT_ID, UNIT, CURRENCY" in sql
+        assert params == {"df": "2024-01-01"}
+
+    def test_breakdown_by_region_filtered_to_a_plan(self):
+        with patch("api.main.get_connection") as mock_conn:
+            mock_conn.return_value = _make_mock_connection([{"REGION": "eu-central-1", "CURRENCY": "EUR",
+                                                             "REVENUE": 3.0, "REPORTING_REVENUE": 3.24}])
+            from api.main import app
+            response = TestClient(app).get("/revenue/breakdown?by=region&plan_id=plan_pro")
+        assert response.status_code == 200
+        assert response.json() == [{"region": "eu-central-1", "plan_id": None, "product_id": None, "unit": None,
+                                    "total_quantity": None, "currency": "EUR", "revenue": 3.0,
+                                    "reporting_revenue": 3.24}]
+        sql, params = mock_conn.return_value.cursor.return_value.execute.call_args[0]
+        assert "GROUP BY REGION, CURRENCY ORDER BY REPORTING_REVENUE DESC" in sql and "TOTAL_QUANTITY" not in sql
+        assert "EVENT_PLAN_ID = %(event_plan_id)s" in sql and params["event_plan_id"] == "plan_pro"
+
+    def test_breakdown_rejects_unknown_dimension(self, client):
+        assert client.get("/revenue/breakdown?by=customer").status_code == 422
+
 
 # ═══════════════════════════════════════════════════════════════════════════
 # Pipeline status
@@ -151,3 +317,209 @@ class TestPricing:
     def test_pricing_returns_200(self, client):
         response = client.get("/pricing")
         assert response.status_code == 200
+
+    def test_simulate_repricing_returns_200(self, client):
+        catalog = (
+            "rate_id,product_id,plan_id,unit,unit_price,currency,effective_from,effective_to\n"
+            "rate_001,prod_api_requests,plan_pro,requests,0.00007,USD,2024-01-01,\n"
+        )
+        response = client.post(
+            "/pricing/simulate?date_from=2024-01-01&date_to=2024-03-31",
+            content=catalog,
+            headers={"Content-Type": "text/csv"},
+        )
+        assert response.status_code == 200
+        assert response.json()["delta_total"] == 0
+
+    def test_simulate_repricing_rejects_overlapping_catalog(self, client):
+        catalog = (
+            "rate_id,product_id,plan_id,unit,unit_price,currency,effective_from,effective_to\n"
+            "rate_001,prod_api_requests,plan_pro,requests,0.00007,USD,2024-01-01,\n"
+            "rate_002,prod_api_requests,plan_pro,requests,0.00006,USD,2024-02-01,\n"
+        )
+        response = client.post("/pricing/simulate", content=catalog, headers={"Content-Type": "text/csv"})
+        assert response.status_code == 422
+
+    def test_simulate_repricing_rejects_bad_input(self, client):
+        catalog = (
+            "rate_id,product_id,plan_id,unit,unit_price,currency,effective_from,effective_to\n"
+            "rate_001,prod_api_requests,plan_pro,requests,0.00007,USD,2024-01-01,\n"
+        )
+        headers = {"Content-Type": "text/csv"}
+        reversed_range = "/pricing/simulate?date_from=2024-03-31&date_to=2024-01-01"
+        assert client.post(reversed_range, content=catalog, headers=headers).status_code == 422
+        no_price = catalog.replace(",unit_price", "").replace(",0.00007", "")
+        assert client.post("/pricing/simulate", content=no_price, headers=headers).status_code == 422
+
+    def test_simulate_repricing_fills_only_the_missing_bound(self, client):
+        catalog = (
+            "rate_id,product_id,plan_id,unit,unit_price,currency,effective_from,effective_to\n"
+            "rate_001,prod_api_requests,plan_pro,requests,0.00007,USD,2024-01-01,\n"
+        )
+        with patch("api.main.default_range", return_value=(date(2024, 1, 1), date(2024, 3, 31))):
+            response = client.post(
+                "/pricing/simulate?date_from=2024-02-15", content=catalog, headers={"Content-Type": "text/csv"}
+            )
+        assert response.status_code == 200
+        assert (response.json()["date_from"], response.json()["date_to"]) == ("2024-02-15", "2024-03-31")
+
+
+# ═══════════════════════════════════════════════════════════════════════════
+# Usage anomalies
+# ═══════════════════════════════════════════════════════════════════════════
+
+class TestAnomalies:
+    def test_anomalies_returns_flags(self):
+        rows = [{
+            "DATE_ID": date(2024, 3, 5), "CUSTOMER_ID": "cust_1", "PRODUCT_ID": "prod_api_requests",
+            "UNIT": "requests", "KIND": "spike", "QUANTITY": 90000.0, "COST_AMOUNT": 9.0, "CURRENCY": "USD",
+            "BASELINE_MEAN": 1000.0, "BASELINE_STDDEV": 120.0, "Z_SCORE": 741.7, "RELATIVE_CHANGE": 89.0,
+            "OBSERVATIONS": 30,
+        }]
+        with patch("api.main.get_connection") as mock_conn:
+            mock_conn.return_value = _make_mock_connection(rows)
+            from api.main import app
+            response = TestClient(app).get("/anomalies?customer_id=cust_1&kind=spike")
+        assert response.status_code == 200
+        assert response.json()[0]["kind"] == "spike"
+        sql, params = mock_conn.return_value.cursor.return_value.execute.call_args[0]
+        assert "OPS.USAGE_ANOMALIES" in sql and params["cid"] == "cust_1" and params["kind"] == "spike"
+
+    def test_anomalies_rejects_unknown_kind(self, client):
+        assert client.get("/anomalies?kind=weird").status_code == 422
+
+
+# ═══════════════════════════════════════════════════════════════════════════
+# Invoice exports
+# ═══════════════════════════════════════════════════════════════════════════
+
+@pytest.fixture
+def client_with_export(tmp_path):
+    """Mocked rows answer both the fingerprint query and the export query."""
+    rows = [
+        {
+            "INVOICE_COUNT": 1, "HEADER_HASH": 101, "LINE_HASH": 202,
+            "INVOICE_ID": "inv_test_001", "CUSTOMER_ID": "cust_1", "CUSTOMER_NAME": "Acme Corp",
+            "BILLING_PERIOD_START": date(2024, 1, 1), "BILLING_PERIOD_END": date(2024, 1, 31),
+            "STATUS": "issued", "TOTAL": 125.5, "LINE_ITEM_ID": "li_1", "AMOUNT": 125.5,
+        }
+    ]
+    with patch("api.main.get_connection") as mock_conn:
+        mock_conn.return_value = _make_mock_connection(rows)
+        import api.main
+        with patch.object(api.main.export_cache, "root", str(tmp_path)):
+            yield TestClient(api.main.app)
+
+
+class TestExports:
+    def test_export_csv_is_gzip_with_etag(self, client_with_export):
+        import gzip
+        response = client_with_export.get("/exports/invoices?period=2024-01&format=csv")
+        assert response.status_code == 200
+        assert response.headers["etag"].startswith('"')
+        assert "invoices_2024-01.csv.gz" in response.headers["content-disposition"]
+        text = gzip.decompress(response.content).decode()
+        assert text.splitlines()[0].startswith("invoice_id,customer_id")
+        assert "inv_test_001" in text
+
+    def test_export_resumes_with_range(self, client_with_export):
+        full = client_with_export.get("/exports/invoices?period=2024-01")
+        etag = full.headers["etag"]
+        part = client_with_export.get(
+            "/exports/invoices?period=2024-01",
+            headers={"Range": "bytes=10-", "If-Range": etag},
+        )
+        assert part.status_code == 206
+        assert part.content == full.content[10:]
+
+        stale = client_with_export.get(
+            "/exports/invoices?period=2024-01",
+            headers={"Range": "bytes=10-", "If-Range": '"old-version"'},
+        )
+        assert stale.status_code == 200
+        assert stale.content == full.content
+
+    def test_export_rejects_bad_period(self, client):
+        assert client.get("/exports/invoices?period=2024-1").status_code == 422
+        assert client.get("/exports/invoices?period=2024-01&format=xlsx").status_code == 422
+
+    def test_export_empty_period_is_404(self, client):
+        assert client.get("/exports/invoices?period=2024-01").status_code == 404
+
+
+# ═══════════════════════════════════════════════════════════════════════════
+# Usage unload jobs
+# ═══════════════════════════════════════════════════════════════════════════
+
+class TestExportJobs:
+    def test_create_usage_export_is_accepted(self, client):
+        response = client.post("/exports/usage?date_from=2024-01-01&date_to=2024-01-31")
+        assert response.status_code == 202
+        body = response.json()
+        assert body["job_id"].startswith("exp_")
+        assert body["status"] == "queued"
+        assert body["params"]["date_from"] == "2024-01-01"
+
+    def test_create_usage_export_rejects_inverted_range(self, client):
+        response = client.post("/exports/usage?date_from=2024-02-01&date_to=2024-01-01")
+        assert response.status_code == 422
+
+    def test_unknown_job_is_404(self, client):
+        assert client.get("/exports/jobs/exp_missing").status_code == 404
+
+
+# ═══════════════════════════════════════════════════════════════════════════
+# Event ingestion
+# ═══════════════════════════════════════════════════════════════════════════
+
+@pytest.fixture
+def client_with_buffer(tmp_path):
+    """Events go to a buffer under tmp_path that holds at most 3 events."""
+    from billing.ingest import EventBuffer, LocalSink
+    with patch("api.main.get_connection") as mock_conn:
+        mock_conn.return_value = _make_mock_connection([])
+        import api.main
+        buffer = EventBuffer(str(tmp_path / "wal"), LocalSink(str(tmp_path / "out")), max_events=3)
+        with patch.object(api.main, "event_buffer", buffer):
+            yield TestClient(api.main.app), buffer
+
+
+def _usage_event(i, **overrides):
+    return {"event_id": f"evt_{i}", "event_timestamp": "2024-01-01T10:00:00Z", "customer_id": "cust_1",
+            "product_id": "prod_api_requests", "quantity": 3, "unit": "requests", "schema_version": "1.0",
+            **overrides}
+
+
+class TestEvents:
+    def test_single_event_is_accepted(self, client_with_buffer):
+        client, buffer = client_with_buffer
+        response = client.post("/events", json=_usage_event(1))
+        assert response.status_code == 202
+        assert response.json() == {"accepted": 1, "rejected": []}
+        assert buffer.pending == 1
+
+    def test_batch_lists_rejected_events(self, client_with_buffer):
+        client, buffer = client_with_buffer
+        response = client.post("/events", json=[_usage_event(1), _usage_event(2, quantity=-4)])
+        assert response.status_code == 202
+        assert response.json() == {"accepted": 1, "rejected": [{"index": 1, "errors": ["negative_quantity"]}]}
+
+    def test_ndjson_batch(self, client_with_buffer):
+        import json
+        client, buffer = client_with_buffer
+        body = "\n".join(json.dumps(_usage_event(i)) for i in range(2))
+        response = client.post("/events", content=body, headers={"content-type": "application/x-ndjson"})
+        assert response.json()["accepted"] == 2
+
+    def test_invalid_and_malformed_batches(self, client_with_buffer):
+        client, buffer = client_with_buffer
+        assert client.post("/events", json=[_usage_event(1, event_id=None)]).status_code == 422
+        assert client.post("/events", content=b"[{", headers={"content-type": "application/json"}).status_code == 400
+        assert buffer.pending == 0
+
+    def test_full_buffer_is_429_with_retry_after(self, client_with_buffer):
+        client, buffer = client_with_buffer
+        assert client.post("/events", json=[_usage_event(i) for i in range(3)]).status_code == 202
+        response = client.post("/events", json=_usage_event(4))
+        assert response.status_code == 429
+        assert int(response.headers["retry-after"]) >= 1
@@ -0,0 +1,1439 @@
+"""Tests for the Python-side billing modules.
+
+Covers the in-memory pricing-rate index used for previews and
+cross-checks against the warehouse SQL, the what-if repricing
+simulator built on top of it, the single-pass data-quality engine, the
+event-ID duplicate pre-filter, the Gold physical-design layer, the
+API's customer key map, bulk invoice exports, warehouse-side unload jobs,
+query coalescing, the memory-mapped usage series store, usage anomaly
+detection, the push-ingestion event buffer, Parquet landing files,
+aggregate routing for /usage, the FX rate cache, tax rule resolution and
+prepaid credit drawdown.
+"""
+import csv
+import gzip
+import json
+import os
+import tempfile
+import threading
+import time
+from datetime import date, datetime
+from decimal import Decimal
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+from billing.anomalies import Baseline, Thresholds, detect
+from billing.credits import CreditGrant, allocate, apply_drawdown, check_grants, read_grants_csv
+from billing.customer_keys import CustomerKeyMap
+from billing.dedup import BlockedBloomFilter, EventIdFilter, hash_ids, prefilter_batch
+from billing.dq import CHECKS, SOURCES, Check, DQGateError, gate, render_scan, run_checks
+from billing.ingest import BufferFull, EventBuffer, LocalSink, SnowflakeSink, parse_batch, validate_event
+from billing.landing import event_schema, landing_file, load_statements, read_events, write_parquet
+from billing.exports import ExportCache, fingerprint, parse_period, write_csv_gz
+from billing.fx import FxRateCache, FxWindow, check_windows, read_rates_csv
+from billing.physical_design import (
+    SPECS, QueryShape, clustering_report, ddl, parse_clustering_info, run_pruning_benchmark,
+)
+from billing.rating import RateIndex, RateOverlapError
+from billing.repricing import default_range, segment_starts, simulate
+from billing.singleflight import SingleFlight, flight_key, is_read
+from billing.tax import TaxLookup, TaxRule, check_rules, read_rules_csv
+from billing.unload import USAGE_COLUMNS, ExportJobs, LocalStage, SnowflakeStage, UsageExport
+from billing.usage_planner import SOURCES as USAGE_SOURCES, UsagePlanner, can_answer, plan as plan_usage
+from billing.usage_store import SeriesFile, UsageSeriesStore, publish, write_store
+from datagen.generate_pricing import generate_pricing, PRICING_RULES
+
+
+def _rate(product, plan, unit, price, eff_from, eff_to=""):
+    return {
+        "product_id": product, "plan_id": plan, "unit": unit,
+        "unit_price": price, "currency": "USD",
+        "effective_from": eff_from, "effective_to": eff_to,
+    }
+
+
+# ═══════════════════════════════════════════════════════════════════════════
+# Rate index
+# ═══════════════════════════════════════════════════════════════════════════
+
+class TestRateIndex:
+    """Test the interval index over effective-dated rates."""
+
+    @pytest.fixture
+    def index(self):
+        return RateIndex([
+            _rate("prod_api_requests", "plan_pro", "requests", 0.0001, "2024-01-01", "2024-03-31"),
+            _rate("prod_api_requests", "plan_pro", "requests", 0.00008, "2024-04-01"),
+            _rate("prod_api_requests", "plan_starter", "requests", 0.0002, "2024-01-01"),
+            _rate("prod_storage_gb", "plan_pro", "gb_month", 0.08, "2024-01-01"),
+        ])
+
+    def test_lookup_picks_window_covering_date(self, index):
+        assert index.lookup("prod_api_requests", "plan_pro", "requests", "2024-03-31")["unit_price"] == 0.0001
+        assert index.lookup("prod_api_requests", "plan_pro", "requests", date(2024, 4, 1))["unit_price"] == 0.00008
+
+    def test_lookup_is_plan_aware(self, index):
+        """Each plan resolves to its own rate instead of fanning out."""
+        assert index.lookup("prod_api_requests", "plan_starter", "requests", "2024-02-01")["unit_price"] == 0.0002
+
+    def test_lookup_outside_any_window_returns_none(self, index):
+        assert index.lookup("prod_api_requests", "plan_pro", "requests", "2023-12-31") is None
+        assert index.lookup("prod_ai_tokens", "plan_pro", "tokens", "2024-02-01") is None
+
+    def test_batch_rating_matches_scalar_lookup(self, index):
+        products = ["prod_api_requests", "prod_api_requests", "prod_storage_gb", "prod_ai_tokens"]
+        plans = ["plan_pro", "plan_pro", "plan_pro", "plan_pro"]
+        units = ["requests", "requests", "gb_month", "tokens"]
+        dates = ["2024-02-15", "2024-05-01", "2024-02-15", "2024-02-15"]
+        qty = [1000, 1000, 10, 50]
+
+        rated = index.rate(products, plans, units, dates, qty)
+
+        np.testing.assert_allclose(rated.cost, [0.1, 0.08, 0.8, 0.0])
+        assert rated.unpriced.tolist() == [False, False, False, True]
+        assert rated.currency[0] == "USD"
+
+    def test_overlapping_windows_rejected(self):
+        with pytest.raises(RateOverlapError):
+            RateIndex([
+                _rate("prod_api_requests", "plan_pro", "requests", 0.0001, "2024-01-01", "2024-06-30"),
+                _rate("prod_api_requests", "plan_pro", "requests", 0.00008, "2024-06-30"),
+            ])
+
+    def test_open_ended_window_overlaps_later_window(self):
+        with pytest.raises(RateOverlapError):
+            RateIndex([
+                _rate("prod_api_requests", "plan_pro", "requests", 0.0001, "2024-01-01"),
+                _rate("prod_api_requests", "plan_pro", "requests", 0.00008, "2024-06-01"),
+            ])
+
+    def test_loads_generated_catalog(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            generate_pricing(tmpdir)
+            index = RateIndex.from_csv(os.path.join(tmpdir, "pricing_catalog.csv"))
+        assert len(index) == len(PRICING_RULES)
+
+    def test_empty_index_rates_nothing(self):
+        rated = RateIndex([]).rate(["prod_api_requests"], ["plan_pro"], ["requests"], ["2024-01-01"], [5])
+        assert rated.unpriced.all()
+        assert rated.cost.tolist() == [0.0]
+
+
+# ═══════════════════════════════════════════════════════════════════════════
+# What-if repricing
+# ═══════════════════════════════════════════════════════════════════════════
+
+class TestRepricing:
+    """Test the segment-based repricing simulator."""
+
+    @pytest.fixture
+    def baseline(self):
+        return RateIndex([
+            _rate("prod_api_requests", "plan_pro", "requests", 0.0001, "2024-01-01"),
+            _rate("prod_storage_gb", "plan_pro", "gb_month", 0.08, "2024-01-01"),
+        ])
+
+    @pytest.fixture
+    def candidate(self):
+        return RateIndex([
+            _rate("prod_api_requests", "plan_pro", "requests", 0.0001, "2024-01-01", "2024-02-14"),
+            _rate("prod_api_requests", "plan_pro", "requests", 0.0002, "2024-02-15"),
+            _rate("prod_storage_gb", "plan_pro", "gb_month", 0.08, "2024-01-01"),
+        ])
+
+    def test_segment_starts_split_on_any_window_change(self, baseline, candidate):
+        starts = segment_starts(date(2024, 1, 1), date(2024, 3, 31), baseline, candidate)
+        assert starts == [date(2024, 1, 1), date(2024, 2, 15)]
+
+    def test_simulate_reports_customer_and_product_deltas(self, baseline, candidate):
+        chunks = [
+            [
+                {"segment_start": date(2024, 1, 1), "customer_id": "cust_1", "plan_id": "plan_pro",
+                 "product_id": "prod_api_requests", "unit": "requests", "total_quantity": 1000},
+                {"segment_start": date(2024, 2, 15), "customer_id": "cust_1", "plan_id": "plan_pro",
+                 "product_id": "prod_api_requests", "unit": "requests", "total_quantity": 1000},
+            ],
+            [
+                {"segment_start": date(2024, 2, 15), "customer_id": "cust_2", "plan_id": "plan_pro",
+                 "product_id": "prod_storage_gb", "unit": "gb_month", "total_quantity": 10},
+            ],
+        ]
+        result = simulate(chunks, baseline, candidate)
+
+        assert result.rows_rated == 3
+        assert result.baseline_total == pytest.approx(0.2 + 0.8)
+        assert result.candidate_total == pytest.approx(0.3 + 0.8)
+        top = result.customer_deltas(top=1)[0]
+        assert top["customer_id"] == "cust_1"
+        assert top["delta"] == pytest.approx(0.1)
+        products = {r["product_id"]: r["delta"] for r in result.product_deltas()}
+        assert products["prod_storage_gb"] == pytest.approx(0.0)
+
+    def test_default_range_is_previous_quarter(self):
+        assert default_range(date(2024, 5, 20)) == (date(2024, 1, 1), date(2024, 3, 31))
+        assert default_range(date(2024, 1, 2)) == (date(2023, 10, 1), date(2023, 12, 31))
+
+
+# ═══════════════════════════════════════════════════════════════════════════
+# Data-quality engine
+# ═══════════════════════════════════════════════════════════════════════════
+
+class _FakeCursor:
+    """Returns canned fused-scan rows and records every statement."""
+
+    def __init__(self, scan_rows):
+        self.scan_rows = list(scan_rows)
+        self.statements = []
+
+    def execute(self, sql, params=None):
+        self.statements.append((sql, params))
+
+    def fetchone(self):
+        return self.scan_rows.pop(0)
+
+
+@pytest.fixture
+def warehouse():
+    """Empty NIMBUSBILL schema on embedded DuckDB (the benchmark's LocalBackend)."""
+    pytest.importorskip("duckdb")
+    from scripts.bench_backends import LocalBackend
+
+    backend = LocalBackend(date(2024, 1, 31))
+    yield backend
+    backend.close()
+
+
+class TestDataQuality:
+    """Test check fusion, partition scoping and severity gating."""
+
+    def test_one_scan_per_source_scoped_to_partitions(self):
+        checks = [c for c in CHECKS if c.source == "silver_events"]
+        sql = render_scan(SOURCES["silver_events"], checks, [date(2024, 1, 16), date(2024, 1, 15)])
+        assert "FROM NIMBUSBILL.SILVER.USAGE_EVENTS_CLEAN e" in sql
+        assert "WHERE e.EVENT_DATE IN ('2024-01-15'::DATE, '2024-01-16'::DATE)" in sql
+        for i in range(len(checks)):
+            assert f"COUNT_IF(F{i}) AS FAILED_{i}" in sql
+
+    def test_duplicate_ids_are_looked_up_outside_the_touched_dates(self):
+        check = next(c for c in CHECKS if c.name == "duplicate_event_id")
+        sql = render_scan(SOURCES["silver_events"], [check], [date(2024, 1, 15)])
+        assert "WHERE o.EVENT_DATE NOT IN ('2024-01-15'::DATE)" in sql
+        assert "elsewhere.EVENT_ID IS NOT NULL" in check.condition
+
+    def test_invoice_scope_uses_billing_months(self):
+        checks = [c for c in CHECKS if c.source == "gold_invoices"]
+        sql = render_scan(SOURCES["gold_invoices"], checks, [date(2024, 1, 31), date(2024, 2, 1)])
+        assert "BILLING_PERIOD_START IN ('2024-01-01'::DATE, '2024-02-01'::DATE)" in sql
+
+    def test_taxed_invoice_passes_the_invoice_checks(self, warehouse):
+        warehouse.execute("""
+            INSERT INTO NIMBUSBILL.GOLD.FACT_INVOICES (INVOICE_ID, BILLING_PERIOD_START, SUBTOTAL, TAX, TOTAL)
+            VALUES ('inv_ok', '2024-01-01', 100, 20, 120), ('inv_bad', '2024-01-01', 100, 0, 100)
+        """)
+        warehouse.execute("""
+            INSERT INTO NIMBUSBILL.GOLD.FACT_INVOICE_LINE_ITEMS (INVOICE_ID, LINE_ITEM_ID, LINE_TYPE, AMOUNT)
+            VALUES ('inv_ok', 'l1', 'usage', 90), ('inv_ok', 'l2', 'adjustment', 10), ('inv_ok', 'l3', 'tax', 20),
+                   ('inv_bad', 'l4', 'usage', 100), ('inv_bad', 'l5', 'tax', 20)
+        """)
+        checks = [c for c in CHECKS if c.source == "gold_invoices"]
+        relation = SOURCES["gold_invoices"].relation.format(months="'2024-01-01'::DATE")
+        flags = ", ".join(f"{c.condition} AS {c.name}" for c in checks)
+        rows = warehouse.execute(f"SELECT i.INVOICE_ID, {flags} {relation} ORDER BY 1")
+
+        assert [c.name for c in checks] == [
+            "invoice_subtotal_mismatch", "invoice_tax_mismatch", "invoice_total_mismatch"]
+        # The untaxed header of inv_bad fails on TAX and TOTAL; its SUBTOTAL is right.
+        assert rows == [("inv_bad", False, True, True), ("inv_ok", False, False, False)]
+
+    def test_results_recorded_and_warnings_pass_gate(self):
+        cursor = _FakeCursor([(100, 0, None, 3, '[{"CUSTOMER_ID": "cust_1"}]')])
+        results = run_checks(cursor, "run_1", [date(2024, 1, 15)], sources=["silver_daily_agg"])
+
+        assert [r.status for r in results] == ["pass", "warn"]
+        assert results[1].samples == [{"CUSTOMER_ID": "cust_1"}]
+        inserts = [p for sql, p in cursor.statements if "DQ_CHECK_RESULTS" in sql]
+        assert [p["check"] for p in inserts] == ["unknown_customer", "unpriced_usage"]
+        assert inserts[1]["failed"] == 3
+        gate(results)
+
+    def test_error_severity_failure_blocks(self):
+        cursor = _FakeCursor([(10, 2, "[]", 0, None, 0, None)])
+        results = run_checks(cursor, "run_1", [date(2024, 1, 15)], sources=["silver_events"])
+        with pytest.raises(DQGateError, match="duplicate_event_id"):
+            gate(results)
+
+    def test_unknown_severity_rejected(self):
+        bad = Check("x", "silver_events", "FALSE", severity="critical")
+        with pytest.raises(ValueError):
+            run_checks(_FakeCursor([]), "run_1", [date(2024, 1, 15)], checks=[bad])
+
+
+# ═══════════════════════════════════════════════════════════════════════════
+# Duplicate pre-filter
+# ═══════════════════════════════════════════════════════════════════════════
+
+class _FilterCursor:
+    """Warehouse stand-in for prefilter_batch: one persisted shard, no new Silver rows."""
+
+    def __init__(self, shards):
+        self.shards = shards  # date -> BlockedBloomFilter
+        self.statements = []
+        self._one, self._all = None, []
+
+    def execute(self, sql, params=None):
+        sql = " ".join(sql.split())
+        self.statements.append((sql, params))
+        self._one, self._all = None, []
+        if sql.startswith("SELECT LAST_INGEST_TS"):
+            self._one = (datetime(2024, 1, 10, 3),)
+        elif sql.startswith("SELECT SHARD_DATE"):
+            start = (params or {}).get("start")
+            self._all = [(d,) for d in self.shards if start is None or d < start]
+        elif sql.startswith("GET"):
+            day = next(d for d in self.shards if d.isoformat() in sql)
+            with open(os.path.join(sql.split("file://")[1], f"shard_{day.isoformat()}.bloom"), "wb") as f:
+                f.write(self.shards[day].to_bytes())
+        elif sql.startswith("DELETE FROM NIMBUSBILL.OPS.EVENT_ID_FILTER_SHARDS"):
+            for d in [d for d in self.shards if d < params["start"]]:
+                del self.shards[d]
+
+    def fetchone(self):
+        return self._one
+
+    def fetchall(self):
+        return self._all
+
+    def fetchmany(self, size):
+        return []
+
+
+class TestDedupFilter:
+    """Test the blocked Bloom filter and the per-date routing decision."""
+
+    def test_no_false_negatives_and_fpr_near_target(self):
+        bloom = BlockedBloomFilter.for_capacity(20_000, fpr=0.01)
+        stored = [f"evt_{i}" for i in range(20_000)]
+        bloom.add(*hash_ids(stored))
+
+        assert bloom.contains(*hash_ids(stored)).all()
+        fresh_hits = bloom.contains(*hash_ids([f"new_{i}" for i in range(50_000)])).mean()
+        assert fresh_hits < 0.02
+        assert bloom.estimated_fpr() == pytest.approx(fresh_hits, abs=0.005)
+
+    def test_serialization_round_trip(self):
+        bloom = BlockedBloomFilter.for_capacity(1_000)
+        bloom.add(*hash_ids(["a", "b"]))
+        restored = BlockedBloomFilter.from_bytes(bloom.to_bytes())
+        assert restored.item_count == 2
+        assert restored.contains(*hash_ids(["a", "b"])).all()
+        np.testing.assert_array_equal(restored.words, bloom.words)
+
+    def test_probe_routes_only_possible_duplicates_to_merge(self):
+        flt = EventIdFilter(window_days=7, min_capacity=1_000)
+        flt.add(["seen_1", "seen_2"], [date(2024, 1, 15), date(2024, 1, 14)])
+
+        ids = ["seen_1", "seen_2", "fresh_1", "fresh_2", "fresh_2", "fresh_3", "fresh_4"]
+        days = [date(2024, 1, 15), date(2024, 1, 15), date(2024, 1, 15), date(2024, 1, 15),
+                date(2024, 1, 15), date(2024, 1, 1), None]
+        result = flt.probe(ids, days, as_of=date(2024, 1, 15))
+
+        # seen_2 is on the neighbouring date; fresh_2 repeats; fresh_3 is older
+        # than the window; fresh_4 has no usable date.
+        assert result.candidates.tolist() == [True, True, False, True, True, True, True]
+        assert result.in_batch_duplicates == 2
+        assert result.out_of_window == 2
+        assert result.new_rows == 1
+
+    def test_redelivery_with_a_shifted_date_is_still_a_candidate(self):
+        flt = EventIdFilter(window_days=30, min_capacity=1_000)
+        flt.add(["evt_orig", "evt_late"], [date(2024, 1, 2), date(2024, 1, 20)])
+
+        # Redelivered 12 days later and 5 days earlier than originally dated.
+        result = flt.probe(["evt_orig", "evt_late", "fresh"],
+                           [date(2024, 1, 14), date(2024, 1, 15), date(2024, 1, 14)], as_of=date(2024, 1, 15))
+        assert result.candidates.tolist() == [True, True, False]
+        # The shard dated after as_of is probed too.
+        assert result.shards_probed == 2
+        assert flt.shard_fpr == pytest.approx(1 - (1 - flt.fpr) ** (1 / 31))
+
+    def test_future_dated_event_neither_expires_shards_nor_skips_the_merge(self, tmp_path):
+        shard = BlockedBloomFilter.for_capacity(1_000)
+        shard.add(*hash_ids(["evt_loaded"]))
+        cursor = _FilterCursor({date(2024, 1, 9): shard})
+        events = [{"event_id": "evt_loaded", "event_timestamp": "2024-01-10T08:00:00Z"},
+                  {"event_id": "evt_future", "event_timestamp": "2099-01-01T00:00:00Z"},
+                  {"event_id": "evt_fresh", "event_timestamp": "2024-01-10T09:00:00Z"}]
+
+        result = prefilter_batch(cursor, "run_1", events, str(tmp_path), date(2024, 1, 10))
+
+        # The 2099 row goes through the MERGE, and the window still ends at the run date.
+        assert result.candidates.tolist() == [True, True, False]
+        assert result.out_of_window == 1
+        assert date(2024, 1, 9) in cursor.shards
+        assert not any(sql.startswith("REMOVE") for sql, _ in cursor.statements)
+
+    def test_shards_load_lazily_and_expire(self):
+        loaded = []
+        stored = BlockedBloomFilter.for_capacity(1_000)
+        stored.add(*hash_ids(["old_evt"]))
+
+        def loader(day):
+            loaded.append(day)
+            return stored if day == date(2024, 1, 10) else None
+
+        flt = EventIdFilter(window_days=3, loader=loader)
+        result = flt.probe(["old_evt"], [date(2024, 1, 10)], as_of=date(2024, 1, 10))
+        assert result.candidates.tolist() == [True]
+        # Every date of the window is looked up once; missing shards are remembered.
+        assert sorted(loaded) == [date(2024, 1, 7), date(2024, 1, 8), date(2024, 1, 9), date(2024, 1, 10)]
+        flt.probe(["x"], [date(2024, 1, 10)], as_of=date(2024, 1, 10))
+        assert len(loaded) == 4
+        assert flt.expire(date(2024, 1, 20)) == [date(2024, 1, 10)]
+
+
+# ═══════════════════════════════════════════════════════════════════════════
+# Physical design
+# ═══════════════════════════════════════════════════════════════════════════
+
+class _ProfileCursor:
+    """Answers fetchone/fetchall from queues and hands out query IDs."""
+
+    def __init__(self, one=(), many=()):
+        self.one = list(one)
+        self.many = list(many)
+        self.statements = []
+        self.sfqid = None
+
+    def execute(self, sql, params=None):
+        self.statements.append((sql, params))
+        self.sfqid = f"q{len(self.statements)}"
+
+    def fetchone(self):
+        return self.one.pop(0)
+
+    def fetchall(self):
+        return self.many.pop(0)
+
+
+class TestPhysicalDesign:
+    """Test the declared keys, the depth report and pruning accounting."""
+
+    def test_keys_follow_api_filters(self):
+        keys = {s.table.split(".")[-1]: s.keys for s in SPECS}
+        assert keys["FACT_CUSTOMER_DAILY_USAGE"] == ("DATE_ID", "CUSTOMER_SK")
+        assert keys["FACT_INVOICE_LINE_ITEMS"] == ("INVOICE_ID",)
+        invoices = next(s for s in SPECS if s.table.endswith("FACT_INVOICES"))
+        assert ddl(invoices)[-1].endswith("ON EQUALITY(INVOICE_ID, STATUS)")
+
+    def test_depth_report_flags_degraded_tables(self):
+        info = {"total_partition_count": 120, "total_constant_partition_count": 4,
+                "average_overlaps": 9.5, "average_depth": 7.25,
+                "partition_depth_histogram": {"00008": 40}}
+        cursor = _ProfileCursor(one=[(json.dumps(info),)])
+        (health,) = clustering_report(cursor, "run_1", specs=SPECS[:1])
+
+        assert health.status == "degraded"
+        assert parse_clustering_info(SPECS[0], info, max_depth=8).status == "ok"
+        insert_params = cursor.statements[1][1]
+        assert insert_params["keys"] == "(DATE_ID, CUSTOMER_SK)"
+        assert insert_params["depth"] == 7.25 and insert_params["status"] == "degraded"
+
+    def test_pruning_ratio_summed_over_samples(self):
+        shape = QueryShape("by_invoice", "SELECT 1 WHERE INVOICE_ID = %(iid)s", ("iid",), "SAMPLE {n}")
+        scan = [("NIMBUSBILL.GOLD.FACT_INVOICE_LINE_ITEMS", 1, 50, 1024)]
+        cursor = _ProfileCursor(many=[[("inv_1",), ("inv_2",)], [], scan, [], scan])
+        (result,) = run_pruning_benchmark(cursor, [shape], samples=2)
+
+        assert cursor.statements[0][0] == "ALTER SESSION SET USE_CACHED_RESULT = FALSE"
+        assert [p for sql, p in cursor.statements if sql == shape.sql] == [{"iid": "inv_1"}, {"iid": "inv_2"}]
+        # Operator stats are read for the replayed query, not the stats query.
+        assert cursor.statements[3][1] == {"qid": "q3"}
+        assert result.runs == 2
+        assert result.tables["FACT_INVOICE_LINE_ITEMS"] == [2, 100, 2048]
+        assert result.pruning_ratio("FACT_INVOICE_LINE_ITEMS") == pytest.approx(0.98)
+
+
+# ═══════════════════════════════════════════════════════════════════════════
+# Customer key map
+# ═══════════════════════════════════════════════════════════════════════════
+
+class _Dim:
+    """DIM_CUSTOMER stand-in answering the key map's queries."""
+
+    def __init__(self, versions):
+        self.versions = list(versions)  # (customer_sk, customer_id)
+        self.calls = []
+
+    def __call__(self, sql, params=None):
+        self.calls.append(sql)
+        if "COUNT(*)" in sql:
+            return [{"row_count": len(self.versions), "max_sk": max(sk for sk, _ in self.versions)}]
+        if "LISTAGG" in sql:
+            by_id = {}
+            for sk, cid in sorted(self.versions):
+                by_id.setdefault(cid, []).append(str(sk))
+            rows = sorted(by_id.items(), key=lambda kv: -int(kv[1][-1]))[: params["n"]]
+            return [{"customer_id": cid, "sks": ",".join(sks)} for cid, sks in rows]
+        if "CUSTOMER_SK > " in sql:
+            return [{"customer_id": cid, "customer_sk": sk} for sk, cid in sorted(self.versions) if sk > params["sk"]]
+        if "CUSTOMER_ID = " in sql:
+            return [{"customer_sk": sk} for sk, cid in sorted(self.versions) if cid == params["cid"]]
+        return [{"customer_id": cid} for sk, cid in self.versions if sk == params["sk"]]
+
+
+class TestCustomerKeyMap:
+    """Test SCD2 key sets, LRU bounds and refresh on dimension changes."""
+
+    def test_warm_holds_every_version_and_evicts_least_recent(self):
+        dim = _Dim([(1, "cust_a"), (2, "cust_b"), (3, "cust_a"), (4, "cust_c")])
+        keys = CustomerKeyMap(dim, capacity=2, refresh_seconds=60, clock=lambda: 0.0)
+
+        assert keys.warm() == 2  # cust_c and cust_a changed most recently
+        assert keys.sks("cust_a") == (1, 3)
+        assert keys.customer_id(3) == "cust_a"
+        assert keys.stats.hits == 2
+
+        assert keys.sks("cust_b") == (2,)  # miss evicts cust_c, the least recently used
+        assert keys.stats.misses == 1 and keys.stats.evictions == 1
+        assert keys.customer_id(4) == "cust_c"
+        assert len(keys) == 2
+
+    def test_unknown_id_is_cached_until_dimension_changes(self):
+        now = [0.0]
+        dim = _Dim([(1, "cust_a")])
+        keys = CustomerKeyMap(dim, capacity=10, refresh_seconds=60, clock=lambda: now[0])
+        keys.warm()
+
+        assert keys.sks("cust_new") == ()
+        assert keys.sks("cust_new") == ()
+        assert keys.stats.misses == 1
+
+        dim.versions.append((2, "cust_new"))
+        now[0] = 30.0
+        assert keys.sks("cust_new") == ()  # not probed again yet
+        now[0] = 61.0
+        assert keys.sks("cust_new") == (2,)
+        assert keys.stats.refreshes == 2
+
+    def test_unchanged_dimension_is_not_reloaded(self):
+        now = [0.0]
+        dim = _Dim([(1, "cust_a")])
+        keys = CustomerKeyMap(dim, capacity=10, refresh_seconds=60, clock=lambda: now[0])
+        keys.warm()
+        now[0] = 120.0
+        assert keys.maybe_refresh() is False
+        assert sum("LISTAGG" in sql for sql in dim.calls) == 1
+
+    def test_changes_are_topped_up_without_a_rebuild(self):
+        now = [0.0]
+        dim = _Dim([(1, "cust_a"), (2, "cust_b")])
+        keys = CustomerKeyMap(dim, capacity=10, refresh_seconds=60, clock=lambda: now[0])
+        keys.warm()
+
+        dim.versions += [(3, "cust_a"), (4, "cust_c")]
+        now[0] = 61.0
+        assert keys.sks("cust_a") == (1, 3)
+        assert keys.customer_id(3) == "cust_a"
+        assert "cust_c" not in keys._by_id  # uncached IDs load in full on a miss
+        assert keys.sks("cust_c") == (4,)
+        assert sum("LISTAGG" in sql for sql in dim.calls) == 1
+
+        dim.versions = [(2, "cust_b"), (3, "cust_a"), (4, "cust_c"), (5, "cust_d")]  # sk 1 deleted
+        now[0] = 122.0
+        assert keys.sks("cust_a") == (3,)
+        assert keys.stats.refreshes == 3
+
+
+# ═══════════════════════════════════════════════════════════════════════════
+# Invoice exports
+# ═══════════════════════════════════════════════════════════════════════════
+
+def _export_rows():
+    return [
+        {"invoice_id": "inv_1", "customer_id": "cust_a", "billing_period_start": date(2024, 1, 1),
+         "status": "issued", "total": 10.5, "line_item_id": "li_1", "amount": 10.5},
+        {"invoice_id": "inv_2", "customer_id": "cust_b", "billing_period_start": date(2024, 1, 1),
+         "status": "issued", "total": 0, "line_item_id": None, "amount": None},
+    ]
+
+
+class TestExports:
+    """Test period parsing, versioning and the on-disk artifact cache."""
+
+    def test_parse_period(self):
+        assert parse_period("2024-02") == date(2024, 2, 1)
+        for bad in ("2024-2", "2024-13", "202402", "24-02"):
+            with pytest.raises(ValueError):
+                parse_period(bad)
+
+    def test_fingerprint_tracks_contents(self):
+        row = {"invoice_count": 2, "header_hash": 11, "line_hash": 22}
+        assert fingerprint({"invoice_count": 0}) is None
+        assert fingerprint(row) == fingerprint(dict(row))
+        assert fingerprint(row) != fingerprint({**row, "line_hash": 23})
+
+    def test_csv_is_one_row_per_line_item(self):
+        with tempfile.TemporaryDirectory() as d:
+            path = os.path.join(d, "out.csv.gz")
+            assert write_csv_gz(iter([_export_rows()[:1], _export_rows()[1:]]), path) == 2
+            with gzip.open(path, "rt", newline="") as f:
+                rows = list(csv.DictReader(f))
+        assert [r["invoice_id"] for r in rows] == ["inv_1", "inv_2"]
+        assert rows[1]["line_item_id"] == "" and rows[0]["amount"] == "10.5"
+
+    def test_cache_builds_once_per_version_and_drops_stale(self):
+        builds = []
+
+        def fetch():
+            builds.append(1)
+            return iter([_export_rows()])
+
+        with tempfile.TemporaryDirectory() as d:
+            cache = ExportCache(d)
+            v1 = cache.get_or_build("2024-01", "csv", "aaaa", fetch)
+            assert cache.get_or_build("2024-01", "csv", "aaaa", fetch) == v1
+            assert len(builds) == 1
+
+            v2 = cache.get_or_build("2024-01", "csv", "bbbb", fetch)
+            assert len(builds) == 2
+            assert sorted(os.listdir(d)) == [os.path.basename(v2)]
+
+    def test_failed_build_leaves_no_artifact(self):
+        def fetch():
+            yield _export_rows()
+            raise RuntimeError("warehouse went away")
+
+        with tempfile.TemporaryDirectory() as d:
+            with pytest.raises(RuntimeError):
+                ExportCache(d).get_or_build("2024-01", "csv", "aaaa", fetch)
+            assert os.listdir(d) == []
+
+    def test_parquet_round_trip(self):
+        pq = pytest.importorskip("pyarrow.parquet")
+        from billing.exports import write_parquet
+
+        with tempfile.TemporaryDirectory() as d:
+            path = os.path.join(d, "out.parquet")
+            assert write_parquet(iter([_export_rows()]), path) == 2
+            table = pq.read_table(path)
+        assert table.num_rows == 2
+        assert str(table.column("amount")[0].as_py()) == "10.5000000000"
+
+
+# ═══════════════════════════════════════════════════════════════════════════
+# Warehouse-side unload jobs
+# ═══════════════════════════════════════════════════════════════════════════
+
+class _Recorder:
+    """query() stand-in: records statements, answers with canned rows by keyword."""
+
+    def __init__(self, answers=None):
+        self.answers = answers or {}
+        self.calls = []
+
+    def __call__(self, sql, params=None):
+        self.calls.append((sql, params))
+        return next((rows for key, rows in self.answers.items() if key in sql), [])
+
+
+def _usage_row(day, customer, qty):
+    return {"date_id": day, "customer_id": customer, "product_id": "prod_api_requests",
+            "unit": "requests", "region": "us-east-1", "event_plan_id": "plan_pro",
+            "total_quantity": qty, "billable_quantity": qty, "cost_amount": qty * 0.0001, "currency": "USD"}
+
+
+class TestUnload:
+    """Test the COPY statement, the local stage layout and job bookkeeping."""
+
+    def test_export_scope(self):
+        with pytest.raises(ValueError):
+            UsageExport(date(2024, 2, 1), date(2024, 1, 1))
+        everyone = UsageExport(date(2024, 1, 1), date(2024, 1, 31))
+        one = UsageExport(date(2024, 1, 1), date(2024, 1, 31), (3, 7))
+        assert "CUSTOMER_SK IN" not in everyone.select_sql() and "sks" not in everyone.params()
+        assert "CUSTOMER_SK IN (%(sks)s)" in one.select_sql() and one.params()["sks"] == (3, 7)
+
+    def test_snowflake_stage_unloads_partitioned_parquet(self):
+        fetch = _Recorder({
+            "COPY INTO": [{"rows_unloaded": 1200, "output_bytes": 4096}],
+            "DIRECTORY(": [{"path": "usage/j1/date=2024-01-01/customer=a/data_0_0_0.snappy.parquet", "size": 4096}],
+        })
+        result = SnowflakeStage(fetch).unload("j1", UsageExport(date(2024, 1, 1), date(2024, 1, 2)))
+
+        copy_sql = fetch.calls[0][0]
+        assert "COPY INTO @NIMBUSBILL.OPS.EXPORT_STAGE/usage/j1/" in copy_sql
+        assert "PARTITION BY ('date=' || TO_VARCHAR(DATE_ID, 'YYYY-MM-DD') || '/customer=' || CUSTOMER_ID)" in copy_sql
+        assert "TYPE = PARQUET" in copy_sql
+        assert fetch.calls[1][1] == {"prefix": "usage/j1/"}  # directory refresh before listing
+        assert (result.rows, len(result.files), result.bytes) == (1200, 1, 4096)
+
+    def test_local_stage_matches_copy_layout(self):
+        pq = pytest.importorskip("pyarrow.parquet")
+        d1, d2 = date(2024, 1, 1), date(2024, 1, 2)
+        chunks = [
+            [_usage_row(d1, "a", 1), _usage_row(d1, "a", 2)],
+            [_usage_row(d1, "a", 3), _usage_row(d1, "b", 4), _usage_row(d2, "a", 5)],
+        ]
+        with tempfile.TemporaryDirectory() as root:
+            stage = LocalStage(root, lambda sql, params: iter(chunks))
+            result = stage.unload("j1", UsageExport(d1, d2))
+
+            assert result.rows == 5
+            assert [f["path"] for f in result.files] == [
+                "usage/j1/date=2024-01-01/customer=a/data_0.snappy.parquet",
+                "usage/j1/date=2024-01-01/customer=b/data_0.snappy.parquet",
+                "usage/j1/date=2024-01-02/customer=a/data_0.snappy.parquet",
+            ]
+            first = pq.read_table(os.path.join(root, result.files[0]["path"]))
+            assert first.column("total_quantity").to_pylist() == [1, 2, 3]
+            assert first.column_names == USAGE_COLUMNS
+            assert first.column("region").to_pylist() == ["us-east-1"] * 3
+            assert first.column("event_plan_id").to_pylist() == ["plan_pro"] * 3
+            located = stage.locations("j1")
+            assert [f["size"] for f in located] == [f["size"] for f in result.files]
+            assert os.path.exists(located[0]["url"])
+
+    def test_job_records_success_and_failure(self):
+        class Stage:
+            def __init__(self, error=None):
+                self.error = error
+
+            def unload(self, job_id, export):
+                if self.error:
+                    raise self.error
+                return SimpleNamespace(rows=10, files=[{"path": "p", "size": 7}], bytes=7)
+
+        export = UsageExport(date(2024, 1, 1), date(2024, 1, 2))
+        fetch = _Recorder()
+        jobs = ExportJobs(fetch, Stage())
+        job_id = jobs.create(export)
+        jobs.run(job_id, export)
+        assert "'queued'" in fetch.calls[0][0] and "'running'" in fetch.calls[1][0]
+        done = fetch.calls[-1][1]
+        assert (done["rows"], done["files"], done["bytes"]) == (10, 1, 7)
+
+        fetch = _Recorder()
+        ExportJobs(fetch, Stage(RuntimeError("COPY failed"))).run("exp_x", export)
+        assert "'failed'" in fetch.calls[-1][0]
+        assert fetch.calls[-1][1]["error"] == "COPY failed"
+
+
+# ═══════════════════════════════════════════════════════════════════════════
+# Query coalescing
+# ═══════════════════════════════════════════════════════════════════════════
+
+class TestSingleFlight:
+    """Test that concurrent identical calls share one execution."""
+
+    @staticmethod
+    def _run_concurrently(flight, n, fn, key="k"):
+        """Start n callers while the first is held inside fn; return their outcomes."""
+        entered, release = threading.Event(), threading.Event()
+
+        def held():
+            entered.set()
+            release.wait(5)
+            return fn()
+
+        outcomes = [None] * n
+
+        def caller(i):
+            try:
+                outcomes[i] = flight.do(key, held if i == 0 else fn)
+            except Exception as e:
+                outcomes[i] = e
+
+        threads = [threading.Thread(target=caller, args=(0,))]
+        threads[0].start()
+        entered.wait(5)
+        threads += [threading.Thread(target=caller, args=(i,)) for i in range(1, n)]
+        for t in threads[1:]:
+            t.start()
+        while flight._calls.get(key) and flight._calls[key].waiters + flight.stats.overflow < n - 1:
+            release.wait(0.001)
+        release.set()
+        for t in threads:
+            t.join(5)
+        return outcomes
+
+    def test_flight_key_normalizes_whitespace_and_param_order(self):
+        a = flight_key("SELECT *\n   FROM t WHERE a = %(a)s", {"a": 1, "b": date(2024, 1, 1)})
+        b = flight_key("SELECT * FROM t  WHERE a = %(a)s", {"b": date(2024, 1, 1), "a": 1})
+        assert a == b
+        assert a != flight_key("SELECT * FROM t WHERE a = %(a)s", {"a": 2, "b": date(2024, 1, 1)})
+        assert is_read("  with x as (select 1) select * from x")
+        assert not is_read("UPDATE t SET a = 1")
+
+    def test_concurrent_callers_share_one_execution(self):
+        flight, calls = SingleFlight(max_waiters=10), []
+        outcomes = self._run_concurrently(flight, 6, lambda: calls.append(1) or [{"n": 1}])
+        assert len(calls) == 1
+        assert [o[0] for o in outcomes] == [[{"n": 1}]] * 6
+        assert sum(shared for _, shared in outcomes) == 5
+        assert flight.stats.to_dict() == {"executions": 1, "coalesced": 5, "overflow": 0, "errors": 0}
+        assert flight._calls == {}
+
+    def test_error_reaches_every_waiter(self):
+        flight = SingleFlight()
+
+        def fail():
+            raise RuntimeError("warehouse suspended")
+
+        outcomes = self._run_concurrently(flight, 4, fail)
+        assert all(isinstance(o, RuntimeError) and str(o) == "warehouse suspended" for o in outcomes)
+        assert flight.stats.executions == 1 and flight.stats.errors == 1
+        # The failed flight is gone; the next call executes again.
+        assert flight.do("k", lambda: 7) == (7, False)
+
+    def test_callers_over_the_waiter_cap_run_their_own_query(self):
+        flight, calls = SingleFlight(max_waiters=2), []
+        outcomes = self._run_concurrently(flight, 5, lambda: calls.append(1) or "rows")
+        assert len(calls) == 3
+        assert all(o[0] == "rows" for o in outcomes)
+        assert flight.stats.coalesced == 2 and flight.stats.overflow == 2
+
+
+# ═══════════════════════════════════════════════════════════════════════════
+# Usage series store
+# ═══════════════════════════════════════════════════════════════════════════
+
+def _series_rows():
+    """Ordered like SNAPSHOT_SQL: customer_sk, product, unit, currency, date."""
+    rows = []
+    for sk in (3, 8):
+        for product, unit in (("prod_api_requests", "requests"), ("prod_storage", "gb_month")):
+            for day in range(1, 4):
+                rows.append((sk, product, unit, "USD", date(2024, 3, day), sk * day, sk * day * 0.01))
+    return rows
+
+
+class TestUsageStore:
+    """Test the store file round trip and the API-side fallbacks."""
+
+    def test_rows_match_warehouse_order_and_filters(self, tmp_path):
+        path = str(tmp_path / "usage.nbus")
+        summary = write_store(_series_rows(), path, date(2024, 1, 1), date(2024, 3, 3))
+        assert (summary.customers, summary.series, summary.points) == (2, 4, 12)
+
+        store = SeriesFile(path)
+        rows = store.rows([8], date(2024, 3, 2))
+        assert [(r["date_id"].day, r["product_id"]) for r in rows] == [
+            (3, "prod_api_requests"), (3, "prod_storage"), (2, "prod_api_requests"), (2, "prod_storage"),
+        ]
+        assert rows[0] == {"date_id": date(2024, 3, 3), "product_id": "prod_api_requests", "unit": "requests",
+                           "total_quantity": 24.0, "cost_amount": 0.24, "currency": "USD"}
+        # Several SCD2 keys for one customer merge into one series.
+        assert len(store.rows([3, 8], date(2024, 3, 1), date(2024, 3, 1))) == 4
+        assert store.rows([5]) == []
+
+    def test_unordered_rows_are_rejected(self, tmp_path):
+        rows = list(reversed(_series_rows()))
+        with pytest.raises(ValueError):
+            write_store(rows, str(tmp_path / "usage.nbus"), date(2024, 1, 1), date(2024, 3, 3))
+
+    def test_publish_snapshots_from_window_start(self, tmp_path):
+        class Cursor:
+            def __init__(self):
+                self.batches = [_series_rows()[:5], _series_rows()[5:], []]
+
+            def execute(self, sql, params):
+                self.sql, self.params = sql, params
+
+            def fetchmany(self, size):
+                return self.batches.pop(0)
+
+        cursor, path = Cursor(), str(tmp_path / "usage.nbus")
+        summary = publish(cursor, path, date(2024, 3, 31), window_days=90)
+        assert cursor.params == {"start": "2024-01-02"}
+        assert summary.points == 12
+        assert SeriesFile(path).window_start == date(2024, 1, 2)
+
+    def test_lookup_falls_back_and_reloads(self, tmp_path):
+        path = str(tmp_path / "usage.nbus")
+        now = [time.time()]
+        store = UsageSeriesStore(path, check_seconds=10, max_age_hours=36, clock=lambda: now[0])
+        assert store.lookup([3], date(2024, 3, 1)) is None  # no file yet
+
+        write_store(_series_rows(), path, date(2024, 2, 1), date(2024, 3, 3))
+        now[0] += 11
+        assert len(store.lookup([3], date(2024, 3, 1))) == 6
+        assert store.lookup([3], date(2024, 1, 31)) is None  # starts before the window
+        assert store.lookup([3], None) is None  # unbounded history
+
+        write_store(_series_rows()[:3], path, date(2024, 2, 1), date(2024, 3, 3))
+        assert len(store.lookup([3], date(2024, 3, 1))) == 6  # not re-checked yet
+        now[0] += 11
+        assert len(store.lookup([3], date(2024, 3, 1))) == 3
+        assert store.stats["reloads"] == 2
+
+        now[0] += 37 * 3600
+        assert store.lookup([3], date(2024, 3, 1)) is None  # pipeline stopped publishing
+        assert store.stats["fallbacks"] == 4
+
+
+# ═══════════════════════════════════════════════════════════════════════════
+# Usage anomaly detection
+# ═══════════════════════════════════════════════════════════════════════════
+
+class _AnomalyCursor:
+    """Answers the batch count, the MERGE counts and the flag INSERT count."""
+
+    def __init__(self, fail_on=None):
+        self.statements, self.fail_on = [], fail_on
+        self._answers = {"SELECT COUNT(*)": (12,), "MERGE INTO": (3, 9), "INSERT INTO": (2,)}
+        self._last = None
+
+    def execute(self, sql, params=None):
+        self.statements.append((" ".join(sql.split()), params))
+        if self.fail_on and self.fail_on in sql:
+            raise RuntimeError("warehouse error")
+        self._last = next((v for k, v in self._answers.items() if k in sql), None)
+
+    def fetchone(self):
+        return self._last
+
+
+class TestAnomalies:
+    """Test the EWMA baseline arithmetic and the detection run's statements."""
+
+    def test_baseline_update(self):
+        b = Baseline().update(100)
+        assert (b.mean, b.var, b.observations) == (100, 0, 1)
+        b = b.update(200, alpha=0.5)
+        assert (b.mean, b.var, b.observations) == (150, 0.5 * (0 + 0.5 * 100 ** 2), 2)
+
+    def test_spike_and_drop_after_warmup(self):
+        t = Thresholds(alpha=0.1, z_threshold=4.0, min_observations=7, min_relative_change=0.5)
+        b = Baseline()
+        for day in range(10):
+            assert day < 7 or b.check(100 + day % 3, t) is None
+            b = b.update(100 + day % 3, t.alpha)
+        kind, z = b.check(1000, t)
+        assert kind == "spike" and z > 4
+        assert b.check(10, t)[0] == "drop"
+        # Within the relative-change floor even if the z-score is large.
+        assert b.check(b.mean * 1.3, t) is None
+
+    def test_not_flagged_before_min_observations(self):
+        b = Baseline(mean=100, var=1, observations=3)
+        assert b.check(10_000, Thresholds(min_observations=7)) is None
+        assert Baseline(mean=5, var=0, observations=30).check(5) is None
+        assert Baseline(mean=5, var=0, observations=30).check(50) == ("spike", None)
+
+    def test_detect_runs_batch_merge_and_flags_in_one_transaction(self):
+        cursor = _AnomalyCursor()
+        run = detect(cursor, date(2024, 3, 5), "run_1", Thresholds(z_threshold=3.0))
+        sqls = [sql for sql, _ in cursor.statements]
+        assert sqls[0].startswith("CREATE OR REPLACE TEMPORARY TABLE")
+        assert cursor.statements[0][1]["day"] == "2024-03-05" and cursor.statements[0][1]["z"] == 3.0
+        assert [s.split()[0] for s in sqls[2:]] == ["BEGIN", "MERGE", "DELETE", "INSERT", "COMMIT"]
+        assert cursor.statements[-2][1] == {"run_id": "run_1"}
+        assert (run.active_keys, run.baselines_inserted, run.baselines_updated, run.flagged) == (12, 3, 9, 2)
+
+    def test_usage_that_stops_is_read_as_a_zero_day(self):
+        assert Baseline(mean=100, var=4, observations=30).check(0) == ("drop", -50.0)
+        cursor = _AnomalyCursor()
+        detect(cursor, date(2024, 3, 5), "run_1")
+        batch_sql = cursor.statements[0][0]
+        # Keys active the day before with no rows today join the batch at quantity 0, including on re-runs.
+        assert "SELECT b.CUSTOMER_ID, b.PRODUCT_ID, b.UNIT, 0::FLOAT, 0, NULL" in batch_sql
+        assert "b.LAST_DATE = %(day)s::DATE - 1 AND b.LAST_QUANTITY > 0" in batch_sql
+        assert "b.PREV_DATE = %(day)s::DATE - 1 AND b.LAST_QUANTITY = 0" in batch_sql
+
+    def test_detect_rolls_back_on_failure(self):
+        cursor = _AnomalyCursor(fail_on="INSERT INTO")
+        with pytest.raises(RuntimeError):
+            detect(cursor, date(2024, 3, 5), "run_1")
+        assert cursor.statements[-1][0] == "ROLLBACK"
+
+
+# ═══════════════════════════════════════════════════════════════════════════
+# Push ingestion buffer
+# ═══════════════════════════════════════════════════════════════════════════
+
+def _event(i=0, **overrides):
+    event = {
+        "event_id": f"evt_{i}", "event_timestamp": "2024-01-01T10:00:00Z", "customer_id": "cust_1",
+        "product_id": "prod_api_requests", "quantity": 5, "unit": "requests", "schema_version": "1.0",
+    }
+    event.update(overrides)
+    return event
+
+
+def _lines(n, start=0):
+    return [json.dumps(_event(i)).encode() for i in range(start, start + n)]
+
+
+def _chunk_ids(directory):
+    ids = []
+    for name in sorted(os.listdir(directory)):
+        with gzip.open(os.path.join(directory, name), "rb") as f:
+            ids += [json.loads(line)["event_id"] for line in f]
+    return ids
+
+
+class _FlakySink(LocalSink):
+    def __init__(self, directory, failures):
+        super().__init__(directory)
+        self.failures = failures
+
+    def __call__(self, path, name, events):
+        if self.failures:
+            self.failures -= 1
+            raise ConnectionError("warehouse unavailable")
+        super().__call__(path, name, events)
+
+
+class TestEventIngest:
+    """Test edge validation, WAL durability, flushing and back-pressure."""
+
+    def test_validate_event_matches_contract_reasons(self):
+        assert validate_event(_event()) == []
+        assert validate_event(_event(quantity="12.5", event_timestamp="2024-01-01")) == []
+        assert validate_event(_event(event_id=" ", event_timestamp="2024-02-30T00:00:00Z", quantity=-1)) == [
+            "missing_event_id", "invalid_event_timestamp", "negative_quantity"]
+        assert validate_event(_event(customer_id=None, product_id="", unit=None, quantity=True)) == [
+            "missing_customer_id", "missing_product_id", "invalid_quantity", "unknown_unit"]
+        assert validate_event([1]) == ["not_an_object"]
+
+    def test_parse_batch_keeps_client_bytes_on_one_line(self):
+        events, raw = parse_batch(b'[ {"event_id": "a",\n  "note": "x\\ny"} ,{"event_id":"\xc3\xa9"}]')
+        assert [e["event_id"] for e in events] == ["a", "\u00e9"]
+        assert raw == [b'{"event_id": "a",   "note": "x\\ny"}', b'{"event_id":"\xc3\xa9"}']
+        assert parse_batch(b'{"event_id":"a"}\n{"event_id":"b"}\n', ndjson=True)[1] == [
+            b'{"event_id":"a"}', b'{"event_id":"b"}']
+        assert parse_batch(b' {"event_id": "a"} ')[1] == [b'{"event_id": "a"}']
+        for bad in (b'[{"a":1} {"b":2}]', b'[{"a":1}] x', b"["):
+            with pytest.raises(ValueError):
+                parse_batch(bad)
+
+    def test_flushes_by_size_and_deletes_wal(self, tmp_path):
+        buf = EventBuffer(str(tmp_path / "wal"), LocalSink(str(tmp_path / "out")), flush_events=3)
+        buf.append(_lines(2))
+        assert buf.flush() == 0                   # live chunk not yet due
+        buf.append(_lines(2, start=2))            # reaches 3 -> sealed
+        assert buf.flush() == 4
+        assert _chunk_ids(tmp_path / "out") == ["evt_0", "evt_1", "evt_2", "evt_3"]
+        assert not [n for n in os.listdir(tmp_path / "wal") if n.startswith("wal-")]
+        assert buf.pending == 0 and buf.stats.flushed_chunks == 1
+
+    def test_buffer_full_until_flushed(self, tmp_path):
+        buf = EventBuffer(str(tmp_path / "wal"), LocalSink(str(tmp_path / "out")), max_events=5)
+        buf.append(_lines(4))
+        with pytest.raises(BufferFull) as exc:
+            buf.append(_lines(2, start=4))
+        assert exc.value.pending == 4 and exc.value.retry_after >= 1
+        assert buf.flush(force=True) == 4
+        assert buf.append(_lines(2, start=4)) == 2
+        assert buf.stats.rejected == 2
+
+    def test_failed_sink_keeps_chunk_for_retry(self, tmp_path):
+        sink = _FlakySink(str(tmp_path / "out"), failures=1)
+        buf = EventBuffer(str(tmp_path / "wal"), sink, flush_events=2)
+        buf.append(_lines(2))
+        assert buf.flush() == 0
+        assert buf.pending == 2 and "ConnectionError" in buf.stats.last_flush_error
+        assert len([n for n in os.listdir(tmp_path / "wal") if n.startswith("wal-")]) == 1
+        assert buf.flush() == 2
+        assert _chunk_ids(tmp_path / "out") == ["evt_0", "evt_1"]
+        assert buf.stats.last_flush_error is None
+
+    def test_acknowledged_events_survive_crash(self, tmp_path):
+        wal = str(tmp_path / "wal")
+        crashed = EventBuffer(wal, LocalSink(str(tmp_path / "out")), flush_events=2)
+        crashed.append(_lines(2))                 # sealed, never sent
+        crashed.append(_lines(1, start=2))        # live segment
+        with open(crashed._wal_path(crashed._live.segment), "ab") as f:
+            f.write(b'{"event_id": "torn')        # died mid-write: never acknowledged
+
+        restarted = EventBuffer(wal, LocalSink(str(tmp_path / "out")))
+        assert restarted.start() == 3
+        restarted.close()
+        assert sorted(_chunk_ids(tmp_path / "out")) == ["evt_0", "evt_1", "evt_2"]
+        assert restarted.stats.recovered_chunks == 2
+
+    def test_wal_directory_is_locked_per_process(self, tmp_path):
+        first = EventBuffer(str(tmp_path), LocalSink(str(tmp_path / "out")))
+        first.start()
+        try:
+            with pytest.raises(RuntimeError):
+                EventBuffer(str(tmp_path), LocalSink(str(tmp_path / "out"))).start()
+        finally:
+            first.close()
+
+    def test_snowflake_sink_puts_and_copies_one_file(self):
+        statements, closed = [], []
+        cursor = SimpleNamespace(execute=lambda sql, params=None: statements.append(sql))
+        conn = SimpleNamespace(cursor=lambda: cursor, close=lambda: closed.append(True))
+        SnowflakeSink(lambda: conn)("/tmp/events-20240101000000-abcdef01.jsonl.gz",
+                                    "events-20240101000000-abcdef01.jsonl.gz", 10)
+        put, copy = statements
+        assert put.startswith("PUT file:///tmp/events-20240101000000-abcdef01.jsonl.gz @NIMBUSBILL.BRONZE.EVENTS_INGEST_STAGE")
+        assert "FILES = ('events-20240101000000-abcdef01.jsonl.gz')" in copy
+        assert "'api_20240101000000-abcdef01'" in copy
+        assert closed == [True]
+
+
+# ═══════════════════════════════════════════════════════════════════════════
+# Landing files
+# ═══════════════════════════════════════════════════════════════════════════
+
+class TestLanding:
+    """Test the typed Parquet landing format and the per-format Bronze loads."""
+
+    def test_parquet_round_trip_is_typed(self, tmp_path):
+        path = str(tmp_path / "usage_events_2024-01-01.parquet")
+        write_parquet([_event(0, quantity=2.5, region="us-east-1"),
+                       _event(1, event_timestamp="2024-01-01T12:30:00+02:00")], path)
+
+        import pyarrow.parquet as pq
+        assert pq.read_schema(path).remove_metadata() == event_schema()
+        first, second = read_events(path)
+        assert first["event_timestamp"] == datetime(2024, 1, 1, 10, 0)
+        assert first["quantity"] == Decimal("2.5") and first["region"] == "us-east-1"
+        assert second["event_timestamp"] == datetime(2024, 1, 1, 10, 30)   # normalized to UTC
+        assert second["plan_id"] is None and second["region"] is None
+
+    @pytest.mark.parametrize("overrides", [
+        {"event_timestamp": "yesterday"},
+        {"quantity": "lots"},
+        {"customer_id": None},
+    ])
+    def test_untypeable_events_fail_the_write(self, tmp_path, overrides):
+        with pytest.raises((ValueError, TypeError)):
+            write_parquet([_event(0, **overrides)], str(tmp_path / "bad.parquet"))
+
+    def test_landing_file_prefers_parquet(self, tmp_path):
+        assert landing_file(str(tmp_path), "2024-01-01") is None
+        (tmp_path / "usage_events_2024-01-01.jsonl").write_text(json.dumps(_event()) + "\n")
+        assert landing_file(str(tmp_path), "2024-01-01").endswith(".jsonl")
+        write_parquet([_event()], str(tmp_path / "usage_events_2024-01-01.parquet"))
+        assert landing_file(str(tmp_path), "2024-01-01").endswith(".parquet")
+
+    def test_jsonl_and_parquet_read_the_same_columns(self, tmp_path):
+        events = [_event(i) for i in range(3)]
+        with open(tmp_path / "e.jsonl", "w") as f:
+            f.writelines(json.dumps(e) + "\n" for e in events)
+        write_parquet(events, str(tmp_path / "e.parquet"))
+        ids = [[e["event_id"] for e in read_events(str(tmp_path / name), columns=["event_id"])]
+               for name in ("e.jsonl", "e.parquet")]
+        assert ids[0] == ids[1] == ["evt_0", "evt_1", "evt_2"]
+
+    def test_load_statements_by_format(self):
+        put, copy = load_statements("/data/usage_events_2024-01-01.jsonl", "2024-01-01", "run_1", "API")
+        assert put.startswith("PUT file:///data/usage_events_2024-01-01.jsonl @NIMBUSBILL.BRONZE.%USAGE_EVENTS_RAW")
+        assert "AUTO_COMPRESS=TRUE" in put
+        assert "INTO NIMBUSBILL.BRONZE.USAGE_EVENTS_RAW" in copy
+        assert "FILES = ('usage_events_2024-01-01.jsonl.gz')" in copy and "'run_1'" in copy
+
+        put, begin, copy, tag, commit = load_statements(
+            "/data/usage_events_2024-01-01.parquet", "2024-01-01", "run_1", "API")
+        assert "@NIMBUSBILL.BRONZE.%USAGE_EVENTS_TYPED AUTO_COMPRESS=FALSE" in put
+        assert (begin, commit) == ("BEGIN", "COMMIT")
+        assert "MATCH_BY_COLUMN_NAME = CASE_INSENSITIVE" in copy
+        assert "FILES = ('usage_events_2024-01-01.parquet')" in copy
+        assert "BATCH_ID = 'run_1'" in tag and "FILE_NAME = 'usage_events_2024-01-01.parquet'" in tag
+
+
+# ═══════════════════════════════════════════════════════════════════════════
+# Usage aggregate routing
+# ═══════════════════════════════════════════════════════════════════════════
+
+class TestUsagePlanner:
+    """Test that /usage reads the smallest table answering it exactly."""
+
+    TODAY = date(2024, 6, 15)
+
+    def _source(self, **kwargs):
+        return plan_usage(today=self.TODAY, **kwargs).source.name
+
+    def test_all_customer_days_read_the_product_rollup(self):
+        result = plan_usage(today=self.TODAY, product_id="prod_storage")
+        assert result.source.name == "product_daily"
+        assert "FROM NIMBUSBILL.GOLD.FACT_PRODUCT_DAILY_USAGE f" in result.sql
+        assert result.params == {"df": "2024-03-17", "pid": "prod_storage"}     # 90-day lookback
+
+    def test_routing_by_dimensions_grain_and_range(self):
+        assert self._source(grain="month") == "product_daily"
+        assert self._source(grain="month", sks=(7,)) == "customer_monthly"
+        assert self._source(grain="day", sks=(7,)) == "customer_daily"
+        assert self._source(grain="hour") == "customer_hourly"
+        assert self._source(grain="day", region="eu-central-1") == "revenue_cube"
+        assert self._source(grain="month", sks=(7,), region="eu-central-1") == "customer_daily"
+        # A range ending mid-month can't be cut from month rows
+        assert self._source(grain="month", sks=(7,), date_to=date(2024, 5, 31)) == "customer_monthly"
+        assert self._source(grain="month", sks=(7,), date_to=date(2024, 5, 30)) == "customer_daily"
+        assert self._source(grain="month", sks=(7,), date_from=date(2024, 3, 2)) == "customer_daily"
+
+    def test_lookback_clips_date_from(self):
+        result = plan_usage(grain="month", sks=(7,), date_from=date(2020, 1, 1), today=self.TODAY)
+        assert result.date_from == date(2023, 6, 1)             # 366 days back, start of that month
+        assert "f.MONTH_ID AS DATE_ID" in result.sql and "f.CUSTOMER_SK IN (%(sks)s)" in result.sql
+
+    def test_hourly_fact_filters_customer_and_region(self):
+        result = plan_usage(grain="hour", sks=(7, 9), region="eu-central-1", today=self.TODAY)
+        assert "FROM NIMBUSBILL.GOLD.FACT_CUSTOMER_HOURLY_USAGE f" in result.sql
+        assert "f.HOUR_TS AS HOUR_TS" in result.sql
+        assert "f.CUSTOMER_SK IN (%(sks)s)" in result.sql and "f.REGION = %(region)s" in result.sql
+        assert result.params["region"] == "eu-central-1"
+
+    def test_hourly_fact_answers_every_request(self):
+        for grain in ("hour", "day", "month"):
+            assert can_answer(USAGE_SOURCES[-1], {"customer", "product", "region"}, grain, self.TODAY, None)
+        with pytest.raises(ValueError):
+            plan_usage(grain="week")
+
+    def test_planner_counts_served_requests(self):
+        planner = UsagePlanner()
+        planner.plan("day", today=self.TODAY)
+        planner.plan("day", today=self.TODAY, product_id="prod_storage")
+        planner.plan("hour", today=self.TODAY)
+        assert planner.info() == {"served": {"product_daily": 2, "customer_hourly": 1}}
+
+
+# ═══════════════════════════════════════════════════════════════════════════
+# FX rates
+# ═══════════════════════════════════════════════════════════════════════════
+
+class TestFxRates:
+    WINDOWS = [FxWindow("EUR", 1.10, date(2024, 1, 1), date(2024, 6, 30)),
+               FxWindow("EUR", 1.05, date(2024, 7, 1)),
+               FxWindow("GBP", 1.27, date(2024, 3, 1), date(2024, 3, 31))]
+
+    def _cache(self, fetch=lambda *a: [], **kwargs):
+        cache = FxRateCache(fetch, **kwargs)
+        cache.load(self.WINDOWS)
+        return cache
+
+    def test_rate_follows_effective_windows(self):
+        fx = self._cache()
+        assert fx.rate("EUR", date(2024, 6, 30)) == 1.10
+        assert fx.rate("eur", date(2024, 7, 1)) == 1.05
+        assert fx.rate("EUR", "2030-01-01") == 1.05
+        assert fx.rate("USD", date(2024, 1, 1)) == 1.0
+        # Before the first window, after a closed one, or an unknown currency: no rate
+        assert fx.rate("EUR", date(2023, 12, 31)) is None
+        assert fx.rate("GBP", date(2024, 4, 1)) is None
+        assert fx.rate("JPY", date(2024, 4, 1)) is None
+        assert fx.convert(100, "GBP", datetime(2024, 3, 15, 12)) == pytest.approx(127.0)
+        assert fx.convert(100, "GBP", date(2024, 4, 1)) is None
+
+    def test_repeat_lookups_hit_the_day_cache(self):
+        fx = self._cache(max_entries=2)
+        for _ in range(3):
+            fx.rate("EUR", date(2024, 2, 1))
+        assert (fx.hits, fx.misses) == (2, 1)
+        fx.rate("EUR", date(2024, 2, 2))
+        fx.rate("EUR", date(2024, 2, 3))      # over max_entries: the day cache starts over
+        assert fx.info()["cached_days"] == 1
+
+    def test_reloads_when_the_dimension_changes(self):
+        clock = [0.0]
+        version = [{"row_count": 1, "max_load_ts": "t1"}]
+        rates = [{"currency": "EUR", "reporting_currency": "USD", "rate": 1.1,
+                  "effective_from": date(2024, 1, 1), "effective_to": None}]
+
+        def fetch(sql, params=None):
+            return version if "MAX(LOAD_TS)" in sql else rates
+
+        fx = FxRateCache(fetch, refresh_seconds=60, clock=lambda: clock[0])
+        assert fx.load() == 1 and fx.rate("EUR", date(2024, 5, 1)) == 1.1
+        rates[0] = {**rates[0], "rate": 1.2}
+        version[0] = {"row_count": 1, "max_load_ts": "t2"}
+        assert fx.maybe_refresh() is False          # probed at most every refresh_seconds
+        clock[0] = 61
+        assert fx.maybe_refresh() is True
+        assert fx.rate("EUR", date(2024, 5, 1)) == 1.2 and fx.loads == 2
+
+    def test_overlapping_or_invalid_windows_are_rejected(self):
+        check_windows(self.WINDOWS)
+        with pytest.raises(ValueError, match="Overlapping FX windows for EUR"):
+            check_windows(self.WINDOWS + [FxWindow("EUR", 1.0, date(2024, 12, 1), date(2024, 12, 31))])
+        with pytest.raises(ValueError, match="must be positive"):
+            check_windows([FxWindow("CAD", 0, date(2024, 1, 1))])
+        # The same currency against another reporting currency is a separate series
+        check_windows(self.WINDOWS + [FxWindow("EUR", 0.86, date(2024, 1, 1), reporting_currency="GBP")])
+
+    def test_seed_file_is_valid(self):
+        windows = read_rates_csv(os.path.join(os.path.dirname(__file__), "..", "seeds", "fx_rates.csv"))
+        assert {w.currency for w in windows} >= {"EUR", "GBP"}
+        assert all(w.reporting_currency == "USD" for w in windows)
+
+
+# ═══════════════════════════════════════════════════════════════════════════
+# Tax rules
+# ═══════════════════════════════════════════════════════════════════════════
+
+class TestTaxRules:
+    RULES = [TaxRule("de_cut", "DE", 0.16, date(2020, 7, 1), date(2020, 12, 31)),
+             TaxRule("de_std", "DE", 0.19, date(2021, 1, 1)),
+             TaxRule("us_std", "US", 0.0, date(2020, 1, 1)),
+             TaxRule("us_ai", "US", 0.0625, date(2024, 1, 1), product_category="AI")]
+
+    def test_rules_in_force_on_the_tax_date(self):
+        assert TaxLookup(self.RULES, date(2020, 12, 31)).rule("DE", "Compute").rule_id == "de_cut"
+        assert TaxLookup(self.RULES, "2021-01-31").rule("de", None).rule_id == "de_std"
+        # Before the first window, or a country without rules: not taxed
+        assert TaxLookup(self.RULES, date(2020, 6, 30)).rule("DE", None) is None
+        assert TaxLookup(self.RULES, date(2024, 1, 31)).rule("FR", "AI") is None
+
+    def test_category_rule_wins_over_country_default(self):
+        lookup = TaxLookup(self.RULES, date(2024, 1, 31))
+        assert lookup.rule("US", "AI").rule_id == "us_ai"
+        assert lookup.rule("US", "Storage").rule_id == "us_std"
+        assert TaxLookup(self.RULES, date(2023, 12, 31)).rule("US", "AI").rule_id == "us_std"
+        # One amount per rule, rounded half up to cents like the close's ROUND()
+        tax = lookup.tax({"AI": 10.0, "Compute": 5.0, None: 1.0}, "US")
+        assert tax == {"us_ai": 0.63, "us_std": 0.0}
+        assert TaxLookup(self.RULES, date(2021, 1, 31)).tax({None: 0.5}, "DE") == {"de_std": 0.1}
+
+    def test_overlapping_or_invalid_rules_are_rejected(self):
+        check_rules(self.RULES)
+        with pytest.raises(ValueError, match="Overlapping tax rules for DE/\\*"):
+            check_rules(self.RULES + [TaxRule("de_new", "DE", 0.2, date(2024, 1, 1))])
+        with pytest.raises(ValueError, match="must be in"):
+            check_rules([TaxRule("bad", "GB", 20, date(2020, 1, 1))])
+        with pytest.raises(ValueError, match="Duplicate tax rule id"):
+            check_rules(self.RULES + [TaxRule("us_ai", "CA", 0.05, date(2020, 1, 1))])
+
+    def test_seed_file_is_valid(self):
+        rules = read_rules_csv(os.path.join(os.path.dirname(__file__), "..", "seeds", "tax_rules.csv"))
+        assert {r.country for r in rules} >= {"US", "CA", "GB", "DE", "FR"}
+
+
+# ═══════════════════════════════════════════════════════════════════════════
+# Prepaid credits
+# ═══════════════════════════════════════════════════════════════════════════
+
+class _CreditCursor:
+    """Records statements and answers the run summary."""
+
+    def __init__(self, fail_on=None):
+        self.statements, self.fail_on = [], fail_on
+
+    def execute(self, sql, params=None):
+        self.statements.append((" ".join(sql.split()), params))
+        if self.fail_on and self.fail_on in sql:
+            raise RuntimeError("warehouse error")
+
+    def fetchone(self):
+        return (1, 2, 5, 3, 812.5, 4)
+
+
+class TestCredits:
+    """Test drawdown order, grant validation and the drawdown run's statements."""
+
+    LONG = CreditGrant("g_long", "cust_1", 100.0, "USD", date(2024, 3, 1), date(2024, 12, 31))
+    SHORT = CreditGrant("g_short", "cust_1", 30.0, "USD", date(2024, 3, 2), date(2024, 3, 31))
+
+    def test_soonest_expiry_is_drawn_first(self):
+        remaining = {self.LONG: 100.0, self.SHORT: 30.0}
+        assert allocate(remaining, 35.0, date(2024, 3, 2)) == {"g_short": 30.0, "g_long": 5.0}
+        assert allocate(remaining, 12.5, date(2024, 3, 2)) == {"g_short": 12.5}
+        # Not yet granted, expired or used up grants are skipped; cost beyond credits stays billable
+        assert allocate(remaining, 35.0, date(2024, 3, 1)) == {"g_long": 35.0}
+        assert allocate(remaining, 35.0, date(2024, 4, 1)) == {"g_long": 35.0}
+        assert allocate({self.LONG: 0.0, self.SHORT: 30.0}, 50.0, "2024-03-05") == {"g_short": 30.0}
+
+    def test_invalid_grants_are_rejected(self):
+        check_grants([self.LONG, self.SHORT])
+        with pytest.raises(ValueError, match="Duplicate credit grant id"):
+            check_grants([self.LONG, self.LONG])
+        with pytest.raises(ValueError, match="must be positive"):
+            check_grants([CreditGrant("g0", "cust_1", 0, "USD", date(2024, 1, 1), date(2024, 2, 1))])
+        with pytest.raises(ValueError, match="expires before it starts"):
+            check_grants([CreditGrant("g1", "cust_1", 5, "USD", date(2024, 2, 1), date(2024, 1, 1))])
+
+    def test_drawdown_applies_each_phase_then_ledger_and_balances_in_one_transaction(self):
+        cursor = _CreditCursor()
+        run = apply_drawdown(cursor, date(2024, 3, 5), "run_1")
+        verbs = [" ".join(sql.split()[:2]) for sql, _ in cursor.statements]
+        assert verbs[0] == "CREATE OR" and verbs[1] == "BEGIN"
+        assert verbs[2:12] == ["INSERT INTO", "INSERT INTO", "MERGE INTO", "INSERT INTO", "MERGE INTO",
+                               "INSERT INTO", "MERGE INTO", "INSERT INTO", "MERGE INTO", "COMMIT"]
+        # Each MERGE into the grants applies only its own phase's entries
+        assert [p["phase"] for sql, p in cursor.statements if sql.startswith("MERGE INTO NIMBUSBILL.GOLD.FACT_CREDIT_GRANTS")] == [1, 2, 3]
+        assert cursor.statements[9][1] == {"day": "2024-03-05", "run_id": "run_1"}
+        assert "FACT_CREDIT_BALANCES b" in cursor.statements[10][0]
+        assert (run.grants_posted, run.grants_expired, run.drawdowns, run.reversals) == (1, 2, 5, 3)
+        assert (run.amount_drawn, run.customers) == (812.5, 4)
+
+    def test_drawdown_sql_matches_allocate_after_a_rerun(self, warehouse):
+        old = CreditGrant("g_old", "cust_1", 30.0, "USD", date(2024, 2, 1), date(2024, 3, 3))
+        grants = [self.LONG, self.SHORT, old]
+        # cust_1's USD cost per day (none on 3/4); the EUR row and cust_2 have no credits to draw.
+        costs = {date(2024, 3, 1): 10.0, date(2024, 3, 2): 5.0, date(2024, 3, 3): 12.5,
+                 date(2024, 3, 5): 40.0, date(2024, 3, 6): 70.0}
+        warehouse.execute("INSERT INTO NIMBUSBILL.GOLD.DIM_CUSTOMER (CUSTOMER_SK, CUSTOMER_ID) "
+                          "VALUES (1, 'cust_1'), (2, 'cust_2')")
+        for g in grants:
+            warehouse.execute(
+                "INSERT INTO NIMBUSBILL.GOLD.FACT_CREDIT_GRANTS "
+                "(GRANT_ID, CUSTOMER_ID, AMOUNT, CURRENCY, GRANTED_DATE, EXPIRES_DATE) "
+                "VALUES (%(id)s, %(cid)s, %(amount)s, %(cur)s, %(start)s, %(end)s)",
+                {"id": g.grant_id, "cid": g.customer_id, "amount": g.amount, "cur": g.currency,
+                 "start": str(g.granted_date), "end": str(g.expires_date)})
+        for day, cost in costs.items():
+            warehouse.execute(
+                "INSERT INTO NIMBUSBILL.GOLD.FACT_CUSTOMER_DAILY_USAGE (DATE_ID, CUSTOMER_SK, COST_AMOUNT, CURRENCY) "
+                "VALUES (%(day)s, 1, %(cost)s, 'USD'), (%(day)s, 1, 5, 'EUR'), (%(day)s, 2, 9, 'USD')",
+                {"day": str(day), "cost": cost})
+
+        cursor = warehouse.cursor()
+        days = [date(2024, 3, d) for d in range(1, 7)]
+        for day in days:
+            apply_drawdown(cursor, day, f"run_{day}")
+        # Late usage raises 3/6's cost; re-running the day reverses its drawdown and draws again.
+        costs[date(2024, 3, 6)] = 125.0
+        warehouse.execute("UPDATE NIMBUSBILL.GOLD.FACT_CUSTOMER_DAILY_USAGE SET COST_AMOUNT = 125 "
+                          "WHERE DATE_ID = '2024-03-06' AND CUSTOMER_SK = 1 AND CURRENCY = 'USD'")
+        rerun = apply_drawdown(cursor, days[-1], "run_rerun")
+
+        # The same days through allocate: post due grants, expire what is left, then draw.
+        remaining, drawn, expired = {}, {}, {}
+        for day in days:
+            for g in grants:
+                if g not in remaining and g.granted_date <= day:
+                    remaining[g] = g.amount
+            for g in remaining:
+                if g.expires_date < day and remaining[g] > 0:
+                    expired[g.grant_id], remaining[g] = remaining[g], 0.0
+            drawn[day] = allocate(remaining, costs.get(day, 0.0), day)
+            for g in remaining:
+                remaining[g] -= drawn[day].get(g.grant_id, 0.0)
+
+        rows = warehouse.execute("SELECT GRANT_ID, REMAINING_AMOUNT FROM NIMBUSBILL.GOLD.FACT_CREDIT_GRANTS")
+        assert {gid: float(v) for gid, v in rows} == pytest.approx({g.grant_id: v for g, v in remaining.items()})
+        assert remaining == {self.LONG: 0.0, self.SHORT: 0.0, old: 0.0}
+        assert expired == {"g_old": 2.5}
+
+        ledger = warehouse.execute("""
+            SELECT DATE_ID, GRANT_ID, ENTRY_TYPE, SUM(AMOUNT) FROM NIMBUSBILL.GOLD.FACT_CREDIT_LEDGER
+            GROUP BY 1, 2, 3""")
+        net_drawn = {}
+        for day, gid, kind, amount in ledger:
+            if kind in ("drawdown", "reversal"):
+                net_drawn[day, gid] = net_drawn.get((day, gid), 0.0) - float(amount)
+        assert {k: v for k, v in net_drawn.items() if v} == \
+            pytest.approx({(d, gid): v for d, by_grant in drawn.items() for gid, v in by_grant.items()})
+        assert {(gid, kind): float(a) for _, gid, kind, a in ledger if kind in ("grant", "expiration")} == {
+            ("g_long", "grant"): 100.0, ("g_short", "grant"): 30.0, ("g_old", "grant"): 30.0,
+            ("g_old", "expiration"): -2.5}
+
+        balances = warehouse.execute("SELECT CUSTOMER_ID, CURRENCY, BALANCE, LAST_ENTRY_DATE "
+                                     "FROM NIMBUSBILL.GOLD.FACT_CREDIT_BALANCES")
+        assert [(c, cur, float(b), d) for c, cur, b, d in balances] == [("cust_1", "USD", 0.0, days[-1])]
+        # 70 reversed, 90 drawn: the run reports the net 20.
+        assert (rerun.reversals, rerun.drawdowns, rerun.amount_drawn) == (1, 1, pytest.approx(20.0))
+
+    def test_drawdown_rolls_back_on_failure(self):
+        cursor = _CreditCursor(fail_on="FACT_CREDIT_BALANCES b")
+        with pytest.raises(RuntimeError):
+            apply_drawdown(cursor, date(2024, 3, 5), "run_1")
+        assert cursor.statements[-1][0] == "ROLLBACK"
+
+    def test_seed_file_is_valid(self):
+        grants = read_grants_csv(os.path.join(os.path.dirname(__file__), "..", "seeds", "credit_grants.csv"))
+        assert grants and all(g.currency == "USD" for g in grants)
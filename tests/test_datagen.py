@@ -93,6 +93,20 @@ class TestUsageEventGeneration:
                 parsed = json.loads(line)
                 assert "event_id" in parsed
 
+    def test_save_events_parquet(self):
+        """save_events(fmt="parquet") should write the typed landing file."""
+        events = generate_events("2024-01-15", num_customers=2, events_per_customer=2,
+                                 late_prob=0, duplicate_prob=0)
+        with tempfile.TemporaryDirectory() as tmpdir:
+            save_events(events, "2024-01-15", tmpdir, fmt="parquet")
+            filepath = os.path.join(tmpdir, "usage_events_2024-01-15.parquet")
+            assert os.path.exists(filepath)
+
+            import pyarrow.parquet as pq
+            table = pq.read_table(filepath)
+            assert table.num_rows == len(events)
+            assert table.column("event_id").to_pylist() == [e["event_id"] for e in events]
+
     def test_valid_product_ids(self):
         """product_id should be one of the known products."""
         valid_products = {"prod_api_requests", "prod_storage_gb", "prod_compute_minutes", "prod_ai_tokens"}
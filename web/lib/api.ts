@@ -92,8 +92,10 @@ export function fetchCustomers() {
   return apiFetch<Customer[]>('/customers');
 }
 
-export function fetchCustomerUsage(customerId: string) {
-  return apiFetch<UsageRecord[]>(`/customers/${customerId}/usage`);
+export function fetchCustomerUsage(customerId: string, days = 90) {
+  // A bounded window is served from the API's precomputed series store.
+  const dateFrom = new Date(Date.now() - (days - 1) * 86_400_000).toISOString().slice(0, 10);
+  return apiFetch<UsageRecord[]>(`/customers/${customerId}/usage`, { date_from: dateFrom });
 }
 
 export function fetchInvoices(params?: { customer_id?: string; status?: string }) {